@@ -1,4 +1,5 @@
 import os
+import click
 from flask import Flask
 from sqlalchemy import BigInteger
 from sqlalchemy.ext.compiler import compiles
@@ -34,9 +35,11 @@ def create_app(config_name=None):
     # Register error handlers
     register_error_handlers(app)
 
-    # Create tables and init FTS5
+    # Create tables, add columns introduced since, and init FTS5
     with app.app_context():
         db.create_all()
+        from app.schema import upgrade_schema
+        upgrade_schema()
         _init_fts5()
 
     # Health check endpoint
@@ -50,6 +53,13 @@ def create_app(config_name=None):
             'app': 'procurement-doc-intel-lite'
         })
 
+    @app.route('/api/health/llm')
+    def llm_health():
+        from flask import jsonify
+        from app.services.llm_gateway import get_llm_gateway
+        gateway = get_llm_gateway()
+        return jsonify({'available': gateway.available, **gateway.stats()})
+
     # Demo auth (enabled via DEMO_AUTH_ENABLED env var)
     try:
         from demo_auth import init_demo_auth
@@ -74,16 +84,177 @@ def create_app(config_name=None):
 
 
 def _init_fts5():
-    """Create FTS5 virtual table for document chunk search if it doesn't exist."""
+    """Create FTS5 virtual table for document chunk search and keep it in sync."""
     from sqlalchemy import text
     try:
         db.session.execute(text("""
             CREATE VIRTUAL TABLE IF NOT EXISTS document_chunks_fts
             USING fts5(content, content='document_chunks', content_rowid='rowid')
         """))
+        had_triggers = db.session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'document_chunks_fts_ai'"
+        )).first() is not None
+        db.session.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS document_chunks_fts_ai AFTER INSERT ON document_chunks BEGIN
+                INSERT INTO document_chunks_fts(rowid, content) VALUES (new.rowid, new.content);
+            END
+        """))
+        db.session.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS document_chunks_fts_ad AFTER DELETE ON document_chunks BEGIN
+                INSERT INTO document_chunks_fts(document_chunks_fts, rowid, content)
+                VALUES ('delete', old.rowid, old.content);
+            END
+        """))
+        db.session.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS document_chunks_fts_au AFTER UPDATE OF content ON document_chunks BEGIN
+                INSERT INTO document_chunks_fts(document_chunks_fts, rowid, content)
+                VALUES ('delete', old.rowid, old.content);
+                INSERT INTO document_chunks_fts(rowid, content) VALUES (new.rowid, new.content);
+            END
+        """))
+        # Rows written before the triggers existed are not indexed yet
+        if not had_triggers:
+            db.session.execute(text("INSERT INTO document_chunks_fts(document_chunks_fts) VALUES ('rebuild')"))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+    _init_line_items_fts()
+
+
+_LINE_ITEM_FTS_VALUES = """
+    (SELECT vendor_name FROM documents WHERE id = new.document_id),
+    (SELECT contract_number FROM documents WHERE id = new.document_id),
+    (SELECT document_number FROM documents WHERE id = new.document_id)
+"""
+
+
+def _init_line_items_fts():
+    """Create the FTS5 inverted index over line item and parent document fields."""
+    from sqlalchemy import text
+    columns = ('product_name, part_number, manufacturer, category, labor_category, '
+               'vendor_name, contract_number, document_number, product_description')
+    insert_row = f"""
+        INSERT INTO line_items_fts(rowid, {columns})
+        VALUES (new.rowid, new.product_name, new.part_number, new.manufacturer, new.category,
+                new.labor_category, {_LINE_ITEM_FTS_VALUES}, new.product_description);
+    """
+    try:
+        db.session.execute(text(f"CREATE VIRTUAL TABLE IF NOT EXISTS line_items_fts USING fts5({columns})"))
+        db.session.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS line_items_fts_vocab USING fts5vocab(line_items_fts, 'row')"
+        ))
+        had_triggers = db.session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'line_items_fts_ai'"
+        )).first() is not None
+        had_count_triggers = db.session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'line_items_fts_count_ai'"
+        )).first() is not None
+        db.session.execute(text(f"""
+            CREATE TRIGGER IF NOT EXISTS line_items_fts_ai AFTER INSERT ON line_items BEGIN
+                {insert_row}
+            END
+        """))
+        db.session.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS line_items_fts_ad AFTER DELETE ON line_items BEGIN
+                DELETE FROM line_items_fts WHERE rowid = old.rowid;
+            END
+        """))
+        db.session.execute(text(f"""
+            CREATE TRIGGER IF NOT EXISTS line_items_fts_au AFTER UPDATE OF
+                product_name, part_number, manufacturer, category, labor_category,
+                product_description, document_id
+            ON line_items BEGIN
+                DELETE FROM line_items_fts WHERE rowid = old.rowid;
+                {insert_row}
+            END
+        """))
+        db.session.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS line_items_fts_doc_au AFTER UPDATE OF
+                vendor_name, contract_number, document_number
+            ON documents BEGIN
+                UPDATE line_items_fts
+                SET vendor_name = new.vendor_name,
+                    contract_number = new.contract_number,
+                    document_number = new.document_number
+                WHERE rowid IN (SELECT rowid FROM line_items WHERE document_id = new.id);
+            END
+        """))
+        # Indexed row count for IDF, kept by triggers so searches never count the index
+        db.session.execute(text("""
+            CREATE TABLE IF NOT EXISTS line_items_fts_stats (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                row_count INTEGER NOT NULL
+            )
+        """))
+        db.session.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS line_items_fts_count_ai AFTER INSERT ON line_items BEGIN
+                UPDATE line_items_fts_stats SET row_count = row_count + 1 WHERE id = 1;
+            END
+        """))
+        db.session.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS line_items_fts_count_ad AFTER DELETE ON line_items BEGIN
+                UPDATE line_items_fts_stats SET row_count = row_count - 1 WHERE id = 1;
+            END
+        """))
+        if not had_triggers:
+            db.session.execute(text("DELETE FROM line_items_fts"))
+            db.session.execute(text(f"""
+                INSERT INTO line_items_fts(rowid, {columns})
+                SELECT li.rowid, li.product_name, li.part_number, li.manufacturer, li.category,
+                       li.labor_category, d.vendor_name, d.contract_number, d.document_number,
+                       li.product_description
+                FROM line_items li LEFT JOIN documents d ON d.id = li.document_id
+            """))
+        if not had_triggers or not had_count_triggers:
+            db.session.execute(text(
+                "INSERT OR REPLACE INTO line_items_fts_stats (id, row_count) "
+                "SELECT 1, count(*) FROM line_items_fts"
+            ))
         db.session.commit()
     except Exception:
         db.session.rollback()
+    _init_trigram_indexes()
+
+
+def _init_trigram_indexes():
+    """Create the trigram substring indexes over identifier columns and keep them in sync."""
+    from sqlalchemy import text
+    from app.services.substring_index import TRIGRAM_INDEXES, normalized_sql
+    for table, (index, columns) in TRIGRAM_INDEXES.items():
+        column_list = ', '.join(columns)
+        new_values = ', '.join(normalized_sql(f'new.{c}') for c in columns)
+        try:
+            db.session.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5({column_list}, tokenize='trigram')"
+            ))
+            had_triggers = db.session.execute(text(
+                f"SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = '{index}_ai'"
+            )).first() is not None
+            db.session.execute(text(f"""
+                CREATE TRIGGER IF NOT EXISTS {index}_ai AFTER INSERT ON {table} BEGIN
+                    INSERT INTO {index}(rowid, {column_list}) VALUES (new.rowid, {new_values});
+                END
+            """))
+            db.session.execute(text(f"""
+                CREATE TRIGGER IF NOT EXISTS {index}_ad AFTER DELETE ON {table} BEGIN
+                    DELETE FROM {index} WHERE rowid = old.rowid;
+                END
+            """))
+            db.session.execute(text(f"""
+                CREATE TRIGGER IF NOT EXISTS {index}_au AFTER UPDATE OF {column_list} ON {table} BEGIN
+                    DELETE FROM {index} WHERE rowid = old.rowid;
+                    INSERT INTO {index}(rowid, {column_list}) VALUES (new.rowid, {new_values});
+                END
+            """))
+            if not had_triggers:
+                db.session.execute(text(f"DELETE FROM {index}"))
+                db.session.execute(text(f"""
+                    INSERT INTO {index}(rowid, {column_list})
+                    SELECT rowid, {', '.join(normalized_sql(c) for c in columns)} FROM {table}
+                """))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
 
 
 def register_cli(app):
@@ -91,7 +262,12 @@ def register_cli(app):
     def seed_command():
         """Seed the database with sample data."""
         from app.seed import seed
+        from app.services.embedder import embed_pending_chunks
+        from app.services.data_version import bump_data_version
         seed()
+        if embed_pending_chunks():
+            bump_data_version()
+        db.session.commit()
         print('Database seeded.')
 
     @app.cli.command('init-db')
@@ -108,5 +284,159 @@ def register_cli(app):
         db.create_all()
         _init_fts5()
         from app.seed import seed
+        from app.services.embedder import embed_pending_chunks
+        from app.services.data_version import bump_data_version
         seed()
+        if embed_pending_chunks():
+            bump_data_version()
+        db.session.commit()
         print('Database reset and seeded.')
+
+    @app.cli.command('embed-chunks')
+    @click.option('--session', 'session_id', default='__default__', help='Session to embed.')
+    @click.option('--rebuild', is_flag=True, help='Re-embed every chunk, not just pending ones.')
+    def embed_chunks_command(session_id, rebuild):
+        """Compute local embeddings for document chunks."""
+        from app.services.embedder import embed_pending_chunks
+        from app.services.data_version import bump_data_version
+        count = embed_pending_chunks(session_id=session_id, rebuild=rebuild)
+        if count:
+            bump_data_version(session_id)
+        db.session.commit()
+        print(f'Embedded {count} chunks.')
+
+    @app.cli.command('process-queue')
+    @click.option('--limit', default=1000, help='Maximum documents to process.')
+    @click.option('--no-batch', is_flag=True, help='Map every document with its own call.')
+    def process_queue_command(limit, no_batch):
+        """Extract and map documents still in the 'uploaded' state."""
+        from app.models.document import Document
+        from app.services.document_pipeline import process_documents
+        from app.services.field_mapper import FieldMapper
+        docs = Document.query.filter_by(processing_status='uploaded')\
+            .order_by(Document.created_at).limit(limit).all()
+        if not docs:
+            print('No documents waiting.')
+            return
+        summary = process_documents(docs, FieldMapper(), batch=not no_batch)
+        print(f"Processed {summary['processed']} documents ({summary['batched']} batched, "
+              f"{summary['individual']} individually) in {summary['mapping_calls']} mapping calls; "
+              f"{summary['failed']} failed.")
+
+    @app.cli.command('train-doc-classifier')
+    @click.option('--session', 'session_id', default='__default__', help='Session to train for.')
+    def train_doc_classifier_command(session_id):
+        """Retrain the local document type classifier from reviewed documents."""
+        from app.services.classifiers import train_document_classifier
+        stats = train_document_classifier(session_id)
+        if not stats['saved']:
+            print(f"Not enough reviewed documents to train ({stats['documents']} usable; "
+                  f"need at least two types with 3+ examples each).")
+            return
+        classes = ', '.join(f'{label}={n}' for label, n in sorted(stats['classes'].items()))
+        print(f"Trained on {stats['documents']} documents ({classes}).")
+        if 'holdout_accuracy' in stats:
+            print(f"Holdout: accuracy {stats['holdout_accuracy']:.1%}, "
+                  f"confident on {stats['holdout_coverage']:.1%} of documents.")
+
+    @app.cli.command('train-category-classifier')
+    @click.option('--session', 'session_id', default='__default__', help='Session to train for.')
+    def train_category_classifier_command(session_id):
+        """Retrain the local line item category classifier from human-verified rows."""
+        from app.services.classifiers import train_line_item_classifier
+        stats = train_line_item_classifier(session_id)
+        if not stats['saved']:
+            print(f"Not enough verified line items to train ({stats['rows']} usable; need two categories).")
+            return
+        print(f"Trained on {stats['rows']} verified line items: {len(stats['categories'])} categories, "
+              f"{stats['sub_categories']} sub-categories.")
+        if 'holdout_accuracy' in stats:
+            print(f"Holdout: category accuracy {stats['holdout_accuracy']:.1%}, "
+                  f"confident on {stats['holdout_coverage']:.1%} of rows.")
+
+    @app.cli.command('categorize-line-items')
+    @click.option('--session', 'session_id', default='__default__', help='Session to categorize.')
+    @click.option('--overwrite', is_flag=True, help='Re-categorize every unverified row, not just uncategorized ones.')
+    def categorize_line_items_command(session_id, overwrite):
+        """Categorize unverified line items with the local classifier."""
+        import time
+        from sqlalchemy import or_, update
+        from app.models.line_item import LineItem
+        from app.services.classifiers import LINE_ITEM_FIELDS, TRAIN_BATCH_SIZE, get_line_item_classifier
+        from app.services.data_version import bump_data_version
+
+        classifier = get_line_item_classifier(session_id)
+        if not classifier.trained:
+            print('No trained category classifier; run `flask train-category-classifier` first.')
+            return
+        query = LineItem.query.with_entities(
+            LineItem.id, LineItem.document_id, *(getattr(LineItem, f) for f in LINE_ITEM_FIELDS),
+        ).filter(LineItem.session_id == session_id, LineItem.human_verified != 1)
+        if not overwrite:
+            query = query.filter(or_(LineItem.category.is_(None), LineItem.category == 'other'))
+        rows = query.all()
+
+        started = time.monotonic()
+        updates, documents = [], set()
+        for start in range(0, len(rows), TRAIN_BATCH_SIZE):
+            batch = rows[start:start + TRAIN_BATCH_SIZE]
+            items = [dict(zip(LINE_ITEM_FIELDS, row[2:])) for row in batch]
+            for row, item, prediction in zip(batch, items, classifier.predict(items)):
+                if not prediction['category']:
+                    continue
+                sub_category = prediction['sub_category'] or (
+                    item['sub_category'] if prediction['category'] == item['category'] else None)
+                if (prediction['category'], sub_category) != (item['category'], item['sub_category']):
+                    updates.append({'id': row[0], 'category': prediction['category'], 'sub_category': sub_category})
+                    documents.add(row[1])
+        elapsed = time.monotonic() - started
+        if updates:
+            db.session.execute(update(LineItem), updates)
+            bump_data_version(session_id, list(documents))
+            db.session.commit()
+        print(f'Classified {len(rows)} line items in {elapsed:.2f}s '
+              f'({len(rows) / max(elapsed, 1e-6):,.0f} rows/s); updated {len(updates)}.')
+
+    @app.cli.command('backfill-dates')
+    @click.option('--session', 'session_id', default=None, help='Session to backfill (default: all).')
+    def backfill_dates_command(session_id):
+        """Recompute parsed date ordinals and month keys from the stored date strings."""
+        from app.services.date_columns import backfill_date_columns
+        updated = backfill_date_columns(session_id)
+        db.session.commit()
+        print(f"Updated parsed dates on {updated['documents']} documents and "
+              f"{updated['line_items']} line items.")
+
+    @app.cli.command('index-advisor')
+    @click.option('--session', 'session_id', default='__default__', help='Session to sample filter values from.')
+    @click.option('--verbose', is_flag=True, help='Print every statement and plan, not just flagged ones.')
+    @click.option('--strict', is_flag=True, help='Exit non-zero when any statement is flagged.')
+    def index_advisor_command(session_id, verbose, strict):
+        """Replay the app's queries with EXPLAIN QUERY PLAN and flag full scans and temp B-trees."""
+        from app.services.index_advisor import advise
+        reports = advise(app, session_id)
+        flagged = [r for r in reports if r.findings]
+        for report in reports:
+            if not (verbose or report.findings):
+                continue
+            status = '; '.join(report.findings) if report.findings else 'ok'
+            print(f'[{report.label}] {status}')
+            print('  ' + ' '.join(report.statement.split()))
+            for step in report.plan:
+                print(f'    {step}')
+        print(f'{len(reports)} statements checked, {len(flagged)} flagged.')
+        if strict and flagged:
+            raise SystemExit(1)
+
+    @app.cli.command('refresh-price-estimates')
+    @click.option('--session', 'session_id', default='__default__', help='Session to estimate.')
+    @click.option('--full', is_flag=True, help='Recompute every estimate, not just invalidated ones.')
+    def refresh_price_estimates_command(session_id, full):
+        """Precompute statistical unit price estimates for canonical products."""
+        import time
+        from app.services.pricing_engine import refresh_price_estimates
+
+        started = time.monotonic()
+        written = refresh_price_estimates(session_id, full=full)
+        db.session.commit()
+        print(f'Computed {written} price estimates in {time.monotonic() - started:.2f}s.')
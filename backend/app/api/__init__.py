@@ -4,6 +4,7 @@ from app.api.line_items import line_items_bp
 from app.api.dashboard import dashboard_bp
 from app.api.chat import chat_bp
 from app.api.products import products_bp
+from app.api.autocomplete import autocomplete_bp
 
 
 def register_blueprints(app):
@@ -13,3 +14,4 @@ def register_blueprints(app):
     app.register_blueprint(dashboard_bp)
     app.register_blueprint(chat_bp)
     app.register_blueprint(products_bp)
+    app.register_blueprint(autocomplete_bp)
@@ -0,0 +1,41 @@
+import logging
+
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required
+
+from app.errors import BadRequestError
+from app.services.autocomplete import DEFAULT_LIMIT, FIELDS, MAX_LIMIT, RANKINGS, get_autocomplete_index
+
+logger = logging.getLogger(__name__)
+
+autocomplete_bp = Blueprint('autocomplete', __name__, url_prefix='/api/autocomplete')
+
+
+@autocomplete_bp.route('', methods=['GET'])
+@jwt_required()
+def autocomplete():
+    """
+    Prefix suggestions for the filter boxes, served from the in-memory
+    autocomplete index. `field` is one or more comma-separated fields;
+    suggestions of several fields are merged by rank and tagged with theirs.
+    """
+    fields = [f.strip() for f in request.args.get('field', '').split(',') if f.strip()]
+    if not fields or any(field not in FIELDS for field in fields):
+        raise BadRequestError(f'field must be one or more of: {", ".join(FIELDS)}')
+    rank = request.args.get('rank', 'spend')
+    if rank not in RANKINGS:
+        raise BadRequestError(f'rank must be one of: {", ".join(RANKINGS)}')
+    limit = max(1, min(request.args.get('limit', DEFAULT_LIMIT, type=int), MAX_LIMIT))
+    prefix = request.args.get('q', '').strip()
+
+    index = get_autocomplete_index('__default__')
+    suggestions = [
+        {**suggestion, 'field': field}
+        for field in fields
+        for suggestion in index.complete(field, prefix, limit, rank)
+    ]
+    if len(fields) > 1:
+        suggestions.sort(key=lambda s: s[rank], reverse=True)
+        suggestions = suggestions[:limit]
+
+    return jsonify({'query': prefix, 'suggestions': suggestions})
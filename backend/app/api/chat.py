@@ -1,8 +1,9 @@
+import json
 import logging
 import random
 
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from app.extensions import db
 from app.models.document import Document
@@ -17,23 +18,40 @@ chat_bp = Blueprint('chat', __name__, url_prefix='/api/chat')
 @chat_bp.route('', methods=['POST'])
 @jwt_required()
 def chat():
-    """Process a natural-language query about procurement data."""
+    """Process a natural-language query about procurement data.
+
+    Send `conversation_id` to continue a stored conversation; the server
+    supplies the conversation memory. Without it a new conversation is
+    started (a client-side `history` is still honoured for that first turn).
+    """
     data = request.get_json()
     if not data or not data.get('message', '').strip():
         raise BadRequestError('Message is required')
 
     message = data['message'].strip()
+    conversation = _conversation(data, message)
     history = data.get('history', [])
+    # Persist a new conversation up front so no failure while answering can discard it
+    db.session.commit()
 
     try:
-        from app.services.chat_service import ChatService
-        service = ChatService(db_session=db.session, session_id='__default__')
-        result = service.answer(message=message, history=history)
-        return jsonify({
+        service = _chat_service()
+        result = service.process_query(
+            message, db.session, session_id='__default__',
+            conversation_history=history, conversation=conversation,
+        )
+        db.session.commit()
+        response = {
             'answer': result.get('answer', ''),
             'sources': result.get('sources', []),
             'query_type': result.get('query_type', 'general'),
-        })
+            'conversation_id': conversation.id,
+        }
+        if result.get('data') is not None:
+            response['data'] = result['data']
+        if result.get('cached'):
+            response['cached'] = True
+        return jsonify(response)
     except ImportError:
         logger.warning('ChatService not available, returning fallback response')
         return jsonify({
@@ -43,6 +61,7 @@ def chat():
         })
     except Exception as e:
         logger.exception('Chat service error')
+        db.session.rollback()
         return jsonify({
             'answer': f'An error occurred while processing your question: {str(e)}',
             'sources': [],
@@ -50,6 +69,102 @@ def chat():
         }), 500
 
 
+@chat_bp.route('/stream', methods=['POST'])
+@jwt_required()
+def chat_stream():
+    """Process a chat query and stream the answer as Server-Sent Events.
+
+    Events: `sources` (sent once retrieval finishes, with the conversation_id),
+    `token` (answer text deltas), then `done`, or `error` if the answer could
+    not be produced. Accepts `conversation_id` like POST /api/chat.
+    """
+    data = request.get_json()
+    if not data or not data.get('message', '').strip():
+        raise BadRequestError('Message is required')
+
+    message = data['message'].strip()
+    conversation = _conversation(data, message)
+    history = data.get('history', [])
+    db.session.commit()
+    service = _chat_service()
+
+    def generate():
+        try:
+            for event in service.stream_query(
+                message, db.session, session_id='__default__',
+                conversation_history=history, conversation=conversation,
+            ):
+                if event['event'] == 'done':
+                    db.session.commit()
+                yield _sse(event['event'], event['data'])
+        except Exception as e:
+            logger.exception('Chat stream error')
+            db.session.rollback()
+            yield _sse('error', {'message': f'An error occurred while processing your question: {str(e)}'})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+@chat_bp.route('/conversations', methods=['GET'])
+@jwt_required()
+def list_conversations():
+    """List the current user's conversations, most recent first."""
+    from app.models.conversation import Conversation
+
+    limit = min(request.args.get('limit', 50, type=int), 200)
+    conversations = Conversation.query.filter_by(
+        user_id=get_jwt_identity(), session_id='__default__',
+    ).order_by(Conversation.updated_at.desc()).limit(limit).all()
+    return jsonify({'conversations': [c.to_dict() for c in conversations]})
+
+
+@chat_bp.route('/conversations/<conversation_id>', methods=['GET'])
+@jwt_required()
+def get_conversation(conversation_id):
+    """Return a conversation with its turns."""
+    from app.services.conversation_store import get_conversation as load_conversation
+
+    conversation = load_conversation(conversation_id, get_jwt_identity())
+    result = conversation.to_dict()
+    result['turns'] = [t.to_dict() for t in conversation.turns.all()]
+    return jsonify(result)
+
+
+@chat_bp.route('/conversations/<conversation_id>', methods=['DELETE'])
+@jwt_required()
+def delete_conversation(conversation_id):
+    """Delete a conversation and its turns."""
+    from app.services.conversation_store import get_conversation as load_conversation
+
+    conversation = load_conversation(conversation_id, get_jwt_identity())
+    db.session.delete(conversation)
+    db.session.commit()
+    return jsonify({'message': 'Conversation deleted'})
+
+
+def _conversation(data: dict, message: str):
+    """The conversation named by conversation_id, or a new one titled by the message."""
+    from app.services.conversation_store import get_conversation as load_conversation, start_conversation
+
+    if data.get('conversation_id'):
+        return load_conversation(data['conversation_id'], get_jwt_identity())
+    return start_conversation(get_jwt_identity(), message)
+
+
+def _chat_service():
+    from app.services.answer_cache import get_answer_cache
+    from app.services.chat_service import ChatService
+    return ChatService(answer_cache=get_answer_cache())
+
+
+def _sse(event: str, data: dict) -> str:
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
 @chat_bp.route('/suggestions', methods=['GET'])
 @jwt_required()
 def suggestions():
@@ -3,8 +3,8 @@ from flask_jwt_extended import jwt_required
 
 from app.extensions import db
 from app.models.document import Document
-from app.models.line_item import LineItem
 from app.models.canonical_product import CanonicalProduct
+from app.services.analytics_snapshot import get_analytics_snapshot
 
 dashboard_bp = Blueprint('dashboard', __name__, url_prefix='/api/dashboard')
 
@@ -37,53 +37,36 @@ def get_dashboard():
      .all()
     documents_by_type = {row[0]: row[1] for row in type_rows if row[0]}
 
+    # Line item aggregates come from the columnar snapshot
+    snapshot = get_analytics_snapshot(session_filter)
+    spend = ('total_spend', 'extended_price', 'sum')
+    overall = snapshot.aggregate([], [spend])['groups']
+
     # Total line items
-    total_line_items = LineItem.query.filter_by(session_id=session_filter).count()
+    total_line_items = len(snapshot)
 
     # Total canonical products
     total_products = CanonicalProduct.query.filter_by(session_id=session_filter).count()
 
     # Total spend (sum of extended_price)
-    total_spend_result = db.session.query(
-        db.func.sum(LineItem.extended_price),
-    ).filter_by(session_id=session_filter).scalar()
-    total_spend = round(total_spend_result or 0, 2)
+    total_spend = round(overall[0]['total_spend'] or 0, 2) if overall else 0
 
     # Top vendors by document count and spend
-    top_vendors_rows = db.session.query(
-        Document.vendor_name,
-        db.func.count(db.distinct(Document.id)).label('doc_count'),
-        db.func.sum(LineItem.extended_price).label('total_spend'),
-    ).join(LineItem, LineItem.document_id == Document.id)\
-     .filter(Document.session_id == session_filter)\
-     .filter(Document.vendor_name.isnot(None))\
-     .group_by(Document.vendor_name)\
-     .order_by(db.func.sum(LineItem.extended_price).desc())\
-     .limit(10)\
-     .all()
-
     top_vendors = [
         {
-            'vendor_name': row[0],
-            'document_count': row[1],
-            'total_spend': round(row[2] or 0, 2),
+            'vendor_name': g['vendor'],
+            'document_count': int(g['document_count']),
+            'total_spend': round(g['total_spend'] or 0, 2),
         }
-        for row in top_vendors_rows
+        for g in snapshot.aggregate(
+            ['vendor'], [spend, ('document_count', 'documents', 'count')], sort='total_spend', limit=10,
+        )['groups']
     ]
 
     # Spend by category
-    category_rows = db.session.query(
-        LineItem.category,
-        db.func.sum(LineItem.extended_price),
-    ).filter_by(session_id=session_filter)\
-     .filter(LineItem.category.isnot(None))\
-     .group_by(LineItem.category)\
-     .order_by(db.func.sum(LineItem.extended_price).desc())\
-     .all()
-
     spend_by_category = [
-        {'category': row[0], 'total': round(row[1] or 0, 2)}
-        for row in category_rows
+        {'category': g['category'], 'total': round(g['total_spend'] or 0, 2)}
+        for g in snapshot.aggregate(['category'], [spend], sort='total_spend')['groups']
     ]
 
     # Recent documents (last 10)
@@ -11,14 +11,20 @@ from app.extensions import db
 from app.models.document import Document
 from app.models.line_item import LineItem
 from app.models.document_chunk import DocumentChunk
-from app.models.field_mapping import FieldMapping
 from app.errors import BadRequestError, NotFoundError
+from app.services.data_version import bump_data_version
+from app.services.price_observations import record_price_observations
+from app.services.substring_index import substring_filter
 
 logger = logging.getLogger(__name__)
 
 documents_bp = Blueprint('documents', __name__, url_prefix='/api/documents')
 
 ALLOWED_EXTENSIONS = {'pdf', 'xlsx', 'xls', 'docx', 'doc', 'csv'}
+# Documents one /process-batch request maps (two packed batches). Mapping runs
+# inside the request, so this keeps it well under the worker timeout; larger
+# backlogs go through `flask process-queue`.
+PROCESS_BATCH_MAX_DOCUMENTS = 16
 
 
 def _get_extension(filename):
@@ -45,7 +51,7 @@ def list_documents():
 
     vendor_name = request.args.get('vendor_name')
     if vendor_name:
-        query = query.filter(Document.vendor_name.ilike(f'%{vendor_name}%'))
+        query = query.filter(substring_filter(Document, ('vendor_name',), vendor_name, db.session))
 
     processing_status = request.args.get('processing_status')
     if processing_status:
@@ -53,19 +59,13 @@ def list_documents():
 
     search = request.args.get('search', '').strip()
     if search:
-        search_filter = f'%{search}%'
-        query = query.filter(
-            db.or_(
-                Document.original_filename.ilike(search_filter),
-                Document.vendor_name.ilike(search_filter),
-                Document.document_number.ilike(search_filter),
-                Document.contract_number.ilike(search_filter),
-            )
-        )
+        query = query.filter(substring_filter(
+            Document, ('original_filename', 'vendor_name', 'document_number', 'contract_number'), search, db.session,
+        ))
 
     # Order and paginate
     query = query.order_by(Document.created_at.desc())
-    total = query.count()
+    total = query.order_by(None).count()
     documents = query.offset((page - 1) * per_page).limit(per_page).all()
 
     return jsonify({
@@ -138,6 +138,8 @@ def upload_document():
     )
 
     db.session.add(doc)
+    db.session.flush()
+    bump_data_version('__default__', [doc.id])
     db.session.commit()
 
     return jsonify(doc.to_dict()), 201
@@ -151,119 +153,36 @@ def process_document(doc_id):
     if not doc:
         raise NotFoundError(f'Document {doc_id} not found')
 
-    api_key = current_app.config.get('ANTHROPIC_API_KEY', '')
-    if not api_key:
+    from app.services.llm_gateway import get_llm_gateway
+    gateway = get_llm_gateway()
+    if not gateway.available:
         raise BadRequestError('ANTHROPIC_API_KEY is not configured. Set it in environment variables.')
 
+    from app.services.document_pipeline import classify_document, extract_document, map_and_persist
+
     try:
         # Stage 1: Extraction
         doc.processing_status = 'extracting'
         db.session.commit()
-
-        from app.services.extractor import DocumentExtractor
-        extractor = DocumentExtractor()
-        extraction = extractor.extract(doc.stored_path, doc.file_format)
-
-        doc.extraction_method = extraction.get('method', 'unknown')
+        extraction = extract_document(doc)
+        _, type_confidence = classify_document(doc, extraction)
 
         # Stage 2: AI Field Mapping
         doc.processing_status = 'mapping'
         db.session.commit()
 
+        # Line items are inserted as the streamed response is parsed
         from app.services.field_mapper import FieldMapper
-        mapper = FieldMapper(api_key)
-
-        # Load known mappings for this vendor
-        known_mappings = {}
-        if doc.vendor_name:
-            existing = FieldMapping.query.filter_by(
-                vendor_name=doc.vendor_name,
-                session_id='__default__',
-            ).all()
-            known_mappings = {fm.source_column_name: fm.target_field for fm in existing}
-
-        result = mapper.map_document(
-            raw_tables=extraction.get('tables', []),
-            document_text=extraction.get('full_text', ''),
-            file_format=doc.file_format,
-            known_mappings=known_mappings,
-        )
-
-        # Check for mapping errors
-        if result.get('error'):
-            logger.warning(f'Mapping returned error for doc {doc_id}: {result["error"]}')
-
-        # Update document metadata from AI results
-        metadata = result.get('metadata', {})
-        doc.document_type = result.get('document_type', doc.document_type)
-        doc.vendor_name = metadata.get('vendor_name') or doc.vendor_name
-        doc.document_number = metadata.get('document_number') or doc.document_number
-        doc.document_date = metadata.get('document_date') or doc.document_date
-        doc.contract_number = metadata.get('contract_number') or doc.contract_number
-        doc.task_order_number = metadata.get('task_order_number') or doc.task_order_number
-        doc.total_amount = metadata.get('total_amount') or doc.total_amount
-        doc.period_of_performance_start = metadata.get('period_of_performance_start') or doc.period_of_performance_start
-        doc.period_of_performance_end = metadata.get('period_of_performance_end') or doc.period_of_performance_end
-        doc.ai_model_used = 'claude-sonnet-4-5-20250929'
-
-        # Create line items
-        line_items_data = result.get('line_items', [])
-        for li_data in line_items_data:
-            li = LineItem(
-                document_id=doc.id,
-                line_number=li_data.get('line_number'),
-                clin=li_data.get('clin'),
-                part_number=li_data.get('part_number'),
-                manufacturer=li_data.get('manufacturer'),
-                product_name=li_data.get('product_name'),
-                product_description=li_data.get('product_description'),
-                category=li_data.get('category'),
-                sub_category=li_data.get('sub_category'),
-                quantity=_safe_float(li_data.get('quantity')),
-                unit_of_issue=li_data.get('unit_of_issue'),
-                unit_price=_safe_float(li_data.get('unit_price')),
-                extended_price=_safe_float(li_data.get('extended_price')),
-                labor_category=li_data.get('labor_category'),
-                labor_hours=_safe_float(li_data.get('labor_hours')),
-                labor_rate=_safe_float(li_data.get('labor_rate')),
-                mapping_confidence=_safe_float(li_data.get('mapping_confidence')),
-                original_row_text=str(li_data),
-                session_id='__default__',
-            )
-            db.session.add(li)
-
-        # Create document chunks for RAG
-        full_text = extraction.get('full_text', '')
-        if full_text:
-            chunks = _create_chunks(full_text)
-            for idx, chunk_text in enumerate(chunks):
-                chunk = DocumentChunk(
-                    document_id=doc.id,
-                    chunk_index=idx,
-                    content=chunk_text,
-                    chunk_type='paragraph',
-                    session_id='__default__',
-                )
-                db.session.add(chunk)
-            doc.chunk_count = len(chunks)
-
-        # Calculate extraction confidence as average of line item confidences
-        confidences = [
-            li_data.get('mapping_confidence', 0)
-            for li_data in line_items_data
-            if li_data.get('mapping_confidence') is not None
-        ]
-        if confidences:
-            doc.extraction_confidence = round(sum(confidences) / len(confidences), 3)
-
-        doc.processing_status = 'review'
+        line_items_created = map_and_persist(doc, extraction, FieldMapper(gateway))
         db.session.commit()
 
         return jsonify({
             'message': 'Document processed successfully',
             'document': doc.to_dict(include_items=True),
-            'line_items_created': len(line_items_data),
+            'line_items_created': line_items_created,
             'chunks_created': doc.chunk_count or 0,
+            'document_type_source': 'local' if extraction.get('document_type') else 'model',
+            'document_type_confidence': type_confidence,
         })
 
     except Exception as e:
@@ -274,6 +193,52 @@ def process_document(doc_id):
         raise BadRequestError(f'Processing failed: {str(e)}')
 
 
+@documents_bp.route('/process-batch', methods=['POST'])
+@jwt_required()
+def process_documents_batch():
+    """Process queued documents, packing small ones into shared mapping calls.
+
+    Body (optional): {"document_ids": [...], "limit": 16, "batch": true}.
+    Without document_ids, the oldest documents still in 'uploaded' are taken.
+    At most PROCESS_BATCH_MAX_DOCUMENTS are processed per request; the
+    response's "remaining" counts queued documents left for further calls.
+    Use `flask process-queue` for bulk runs.
+    """
+    from app.services.document_pipeline import process_documents
+    from app.services.field_mapper import FieldMapper
+    from app.services.llm_gateway import get_llm_gateway
+
+    gateway = get_llm_gateway()
+    if not gateway.available:
+        raise BadRequestError('ANTHROPIC_API_KEY is not configured. Set it in environment variables.')
+
+    data = request.get_json(silent=True) or {}
+    limit = data.get('limit', PROCESS_BATCH_MAX_DOCUMENTS)
+    if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+        raise BadRequestError('limit must be a positive integer')
+    limit = min(limit, PROCESS_BATCH_MAX_DOCUMENTS)
+    document_ids = data.get('document_ids')
+    if document_ids and len(document_ids) > PROCESS_BATCH_MAX_DOCUMENTS:
+        raise BadRequestError(
+            f'At most {PROCESS_BATCH_MAX_DOCUMENTS} documents per request; '
+            f'use `flask process-queue` for larger backlogs'
+        )
+    query = Document.query.filter(Document.session_id == '__default__')
+    if document_ids:
+        query = query.filter(Document.id.in_(document_ids))
+    else:
+        query = query.filter(Document.processing_status == 'uploaded')
+    docs = query.order_by(Document.created_at).limit(limit).all()
+    if not docs:
+        raise BadRequestError('No documents to process')
+
+    summary = process_documents(docs, FieldMapper(gateway), batch=data.get('batch', True))
+    summary['remaining'] = Document.query.filter_by(
+        session_id='__default__', processing_status='uploaded',
+    ).count()
+    return jsonify(summary)
+
+
 @documents_bp.route('/<doc_id>', methods=['PUT'])
 @jwt_required()
 def update_document(doc_id):
@@ -297,6 +262,12 @@ def update_document(doc_id):
         if field in data:
             setattr(doc, field, data[field])
 
+    # Observations carry the document's date, vendor and number
+    if {'document_date', 'vendor_name', 'document_number'} & set(data):
+        db.session.flush()
+        record_price_observations('__default__', [doc.id])
+
+    bump_data_version('__default__', [doc.id])
     db.session.commit()
     return jsonify(doc.to_dict())
 
@@ -321,6 +292,7 @@ def approve_document(doc_id):
     if data and data.get('review_notes'):
         doc.review_notes = data['review_notes']
 
+    bump_data_version('__default__', [doc.id])
     db.session.commit()
     return jsonify(doc.to_dict())
 
@@ -333,7 +305,8 @@ def reprocess_document(doc_id):
     if not doc:
         raise NotFoundError(f'Document {doc_id} not found')
 
-    # Delete existing line items
+    # Delete existing line items and their price observations
+    doc.price_observations.delete()
     LineItem.query.filter_by(document_id=doc.id).delete()
     # Delete existing chunks
     DocumentChunk.query.filter_by(document_id=doc.id).delete()
@@ -344,10 +317,12 @@ def reprocess_document(doc_id):
     doc.extraction_confidence = None
     doc.ai_model_used = None
     doc.chunk_count = 0
+    doc.embedded = 0
     doc.reviewed_by = None
     doc.reviewed_at = None
     doc.review_notes = None
 
+    bump_data_version('__default__', [doc.id])
     db.session.commit()
 
     return jsonify({
@@ -373,33 +348,7 @@ def delete_document(doc_id):
 
     # Delete related records (cascade handles line_items and chunks)
     db.session.delete(doc)
+    bump_data_version('__default__', [doc_id])
     db.session.commit()
 
     return jsonify({'message': f'Document {doc_id} deleted'})
-
-
-def _safe_float(value):
-    """Safely convert a value to float, returning None on failure."""
-    if value is None:
-        return None
-    try:
-        return float(value)
-    except (ValueError, TypeError):
-        return None
-
-
-def _create_chunks(text, chunk_size=800, overlap=100):
-    """Split text into overlapping chunks for RAG."""
-    if not text:
-        return []
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunk = text[start:end]
-        if chunk.strip():
-            chunks.append(chunk.strip())
-        start = end - overlap
-        if start >= len(text):
-            break
-    return chunks
@@ -11,34 +11,68 @@ from app.models.line_item import LineItem
 from app.models.document import Document
 from app.models.field_mapping import FieldMapping
 from app.errors import BadRequestError, NotFoundError
+from app.services.analytics_snapshot import AGGREGATES, DIMENSIONS, FACETS, MEASURES, get_analytics_snapshot
+from app.services.classifiers import LINE_ITEM_FIELDS, item_fields, learn_line_item_labels
+from app.services.data_version import bump_data_version
+from app.services.date_utils import parse_date
+from app.services.line_item_search import explorer_match_expression, index_available
+from app.services.price_observations import record_price_observations, sync_observation_products
+from app.services.product_resolver import link_line_items
+from app.services.substring_index import PART_NUMBER_COLUMNS, substring_filter
 
 logger = logging.getLogger(__name__)
 
 line_items_bp = Blueprint('line_items', __name__, url_prefix='/api/line-items')
 
+# Edits to these fields rewrite the document's price observations
+PRICE_FIELDS = {'unit_price', 'quantity', 'extended_price'}
+# Edits to these fields re-resolve the item's canonical product
+IDENTITY_FIELDS = {'part_number', 'product_name', 'manufacturer'}
+
+
+def _date_arg(args, key):
+    """Parsed date of a query arg, None when absent; BadRequestError when it is not a date."""
+    value = args.get(key, '').strip()
+    if not value:
+        return None
+    parsed = parse_date(value)
+    if parsed is None:
+        raise BadRequestError(f'{key} must be a date')
+    return parsed
+
 
 def _build_line_items_query(args):
     """Build a filtered query for line items based on request args."""
     query = LineItem.query.join(Document, LineItem.document_id == Document.id)
     query = query.filter(LineItem.session_id == '__default__')
 
-    # Text search on product_name and part_number
+    # Text search on product_name, part_number, manufacturer and description,
+    # plus substrings of part numbers ("BGCD" in "X-BGCD-1")
     search = args.get('search', '').strip()
     if search:
-        search_filter = f'%{search}%'
-        query = query.filter(
-            db.or_(
-                LineItem.product_name.ilike(search_filter),
-                LineItem.part_number.ilike(search_filter),
-                LineItem.manufacturer.ilike(search_filter),
-                LineItem.product_description.ilike(search_filter),
+        match = explorer_match_expression(search)
+        if match and index_available(db.session):
+            query = query.filter(db.or_(
+                db.text(
+                    'line_items.rowid IN (SELECT rowid FROM line_items_fts WHERE line_items_fts MATCH :search_match)'
+                ).bindparams(search_match=match),
+                substring_filter(LineItem, PART_NUMBER_COLUMNS, search, db.session),
+            ))
+        else:
+            search_filter = f'%{search}%'
+            query = query.filter(
+                db.or_(
+                    LineItem.product_name.ilike(search_filter),
+                    LineItem.part_number.ilike(search_filter),
+                    LineItem.manufacturer.ilike(search_filter),
+                    LineItem.product_description.ilike(search_filter),
+                )
             )
-        )
 
     # Vendor filter (join to Document)
     vendor = args.get('vendor', '').strip()
     if vendor:
-        query = query.filter(Document.vendor_name.ilike(f'%{vendor}%'))
+        query = query.filter(substring_filter(Document, ('vendor_name',), vendor, db.session))
 
     # Category filters
     category = args.get('category', '').strip()
@@ -58,14 +92,14 @@ def _build_line_items_query(args):
     if max_price is not None:
         query = query.filter(LineItem.unit_price <= max_price)
 
-    # Date range (from Document.document_date)
-    date_from = args.get('date_from', '').strip()
+    # Date range, on the parsed document date
+    date_from = _date_arg(args, 'date_from')
     if date_from:
-        query = query.filter(Document.document_date >= date_from)
+        query = query.filter(Document.document_date_ordinal >= date_from.toordinal())
 
-    date_to = args.get('date_to', '').strip()
+    date_to = _date_arg(args, 'date_to')
     if date_to:
-        query = query.filter(Document.document_date <= date_to)
+        query = query.filter(Document.document_date_ordinal <= date_to.toordinal())
 
     # Document type filter
     document_type = args.get('document_type', '').strip()
@@ -75,7 +109,7 @@ def _build_line_items_query(args):
     # Contract number filter
     contract_number = args.get('contract_number', '').strip()
     if contract_number:
-        query = query.filter(Document.contract_number.ilike(f'%{contract_number}%'))
+        query = query.filter(substring_filter(Document, ('contract_number',), contract_number, db.session))
 
     # Sorting
     sort_by = args.get('sort_by', 'created_at')
@@ -110,7 +144,7 @@ def list_line_items():
     per_page = min(per_page, 100)
 
     query = _build_line_items_query(request.args)
-    total = query.count()
+    total = query.order_by(None).count()
     items = query.offset((page - 1) * per_page).limit(per_page).all()
 
     return jsonify({
@@ -214,60 +248,44 @@ def export_line_items():
         )
 
 
+def _snapshot_filters(args) -> dict:
+    """The explorer filters of _build_line_items_query as an analytics snapshot filter dict."""
+    filters = {
+        key: args.get(key, '').strip()
+        for key in ('search', 'vendor', 'category', 'sub_category', 'document_type',
+                    'contract_number', 'product_id', 'date_from', 'date_to')
+    }
+    for key in ('date_from', 'date_to'):
+        _date_arg(args, key)
+    filters['min_price'] = args.get('min_price', type=float)
+    filters['max_price'] = args.get('max_price', type=float)
+    return filters
+
+
 @line_items_bp.route('/spend-analysis', methods=['GET'])
 @jwt_required()
 def spend_analysis():
-    """Return aggregated spend analysis data."""
-    base_query = LineItem.query.join(Document, LineItem.document_id == Document.id)\
-        .filter(LineItem.session_id == '__default__')
+    """Return aggregated spend analysis data (accepts the explorer filters)."""
+    snapshot = get_analytics_snapshot('__default__')
+    filters = _snapshot_filters(request.args)
+    spend = [('total', 'extended_price', 'sum')]
 
     # Spend by vendor
-    spend_by_vendor_rows = db.session.query(
-        Document.vendor_name,
-        db.func.sum(LineItem.extended_price),
-    ).join(LineItem, LineItem.document_id == Document.id)\
-     .filter(LineItem.session_id == '__default__')\
-     .filter(Document.vendor_name.isnot(None))\
-     .group_by(Document.vendor_name)\
-     .order_by(db.func.sum(LineItem.extended_price).desc())\
-     .all()
-
     spend_by_vendor = [
-        {'vendor': row[0], 'total': round(row[1] or 0, 2)}
-        for row in spend_by_vendor_rows
+        {'vendor': g['vendor'], 'total': round(g['total'] or 0, 2)}
+        for g in snapshot.aggregate(['vendor'], spend, filters, sort='total')['groups']
     ]
 
     # Spend by category
-    spend_by_category_rows = db.session.query(
-        LineItem.category,
-        db.func.sum(LineItem.extended_price),
-    ).filter(LineItem.session_id == '__default__')\
-     .filter(LineItem.category.isnot(None))\
-     .group_by(LineItem.category)\
-     .order_by(db.func.sum(LineItem.extended_price).desc())\
-     .all()
-
     spend_by_category = [
-        {'category': row[0], 'total': round(row[1] or 0, 2)}
-        for row in spend_by_category_rows
+        {'category': g['category'], 'total': round(g['total'] or 0, 2)}
+        for g in snapshot.aggregate(['category'], spend, filters, sort='total')['groups']
     ]
 
-    # Spend over time (grouped by month from Document.document_date)
-    # document_date is stored as string (YYYY-MM-DD or similar), so we substring for month
-    spend_over_time_rows = db.session.query(
-        db.func.substr(Document.document_date, 1, 7).label('month'),
-        db.func.sum(LineItem.extended_price),
-    ).join(LineItem, LineItem.document_id == Document.id)\
-     .filter(LineItem.session_id == '__default__')\
-     .filter(Document.document_date.isnot(None))\
-     .filter(Document.document_date != '')\
-     .group_by(db.func.substr(Document.document_date, 1, 7))\
-     .order_by(db.func.substr(Document.document_date, 1, 7))\
-     .all()
-
+    # Spend over time, by month of the parsed document date
     spend_over_time = [
-        {'month': row[0], 'total': round(row[1] or 0, 2)}
-        for row in spend_over_time_rows
+        {'month': g['month'], 'total': round(g['total'] or 0, 2)}
+        for g in snapshot.aggregate(['month'], spend, filters)['groups']
     ]
 
     return jsonify({
@@ -277,6 +295,57 @@ def spend_analysis():
     })
 
 
+@line_items_bp.route('/facets', methods=['GET'])
+@jwt_required()
+def line_item_facets():
+    """Facet value counts for the explorer filters (facets=comma-separated subset, limit per facet)."""
+    facets = [f.strip() for f in request.args.get('facets', '').split(',') if f.strip()] or list(FACETS)
+    unknown = [f for f in facets if f not in FACETS]
+    if unknown:
+        raise BadRequestError(f'Unknown facet: {unknown[0]}. Use one of: {", ".join(FACETS)}')
+    limit = request.args.get('limit', 50, type=int)
+    if limit < 1:
+        raise BadRequestError('limit must be positive')
+
+    snapshot = get_analytics_snapshot('__default__')
+    return jsonify(snapshot.facet_counts(_snapshot_filters(request.args), tuple(facets), limit))
+
+
+@line_items_bp.route('/pivot', methods=['GET'])
+@jwt_required()
+def pivot_line_items():
+    """
+    Pivot line items: rows (comma-separated dimensions), an optional column
+    dimension, a measure and an aggregate, over the explorer filters.
+    """
+    rows = [d.strip() for d in request.args.get('rows', 'vendor').split(',') if d.strip()]
+    column = request.args.get('columns', '').strip() or None
+    measure = request.args.get('measure', 'extended_price')
+    agg = request.args.get('agg', 'sum')
+    limit = request.args.get('limit', 100, type=int)
+
+    if not rows or len(rows) > 3:
+        raise BadRequestError('rows must name one to three dimensions')
+    unknown = [d for d in rows + ([column] if column else []) if d not in DIMENSIONS]
+    if unknown:
+        raise BadRequestError(f'Unknown dimension: {unknown[0]}. Use one of: {", ".join(DIMENSIONS)}')
+    if measure not in MEASURES + ('rows', 'documents'):
+        raise BadRequestError(f'measure must be one of: {", ".join(MEASURES)}, rows, documents')
+    if agg not in AGGREGATES:
+        raise BadRequestError(f'agg must be one of: {", ".join(AGGREGATES)}')
+    if limit < 1:
+        raise BadRequestError('limit must be positive')
+
+    snapshot = get_analytics_snapshot('__default__')
+    filters = _snapshot_filters(request.args)
+    try:
+        result = snapshot.pivot(rows, column, measure, agg, filters, limit=min(limit, 10_000))
+    except ValueError as e:
+        raise BadRequestError(str(e))
+    result.update({'dimensions': rows, 'column': column, 'measure': measure, 'agg': agg})
+    return jsonify(result)
+
+
 @line_items_bp.route('/<item_id>', methods=['PUT'])
 @jwt_required()
 def update_line_item(item_id):
@@ -300,6 +369,9 @@ def update_line_item(item_id):
 
     # Track which fields were changed for field_mapping updates
     changed_fields = []
+    was_verified = bool(item.human_verified)
+    before = item_fields(item)
+    previous_product_id = item.canonical_product_id
 
     for field in updatable_fields:
         if field in data:
@@ -336,5 +408,32 @@ def update_line_item(item_id):
                     )
                     db.session.add(mapping)
 
+    if set(changed_fields) & IDENTITY_FIELDS:
+        db.session.flush()
+        link_line_items('__default__', document_ids=[item.document_id])
+    if set(changed_fields) & PRICE_FIELDS:
+        db.session.flush()
+        record_price_observations('__default__', [item.document_id])
+    if set(changed_fields) & IDENTITY_FIELDS:
+        # Observations follow the item to its new product; both products' stats move
+        from app.services.canonicalizer import refresh_product_stats
+        sync_observation_products('__default__')
+        product_id = db.session.query(LineItem.canonical_product_id).filter(LineItem.id == item.id).scalar()
+        products = {p for p in (previous_product_id, product_id) if p}
+        if products:
+            refresh_product_stats('__default__', list(products))
+    if changed_fields:
+        bump_data_version('__default__', [item.document_id])
     db.session.commit()
+
+    # Verified labels train the local category classifier incrementally
+    if item.human_verified and item.category and (
+            not was_verified or set(changed_fields) & set(LINE_ITEM_FIELDS)):
+        try:
+            learn_line_item_labels(
+                '__default__', add=[item_fields(item)],
+                remove=[before] if was_verified and before['category'] else [],
+            )
+        except Exception as e:
+            logger.warning(f'Could not update category classifier from item {item.id}: {e}')
     return jsonify(item.to_dict())
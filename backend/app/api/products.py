@@ -1,20 +1,29 @@
-import json
 import logging
+import math
 from datetime import datetime, timezone
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify
 from flask_jwt_extended import jwt_required
 
 from app.extensions import db
 from app.models.canonical_product import CanonicalProduct
 from app.models.line_item import LineItem
 from app.models.document import Document
+from app.models.price_observation import PriceObservation
 from app.errors import BadRequestError, NotFoundError
+from app.services.data_version import bump_data_version
+from app.services.date_utils import parse_date
+from app.services.igce import MAX_LINES, MAX_OPTION_YEARS, build_batch_igce, igce_workbook
+from app.services.price_observations import SERIES_INTERVALS, price_series
+from app.services.pricing_engine import get_price_estimates
 
 logger = logging.getLogger(__name__)
 
 products_bp = Blueprint('products', __name__, url_prefix='/api/products')
 
+# Optional string fields of a batch IGCE line.
+IGCE_LINE_TEXT_FIELDS = ('product_id', 'part_number', 'product_name', 'manufacturer', 'description')
+
 
 @products_bp.route('', methods=['GET'])
 @jwt_required()
@@ -43,11 +52,11 @@ def list_products():
         query = query.filter(CanonicalProduct.category == category)
 
     query = query.order_by(CanonicalProduct.canonical_name)
-    total = query.count()
+    total = query.order_by(None).count()
     products = query.offset((page - 1) * per_page).limit(per_page).all()
 
     return jsonify({
-        'items': [p.to_dict() for p in products],
+        'items': [p.to_dict(include_history=False) for p in products],
         'total': total,
         'page': page,
         'per_page': per_page,
@@ -62,21 +71,28 @@ def get_product(product_id):
     if not product:
         raise NotFoundError(f'Product {product_id} not found')
 
-    result = product.to_dict()
+    result = product.to_dict(include_history=False)
+
+    # Most recent observations, oldest first, for the price chart
+    recent = PriceObservation.query.filter_by(canonical_product_id=product.id)\
+        .order_by(PriceObservation.observed_on.desc())\
+        .limit(50)\
+        .all()
+    result['price_history'] = [
+        {'price': round(o.unit_price, 2), 'date': o.observed_on.isoformat() if o.observed_on else None,
+         'vendor': o.vendor_name}
+        for o in reversed(recent)
+    ]
 
     # Include recent line items for this product
     line_items = LineItem.query.join(Document, LineItem.document_id == Document.id)\
-        .filter(LineItem.session_id == '__default__')\
-        .filter(LineItem.product_name == product.canonical_name)\
+        .filter(LineItem.canonical_product_id == product.id)\
         .order_by(LineItem.created_at.desc())\
         .limit(20)\
         .all()
 
     result['recent_line_items'] = [li.to_dict() for li in line_items]
-    result['line_item_count'] = LineItem.query.filter_by(
-        product_name=product.canonical_name,
-        session_id='__default__',
-    ).count()
+    result['line_item_count'] = LineItem.query.filter_by(canonical_product_id=product.id).count()
 
     return jsonify(result)
 
@@ -102,27 +118,30 @@ def generate_igce(product_id):
     if avg_price is None:
         raise BadRequestError(f'No pricing data available for product "{product.canonical_name}"')
 
-    # Apply escalation: estimated_unit_price = avg_price * (1 + escalation_rate)
-    estimated_unit_price = round(avg_price * (1 + escalation_rate), 2)
+    # Statistical estimate (recency-weighted, outliers trimmed, at this
+    # quantity) when observations exist, otherwise the plain average
+    estimate = get_price_estimates('__default__', [product.id]).get(product.id)
+    base_price = estimate.price_at(quantity) if estimate else avg_price
+    db.session.commit()
+
+    # Apply escalation: estimated_unit_price = base_price * (1 + escalation_rate)
+    estimated_unit_price = round(base_price * (1 + escalation_rate), 2)
     estimated_total = round(estimated_unit_price * quantity, 2)
 
-    # Gather price sources from line items
+    # Gather the most recent price observations as sources
     price_sources_query = db.session.query(
-        LineItem.unit_price,
-        Document.document_date,
-        Document.vendor_name,
-    ).join(Document, LineItem.document_id == Document.id)\
-     .filter(LineItem.session_id == '__default__')\
-     .filter(LineItem.product_name == product.canonical_name)\
-     .filter(LineItem.unit_price.isnot(None))\
-     .order_by(Document.document_date.desc())\
+        PriceObservation.unit_price,
+        PriceObservation.observed_on,
+        PriceObservation.vendor_name,
+    ).filter(PriceObservation.canonical_product_id == product.id)\
+     .order_by(PriceObservation.observed_on.desc())\
      .limit(20)\
      .all()
 
     price_sources = [
         {
             'price': round(row[0], 2) if row[0] else None,
-            'date': row[1],
+            'date': row[1].isoformat() if row[1] else None,
             'vendor': row[2],
         }
         for row in price_sources_query
@@ -137,6 +156,9 @@ def generate_igce(product_id):
         'min_price': round(product.min_price, 2) if product.min_price else None,
         'max_price': round(product.max_price, 2) if product.max_price else None,
         'escalation_rate': escalation_rate,
+        'base_unit_price': round(base_price, 2),
+        'pricing_method': 'statistical' if estimate else 'average',
+        'price_estimate': estimate.to_dict() if estimate else None,
         'estimated_unit_price': estimated_unit_price,
         'estimated_total': estimated_total,
         'price_sources': price_sources,
@@ -144,123 +166,135 @@ def generate_igce(product_id):
     })
 
 
+@products_bp.route('/<product_id>/estimate', methods=['GET'])
+@jwt_required()
+def get_price_estimate(product_id):
+    """Statistical unit price estimate of a product, optionally at an order quantity (?quantity=)."""
+    product = CanonicalProduct.query.get(product_id)
+    if not product:
+        raise NotFoundError(f'Product {product_id} not found')
+    quantity = request.args.get('quantity', type=float)
+    if quantity is not None and quantity <= 0:
+        raise BadRequestError('Quantity must be a positive number')
+
+    estimate = get_price_estimates('__default__', [product.id]).get(product.id)
+    db.session.commit()
+    if estimate is None:
+        raise NotFoundError(f'No price observations for product "{product.canonical_name}"')
+
+    result = estimate.to_dict()
+    result['product_name'] = product.canonical_name
+    result['quantity'] = quantity
+    result['unit_price_at_quantity'] = round(estimate.price_at(quantity), 2)
+    return jsonify(result)
+
+
+@products_bp.route('/igce/batch', methods=['POST'])
+@jwt_required()
+def generate_batch_igce():
+    """Generate an IGCE for a whole BOM or requirement basket in one request.
+
+    Body: {"lines": [{"product_id" | "part_number" | "product_name", "manufacturer"?,
+    "quantity", "description"?}, ...], "escalation_rate": 0.03, "option_years": 0}.
+    Query param format=xlsx returns the estimate as a workbook.
+    """
+    fmt = request.args.get('format', 'json').lower()
+    if fmt not in ('json', 'xlsx'):
+        raise BadRequestError('Format must be json or xlsx')
+
+    data = request.get_json(silent=True) or {}
+    lines = data.get('lines')
+    escalation_rate = data.get('escalation_rate', 0.03)
+    option_years = data.get('option_years', 0)
+
+    if not isinstance(lines, list) or not lines:
+        raise BadRequestError('lines must be a non-empty list')
+    if len(lines) > MAX_LINES:
+        raise BadRequestError(f'At most {MAX_LINES} lines per request')
+    if not _is_number(escalation_rate) or escalation_rate < 0:
+        raise BadRequestError('Escalation rate must be a non-negative number')
+    if not isinstance(option_years, int) or isinstance(option_years, bool) \
+            or not 0 <= option_years <= MAX_OPTION_YEARS:
+        raise BadRequestError(f'option_years must be an integer between 0 and {MAX_OPTION_YEARS}')
+    for index, line in enumerate(lines, 1):
+        if not isinstance(line, dict):
+            raise BadRequestError(f'Line {index} must be an object')
+        for field in IGCE_LINE_TEXT_FIELDS:
+            if line.get(field) is not None and not isinstance(line[field], str):
+                raise BadRequestError(f'Line {index}: {field} must be a string')
+        if not any(line.get(k) for k in ('product_id', 'part_number', 'product_name')):
+            raise BadRequestError(f'Line {index} needs a product_id, part_number or product_name')
+        quantity = line.get('quantity', 1)
+        if not _is_number(quantity) or quantity <= 0:
+            raise BadRequestError(f'Line {index}: quantity must be a positive number')
+        line['quantity'] = quantity
+
+    estimate = build_batch_igce(lines, escalation_rate, option_years, '__default__')
+    db.session.commit()
+    estimate['generated_at'] = datetime.now(timezone.utc).isoformat()
+
+    if fmt == 'xlsx':
+        return Response(
+            igce_workbook(estimate),
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            headers={'Content-Disposition': 'attachment; filename=igce_estimate.xlsx'},
+        )
+    return jsonify(estimate)
+
+
+@products_bp.route('/<product_id>/price-series', methods=['GET'])
+@jwt_required()
+def get_price_series(product_id):
+    """Price time series of a product, downsampled per month (or year) to min/avg/max.
+
+    Query params: interval (month|year), date_from, date_to.
+    """
+    product = CanonicalProduct.query.get(product_id)
+    if not product:
+        raise NotFoundError(f'Product {product_id} not found')
+
+    interval = request.args.get('interval', 'month')
+    if interval not in SERIES_INTERVALS:
+        raise BadRequestError(f'interval must be one of: {", ".join(SERIES_INTERVALS)}')
+    bounds = {}
+    for name in ('date_from', 'date_to'):
+        raw = request.args.get(name, '').strip()
+        if raw:
+            bounds[name] = parse_date(raw)
+            if bounds[name] is None:
+                raise BadRequestError(f'{name} is not a valid date')
+
+    series = price_series(product.id, interval, bounds.get('date_from'), bounds.get('date_to'))
+    return jsonify({
+        'product_id': product.id,
+        'product_name': product.canonical_name,
+        'interval': interval,
+        'series': series,
+        'observations': sum(point['count'] for point in series),
+    })
+
+
 @products_bp.route('/rebuild', methods=['POST'])
 @jwt_required()
 def rebuild_catalog():
-    """Rebuild canonical product catalog from line items."""
-    session_filter = '__default__'
-
-    # Group line items by product_name and compute statistics
-    product_stats = db.session.query(
-        LineItem.product_name,
-        LineItem.category,
-        LineItem.manufacturer,
-        LineItem.part_number,
-        db.func.avg(LineItem.unit_price).label('avg_price'),
-        db.func.min(LineItem.unit_price).label('min_price'),
-        db.func.max(LineItem.unit_price).label('max_price'),
-        db.func.count(LineItem.id).label('item_count'),
-    ).filter_by(session_id=session_filter)\
-     .filter(LineItem.product_name.isnot(None))\
-     .filter(LineItem.product_name != '')\
-     .group_by(LineItem.product_name)\
-     .all()
+    """Rebuild canonical product catalog from line items.
 
-    created = 0
-    updated = 0
-
-    for stat in product_stats:
-        product_name = stat[0]
-        category = stat[1]
-        manufacturer = stat[2]
-        part_number = stat[3]
-        avg_price = stat[4]
-        min_price = stat[5]
-        max_price = stat[6]
-
-        # Check if canonical product already exists
-        existing = CanonicalProduct.query.filter_by(
-            canonical_name=product_name,
-            session_id=session_filter,
-        ).first()
-
-        # Get the latest price and date
-        latest_item = LineItem.query.join(Document, LineItem.document_id == Document.id)\
-            .filter(LineItem.session_id == session_filter)\
-            .filter(LineItem.product_name == product_name)\
-            .filter(LineItem.unit_price.isnot(None))\
-            .order_by(Document.document_date.desc())\
-            .first()
-
-        last_price = latest_item.unit_price if latest_item else None
-        last_date = latest_item.document.document_date if latest_item and latest_item.document else None
-
-        # Build price history from individual line items
-        price_history_rows = db.session.query(
-            LineItem.unit_price,
-            Document.document_date,
-            Document.vendor_name,
-        ).join(Document, LineItem.document_id == Document.id)\
-         .filter(LineItem.session_id == session_filter)\
-         .filter(LineItem.product_name == product_name)\
-         .filter(LineItem.unit_price.isnot(None))\
-         .order_by(Document.document_date.asc())\
-         .limit(50)\
-         .all()
-
-        price_history = [
-            {
-                'price': round(r[0], 2) if r[0] else None,
-                'date': r[1],
-                'vendor': r[2],
-            }
-            for r in price_history_rows
-        ]
-
-        # Collect known part numbers
-        part_numbers_rows = db.session.query(
-            db.distinct(LineItem.part_number),
-        ).filter_by(session_id=session_filter)\
-         .filter(LineItem.product_name == product_name)\
-         .filter(LineItem.part_number.isnot(None))\
-         .filter(LineItem.part_number != '')\
-         .all()
-        known_part_numbers = [r[0] for r in part_numbers_rows if r[0]]
-
-        if existing:
-            existing.category = category or existing.category
-            existing.manufacturer = manufacturer or existing.manufacturer
-            existing.avg_price = round(avg_price, 2) if avg_price else existing.avg_price
-            existing.min_price = round(min_price, 2) if min_price else existing.min_price
-            existing.max_price = round(max_price, 2) if max_price else existing.max_price
-            existing.last_known_price = round(last_price, 2) if last_price else existing.last_known_price
-            existing.last_price_date = last_date or existing.last_price_date
-            existing.price_history = json.dumps(price_history)
-            existing.known_part_numbers = json.dumps(known_part_numbers)
-            updated += 1
-        else:
-            product = CanonicalProduct(
-                canonical_name=product_name,
-                category=category,
-                manufacturer=manufacturer,
-                known_part_numbers=json.dumps(known_part_numbers),
-                known_aliases=json.dumps([]),
-                last_known_price=round(last_price, 2) if last_price else None,
-                last_price_date=last_date,
-                avg_price=round(avg_price, 2) if avg_price else None,
-                min_price=round(min_price, 2) if min_price else None,
-                max_price=round(max_price, 2) if max_price else None,
-                price_history=json.dumps(price_history),
-                session_id=session_filter,
-            )
-            db.session.add(product)
-            created += 1
+    Body (optional): {"full": true} re-clusters every line item; by default
+    only line items not yet linked to a product are canonicalized.
+    """
+    from app.services.canonicalizer import canonicalize_products
 
+    data = request.get_json(silent=True) or {}
+    summary = canonicalize_products('__default__', full=bool(data.get('full')))
+    bump_data_version('__default__')
     db.session.commit()
 
     return jsonify({
-        'message': f'Product catalog rebuilt: {created} created, {updated} updated',
-        'created': created,
-        'updated': updated,
-        'total': created + updated,
+        'message': f"Product catalog rebuilt: {summary['created']} created, {summary['updated']} updated",
+        **summary,
     })
+
+
+def _is_number(value) -> bool:
+    """A finite int or float; JSON booleans are not numbers here."""
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
@@ -12,7 +12,25 @@ class BaseConfig:
     JWT_REFRESH_TOKEN_EXPIRES = 86400 * 30  # 30 days
     JWT_TOKEN_LOCATION = ['headers']
     ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY', '')
+    # Override to point at a proxy or a local fake model server (tests)
+    ANTHROPIC_BASE_URL = os.getenv('ANTHROPIC_BASE_URL', '')
+    # 'anthropic' or 'stub' (offline canned replies, no API key needed)
+    LLM_GATEWAY = os.getenv('LLM_GATEWAY', 'anthropic')
+    # Concurrent model calls per worker process; adapts downward on rate limits
+    LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 4))
     UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', '/app/uploads')
+    VECTOR_INDEX_FOLDER = os.getenv('VECTOR_INDEX_FOLDER', '/app/data/vectors')
+    MODEL_FOLDER = os.getenv('MODEL_FOLDER', '/app/data/models')
+    # Local document type predictions at or above this posterior skip model classification
+    DOC_TYPE_MIN_CONFIDENCE = float(os.getenv('DOC_TYPE_MIN_CONFIDENCE', 0.9))
+    # Local line item category predictions at or above this posterior replace the model's
+    CATEGORY_MIN_CONFIDENCE = float(os.getenv('CATEGORY_MIN_CONFIDENCE', 0.9))
+    # Price estimates: weight of an observation halves every this many days,
+    # and outliers are trimmed by 'mad' (robust z-score) or 'iqr' (Tukey fences)
+    PRICE_HALF_LIFE_DAYS = float(os.getenv('PRICE_HALF_LIFE_DAYS', 365))
+    PRICE_OUTLIER_METHOD = os.getenv('PRICE_OUTLIER_METHOD', 'mad')
+    ANSWER_CACHE_TTL_SECONDS = int(os.getenv('ANSWER_CACHE_TTL_SECONDS', 3600))
+    ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', 512))
     MAX_CONTENT_LENGTH = 50 * 1024 * 1024  # 50MB max upload
 
 
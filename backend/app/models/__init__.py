@@ -4,8 +4,15 @@ from app.models.line_item import LineItem
 from app.models.document_chunk import DocumentChunk
 from app.models.field_mapping import FieldMapping
 from app.models.canonical_product import CanonicalProduct
+from app.models.product_identifier import ProductIdentifier
+from app.models.price_observation import PriceObservation
+from app.models.price_estimate import PriceEstimate
+from app.models.data_version import DataVersion, DataChange, CatalogChange
+from app.models.conversation import Conversation, ConversationTurn
 
 __all__ = [
     'User', 'Document', 'LineItem', 'DocumentChunk',
-    'FieldMapping', 'CanonicalProduct',
+    'FieldMapping', 'CanonicalProduct', 'ProductIdentifier', 'PriceObservation', 'PriceEstimate',
+    'DataVersion', 'DataChange', 'CatalogChange',
+    'Conversation', 'ConversationTurn',
 ]
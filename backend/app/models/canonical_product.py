@@ -6,6 +6,10 @@ from app.extensions import db
 
 class CanonicalProduct(db.Model):
     __tablename__ = 'canonical_products'
+    __table_args__ = (
+        db.Index('ix_canonical_products_session_name', 'session_id', 'canonical_name'),
+        db.Index('ix_canonical_products_session_category', 'session_id', 'category', 'canonical_name'),
+    )
 
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     canonical_name = db.Column(db.String(300), nullable=False, index=True)
@@ -30,7 +34,10 @@ class CanonicalProduct(db.Model):
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     session_id = db.Column(db.String(100), default='__default__', index=True)
 
-    def to_dict(self):
+    identifiers = db.relationship('ProductIdentifier', backref='product', lazy='dynamic',
+                                  cascade='all, delete-orphan')
+
+    def to_dict(self, include_history=True):
         def _parse_json(val):
             if not val:
                 return []
@@ -39,7 +46,7 @@ class CanonicalProduct(db.Model):
             except (json.JSONDecodeError, TypeError):
                 return []
 
-        return {
+        d = {
             'id': self.id,
             'canonical_name': self.canonical_name,
             'category': self.category,
@@ -51,7 +58,9 @@ class CanonicalProduct(db.Model):
             'avg_price': self.avg_price,
             'min_price': self.min_price,
             'max_price': self.max_price,
-            'price_history': _parse_json(self.price_history),
             'asset_tracker_category': self.asset_tracker_category,
             'created_at': self.created_at.isoformat() if self.created_at else None,
         }
+        if include_history:
+            d['price_history'] = _parse_json(self.price_history)
+        return d
@@ -0,0 +1,66 @@
+import json
+import uuid
+from datetime import datetime, timezone
+from app.extensions import db
+
+
+class Conversation(db.Model):
+    """A chat conversation. Older turns are folded into `summary`."""
+    __tablename__ = 'conversations'
+
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = db.Column(db.String(100), index=True)
+    title = db.Column(db.String(200))
+    summary = db.Column(db.Text, default='')
+    summarized_turns = db.Column(db.Integer, default=0)  # oldest turns folded into summary
+    turn_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc),
+                           onupdate=lambda: datetime.now(timezone.utc))
+    session_id = db.Column(db.String(100), default='__default__', index=True)
+
+    turns = db.relationship('ConversationTurn', backref='conversation', lazy='dynamic',
+                            cascade='all, delete-orphan', order_by='ConversationTurn.turn_index')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'title': self.title,
+            'turn_count': self.turn_count,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
+
+
+class ConversationTurn(db.Model):
+    """One question and answer, with the retrieval hits the answer was built from."""
+    __tablename__ = 'conversation_turns'
+    __table_args__ = (
+        db.UniqueConstraint('conversation_id', 'turn_index', name='uq_conversation_turn'),
+    )
+
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    conversation_id = db.Column(db.String(36), db.ForeignKey('conversations.id'), nullable=False, index=True)
+    turn_index = db.Column(db.Integer, nullable=False)
+    question = db.Column(db.Text, nullable=False)
+    answer = db.Column(db.Text)
+    query_type = db.Column(db.String(50))
+    sources = db.Column(db.Text, default='[]')  # JSON array of source citations
+    source_keys = db.Column(db.Text, default='[]')  # JSON array of [type, id] retrieval hits
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    session_id = db.Column(db.String(100), default='__default__', index=True)
+
+    def to_dict(self):
+        try:
+            sources = json.loads(self.sources or '[]')
+        except (json.JSONDecodeError, TypeError):
+            sources = []
+        return {
+            'id': self.id,
+            'turn_index': self.turn_index,
+            'question': self.question,
+            'answer': self.answer,
+            'query_type': self.query_type,
+            'sources': sources,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
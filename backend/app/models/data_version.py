@@ -0,0 +1,47 @@
+from datetime import datetime, timezone
+from app.extensions import db
+
+
+class DataVersion(db.Model):
+    """Monotonic per-session counter bumped whenever document data changes."""
+    __tablename__ = 'data_versions'
+
+    session_id = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc),
+                           onupdate=lambda: datetime.now(timezone.utc))
+
+    def to_dict(self):
+        return {
+            'session_id': self.session_id,
+            'version': self.version,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
+
+
+class DataChange(db.Model):
+    """Which documents a data version touched; NULL document_id means everything."""
+    __tablename__ = 'data_changes'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    session_id = db.Column(db.String(100), nullable=False, index=True)
+    version = db.Column(db.Integer, nullable=False, index=True)
+    document_id = db.Column(db.String(36))
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+class CatalogChange(db.Model):
+    """
+    Which canonical products had their identifiers rewritten; NULL product id
+    means the whole catalog. The autoincrement id orders changes and serves as
+    the catalog version product resolvers refresh from.
+    """
+    __tablename__ = 'catalog_changes'
+    __table_args__ = (
+        db.Index('ix_catalog_changes_session_id_id', 'session_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    session_id = db.Column(db.String(100), nullable=False)
+    canonical_product_id = db.Column(db.String(36))
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
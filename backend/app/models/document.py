@@ -1,10 +1,20 @@
 import uuid
 from datetime import datetime, timezone
+from sqlalchemy.orm import validates
 from app.extensions import db
+from app.services.date_utils import date_ordinal, month_key
 
 
 class Document(db.Model):
     __tablename__ = 'documents'
+    __table_args__ = (
+        # Library, dashboard and queue queries: session first, newest/oldest first
+        db.Index('ix_documents_session_created', 'session_id', 'created_at'),
+        db.Index('ix_documents_session_status', 'session_id', 'processing_status', 'created_at'),
+        db.Index('ix_documents_session_type', 'session_id', 'document_type', 'created_at'),
+        db.Index('ix_documents_session_vendor', 'session_id', 'vendor_name'),
+        db.Index('ix_documents_session_contract', 'session_id', 'contract_number'),
+    )
 
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
 
@@ -29,6 +39,12 @@ class Document(db.Model):
     total_amount = db.Column(db.Float)
     currency = db.Column(db.String(10), default='USD')
 
+    # Parsed dates (day ordinals, date.toordinal()), kept in sync with the strings above
+    document_date_ordinal = db.Column(db.Integer, index=True)
+    document_month = db.Column(db.String(7), index=True)  # YYYY-MM
+    period_of_performance_start_ordinal = db.Column(db.Integer)
+    period_of_performance_end_ordinal = db.Column(db.Integer)
+
     # Processing
     processing_status = db.Column(db.String(20), default='uploaded')
     # uploaded, extracting, mapping, review, complete, failed
@@ -59,6 +75,19 @@ class Document(db.Model):
                                  cascade='all, delete-orphan')
     chunks = db.relationship('DocumentChunk', backref='document', lazy='dynamic',
                              cascade='all, delete-orphan')
+    price_observations = db.relationship('PriceObservation', backref='document', lazy='dynamic',
+                                         cascade='all, delete-orphan')
+
+    @validates('document_date')
+    def _parse_document_date(self, key, value):
+        self.document_date_ordinal = date_ordinal(value)
+        self.document_month = month_key(value)
+        return value
+
+    @validates('period_of_performance_start', 'period_of_performance_end')
+    def _parse_period(self, key, value):
+        setattr(self, f'{key}_ordinal', date_ordinal(value))
+        return value
 
     def to_dict(self, include_items=False):
         d = {
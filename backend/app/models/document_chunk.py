@@ -13,8 +13,8 @@ class DocumentChunk(db.Model):
     chunk_type = db.Column(db.String(30))  # header, table, paragraph, terms, metadata
     page_number = db.Column(db.Integer)
 
-    # Embedding stored as JSON text (or NULL if using external store)
-    embedding = db.Column(db.Text)
+    # Embedding stored as a float32 little-endian blob (see services/embedder.py)
+    embedding = db.Column(db.LargeBinary)
 
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     session_id = db.Column(db.String(100), default='__default__', index=True)
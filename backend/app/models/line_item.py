@@ -1,13 +1,26 @@
 import uuid
 from datetime import datetime, timezone
+from sqlalchemy.orm import validates
 from app.extensions import db
+from app.services.date_utils import date_ordinal
 
 
 class LineItem(db.Model):
     __tablename__ = 'line_items'
+    __table_args__ = (
+        # Explorer and chat lookups filter on session first, then page in sort order
+        db.Index('ix_line_items_session_created', 'session_id', 'created_at'),
+        db.Index('ix_line_items_session_category', 'session_id', 'category', 'created_at'),
+        db.Index('ix_line_items_session_unit_price', 'session_id', 'unit_price'),
+        db.Index('ix_line_items_session_extended_price', 'session_id', 'extended_price'),
+        db.Index('ix_line_items_session_product_name', 'session_id', 'product_name'),
+        db.Index('ix_line_items_product_created', 'canonical_product_id', 'created_at'),
+        # Covers the session check when joining documents to their line items (explorer counts)
+        db.Index('ix_line_items_document_session', 'document_id', 'session_id'),
+    )
 
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    document_id = db.Column(db.String(36), db.ForeignKey('documents.id'), nullable=False, index=True)
+    document_id = db.Column(db.String(36), db.ForeignKey('documents.id'), nullable=False)
 
     # Line identification
     line_number = db.Column(db.Integer)
@@ -21,6 +34,9 @@ class LineItem(db.Model):
     product_name = db.Column(db.String(500), index=True)
     product_description = db.Column(db.Text)
 
+    # Resolved canonical product (see services/product_resolver.py)
+    canonical_product_id = db.Column(db.String(36), db.ForeignKey('canonical_products.id'), index=True)
+
     # Categorization
     category = db.Column(db.String(50), index=True)
     # hardware, software, service, license, maintenance, labor, other
@@ -42,6 +58,8 @@ class LineItem(db.Model):
     # Period
     period_start = db.Column(db.String(20))
     period_end = db.Column(db.String(20))
+    period_start_ordinal = db.Column(db.Integer)  # date.toordinal(), kept in sync with period_start
+    period_end_ordinal = db.Column(db.Integer)
 
     # Mapping confidence
     mapping_confidence = db.Column(db.Float)
@@ -53,6 +71,11 @@ class LineItem(db.Model):
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     session_id = db.Column(db.String(100), default='__default__', index=True)
 
+    @validates('period_start', 'period_end')
+    def _parse_period(self, key, value):
+        setattr(self, f'{key}_ordinal', date_ordinal(value))
+        return value
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -63,6 +86,7 @@ class LineItem(db.Model):
             'part_number': self.part_number,
             'manufacturer': self.manufacturer,
             'manufacturer_part_number': self.manufacturer_part_number,
+            'canonical_product_id': self.canonical_product_id,
             'product_name': self.product_name,
             'product_description': self.product_description,
             'category': self.category,
@@ -0,0 +1,59 @@
+import uuid
+from datetime import datetime, timezone
+from app.extensions import db
+
+
+class PriceEstimate(db.Model):
+    """Precomputed statistical unit price of a canonical product (see services/pricing_engine.py)."""
+    __tablename__ = 'price_estimates'
+
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    canonical_product_id = db.Column(db.String(36), db.ForeignKey('canonical_products.id'),
+                                     nullable=False, unique=True)
+
+    estimated_price = db.Column(db.Float, nullable=False)  # recency-weighted mean after trimming
+    median_price = db.Column(db.Float)
+    std_dev = db.Column(db.Float)
+    ci_low = db.Column(db.Float)
+    ci_high = db.Column(db.Float)
+    confidence_level = db.Column(db.Float)
+
+    # Quantity breaks: price ~ estimated_price * (quantity / reference_quantity) ** quantity_slope
+    quantity_slope = db.Column(db.Float)
+    reference_quantity = db.Column(db.Float)
+
+    observations = db.Column(db.Integer)
+    observations_used = db.Column(db.Integer)
+    outliers_trimmed = db.Column(db.Integer)
+    effective_sample_size = db.Column(db.Float)
+    latest_observation = db.Column(db.Date)
+    method = db.Column(db.String(50))
+
+    computed_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    session_id = db.Column(db.String(100), default='__default__', index=True)
+
+    def price_at(self, quantity=None) -> float:
+        """Estimated unit price at an order quantity, following the fitted quantity breaks."""
+        if not quantity or not self.quantity_slope or not self.reference_quantity:
+            return self.estimated_price
+        return self.estimated_price * (quantity / self.reference_quantity) ** self.quantity_slope
+
+    def to_dict(self):
+        return {
+            'canonical_product_id': self.canonical_product_id,
+            'estimated_price': self.estimated_price,
+            'median_price': self.median_price,
+            'std_dev': self.std_dev,
+            'ci_low': self.ci_low,
+            'ci_high': self.ci_high,
+            'confidence_level': self.confidence_level,
+            'quantity_slope': self.quantity_slope,
+            'reference_quantity': self.reference_quantity,
+            'observations': self.observations,
+            'observations_used': self.observations_used,
+            'outliers_trimmed': self.outliers_trimmed,
+            'effective_sample_size': self.effective_sample_size,
+            'latest_observation': self.latest_observation.isoformat() if self.latest_observation else None,
+            'method': self.method,
+            'computed_at': self.computed_at.isoformat() if self.computed_at else None,
+        }
@@ -0,0 +1,39 @@
+import uuid
+from app.extensions import db
+
+
+class PriceObservation(db.Model):
+    """One unit price seen on a line item, indexed by product and date for time-series queries."""
+    __tablename__ = 'price_observations'
+    __table_args__ = (
+        # Covers series, stats and recent-price queries without touching the table
+        db.Index('ix_price_observations_product_date', 'canonical_product_id', 'observed_on', 'unit_price'),
+    )
+
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    line_item_id = db.Column(db.String(36), db.ForeignKey('line_items.id'), nullable=False, unique=True)
+    document_id = db.Column(db.String(36), db.ForeignKey('documents.id'), nullable=False, index=True)
+    canonical_product_id = db.Column(db.String(36), db.ForeignKey('canonical_products.id'))
+
+    unit_price = db.Column(db.Float, nullable=False)
+    quantity = db.Column(db.Float)
+    extended_price = db.Column(db.Float)
+    vendor_name = db.Column(db.String(200))
+    document_number = db.Column(db.String(100))
+    observed_on = db.Column(db.Date)  # parsed document date, None when unparseable
+
+    session_id = db.Column(db.String(100), default='__default__', index=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'line_item_id': self.line_item_id,
+            'document_id': self.document_id,
+            'canonical_product_id': self.canonical_product_id,
+            'unit_price': self.unit_price,
+            'quantity': self.quantity,
+            'extended_price': self.extended_price,
+            'vendor_name': self.vendor_name,
+            'document_number': self.document_number,
+            'observed_on': self.observed_on.isoformat() if self.observed_on else None,
+        }
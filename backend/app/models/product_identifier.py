@@ -0,0 +1,30 @@
+import uuid
+from app.extensions import db
+
+
+class ProductIdentifier(db.Model):
+    """A normalized part number or name alias that resolves to a canonical product."""
+    __tablename__ = 'product_identifiers'
+    __table_args__ = (
+        db.Index('ix_product_identifiers_lookup', 'session_id', 'kind', 'normalized_key'),
+    )
+
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    canonical_product_id = db.Column(db.String(36), db.ForeignKey('canonical_products.id'),
+                                     nullable=False, index=True)
+    kind = db.Column(db.String(20), nullable=False)  # part_number, alias
+    value = db.Column(db.String(500))  # as written in the source
+    normalized_key = db.Column(db.String(500), nullable=False)
+    manufacturer_key = db.Column(db.String(100))
+    minhash = db.Column(db.LargeBinary)  # alias signature for canonicalization blocking
+    session_id = db.Column(db.String(100), default='__default__', index=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'canonical_product_id': self.canonical_product_id,
+            'kind': self.kind,
+            'value': self.value,
+            'normalized_key': self.normalized_key,
+            'manufacturer_key': self.manufacturer_key,
+        }
@@ -0,0 +1,115 @@
+"""
+Additive schema upgrades for databases created before a column existed.
+
+db.create_all() creates missing tables but never alters existing ones, so
+columns added to existing models are listed here and added in place at
+startup, each with an optional backfill run once when the column appears.
+Indexes declared on models but missing from existing tables are created,
+and the planner statistics refreshed when any were.
+Tables derived from existing rows are filled by their backfill while they
+are still empty and their source table is not.
+"""
+
+import logging
+
+from sqlalchemy import inspect, text
+
+from app.extensions import db
+
+logger = logging.getLogger(__name__)
+
+# (table, column, column DDL, index DDL or None, backfill "module:function" or None)
+COLUMN_UPGRADES = (
+    ('line_items', 'canonical_product_id', 'VARCHAR(36) REFERENCES canonical_products (id)',
+     'CREATE INDEX IF NOT EXISTS ix_line_items_canonical_product_id ON line_items (canonical_product_id)',
+     'app.services.product_resolver:backfill_product_links'),
+    ('product_identifiers', 'minhash', 'BLOB', None, None),
+    ('documents', 'document_date_ordinal', 'INTEGER',
+     'CREATE INDEX IF NOT EXISTS ix_documents_document_date_ordinal ON documents (document_date_ordinal)', None),
+    ('documents', 'period_of_performance_start_ordinal', 'INTEGER', None, None),
+    ('documents', 'period_of_performance_end_ordinal', 'INTEGER', None, None),
+    ('documents', 'document_month', 'VARCHAR(7)',
+     'CREATE INDEX IF NOT EXISTS ix_documents_document_month ON documents (document_month)',
+     'app.services.date_columns:backfill_document_dates'),
+    ('line_items', 'period_start_ordinal', 'INTEGER', None, None),
+    ('line_items', 'period_end_ordinal', 'INTEGER', None,
+     'app.services.date_columns:backfill_line_item_dates'),
+)
+
+# (derived table, source table, backfill "module:function")
+TABLE_BACKFILLS = (
+    ('price_observations', 'line_items', 'app.services.price_observations:backfill_price_observations'),
+)
+
+
+def upgrade_schema() -> list:
+    """Add missing columns (and their indexes), run their backfills. Returns 'table.column' names added."""
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    added = []
+    for table, column, ddl, index_ddl, backfill in COLUMN_UPGRADES:
+        if table not in tables:
+            continue
+        if column in {c['name'] for c in inspector.get_columns(table)}:
+            continue
+        try:
+            db.session.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+            if index_ddl:
+                db.session.execute(text(index_ddl))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logger.exception(f'Schema upgrade failed adding {table}.{column}')
+            continue
+        logger.info(f'Schema upgrade: added {table}.{column}')
+        added.append(f'{table}.{column}')
+        if backfill:
+            _run_backfill(backfill)
+
+    created = _create_missing_indexes(tables)
+    if created:
+        db.session.execute(text('ANALYZE'))
+        db.session.commit()
+        logger.info(f'Schema upgrade: created indexes {", ".join(created)}')
+
+    for table, source, backfill in TABLE_BACKFILLS:
+        if table in tables and source in tables and _is_empty(table) and not _is_empty(source):
+            logger.info(f'Schema upgrade: backfilling {table} from {source}')
+            _run_backfill(backfill)
+    return added
+
+
+def _create_missing_indexes(tables: set) -> list:
+    """Create model-declared indexes missing from tables that already existed. Returns their names."""
+    inspector = inspect(db.engine)
+    created = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            try:
+                index.create(db.engine)
+            except Exception:
+                logger.exception(f'Schema upgrade failed creating index {index.name}')
+                continue
+            created.append(index.name)
+    return created
+
+
+def _is_empty(table: str) -> bool:
+    return db.session.execute(text(f'SELECT 1 FROM {table} LIMIT 1')).first() is None
+
+
+def _run_backfill(target: str):
+    import importlib
+
+    module_name, func_name = target.split(':')
+    try:
+        getattr(importlib.import_module(module_name), func_name)()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        logger.exception(f'Schema backfill {target} failed')
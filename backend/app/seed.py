@@ -15,8 +15,9 @@ from datetime import datetime, timezone
 from app.extensions import db
 from app.models import (
     User, Document, LineItem, DocumentChunk,
-    FieldMapping, CanonicalProduct,
+    FieldMapping, CanonicalProduct, ProductIdentifier, PriceObservation, PriceEstimate,
 )
+from app.services.data_version import bump_data_version
 
 SESSION = '__default__'
 
@@ -26,9 +27,12 @@ def seed():
 
     # ── Clear existing __default__ data (order matters for FK constraints) ──
     DocumentChunk.query.filter_by(session_id=SESSION).delete()
+    PriceObservation.query.filter_by(session_id=SESSION).delete()
     LineItem.query.filter_by(session_id=SESSION).delete()
     Document.query.filter_by(session_id=SESSION).delete()
     FieldMapping.query.filter_by(session_id=SESSION).delete()
+    ProductIdentifier.query.filter_by(session_id=SESSION).delete()
+    PriceEstimate.query.filter_by(session_id=SESSION).delete()
     CanonicalProduct.query.filter_by(session_id=SESSION).delete()
     User.query.delete()
     db.session.flush()
@@ -1402,6 +1406,17 @@ def seed():
     db.session.add_all(products)
     db.session.flush()
 
+    # Index product identifiers, link line items to their products and
+    # record their prices as observations for the price estimates
+    from app.services.product_resolver import link_line_items, sync_product_identifiers
+    from app.services.price_observations import record_price_observations
+    from app.services.pricing_engine import refresh_price_estimates
+    sync_product_identifiers(products, full=True)
+    linked = link_line_items(SESSION)
+    db.session.flush()
+    record_price_observations(SESSION)
+    refresh_price_estimates(SESSION, full=True)
+
     # ================================================================
     # FIELD MAPPINGS  (~20)
     # ================================================================
@@ -1883,11 +1898,12 @@ def seed():
     db.session.flush()
 
     # ── Single commit ──
+    bump_data_version(SESSION)
     db.session.commit()
 
     print(f'  Users:             2')
     print(f'  Documents:         {len(docs)}')
     print(f'  Line items:        {len(line_items)}')
-    print(f'  Canonical products:{len(products)}')
+    print(f'  Canonical products:{len(products)} ({linked} line items linked)')
     print(f'  Field mappings:    {len(mappings)}')
     print(f'  Document chunks:   {len(chunks)}')
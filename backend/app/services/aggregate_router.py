@@ -0,0 +1,577 @@
+import calendar
+import logging
+import re
+from datetime import date, timedelta
+
+from app.services.text_utils import STOPWORDS, tokenize
+
+logger = logging.getLogger(__name__)
+
+MONTHS = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+MONTHS.update({name.lower(): i for i, name in enumerate(calendar.month_abbr) if name})
+
+DOCUMENT_TYPES = {
+    'invoice': 'invoice', 'invoices': 'invoice',
+    'po': 'purchase_order', 'pos': 'purchase_order',
+    'purchase order': 'purchase_order', 'purchase orders': 'purchase_order',
+    'quote': 'vendor_quote', 'quotes': 'vendor_quote',
+    'bom': 'bom', 'boms': 'bom', 'bill of materials': 'bom',
+    'modification': 'contract_mod', 'modifications': 'contract_mod', 'mods': 'contract_mod',
+    'timesheet': 'timesheet', 'timesheets': 'timesheet',
+}
+
+GROUPINGS = {
+    'vendor': ('vendor', 'vendors', 'supplier', 'suppliers'),
+    'category': ('category', 'categories'),
+    'month': ('month', 'months', 'monthly', 'over time'),
+    'product': ('product', 'products', 'item', 'items'),
+    'contract': ('contract', 'contracts'),
+    'manufacturer': ('manufacturer', 'manufacturers', 'brand', 'brands'),
+    'document_type': ('document type', 'document types'),
+}
+
+_CORPORATE_SUFFIXES = re.compile(
+    r'\b(inc|llc|ltd|corp|corporation|co|company|technologies|systems|networks|group)\b\.?', re.I
+)
+_GENERIC_FIRST_WORDS = {'the', 'general', 'global', 'national', 'international', 'united', 'american'}
+# Common English words that open company names ("Total Network Solutions", "First Federal")
+# but would match ordinary questions when used alone as a vendor alias.
+_COMMON_FIRST_WORDS = set("""
+best first new great good prime premier advanced smart quality central direct custom standard
+superior pro star summit apex liberty patriot eagle capital metro city state federal public
+north south east west northern southern eastern western pacific atlantic allied applied digital
+secure simple rapid express integrated professional complete main key core next one single
+""".split())
+
+# Words that describe the question itself rather than what to filter on.
+_QUESTION_WORDS = set("""
+total totals sum spend spent spending cost costs much many count number average avg mean
+top highest lowest most least largest biggest smallest cheapest expensive greatest
+breakdown break per each show list give tell find compare ranked rank ranking
+purchase purchased purchases buy bought order ordered orders paid pay
+vendor vendors supplier suppliers category categories month months monthly time
+product products item items line lines contract contracts manufacturer manufacturers
+brand brands document documents type types unit units price prices quantity quantities
+overall across entire whole data database records record us all ever far
+""".split())
+
+_AGGREGATE_CUES = re.compile(
+    r'\b(total|sum|how much|how many|number of|count|average|avg|mean|spend|spent|spending|'
+    r'breakdown|top \d+|top|highest|lowest|most|least|largest|biggest|cheapest|most expensive)\b'
+)
+# Nouns after "how many" that count records rather than purchased units.
+_RECORD_NOUNS = {
+    'line', 'lines', 'record', 'records', 'document', 'documents', 'docs', 'vendor', 'vendors',
+    'supplier', 'suppliers', 'category', 'categories', 'contract', 'contracts', 'manufacturer',
+    'manufacturers', 'month', 'months', 'times', 'different', 'distinct', 'unique',
+}
+_PURCHASE_VERBS = re.compile(r'\b(did|do|have|has) (we|you|they) (buy|bought|order|ordered|purchase|purchased|get|got)\b')
+_LIST_CUES = re.compile(r'^\s*(show|list|what did we (buy|purchase|order)|what have we (bought|purchased))\b')
+
+_MONEY = r'\$\s*([\d,]+(?:\.\d+)?)\s*([km])?\b'
+_PRICE_MIN = re.compile(r'\b(?:over|above|more than|greater than|at least|exceeding)\s+' + _MONEY)
+_PRICE_MAX = re.compile(r'\b(?:under|below|less than|at most|cheaper than)\s+' + _MONEY)
+
+_ISO = r'(\d{4}-\d{2}(?:-\d{2})?)'
+_MONTH_YEAR = r'((?:%s)\.?\s+\d{4})' % '|'.join(sorted(MONTHS, key=len, reverse=True))
+_DATE_TOKEN = f'(?:{_ISO}|{_MONTH_YEAR}|(\\d{{4}}))'
+
+
+class AggregateIntentParser:
+    """
+    Recognize aggregate, ranking and filter questions without a model call.
+
+    parse() returns an intent dict such as
+    {'kind': 'aggregate', 'metric': 'spend', 'group_by': 'vendor', 'order': 'desc',
+     'limit': 10, 'filters': {...}} or None when the question needs retrieval.
+    """
+
+    def __init__(self, vocabulary: dict, today: date = None):
+        # vocabulary: {'vendors': [...], 'categories': [...], 'contracts': [...]}
+        self.vocabulary = vocabulary
+        self.today = today or date.today()
+
+    def parse(self, question: str):
+        q = original = ' ' + re.sub(r'\s+', ' ', question.lower().strip().rstrip('?.!')) + ' '
+        filters = {}
+        consumed = []
+
+        q = self._extract_prices(q, filters)
+        q = self._extract_dates(q, filters)
+        q = self._extract_contracts(q, filters, consumed)
+        q = self._extract_vendors(q, filters, consumed)
+        q = self._extract_categories(q, filters)
+        q = self._extract_document_types(q, filters)
+
+        is_aggregate = bool(_AGGREGATE_CUES.search(q))
+        is_list = bool(_LIST_CUES.search(q))
+        if not is_aggregate and not (is_list and filters):
+            return None
+
+        group_by = self._grouping(q)
+        metric = self._metric(original, filters)
+        order = 'asc' if re.search(r'\b(lowest|least|smallest|cheapest|bottom)\b', q) else 'desc'
+        limit_match = re.search(r'\btop (\d+)\b', q)
+        limit = min(int(limit_match.group(1)), 100) if limit_match else 10
+
+        kind = 'aggregate' if is_aggregate else 'list'
+        if kind == 'list' and group_by:
+            kind = 'aggregate'
+
+        # Leftover content words name products; they must exist in the index
+        leftover = [
+            t for t in tokenize(q, min_length=2)
+            if t not in _QUESTION_WORDS and not t.isdigit()
+            and not any(t in c for c in consumed)
+        ]
+        if leftover:
+            filters['product_terms'] = leftover
+
+        return {
+            'kind': kind,
+            'metric': metric,
+            'group_by': group_by,
+            'order': order,
+            'limit': limit,
+            'filters': filters,
+        }
+
+    # ── Filters ─────────────────────────────────────────────────
+
+    def _extract_prices(self, q, filters):
+        for pattern, key in ((_PRICE_MIN, 'min_price'), (_PRICE_MAX, 'max_price')):
+            m = pattern.search(q)
+            if m:
+                value = float(m.group(1).replace(',', ''))
+                value *= {'k': 1_000, 'm': 1_000_000}.get(m.group(2), 1)
+                filters[key] = value
+                q = q[:m.start()] + ' ' + q[m.end():]
+        return q
+
+    def _extract_dates(self, q, filters):
+        m = re.search(rf'\bbetween {_DATE_TOKEN} and {_DATE_TOKEN}', q)
+        if m:
+            start = self._date_range(m.group(1) or m.group(2) or m.group(3))
+            end = self._date_range(m.group(4) or m.group(5) or m.group(6))
+            if start and end:
+                filters['date_from'], filters['date_to'] = start[0], end[1]
+                return q[:m.start()] + ' ' + q[m.end():]
+
+        m = re.search(r'\b(?:in |during )?(?:the )?(?:last|past) (\d+) (day|week|month|year)s?\b', q)
+        if m:
+            n, unit = int(m.group(1)), m.group(2)
+            days = {'day': 1, 'week': 7, 'month': 30, 'year': 365}[unit] * n
+            filters['date_from'] = (self.today - timedelta(days=days)).isoformat()
+            filters['date_to'] = self.today.isoformat()
+            return q[:m.start()] + ' ' + q[m.end():]
+
+        m = re.search(r'\b(?:in |during )?(this|last) (year|month)\b', q)
+        if m:
+            if m.group(2) == 'year':
+                year = self.today.year - (m.group(1) == 'last')
+                filters['date_from'], filters['date_to'] = f'{year}-01-01', f'{year}-12-31'
+            else:
+                first = self.today.replace(day=1)
+                if m.group(1) == 'last':
+                    first = (first - timedelta(days=1)).replace(day=1)
+                rng = self._date_range(first.strftime('%Y-%m'))
+                filters['date_from'], filters['date_to'] = rng
+            return q[:m.start()] + ' ' + q[m.end():]
+
+        m = re.search(r'\b(?:in |during )?q([1-4]) (?:of )?(\d{4})\b', q)
+        if m:
+            quarter, year = int(m.group(1)), int(m.group(2))
+            start_month = 3 * (quarter - 1) + 1
+            end_month = start_month + 2
+            filters['date_from'] = f'{year}-{start_month:02d}-01'
+            filters['date_to'] = f'{year}-{end_month:02d}-{calendar.monthrange(year, end_month)[1]:02d}'
+            return q[:m.start()] + ' ' + q[m.end():]
+
+        for pattern, keys in (
+            (rf'\b(?:since|after|from) {_DATE_TOKEN}', ('date_from',)),
+            (rf'\b(?:before|until|through|prior to) {_DATE_TOKEN}', ('date_to',)),
+            (rf'\b(?:in|during|for|on) {_DATE_TOKEN}', ('date_from', 'date_to')),
+        ):
+            m = re.search(pattern, q)
+            if m:
+                rng = self._date_range(m.group(1) or m.group(2) or m.group(3))
+                if rng:
+                    if keys == ('date_from',):
+                        filters['date_from'] = rng[0]
+                    elif keys == ('date_to',):
+                        filters['date_to'] = rng[1]
+                    else:
+                        filters['date_from'], filters['date_to'] = rng
+                    q = q[:m.start()] + ' ' + q[m.end():]
+        return q
+
+    def _date_range(self, token):
+        """Expand '2025', 'march 2025', '2025-03' or '2025-03-15' to (first_day, last_day)."""
+        if not token:
+            return None
+        token = token.strip().rstrip('.')
+        if re.fullmatch(r'\d{4}', token):
+            return f'{token}-01-01', f'{token}-12-31'
+        m = re.fullmatch(r'(\d{4})-(\d{2})(?:-(\d{2}))?', token)
+        if m:
+            year, month = int(m.group(1)), int(m.group(2))
+            if not 1 <= month <= 12:
+                return None
+            if m.group(3):
+                return token, token
+            return f'{year}-{month:02d}-01', f'{year}-{month:02d}-{calendar.monthrange(year, month)[1]:02d}'
+        parts = token.split()
+        if len(parts) == 2 and parts[0].rstrip('.') in MONTHS:
+            year, month = int(parts[1]), MONTHS[parts[0].rstrip('.')]
+            return f'{year}-{month:02d}-01', f'{year}-{month:02d}-{calendar.monthrange(year, month)[1]:02d}'
+        return None
+
+    def _extract_contracts(self, q, filters, consumed):
+        found = []
+        for contract in self.vocabulary.get('contracts', []):
+            key = contract.lower()
+            if key and key in q:
+                found.append(contract)
+                consumed.append(key)
+                q = q.replace(key, ' ')
+        if found:
+            filters['contract'] = found
+        return q
+
+    def _extract_vendors(self, q, filters, consumed):
+        found = []
+        for vendor in self.vocabulary.get('vendors', []):
+            for alias in _vendor_aliases(vendor):
+                if re.search(rf'\b{re.escape(alias)}\b', q):
+                    found.append(vendor)
+                    consumed.append(vendor.lower())
+                    q = re.sub(rf'\b{re.escape(alias)}\b', ' ', q)
+                    break
+        if found:
+            filters['vendor'] = found
+        return q
+
+    def _extract_categories(self, q, filters):
+        found = []
+        for category in self.vocabulary.get('categories', []):
+            key = category.lower()
+            plural = key + ('es' if key.endswith('s') else 's')
+            pattern = rf'\b({re.escape(plural)}|{re.escape(key)})\b'
+            if re.search(pattern, q):
+                found.append(category)
+                q = re.sub(pattern, ' ', q)
+        if found:
+            filters['category'] = found
+        return q
+
+    def _extract_document_types(self, q, filters):
+        for phrase in sorted(DOCUMENT_TYPES, key=len, reverse=True):
+            pattern = rf'\b{re.escape(phrase)}\b'
+            if re.search(pattern, q):
+                filters.setdefault('document_type', [])
+                if DOCUMENT_TYPES[phrase] not in filters['document_type']:
+                    filters['document_type'].append(DOCUMENT_TYPES[phrase])
+                q = re.sub(pattern, ' ', q)
+        return q
+
+    # ── Shape ───────────────────────────────────────────────────
+
+    def _grouping(self, q):
+        for group, words in GROUPINGS.items():
+            alternatives = '|'.join(re.escape(w) for w in words)
+            if re.search(rf'\b(by|per|each|which|what|top \d+|top|across) ({alternatives})\b', q) \
+                    or re.search(rf'\b({alternatives}) (have|has|had|with|by|ranked)\b', q):
+                return group
+        if re.search(r'\bover time\b|\bmonthly\b|\btrend\b', q):
+            return 'month'
+        return None
+
+    def _metric(self, q, filters):
+        if re.search(r'\b(average|avg|mean) (unit )?(price|cost|rate)\b', q):
+            return 'avg_price'
+        if re.search(r'\b(lowest|cheapest) (unit )?(prices?|costs?)\b|\bcheapest\b', q):
+            return 'min_price'
+        if re.search(r'\b(highest|most expensive) (unit )?(prices?|costs?)\b|\bmost expensive\b', q):
+            return 'max_price'
+        if re.search(r'\bhow many (units|licenses|seats)\b|\b(total )?quantity\b', q):
+            return 'quantity'
+        # "how many laptops", "how many did we buy": units bought, not line items
+        m = re.search(r'\bhow many ([a-z0-9-]+)', q)
+        if m:
+            noun = m.group(1)
+            generic = noun in _QUESTION_WORDS or noun in STOPWORDS
+            if noun not in _RECORD_NOUNS and noun not in DOCUMENT_TYPES \
+                    and (not generic or _PURCHASE_VERBS.search(q)):
+                return 'quantity'
+        if re.search(r'\b(how many|number of|count)\b', q):
+            if re.search(r'\bdocuments?\b', q) or filters.get('document_type'):
+                return 'documents'
+            return 'count'
+        return 'spend'
+
+
+def _vendor_aliases(vendor: str) -> list:
+    name = vendor.lower().strip()
+    aliases = [name]
+    short = re.sub(r'\s+', ' ', _CORPORATE_SUFFIXES.sub('', name)).strip(' ,.')
+    if short and short != name:
+        aliases.append(short)
+    first = name.split()[0] if name.split() else ''
+    # The first word alone is only an alias when it cannot be read as part of the question
+    if len(first) >= 3 and first not in aliases and not _is_common_word(first):
+        aliases.append(first)
+    return aliases
+
+
+def _is_common_word(word: str) -> bool:
+    return (word in _GENERIC_FIRST_WORDS or word in _COMMON_FIRST_WORDS or word in _QUESTION_WORDS
+            or word in STOPWORDS or word in GROUPINGS or bool(_AGGREGATE_CUES.fullmatch(word)))
+
+
+METRIC_LABELS = {
+    'spend': 'Total spend',
+    'count': 'Line items',
+    'documents': 'Documents',
+    'avg_price': 'Average unit price',
+    'max_price': 'Highest unit price',
+    'min_price': 'Lowest unit price',
+    'quantity': 'Total quantity',
+}
+GROUP_LABELS = {
+    'vendor': 'vendor', 'category': 'category', 'month': 'month', 'product': 'product',
+    'contract': 'contract', 'manufacturer': 'manufacturer', 'document_type': 'document type',
+}
+MONEY_METRICS = {'spend', 'avg_price', 'max_price', 'min_price'}
+PRODUCT_COLUMNS = ('product_name', 'part_number', 'manufacturer', 'product_description', 'labor_category')
+LIST_LIMIT = 20
+
+
+class AggregateQueryRunner:
+    """Answer a parsed aggregate intent with parameterized SQL over line items and documents."""
+
+    def run(self, intent: dict, db_session, session_id: str):
+        """Returns {'answer', 'sources', 'query_type', 'data'} or None if the intent cannot be served."""
+        from app.extensions import db
+        from app.models.document import Document
+        from app.models.line_item import LineItem
+
+        metric_exprs = {
+            'spend': db.func.sum(LineItem.extended_price),
+            'count': db.func.count(LineItem.id),
+            'documents': db.func.count(db.distinct(Document.id)),
+            'avg_price': db.func.avg(LineItem.unit_price),
+            'max_price': db.func.max(LineItem.unit_price),
+            'min_price': db.func.min(LineItem.unit_price),
+            'quantity': db.func.sum(LineItem.quantity),
+        }
+        group_exprs = {
+            'vendor': Document.vendor_name,
+            'category': LineItem.category,
+            'month': Document.document_month,
+            'product': LineItem.product_name,
+            'contract': Document.contract_number,
+            'manufacturer': LineItem.manufacturer,
+            'document_type': Document.document_type,
+        }
+
+        filters = intent['filters']
+        metric = intent['metric']
+
+        def _scoped(*columns):
+            if metric == 'documents':
+                q = db_session.query(*columns).select_from(Document)\
+                    .outerjoin(LineItem, LineItem.document_id == Document.id)
+            else:
+                q = db_session.query(*columns).select_from(LineItem)\
+                    .join(Document, LineItem.document_id == Document.id)
+            return self._apply_filters(q.filter(Document.session_id == session_id), filters)
+
+        try:
+            base = _scoped(Document.id)
+        except LookupError:
+            return None
+
+        metric_expr = metric_exprs[metric]
+        line_count = db.func.count(LineItem.id)
+        spend = db.func.sum(LineItem.extended_price)
+
+        if intent['kind'] == 'list':
+            answer, data = self._list(_scoped(LineItem, Document), _scoped(line_count, spend), filters)
+        elif intent['group_by']:
+            key = group_exprs[intent['group_by']]
+            q = _scoped(key, metric_expr, line_count).filter(key.isnot(None)).filter(key != '').group_by(key)
+            if intent['group_by'] == 'month':
+                q = q.order_by(key.asc())
+            else:
+                ordered = metric_expr.asc() if intent['order'] == 'asc' else metric_expr.desc()
+                q = q.order_by(ordered).limit(intent['limit'])
+            rows = q.all()
+            data = [
+                {'key': row[0], 'value': _round(row[1]), 'line_items': row[2]}
+                for row in rows
+            ]
+            answer = self._grouped_answer(intent, data, filters)
+        else:
+            row = _scoped(metric_expr, line_count, db.func.count(db.distinct(Document.id)), spend).one()
+            data = {'value': _round(row[0]), 'line_items': row[1], 'documents': row[2], 'spend': _round(row[3])}
+            answer = self._total_answer(intent, data, filters)
+
+        source_rows = _scoped(Document.id, Document.document_number, Document.vendor_name,
+                              Document.original_filename)\
+            .group_by(Document.id)\
+            .order_by(spend.desc())\
+            .limit(10)\
+            .all()
+        sources = [
+            {'document_id': r[0], 'document_number': r[1], 'vendor_name': r[2], 'original_filename': r[3]}
+            for r in source_rows
+        ]
+        return {'answer': answer, 'sources': sources, 'query_type': 'aggregate', 'data': data}
+
+    def _apply_filters(self, q, filters):
+        from app.extensions import db
+        from app.models.document import Document
+        from app.models.line_item import LineItem
+        from app.services.date_utils import date_ordinal
+        from app.services.line_item_search import index_available, resolve_terms
+
+        if filters.get('vendor'):
+            q = q.filter(Document.vendor_name.in_(filters['vendor']))
+        if filters.get('contract'):
+            q = q.filter(Document.contract_number.in_(filters['contract']))
+        if filters.get('category'):
+            q = q.filter(LineItem.category.in_(filters['category']))
+        if filters.get('document_type'):
+            q = q.filter(Document.document_type.in_(filters['document_type']))
+        if filters.get('date_from'):
+            q = q.filter(Document.document_date_ordinal >= date_ordinal(filters['date_from']))
+        if filters.get('date_to'):
+            q = q.filter(Document.document_date_ordinal <= date_ordinal(filters['date_to']))
+        if filters.get('min_price') is not None:
+            q = q.filter(LineItem.unit_price >= filters['min_price'])
+        if filters.get('max_price') is not None:
+            q = q.filter(LineItem.unit_price <= filters['max_price'])
+        if filters.get('product_terms'):
+            # Unknown words mean the question is about something we cannot scope by SQL
+            terms = resolve_terms(filters['product_terms'], q.session) if index_available(q.session) else None
+            if not terms:
+                raise LookupError('unresolved product terms')
+            match = '{%s}: (%s)' % (' '.join(PRODUCT_COLUMNS), ' AND '.join(f'"{t}"*' for t in terms))
+            q = q.filter(db.text(
+                'line_items.rowid IN (SELECT rowid FROM line_items_fts WHERE line_items_fts MATCH :product_match)'
+            ).bindparams(product_match=match))
+        return q
+
+    def _list(self, items_query, totals_query, filters):
+        from app.models.line_item import LineItem
+
+        total_count, total_spend = totals_query.one()
+        rows = items_query.order_by(LineItem.extended_price.desc()).limit(LIST_LIMIT).all()
+        data = [
+            {
+                'line_item_id': item.id,
+                'product_name': item.product_name,
+                'part_number': item.part_number,
+                'quantity': item.quantity,
+                'unit_price': item.unit_price,
+                'extended_price': item.extended_price,
+                'vendor_name': doc.vendor_name,
+                'document_number': doc.document_number,
+                'document_date': doc.document_date,
+            }
+            for item, doc in rows
+        ]
+        if not total_count:
+            return f"No line items found{_scope(filters)}.", data
+
+        lines = [f"Found {_count(total_count, 'line item')}{_scope(filters)} totaling {_money(total_spend)}:"]
+        for r in data:
+            line = f"- {r['product_name'] or 'N/A'}"
+            if r['part_number']:
+                line += f" ({r['part_number']})"
+            if r['quantity'] is not None and r['unit_price'] is not None:
+                line += f" — {_number(r['quantity'])} @ {_money(r['unit_price'])}"
+            if r['extended_price'] is not None:
+                line += f" = {_money(r['extended_price'])}"
+            line += f" | {r['vendor_name'] or 'N/A'} | {r['document_number'] or 'N/A'} ({r['document_date'] or 'N/A'})"
+            lines.append(line)
+        if total_count > len(data):
+            lines.append(f"…and {total_count - len(data)} more.")
+        return '\n'.join(lines), data
+
+    def _grouped_answer(self, intent, data, filters):
+        metric = intent['metric']
+        label = METRIC_LABELS[metric]
+        group = GROUP_LABELS[intent['group_by']]
+        if not data:
+            return f"No matching data found{_scope(filters)}."
+        heading = f"{label} by {group}{_scope(filters)}:"
+        if intent['group_by'] != 'month':
+            direction = 'lowest' if intent['order'] == 'asc' else 'highest'
+            heading = f"{label} by {group}{_scope(filters)} ({direction} first):"
+        lines = [heading]
+        for i, r in enumerate(data, 1):
+            value = _money(r['value']) if metric in MONEY_METRICS else _number(r['value'])
+            lines.append(f"{i}. {r['key']} — {value} ({_count(r['line_items'], 'line item')})")
+        return '\n'.join(lines)
+
+    def _total_answer(self, intent, data, filters):
+        metric = intent['metric']
+        scope = _scope(filters)
+        if not data['line_items'] and metric != 'documents':
+            return f"No matching line items found{scope}."
+        if metric == 'spend':
+            return (f"Total spend{scope}: {_money(data['value'])} across {_count(data['line_items'], 'line item')} "
+                    f"in {_count(data['documents'], 'document')}.")
+        if metric == 'count':
+            return (f"{_count(data['line_items'], 'line item')}{scope} across "
+                    f"{_count(data['documents'], 'document')}, totaling {_money(data['spend'])}.")
+        if metric == 'documents':
+            return f"{_count(data['value'], 'document')}{scope}."
+        if metric == 'quantity':
+            return (f"Total quantity{scope}: {_number(data['value'])} units across "
+                    f"{_count(data['line_items'], 'line item')}.")
+        return f"{METRIC_LABELS[metric]}{scope}: {_money(data['value'])} over {_count(data['line_items'], 'line item')}."
+
+
+def _scope(filters: dict) -> str:
+    parts = []
+    if filters.get('vendor'):
+        parts.append('with ' + ', '.join(filters['vendor']))
+    if filters.get('product_terms'):
+        parts.append('for "' + ' '.join(filters['product_terms']) + '"')
+    if filters.get('category'):
+        parts.append('in ' + ', '.join(filters['category']))
+    if filters.get('document_type'):
+        parts.append('on ' + ', '.join(t.replace('_', ' ') + 's' for t in filters['document_type']))
+    if filters.get('contract'):
+        parts.append('under contract ' + ', '.join(filters['contract']))
+    if filters.get('date_from') and filters.get('date_to'):
+        parts.append(f"from {filters['date_from']} to {filters['date_to']}")
+    elif filters.get('date_from'):
+        parts.append(f"since {filters['date_from']}")
+    elif filters.get('date_to'):
+        parts.append(f"through {filters['date_to']}")
+    if filters.get('min_price') is not None:
+        parts.append(f"with unit price ≥ {_money(filters['min_price'])}")
+    if filters.get('max_price') is not None:
+        parts.append(f"with unit price ≤ {_money(filters['max_price'])}")
+    return (' ' + ' '.join(parts)) if parts else ''
+
+
+def _count(n, noun: str) -> str:
+    return f"{n} {noun}" if n == 1 else f"{n} {noun}s"
+
+
+def _round(value):
+    return round(value, 2) if isinstance(value, float) else value
+
+
+def _money(value) -> str:
+    return f"${value or 0:,.2f}"
+
+
+def _number(value) -> str:
+    if value is None:
+        return '0'
+    return f"{value:,.0f}" if float(value).is_integer() else f"{value:,.2f}"
@@ -0,0 +1,703 @@
+import logging
+import threading
+import time
+from typing import NamedTuple
+
+import numpy as np
+
+from app.services.date_utils import parse_date
+from app.services.substring_index import PART_NUMBER_COLUMNS, contains, substring_rowids
+
+logger = logging.getLogger(__name__)
+
+# Dictionary-encoded columns: dimension name -> (source, column attribute).
+DIMENSION_COLUMNS = {
+    'vendor': ('document', 'vendor_name'),
+    'category': ('line_item', 'category'),
+    'sub_category': ('line_item', 'sub_category'),
+    'manufacturer': ('line_item', 'manufacturer'),
+    'document_type': ('document', 'document_type'),
+    'contract_number': ('document', 'contract_number'),
+    'product': ('line_item', 'canonical_product_id'),
+    'document': ('line_item', 'document_id'),
+    'part_number': ('line_item', 'part_number'),
+    'product_name': ('line_item', 'product_name'),
+    'document_number': ('document', 'document_number'),
+}
+# Dimensions derived from the parsed document date.
+DATE_DIMENSIONS = ('month', 'year')
+# Unit price range (PRICE_FACET_EDGES) of a line item.
+PRICE_DIMENSION = 'price_band'
+DIMENSIONS = tuple(DIMENSION_COLUMNS) + DATE_DIMENSIONS + (PRICE_DIMENSION,)
+# Dimensions with one value per document.
+DOCUMENT_DIMENSIONS = frozenset(
+    [name for name, (source, _) in DIMENSION_COLUMNS.items() if source == 'document']
+    + ['document', *DATE_DIMENSIONS]
+)
+MEASURES = ('extended_price', 'unit_price', 'quantity')
+# Explorer facets; 'price' counts unit prices per price band.
+FACETS = ('category', 'sub_category', 'vendor', 'document_type', 'contract_number', 'price')
+PRICE_FACET_EDGES = (0, 100, 1_000, 10_000, 100_000)
+AGGREGATES = ('sum', 'avg', 'min', 'max', 'count')
+
+# Null marker of the date column (days since 1970-01-01).
+NO_DATE = np.iinfo(np.int32).min
+# Compact once tombstoned rows exceed this fraction of the arrays.
+COMPACT_FRACTION = 0.25
+COMPACT_MIN_ROWS = 10_000
+_FETCH_CHUNK = 500
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def get_analytics_snapshot(session_id: str = '__default__') -> 'AnalyticsSnapshot':
+    """Return the session's line item snapshot, brought up to the current data version."""
+    with _snapshots_lock:
+        snapshot = _snapshots.get(session_id)
+        if snapshot is None:
+            snapshot = AnalyticsSnapshot(session_id)
+            _snapshots[session_id] = snapshot
+    snapshot.sync()
+    return snapshot
+
+
+class _Dictionary:
+    """Append-only value <-> int32 code mapping; -1 encodes NULL and ''."""
+
+    __slots__ = ('values', 'codes')
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def encode(self, value) -> int:
+        if value is None or value == '':
+            return -1
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def encode_distinct(self, values) -> list:
+        """encode() of each of a list of distinct values, in bulk."""
+        if not self.values:
+            fresh = [value for value in values if value is not None and value != '']
+            self.values = fresh
+            self.codes = dict(zip(fresh, range(len(fresh))))
+            get = self.codes.get
+            return [get(value, -1) for value in values]
+        get = self.codes.get
+        codes = [get(value) for value in values]
+        return [self.encode(value) if code is None else code for value, code in zip(values, codes)]
+
+    def matching(self, needle: str) -> np.ndarray:
+        """Codes of values containing needle, as the SQL substring filter matches them."""
+        return np.array([code for code, value in enumerate(self.values) if contains(needle, value)],
+                        dtype=np.int32)
+
+
+class _Columns:
+    """One immutable generation of the snapshot arrays; replaced wholesale on refresh."""
+
+    __slots__ = ('rowid', 'day', 'alive', 'measures', 'dims', 'dictionaries')
+
+    def __init__(self, rowid, day, alive, measures, dims, dictionaries):
+        self.rowid = rowid
+        self.day = day
+        self.alive = alive
+        self.measures = measures
+        self.dims = dims
+        self.dictionaries = dictionaries
+
+    @classmethod
+    def empty(cls, dictionaries: dict = None):
+        return cls(
+            np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=bool),
+            {m: np.zeros(0) for m in MEASURES},
+            {d: np.zeros(0, dtype=np.int32) for d in DIMENSIONS},
+            dictionaries or {d: _Dictionary() for d in DIMENSION_COLUMNS},
+        )
+
+    def __len__(self):
+        return len(self.rowid)
+
+    def take(self, keep: np.ndarray) -> '_Columns':
+        return _Columns(
+            self.rowid[keep], self.day[keep], self.alive[keep],
+            {m: v[keep] for m, v in self.measures.items()},
+            {d: v[keep] for d, v in self.dims.items()},
+            self.dictionaries,
+        )
+
+    def concat(self, other: '_Columns') -> '_Columns':
+        return _Columns(
+            np.concatenate([self.rowid, other.rowid]),
+            np.concatenate([self.day, other.day]),
+            np.concatenate([self.alive, other.alive]),
+            {m: np.concatenate([v, other.measures[m]]) for m, v in self.measures.items()},
+            {d: np.concatenate([v, other.dims[d]]) for d, v in self.dims.items()},
+            self.dictionaries,
+        )
+
+
+class AnalyticsSnapshot:
+    """
+    Columnar in-memory copy of a session's line items for analytics.
+
+    Document and line item dimensions are dictionary-encoded into int32 code
+    arrays, the document date is parsed once into a day number, and prices
+    and quantities are float64 arrays with NaN for NULL. Filters become
+    boolean masks and group-bys become integer keys reduced with bincount,
+    so aggregations never touch SQLite. The snapshot follows the session data
+    version: only line items of changed documents are re-read, the old rows
+    are tombstoned and compacted away once they pile up.
+    """
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.version = None
+        self.columns = _Columns.empty()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return int(self.columns.alive.sum())
+
+    # ── Maintenance ─────────────────────────────────────────────
+
+    def sync(self):
+        """Bring the snapshot up to the session's current data version."""
+        from app.services.data_version import get_data_version, changed_documents_since
+
+        if self.version == get_data_version(self.session_id):
+            return
+        with self._lock:
+            current, changed = changed_documents_since(self.session_id, self.version)
+            if self.version == current:
+                return
+            started = time.perf_counter()
+            if changed is None:
+                self.columns = self._fetch(None, {d: _Dictionary() for d in DIMENSION_COLUMNS})
+                logger.info(f'Analytics snapshot rebuilt for {self.session_id}: {len(self.columns)} line items '
+                            f'in {time.perf_counter() - started:.2f}s')
+            else:
+                self._apply_changes(changed)
+            self.version = current
+
+    def _apply_changes(self, changed_doc_ids: set):
+        columns = self.columns
+        if changed_doc_ids:
+            doc_codes = [columns.dictionaries['document'].codes.get(doc_id) for doc_id in changed_doc_ids]
+            doc_codes = np.array([code for code in doc_codes if code is not None], dtype=np.int32)
+            if len(doc_codes):
+                alive = columns.alive & ~np.isin(columns.dims['document'], doc_codes)
+                columns = _Columns(columns.rowid, columns.day, alive, columns.measures, columns.dims,
+                                   columns.dictionaries)
+            columns = columns.concat(self._fetch(sorted(changed_doc_ids), columns.dictionaries))
+        dead = len(columns) - int(columns.alive.sum())
+        if dead > max(COMPACT_MIN_ROWS, COMPACT_FRACTION * len(columns)):
+            columns = columns.take(columns.alive)
+        self.columns = columns
+
+    def _fetch(self, document_ids, dictionaries: dict) -> _Columns:
+        """
+        Read and encode the line items of the given documents (all when None).
+        Documents are read separately and their attributes broadcast to line
+        items by document code, which is much cheaper than joining per row.
+        """
+        from app.extensions import db
+        from app.models.document import Document
+        from app.models.line_item import LineItem
+
+        items, docs = LineItem.__table__, Document.__table__
+        item_fields = [name for name, (src, _) in DIMENSION_COLUMNS.items() if src == 'line_item']
+        doc_fields = [name for name, (src, _) in DIMENSION_COLUMNS.items() if src == 'document']
+        item_query = db.select(
+            db.literal_column('line_items.rowid'),
+            *[items.c[m] for m in MEASURES],
+            *[items.c[DIMENSION_COLUMNS[name][1]] for name in item_fields],
+        ).where(items.c.session_id == self.session_id)
+        doc_query = db.select(
+            docs.c.id, docs.c.document_date_ordinal,
+            *[docs.c[DIMENSION_COLUMNS[name][1]] for name in doc_fields],
+        ).where(docs.c.session_id == self.session_id)
+        if document_ids is None:
+            batches = [(item_query, doc_query)]
+        else:
+            batches = [
+                (item_query.where(items.c.document_id.in_(chunk)), doc_query.where(docs.c.id.in_(chunk)))
+                for chunk in (document_ids[i:i + _FETCH_CHUNK] for i in range(0, len(document_ids), _FETCH_CHUNK))
+            ]
+        item_rows, doc_rows = [], []
+        for item_batch, doc_batch in batches:
+            item_rows.extend(db.session.execute(item_batch).all())
+            doc_rows.extend(db.session.execute(doc_batch).all())
+        if not item_rows:
+            return _Columns.empty(dictionaries)
+
+        item_columns = list(zip(*item_rows))
+        del item_rows
+        dims = {
+            name: _encode(dictionaries[name], values)
+            for name, values in zip(item_fields, item_columns[1 + len(MEASURES):])
+        }
+
+        # Per-document attribute arrays indexed by document code
+        doc_codes = np.array([dictionaries['document'].encode(row[0]) for row in doc_rows], dtype=np.int64)
+        n_docs = len(dictionaries['document'].values)
+        doc_day = np.full(n_docs, NO_DATE, dtype=np.int32)
+        doc_day[doc_codes] = [_day_number(row[1]) for row in doc_rows]
+        item_docs = dims['document']
+        day = doc_day[item_docs]
+        for offset, name in enumerate(doc_fields, 2):
+            by_doc = np.full(n_docs, -1, dtype=np.int32)
+            by_doc[doc_codes] = [dictionaries[name].encode(row[offset]) for row in doc_rows]
+            dims[name] = by_doc[item_docs]
+        dims.update(_date_codes(day))
+        measures = {m: np.array(v, dtype=np.float64) for m, v in zip(MEASURES, item_columns[1:])}
+        dims[PRICE_DIMENSION] = _price_bands(measures['unit_price'])
+
+        return _Columns(
+            np.array(item_columns[0], dtype=np.int64),
+            day,
+            np.ones(len(day), dtype=bool),
+            measures,
+            dims,
+            dictionaries,
+        )
+
+    # ── Queries ─────────────────────────────────────────────────
+
+    def mask(self, filters: dict = None, columns: _Columns = None) -> np.ndarray:
+        """
+        Boolean mask of live rows matching the line item explorer filters:
+        search, vendor, category, sub_category, min_price, max_price, date_from,
+        date_to, document_type, contract_number and product_id.
+        """
+        if columns is None:
+            columns = self.columns
+        mask = columns.alive.copy()
+        for part in self._filter_masks(filters, columns).values():
+            mask &= part
+        return mask
+
+    def facet_counts(self, filters: dict = None, facets: tuple = FACETS, limit: int = None) -> dict:
+        """
+        Line item counts per value of each facet under the explorer filters.
+        Each facet is counted with every filter except its own, so the other
+        values of an active facet stay visible; values are ordered by count.
+        """
+        columns = self.columns
+        masks = self._filter_masks(filters, columns)
+        combined = {}
+
+        def without(facet: str = None) -> np.ndarray:
+            key = facet if facet in masks else None
+            if key not in combined:
+                mask = columns.alive.copy()
+                for name, part in masks.items():
+                    if name != key:
+                        mask &= part
+                combined[key] = mask
+            return combined[key]
+
+        result = {}
+        for facet in facets:
+            mask = without(facet)
+            if facet == 'price':
+                bands = columns.dims[PRICE_DIMENSION]
+                counts = _count_codes(bands, mask, len(PRICE_FACET_EDGES))
+                result[facet] = [
+                    {
+                        'value': _band_label(code),
+                        'min_price': low,
+                        'max_price': high,
+                        'count': int(counts[code]),
+                    }
+                    for code, (low, high) in enumerate(zip(PRICE_FACET_EDGES, PRICE_FACET_EDGES[1:] + (None,)))
+                    if counts[code]
+                ]
+                continue
+            values = columns.dictionaries[facet].values
+            counts = _count_codes(columns.dims[facet], mask, len(values))
+            present = np.flatnonzero(counts)
+            order = present[np.argsort(-counts[present], kind='stable')][:limit]
+            result[facet] = [{'value': values[code], 'count': int(counts[code])} for code in order]
+        return {'total': int(without().sum()), 'facets': result}
+
+    def _filter_masks(self, filters: dict, columns: _Columns) -> dict:
+        """One boolean mask per active filter, keyed by the facet it restricts."""
+        filters = filters or {}
+        dims = columns.dims
+        dictionaries = columns.dictionaries
+        masks = {}
+
+        search = (filters.get('search') or '').strip()
+        if search:
+            masks['search'] = np.isin(columns.rowid, _search_rowids(self.session_id, search))
+        for name in ('vendor', 'contract_number'):
+            needle = (filters.get(name) or '').strip()
+            if needle:
+                selected = np.zeros(len(dictionaries[name].values) + 1, dtype=bool)
+                selected[dictionaries[name].matching(needle) + 1] = True
+                masks[name] = selected[dims[name] + 1]
+        for name, key in (('category', 'category'), ('sub_category', 'sub_category'),
+                          ('document_type', 'document_type'), ('product', 'product_id')):
+            value = (filters.get(key) or '').strip()
+            if value:
+                masks[name] = dims[name] == dictionaries[name].codes.get(value, -2)
+
+        prices = columns.measures['unit_price']
+        if filters.get('min_price') is not None or filters.get('max_price') is not None:
+            mask = ~np.isnan(prices)
+            if filters.get('min_price') is not None:
+                mask &= prices >= filters['min_price']
+            if filters.get('max_price') is not None:
+                mask &= prices <= filters['max_price']
+            masks['price'] = mask
+
+        date_from = parse_date(filters.get('date_from'))
+        date_to = parse_date(filters.get('date_to'))
+        if date_from or date_to:
+            mask = columns.day != NO_DATE
+            if date_from:
+                mask &= columns.day >= date_from.toordinal() - _EPOCH_ORDINAL
+            if date_to:
+                mask &= columns.day <= date_to.toordinal() - _EPOCH_ORDINAL
+            masks['date'] = mask
+        return masks
+
+    def aggregate(self, group_by: list, metrics: list, filters: dict = None,
+                  sort: str = None, descending: bool = True, limit: int = None,
+                  include_null: bool = False) -> dict:
+        """
+        Group the matching line items by the given dimensions and compute
+        metrics, each (name, measure, agg) where agg is one of AGGREGATES, or
+        (name, 'rows' | 'documents', 'count') for row and distinct document
+        counts. Groups are sorted by the named metric (or by key when sort is
+        None) and returned as [{dimension: value, ..., metric: value}].
+        """
+        columns = self.columns
+        return _aggregate(columns, self.mask(filters, columns), group_by, metrics,
+                          sort, descending, limit, include_null)
+
+    def pivot(self, rows: list, column: str = None, measure: str = 'extended_price', agg: str = 'sum',
+              filters: dict = None, limit: int = None) -> dict:
+        """
+        Cross-tab of one measure over the matching line items with a value in
+        every pivot dimension: a row per combination of the `rows` dimensions
+        (largest total first, up to limit) and a cell per value of `column`
+        (chronological for dates, alphabetical otherwise), with row, column
+        and grand totals.
+        """
+        columns = self.columns
+        mask = self.mask(filters, columns)
+        for name in list(rows) + ([column] if column else []):
+            _check_dimension(name)
+            mask &= columns.dims[name] >= 0
+        source = _metric_source(measure, agg)
+
+        row_groups = _grouping(columns, mask, rows)
+        if row_groups is None:
+            return {'rows': [], 'columns': [], 'column_totals': [], 'grand_total': None, 'matched': 0}
+        selected = row_groups.rows
+        grand_total = _metric(columns, selected, None, 1, *source)[0]
+        row_totals = _metric(columns, selected, row_groups.inverse, row_groups.n_slots, *source,
+                             _per_document(rows))[row_groups.slots]
+        top = _order(row_totals, descending=True)[:limit]
+        labels = _group_labels(columns, row_groups.parts, row_groups.keys[top])
+        table = [
+            {'key': {name: labels[name][i] for name in rows}, 'total': total}
+            for i, total in enumerate(_values(row_totals[top]))
+        ]
+        result = {'rows': table, 'grand_total': _value(grand_total), 'matched': len(selected)}
+        if not column:
+            for entry in table:
+                entry['values'] = [entry['total']]
+            result.update({'columns': [], 'column_totals': []})
+            return result
+
+        column_groups = _grouping(columns, mask, [column])
+        n_slots = column_groups.n_slots
+        rank = np.full(row_groups.n_slots, -1, dtype=np.int64)
+        rank[row_groups.slots[top]] = np.arange(len(top))
+        row_rank = rank[row_groups.inverse]
+        in_top = row_rank >= 0
+        cells = _metric(columns, selected[in_top], row_rank[in_top] * n_slots + column_groups.inverse[in_top],
+                        len(top) * n_slots, *source, _per_document(list(rows) + [column]))
+        column_labels = _group_labels(columns, column_groups.parts, column_groups.keys)[column]
+        column_order = np.arange(len(column_labels))
+        if column not in DATE_DIMENSIONS + (PRICE_DIMENSION,):
+            column_order = np.array(sorted(column_order, key=lambda i: str(column_labels[i])), dtype=np.intp)
+        column_slots = column_groups.slots[column_order]
+        cells = cells.reshape(len(top), n_slots)[:, column_slots]
+        for entry, values in zip(table, _values(cells)):
+            entry['values'] = values
+        column_totals = _metric(columns, selected, column_groups.inverse, n_slots, *source,
+                                _per_document([column]))[column_slots]
+        result.update({
+            'columns': [column_labels[i] for i in column_order],
+            'column_totals': _values(column_totals),
+        })
+        return result
+
+
+_EPOCH_ORDINAL = 719163  # date(1970, 1, 1).toordinal()
+# Month and year codes count from January of year 1, so every real date is non-negative.
+_MONTH_ORIGIN = -1969 * 12
+_YEAR_ORIGIN = -1969
+# Group keys index metric arrays directly while the key space stays this small.
+_DENSE_KEY_SPACE = 1 << 20
+
+
+def _encode(dictionary: _Dictionary, values) -> np.ndarray:
+    """
+    Dictionary codes of a column of values: factorized in bulk, then only the
+    distinct values are looked up, so codes stay stable across refreshes.
+    """
+    import pandas as pd
+
+    codes, uniques = pd.factorize(np.array(values, dtype=object))
+    lookup = np.array(dictionary.encode_distinct(list(uniques)) + [-1], dtype=np.int32)
+    return lookup[codes]
+
+
+def _day_number(ordinal) -> int:
+    return ordinal - _EPOCH_ORDINAL if ordinal is not None else NO_DATE
+
+
+def _date_codes(day: np.ndarray) -> dict:
+    """Month and year dimension codes (-1 when undated) of a day-number column."""
+    dated = day != NO_DATE
+    days = np.where(dated, day, 0).astype('datetime64[D]')
+    return {
+        'month': np.where(dated, days.astype('datetime64[M]').astype(np.int64) - _MONTH_ORIGIN, -1)
+        .astype(np.int32),
+        'year': np.where(dated, days.astype('datetime64[Y]').astype(np.int64) - _YEAR_ORIGIN, -1)
+        .astype(np.int32),
+    }
+
+
+def _price_bands(prices: np.ndarray) -> np.ndarray:
+    """Price band codes of unit prices (-1 for NULL or negative)."""
+    bands = np.searchsorted(PRICE_FACET_EDGES, prices, side='right') - 1
+    bands[np.isnan(prices)] = -1
+    return bands.astype(np.int32)
+
+
+def _band_label(code: int):
+    low = PRICE_FACET_EDGES[code]
+    return f'{low:g}+' if code == len(PRICE_FACET_EDGES) - 1 else f'{low:g}-{PRICE_FACET_EDGES[code + 1]:g}'
+
+
+def _count_codes(codes: np.ndarray, mask: np.ndarray, n_values: int) -> np.ndarray:
+    """Masked row count per code (NULL codes dropped); selective masks are compressed first."""
+    if np.count_nonzero(mask) * 4 < len(mask):
+        return np.bincount(codes[mask] + 1, minlength=n_values + 1)[1:]
+    return np.bincount(codes + 1, weights=mask, minlength=n_values + 1)[1:].astype(np.int64)
+
+
+def _check_dimension(name: str):
+    if name not in DIMENSIONS:
+        raise ValueError(f'Unknown dimension: {name}')
+
+
+def _labels(columns: _Columns, name: str):
+    """Function turning a dimension's codes into labels (None for -1)."""
+    if name == 'month':
+        return lambda codes: [str(np.datetime64(int(c) + _MONTH_ORIGIN, 'M')) if c >= 0 else None
+                              for c in codes]
+    if name == 'year':
+        return lambda codes: [str(1970 + int(c) + _YEAR_ORIGIN) if c >= 0 else None for c in codes]
+    if name == PRICE_DIMENSION:
+        return lambda codes: [_band_label(int(c)) if c >= 0 else None for c in codes]
+    values = columns.dictionaries[name].values
+    return lambda codes: [values[c] if c >= 0 else None for c in codes]
+
+
+class _Grouping(NamedTuple):
+    rows: np.ndarray       # indices of the grouped rows
+    keys: np.ndarray       # key of each non-empty group
+    slots: np.ndarray      # metric array position of each non-empty group
+    inverse: np.ndarray    # metric array position of each row
+    n_slots: int
+    parts: list            # (dimension, lowest code, radix) per key digit
+
+
+def _grouping(columns: _Columns, mask: np.ndarray, group_by: list, include_null: bool = False):
+    """
+    Group the masked rows by dimension codes, combined into one int64 key per
+    row (mixed radix over each dimension's code range). A small key space is
+    used directly as metric array positions; larger ones are compacted with
+    np.unique. Returns None when no row matches. Rows with a NULL in any
+    grouping dimension are left out unless include_null.
+    """
+    for name in group_by:
+        _check_dimension(name)
+        if not include_null:
+            mask = mask & (columns.dims[name] >= 0)
+    rows = np.flatnonzero(mask)
+    if not len(rows):
+        return None
+
+    keys = np.zeros(len(rows), dtype=np.int64)
+    parts = []
+    key_space = 1
+    for name in group_by:
+        codes = columns.dims[name][rows]
+        low = int(codes.min())
+        radix = int(codes.max()) - low + 1
+        key_space *= radix
+        if key_space >= 1 << 62:
+            raise ValueError('Too many distinct groups for these dimensions')
+        keys = keys * radix + (codes - low)
+        parts.append((name, low, radix))
+
+    if key_space <= max(_DENSE_KEY_SPACE, len(rows)):
+        groups = np.flatnonzero(np.bincount(keys, minlength=key_space))
+        return _Grouping(rows, groups, groups, keys, key_space, parts)
+    groups, inverse = np.unique(keys, return_inverse=True)
+    return _Grouping(rows, groups, np.arange(len(groups)), inverse, len(groups), parts)
+
+
+def _group_labels(columns: _Columns, parts: list, keys: np.ndarray) -> dict:
+    """Dimension name -> labels of the given group keys."""
+    labels = {}
+    for name, low, radix in reversed(parts):
+        labels[name] = _labels(columns, name)(keys % radix + low)
+        keys = keys // radix
+    return labels
+
+
+def _order(values: np.ndarray, descending: bool) -> np.ndarray:
+    """Stable sort order of metric values with NaN last."""
+    if descending:
+        return np.argsort(-np.nan_to_num(values, nan=-np.inf), kind='stable')
+    return np.argsort(np.nan_to_num(values, nan=np.inf), kind='stable')
+
+
+def _per_document(group_by: list) -> bool:
+    return all(name in DOCUMENT_DIMENSIONS for name in group_by)
+
+
+def _value(value):
+    return None if np.isnan(value) else float(value)
+
+
+def _values(array: np.ndarray) -> list:
+    """Nested list of an array's values with None for NaN."""
+    return np.where(np.isnan(array), None, array).tolist()
+
+
+def _aggregate(columns: _Columns, mask: np.ndarray, group_by: list, metrics: list, sort: str = None,
+               descending: bool = True, limit: int = None, include_null: bool = False) -> dict:
+    grouping = _grouping(columns, mask, group_by, include_null)
+    if grouping is None:
+        return {'groups': [], 'matched': 0}
+
+    per_document = _per_document(group_by)
+    values = {
+        name: _metric(columns, grouping.rows, grouping.inverse, grouping.n_slots, measure, agg,
+                      per_document)[grouping.slots]
+        for name, measure, agg in metrics
+    }
+    order = _order(values[sort], descending) if sort is not None else np.arange(len(grouping.keys))
+    if limit is not None:
+        order = order[:limit]
+    labels = _group_labels(columns, grouping.parts, grouping.keys[order])
+    selected = {name: _values(metric[order]) for name, metric in values.items()}
+    result = []
+    for position in range(len(order)):
+        entry = {name: labels[name][position] for name in group_by}
+        entry.update({name: metric[position] for name, metric in selected.items()})
+        result.append(entry)
+    return {'groups': result, 'matched': len(grouping.rows)}
+
+
+def _metric(columns: _Columns, rows: np.ndarray, inverse: np.ndarray, n_groups: int,
+            measure: str, agg: str, per_document: bool = False) -> np.ndarray:
+    """
+    One metric per group. inverse=None means a single group of all rows.
+    per_document says every grouping dimension is a document attribute, so
+    a document falls in exactly one group and distinct documents can be
+    counted without sorting (row, document) pairs.
+    """
+    if inverse is None:
+        inverse = np.zeros(len(rows), dtype=np.intp)
+        per_document = True
+    if measure == 'rows':
+        return np.bincount(inverse, minlength=n_groups).astype(np.float64)
+    if measure == 'documents':
+        documents = columns.dims['document'][rows]
+        if per_document:
+            group_of = np.full(len(columns.dictionaries['document'].values), -1, dtype=np.int64)
+            group_of[documents] = inverse
+            group_of = group_of[group_of >= 0]
+        else:
+            group_of = np.unique(inverse.astype(np.int64) << 31 | documents) >> 31
+        return np.bincount(group_of, minlength=n_groups).astype(np.float64)
+
+    values = columns.measures[measure]
+    if len(rows) != len(values):
+        values = values[rows]
+    if n_groups == 1:
+        valid = values[~np.isnan(values)]
+        if not len(valid):
+            return np.array([0.0 if agg == 'count' else np.nan])
+        reduce = {'count': len, 'sum': np.sum, 'avg': np.mean, 'min': np.min, 'max': np.max}[agg]
+        return np.array([float(reduce(valid))])
+    valid = ~np.isnan(values)
+    counts = np.bincount(inverse, weights=valid, minlength=n_groups)
+    if agg == 'count':
+        return counts
+    if agg in ('sum', 'avg'):
+        totals = np.bincount(inverse, weights=np.where(valid, values, 0.0), minlength=n_groups)
+        if agg == 'sum':
+            return np.where(counts > 0, totals, np.nan)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return totals / counts
+    if agg == 'min':
+        result = np.full(n_groups, np.inf)
+        np.minimum.at(result, inverse[valid], values[valid])
+    else:
+        result = np.full(n_groups, -np.inf)
+        np.maximum.at(result, inverse[valid], values[valid])
+    return np.where(counts > 0, result, np.nan)
+
+
+def _metric_source(measure: str, agg: str) -> tuple:
+    """Map an API (measure, agg) pair to an aggregate() metric source."""
+    if measure in ('rows', 'documents'):
+        return measure, 'count'
+    return measure, agg
+
+
+def _search_rowids(session_id: str, search: str) -> np.ndarray:
+    """
+    Rowids of line items matching the explorer search box: FTS word prefixes
+    plus part number substrings, or LIKE without the index.
+    """
+    from app.extensions import db
+    from app.models.line_item import LineItem
+    from app.services.line_item_search import explorer_match_expression, index_available
+
+    match = explorer_match_expression(search)
+    if match and index_available(db.session):
+        rowids = [row[0] for row in db.session.execute(
+            db.text('SELECT rowid FROM line_items_fts WHERE line_items_fts MATCH :search_match'),
+            {'search_match': match},
+        )]
+        rowids += substring_rowids('line_items', PART_NUMBER_COLUMNS, search, db.session)
+        return np.array(rowids, dtype=np.int64)
+
+    pattern = f'%{search}%'
+    rows = db.session.query(db.literal_column('line_items.rowid'))\
+        .filter(LineItem.session_id == session_id)\
+        .filter(db.or_(
+            LineItem.product_name.ilike(pattern),
+            LineItem.part_number.ilike(pattern),
+            LineItem.manufacturer.ilike(pattern),
+            LineItem.product_description.ilike(pattern),
+        ))
+    return np.fromiter((row[0] for row in rows), dtype=np.int64)
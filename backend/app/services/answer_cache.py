@@ -0,0 +1,216 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from app.services.text_utils import tokenize
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = 3600
+DEFAULT_MAX_ENTRIES = 512
+# Cosine similarity between question embeddings above which two questions
+# that retrieved exactly the same sources are treated as the same question.
+NEAR_DUPLICATE_SIMILARITY = 0.9
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    """Return the process-wide answer cache, sized from app config."""
+    global _cache
+    if _cache is None:
+        from flask import current_app
+        with _cache_lock:
+            if _cache is None:
+                _cache = AnswerCache(
+                    ttl_seconds=current_app.config.get('ANSWER_CACHE_TTL_SECONDS', DEFAULT_TTL_SECONDS),
+                    max_entries=current_app.config.get('ANSWER_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES),
+                )
+    return _cache
+
+
+def normalize_question(question: str) -> str:
+    """Case, punctuation and whitespace-insensitive form of a question."""
+    return ' '.join(tokenize(question, drop_stopwords=False))
+
+
+def sources_fingerprint(source_keys) -> str:
+    """Order-independent digest of the retrieval hits an answer was built from."""
+    joined = '|'.join(sorted(f'{kind}:{key}' for kind, key in source_keys))
+    return hashlib.sha1(joined.encode('utf-8')).hexdigest()
+
+
+class _Entry:
+    __slots__ = ('session_id', 'question', 'vector', 'fingerprint', 'document_ids',
+                 'version', 'expires_at', 'response')
+
+    def __init__(self, session_id, question, vector, fingerprint, document_ids,
+                 version, expires_at, response):
+        self.session_id = session_id
+        self.question = question
+        self.vector = vector
+        self.fingerprint = fingerprint
+        # None means the answer depends on the whole dataset (aggregates)
+        self.document_ids = document_ids
+        self.version = version
+        self.expires_at = expires_at
+        self.response = response
+
+
+class AnswerCache:
+    """
+    In-process LRU cache of chat answers with a TTL.
+
+    Entries are keyed by (session, normalized question) and remember the data
+    version they were built at, the fingerprint of the retrieved sources and
+    the documents those sources came from. Two lookups are offered:
+
+    - lookup(): exact question at the current data version, no retrieval needed.
+    - lookup_similar(): after retrieval, a near-duplicate question that
+      retrieved the same sources, provided none of its documents changed.
+
+    When the data version moves, entries citing changed documents (and all
+    dataset-wide entries) are dropped using the change log.
+    """
+
+    def __init__(self, ttl_seconds: int = DEFAULT_TTL_SECONDS,
+                 max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._by_sources = {}
+        self._seen_versions = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, session_id: str, question: str, version: int):
+        """Return a cached response for this exact question, or None."""
+        key = (session_id, normalize_question(question))
+        self._revalidate(session_id, version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version != version:
+                return None
+            if entry.expires_at < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return dict(entry.response)
+
+    def lookup_similar(self, session_id: str, question: str, version: int, source_keys):
+        """
+        Return a cached response for a near-duplicate question whose retrieval
+        produced exactly these sources, or None.
+        """
+        import numpy as np
+        from app.services.embedder import ChunkEmbedder
+
+        self._revalidate(session_id, version)
+        fingerprint = sources_fingerprint(source_keys)
+        with self._lock:
+            keys = list(self._by_sources.get((session_id, fingerprint), ()))
+        if not keys:
+            return None
+
+        vector = ChunkEmbedder().embed_one(normalize_question(question))
+        now = time.monotonic()
+        with self._lock:
+            best_key, best_score = None, NEAR_DUPLICATE_SIMILARITY
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None or entry.expires_at < now:
+                    continue
+                score = float(np.dot(entry.vector, vector))
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is None:
+                return None
+            entry = self._entries[best_key]
+            # Same sources and none of their documents changed: still current
+            entry.version = version
+            self._entries.move_to_end(best_key)
+            return dict(entry.response)
+
+    def store(self, session_id: str, question: str, version: int, response: dict,
+              source_keys=(), document_ids=None):
+        """
+        Cache a response. Pass document_ids=None for answers computed over the
+        whole dataset; they are dropped on any data change.
+        """
+        from app.services.embedder import ChunkEmbedder
+
+        normalized = normalize_question(question)
+        if not normalized:
+            return
+        entry = _Entry(
+            session_id=session_id,
+            question=normalized,
+            vector=ChunkEmbedder().embed_one(normalized),
+            fingerprint=sources_fingerprint(source_keys),
+            document_ids=frozenset(document_ids) if document_ids is not None else None,
+            version=version,
+            expires_at=time.monotonic() + self.ttl_seconds,
+            response=dict(response),
+        )
+        key = (session_id, normalized)
+        with self._lock:
+            if version < self._seen_versions.get(session_id, version):
+                return  # built from data that has since changed
+            self._remove(key)
+            self._entries[key] = entry
+            self._by_sources.setdefault((session_id, entry.fingerprint), set()).add(key)
+            self._seen_versions.setdefault(session_id, version)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, session_id: str, document_ids=None) -> int:
+        """Drop entries citing any of document_ids (all of the session's if None)."""
+        with self._lock:
+            doomed = [
+                key for key, entry in self._entries.items()
+                if entry.session_id == session_id and (
+                    document_ids is None or entry.document_ids is None
+                    or not entry.document_ids.isdisjoint(document_ids)
+                )
+            ]
+            for key in doomed:
+                self._remove(key)
+        return len(doomed)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_sources.clear()
+            self._seen_versions.clear()
+
+    def _revalidate(self, session_id: str, version: int):
+        """Apply document changes recorded since this cache last saw the session."""
+        from app.services.data_version import changed_documents_since
+
+        with self._lock:
+            seen = self._seen_versions.get(session_id)
+            if seen is None or seen == version:
+                self._seen_versions[session_id] = version
+                return
+            self._seen_versions[session_id] = version
+
+        try:
+            _, changed = changed_documents_since(session_id, seen)
+        except Exception as e:
+            logger.error(f'Answer cache revalidation failed: {e}')
+            changed = None
+        dropped = self.invalidate(session_id, changed)
+        if dropped:
+            logger.info(f'Answer cache dropped {dropped} entries for session {session_id}')
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        group = self._by_sources.get((entry.session_id, entry.fingerprint))
+        if group is not None:
+            group.discard(key)
+            if not group:
+                del self._by_sources[(entry.session_id, entry.fingerprint)]
@@ -0,0 +1,156 @@
+import logging
+import threading
+
+import numpy as np
+
+from app.services.substring_index import normalize_identifier
+
+logger = logging.getLogger(__name__)
+
+# Completable fields; each is an analytics snapshot dimension of the same name.
+FIELDS = ('vendor', 'contract_number', 'document_number', 'part_number', 'product_name', 'manufacturer')
+# Suggestion order: total extended price of the value's line items, or their count.
+RANKINGS = ('spend', 'count')
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+# Keys are normalized word suffixes of a value ("GS-35F-12345" -> gs35f12345,
+# 35f12345, 12345), truncated to KEY_BYTES; at most KEYS_PER_VALUE per value.
+KEY_BYTES = 24
+KEYS_PER_VALUE = 6
+# Results for prefixes up to this length are cached until the weights change,
+# since their key ranges span a large share of the index.
+CACHED_PREFIX_LENGTH = 2
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_autocomplete_index(session_id: str = '__default__') -> 'AutocompleteIndex':
+    """Return the session's autocomplete index, brought up to the current data version."""
+    from app.services.analytics_snapshot import get_analytics_snapshot
+
+    snapshot = get_analytics_snapshot(session_id)
+    with _indexes_lock:
+        index = _indexes.get(session_id)
+        if index is None:
+            index = _indexes[session_id] = AutocompleteIndex()
+    index.sync(snapshot.columns)
+    return index
+
+
+def _value_keys(value: str) -> list:
+    """Normalized, truncated keys of each word start of value."""
+    starts = [i for i, char in enumerate(value) if char.isalnum() and (i == 0 or not value[i - 1].isalnum())]
+    keys = []
+    for start in starts[:KEYS_PER_VALUE]:
+        key = normalize_identifier(value[start:]).encode()[:KEY_BYTES]
+        if key and key not in keys:
+            keys.append(key)
+    return keys
+
+
+class _FieldIndex:
+    """Sorted key array over one snapshot dictionary, with per-value rank weights."""
+
+    __slots__ = ('keys', 'codes', 'indexed', 'spend', 'count', 'cache')
+
+    def __init__(self, keys=None, codes=None, indexed: int = 0):
+        self.keys = keys if keys is not None else np.zeros(0, dtype=f'S{KEY_BYTES}')
+        self.codes = codes if codes is not None else np.zeros(0, dtype=np.int32)
+        self.indexed = indexed
+        self.spend = np.zeros(indexed)
+        self.count = np.zeros(indexed, dtype=np.int64)
+        self.cache = {}
+
+    def extended(self, values: list) -> '_FieldIndex':
+        """A copy that also holds the keys of dictionary values appended since this one was built."""
+        new_keys, new_codes = [], []
+        for code in range(self.indexed, len(values)):
+            for key in _value_keys(str(values[code])):
+                new_keys.append(key)
+                new_codes.append(code)
+        if not new_keys:
+            return _FieldIndex(self.keys, self.codes, len(values))
+        keys = np.array(new_keys, dtype=f'S{KEY_BYTES}')
+        order = np.argsort(keys, kind='stable')
+        keys, codes = keys[order], np.array(new_codes, dtype=np.int32)[order]
+        if len(self.keys):
+            # Sorted insert: a linear merge instead of re-sorting the whole index
+            positions = np.searchsorted(self.keys, keys)
+            keys = np.insert(self.keys, positions, keys)
+            codes = np.insert(self.codes, positions, codes)
+        return _FieldIndex(keys, codes, len(values))
+
+    def weigh(self, dim: np.ndarray, alive: np.ndarray, spend: np.ndarray):
+        """Set spend and line item count per value from the live snapshot rows."""
+        rows = alive & (dim >= 0)
+        self.spend = np.bincount(dim[rows], weights=np.nan_to_num(spend[rows]), minlength=self.indexed)
+        self.count = np.bincount(dim[rows], minlength=self.indexed)
+
+    def complete(self, prefix: str, limit: int, rank: str) -> list:
+        """Codes of the best-ranked live values with a word starting with prefix."""
+        key = normalize_identifier(prefix).encode()[:KEY_BYTES]
+        cached = len(key) <= CACHED_PREFIX_LENGTH
+        if cached and (key, rank) in self.cache:
+            return self.cache[key, rank][:limit]
+        low = np.searchsorted(self.keys, key, side='left')
+        if len(key) < KEY_BYTES:
+            high = np.searchsorted(self.keys, key + b'\xff', side='left')
+        else:
+            high = np.searchsorted(self.keys, key, side='right')
+        candidates = np.unique(self.codes[low:high])
+        candidates = candidates[self.count[candidates] > 0]
+        weights = self.spend[candidates] if rank == 'spend' else self.count[candidates]
+        take = MAX_LIMIT if cached else limit
+        if len(candidates) > take:
+            top = np.argpartition(-weights, take - 1)[:take]
+            candidates, weights = candidates[top], weights[top]
+        ordered = candidates[np.argsort(-weights, kind='stable')].tolist()
+        if cached:
+            self.cache[key, rank] = ordered
+        return ordered[:limit]
+
+
+class AutocompleteIndex:
+    """
+    Per-session prefix index for the filter boxes, one sorted key array per
+    field. Keys and values come from the analytics snapshot's append-only
+    dictionaries, so a refresh only merges in keys of values added since the
+    last one (a full snapshot rebuild starts over); rank weights are
+    re-aggregated from the snapshot columns whenever the snapshot moved to a
+    new data version. Lookups are two binary searches plus a top-k over the
+    matching slice.
+    """
+
+    def __init__(self):
+        # (snapshot columns, {field: _FieldIndex}), replaced together
+        self.state = (None, {field: _FieldIndex() for field in FIELDS})
+        self._lock = threading.Lock()
+
+    def sync(self, columns):
+        """Catch up with a snapshot generation (the snapshot's _Columns)."""
+        if columns is self.state[0]:
+            return
+        with self._lock:
+            previous, fields = self.state
+            if columns is previous:
+                return
+            if previous is None or columns.dictionaries is not previous.dictionaries:
+                fields = {field: _FieldIndex() for field in FIELDS}
+            spend = columns.measures['extended_price']
+            refreshed = {}
+            for field, index in fields.items():
+                index = index.extended(columns.dictionaries[field].values)
+                index.weigh(columns.dims[field], columns.alive, spend)
+                refreshed[field] = index
+            self.state = (columns, refreshed)
+
+    def complete(self, field: str, prefix: str, limit: int = DEFAULT_LIMIT, rank: str = 'spend') -> list:
+        """Suggestions [{value, spend, count}, ...] for prefix, best first."""
+        columns, fields = self.state
+        index = fields[field]
+        values = columns.dictionaries[field].values
+        return [
+            {'value': values[code], 'spend': round(float(index.spend[code]), 2), 'count': int(index.count[code])}
+            for code in index.complete(prefix, limit, rank)
+        ]
@@ -0,0 +1,593 @@
+import json
+import logging
+import re
+import zlib
+from collections import Counter, defaultdict
+from itertools import chain
+
+import numpy as np
+
+from app.services.product_resolver import normalize_alias, normalize_manufacturer, normalize_part_number
+from app.services.text_utils import tokenize
+
+logger = logging.getLogger(__name__)
+
+# MinHash signature length and LSH banding. With 3 rows per band, names with
+# Jaccard similarity around 0.3 and above become candidates with high probability.
+NUM_PERM = 96
+BAND_ROWS = 3
+NUM_BANDS = NUM_PERM // BAND_ROWS
+# Buckets with more members than this (very common words) are not used to
+# generate candidate pairs.
+MAX_BUCKET_SIZE = 50
+# Candidate pairs scoring at or above this are merged.
+MERGE_THRESHOLD = 0.55
+MODEL_BONUS = 0.3
+MANUFACTURER_BONUS = 0.1
+PART_MISMATCH_PENALTY = 0.2
+PRICE_HISTORY_LIMIT = 50
+SIGNATURE_DTYPE = np.dtype('<u4')
+
+# Equivalent words folded together before shingling.
+SYNONYMS = {
+    'notebook': 'laptop', 'laptops': 'laptop', 'notebooks': 'laptop',
+    'svr': 'server', 'servers': 'server',
+    'lic': 'license', 'licence': 'license', 'licenses': 'license', 'lics': 'license',
+    'subscr': 'subscription', 'sub': 'subscription', 'subs': 'subscription',
+    'yr': 'year', 'yrs': 'year', 'years': 'year', 'annual': 'year',
+    'mo': 'month', 'mos': 'month', 'months': 'month',
+    'maint': 'maintenance', 'supp': 'support',
+    'dock': 'docking', 'monitors': 'monitor', 'display': 'monitor',
+}
+
+_DIGIT_RE = re.compile(r'\d+')
+# Description tokens that are dates rather than model numbers ("September 2025", "20250901").
+_DATE_TOKEN_RE = re.compile(r'(?:19|20)\d{2}(?:[01]\d(?:[0-3]\d)?)?')
+# Short qualifiers that distinguish otherwise identical names ("Tier 1" vs "Tier 2", "Level II").
+_QUALIFIER_RE = re.compile(r'\d{1,2}|ii|iii|iv|vi|vii|viii|ix')
+_rng = np.random.default_rng(20250101)
+_PERM_MUL = _rng.integers(1, 2**32, size=NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_PERM_ADD = _rng.integers(0, 2**32, size=NUM_PERM, dtype=np.uint64)
+_MASK32 = np.uint64(0xFFFFFFFF)
+_BAND_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+def shingles(name: str, description: str = None) -> frozenset:
+    """
+    Word shingles of a product name plus model-like tokens (containing digits)
+    of its description. Years and dates in descriptions ("September 2025")
+    describe the billing period, not the product, and are skipped.
+    """
+    tokens = {SYNONYMS.get(t, t) for t in tokenize(name)}
+    for t in tokenize(description)[:40]:
+        if any(c.isdigit() for c in t) and len(t) >= 3 and not _DATE_TOKEN_RE.fullmatch(t):
+            tokens.add(t)
+    return frozenset(tokens)
+
+
+def model_tokens(tokens) -> set:
+    """Tokens that look like model numbers or specs (contain a digit)."""
+    return {t for t in tokens if any(c.isdigit() for c in t) and len(t) >= 3}
+
+
+def qualifier_tokens(tokens) -> set:
+    """Short numeric or roman-numeral qualifiers (tier, level, grade numbers)."""
+    return {t for t in tokens if _QUALIFIER_RE.fullmatch(t)}
+
+
+def minhash_signature(tokens) -> np.ndarray:
+    """MinHash signature (NUM_PERM uint32 values) of a token set."""
+    if not tokens:
+        return np.full(NUM_PERM, 0xFFFFFFFF, dtype=SIGNATURE_DTYPE)
+    h = np.fromiter((zlib.crc32(t.encode('utf-8')) for t in tokens), dtype=np.uint64, count=len(tokens))
+    return ((h[:, None] * _PERM_MUL + _PERM_ADD) & _MASK32).min(axis=0).astype(SIGNATURE_DTYPE)
+
+
+def signature_bytes(tokens) -> bytes:
+    return minhash_signature(tokens).tobytes()
+
+
+def band_hashes(signatures: np.ndarray) -> np.ndarray:
+    """(n, NUM_BANDS) uint64 hash of each band of n signatures; equal bands hash equal."""
+    rows = signatures.reshape(len(signatures), NUM_BANDS, BAND_ROWS).astype(np.uint64)
+    hashes = rows[:, :, 0].copy()
+    for r in range(1, BAND_ROWS):
+        hashes = hashes * _BAND_MIX + rows[:, :, r]
+    return hashes
+
+
+def band_buckets(hashes: np.ndarray):
+    """Yield arrays of row indices sharing a band hash (2..MAX_BUCKET_SIZE members)."""
+    for band in range(hashes.shape[1]):
+        column = hashes[:, band]
+        order = np.argsort(column, kind='stable')
+        sorted_column = column[order]
+        bounds = np.flatnonzero(sorted_column[1:] != sorted_column[:-1]) + 1
+        starts = np.concatenate(([0], bounds))
+        ends = np.concatenate((bounds, [len(column)]))
+        for start, end in zip(starts[(ends - starts) >= 2], ends[(ends - starts) >= 2]):
+            if end - start <= MAX_BUCKET_SIZE:
+                yield order[start:end]
+
+
+class NameRecord:
+    """Line items sharing one normalized product name, or an existing product alias."""
+
+    __slots__ = ('key', 'names', 'item_ids', 'manufacturers', 'part_numbers', 'part_keys',
+                 'categories', 'tokens', 'models', 'product_id')
+
+    def __init__(self, key: str, product_id: str = None):
+        self.key = key
+        self.names = Counter()
+        self.item_ids = []
+        self.manufacturers = Counter()
+        self.part_numbers = set()
+        self.part_keys = set()
+        self.categories = Counter()
+        self.tokens = frozenset()
+        self.models = set()
+        self.product_id = product_id
+
+    @property
+    def manufacturer(self) -> str:
+        return normalize_manufacturer(self.manufacturers.most_common(1)[0][0]) if self.manufacturers else ''
+
+    @property
+    def size(self) -> int:
+        return len(self.item_ids)
+
+
+def score_pair(a: NameRecord, b: NameRecord) -> float:
+    """
+    Similarity of two name records: token Jaccard, raised by shared model
+    numbers and manufacturer, decided outright by a shared part number, and
+    vetoed by conflicting manufacturers, conflicting model/spec tokens
+    (5550 vs 5540, 16gb vs 32gb) or conflicting qualifiers (Tier 1 vs Tier 2).
+    """
+    mfr_a, mfr_b = a.manufacturer, b.manufacturer
+    if mfr_a and mfr_b and mfr_a != mfr_b:
+        return 0.0
+    if a.part_keys & b.part_keys:
+        return 1.0
+    if _models_conflict(a.models, b.models):
+        return 0.0
+    qualifiers_a, qualifiers_b = qualifier_tokens(a.tokens), qualifier_tokens(b.tokens)
+    if qualifiers_a - qualifiers_b and qualifiers_b - qualifiers_a:
+        return 0.0
+    union = len(a.tokens | b.tokens)
+    score = len(a.tokens & b.tokens) / union if union else 0.0
+    if a.models & b.models:
+        score += MODEL_BONUS
+    if mfr_a and mfr_a == mfr_b:
+        score += MANUFACTURER_BONUS
+    if a.part_keys and b.part_keys:
+        score -= PART_MISMATCH_PENALTY
+    return score
+
+
+class _UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, x):
+        self.parent.setdefault(x, x)
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[rb] = ra
+
+
+def canonicalize_products(session_id: str = '__default__', full: bool = False) -> dict:
+    """
+    Cluster line item product names into canonical products.
+
+    Names are shingled and MinHash-signed; LSH band buckets and shared part
+    numbers propose candidate pairs, which are scored on token overlap, part
+    numbers, model numbers and manufacturer. Incremental runs (the default)
+    only block line items not yet linked to a product, against each other and
+    against the existing product aliases that share a band or part number
+    with them. full=True re-clusters every line item and reassigns existing
+    products to the resulting clusters. Product price stats and invalidated
+    price estimates are refreshed afterwards.
+    Caller commits. Returns counts.
+    """
+    from app.extensions import db
+    from app.models.canonical_product import CanonicalProduct
+    from app.services.price_observations import sync_observation_products
+    from app.services.pricing_engine import refresh_price_estimates
+    from app.services.product_resolver import link_line_items, sync_product_identifiers
+
+    records = _load_records(session_id, unlinked_only=not full)
+    signatures = np.empty((len(records), NUM_PERM), dtype=SIGNATURE_DTYPE)
+    for i, record in enumerate(records):
+        signatures[i] = minhash_signature(record.tokens)
+    hashes = band_hashes(signatures)
+    anchors, anchor_hashes = [], hashes[:0]
+    if records and not full:
+        part_keys = set().union(*(r.part_keys for r in records))
+        anchors, anchor_hashes = _load_anchors(session_id, hashes, part_keys)
+
+    nodes = anchors + records
+    hashes = np.concatenate((anchor_hashes, hashes))
+    # Names sharing a part number are blocked together as well
+    part_buckets = defaultdict(list)
+    for node, record in enumerate(nodes):
+        for key in record.part_keys:
+            part_buckets[key].append(node)
+
+    uf = _UnionFind()
+    scored = set()
+    candidate_pairs = 0
+    buckets = (bucket.tolist() for bucket in band_buckets(hashes))
+    for members in chain(buckets, part_buckets.values()):
+        if not 2 <= len(members) <= MAX_BUCKET_SIZE:
+            continue
+        # Incremental runs only need pairs involving a new name; existing
+        # products are never merged with each other here
+        if not any(nodes[m].item_ids for m in members):
+            continue
+        for i, a in enumerate(members):
+            for b in members[i + 1:]:
+                pair = (a, b) if a < b else (b, a)
+                if pair in scored or (nodes[a].product_id and nodes[b].product_id):
+                    continue
+                scored.add(pair)
+                candidate_pairs += 1
+                if score_pair(nodes[a], nodes[b]) >= MERGE_THRESHOLD:
+                    uf.union(a, b)
+
+    clusters = defaultdict(list)
+    for node in range(len(nodes)):
+        clusters[uf.find(node)].append(node)
+
+    products = CanonicalProduct.query.filter_by(session_id=session_id)
+    if not full:
+        products = products.filter(CanonicalProduct.id.in_({a.product_id for a in anchors}))
+    products = {p.id: p for p in products}
+    alias_owner = _alias_owners(products.values()) if full else {}
+    part_owner = _part_owners(products.values()) if full else {}
+    # In a full run, aliases naming line items now clustered elsewhere are dropped
+    name_keys = {r.key for r in records} if full else set()
+    claimed = set()
+    created = updated = 0
+    assignments = {}
+    touched = {}
+    for members in clusters.values():
+        cluster = [nodes[m] for m in members]
+        new_records = [r for r in cluster if r.item_ids]
+        if not new_records:
+            continue
+        product = _choose_product(cluster, products, alias_owner, part_owner, claimed, full)
+        if product is None:
+            product = _new_product(new_records, session_id)
+            db.session.add(product)
+            db.session.flush()
+            products[product.id] = product
+            created += 1
+        elif product.id not in touched:
+            updated += 1
+        claimed.add(product.id)
+        _merge_into(product, new_records, name_keys)
+        touched[product.id] = product
+        for record in new_records:
+            for item_id in record.item_ids:
+                assignments[item_id] = product.id
+
+    if full:
+        _drop_stale_aliases(products, touched, name_keys)
+
+    from sqlalchemy import update
+    from app.models.line_item import LineItem
+    if assignments:
+        db.session.execute(update(LineItem), [
+            {'id': item_id, 'canonical_product_id': product_id} for item_id, product_id in assignments.items()
+        ])
+    db.session.flush()
+    sync_product_identifiers(list(products.values()) if full else list(touched.values()), full=full)
+    # Rows without a product name can still resolve by part number
+    linked = link_line_items(session_id, unlinked_only=True)
+    sync_observation_products(session_id)
+    refresh_product_stats(session_id)
+    estimated = refresh_price_estimates(session_id)
+
+    return {
+        'created': created,
+        'updated': updated,
+        'total': created + updated,
+        'names_blocked': len(records),
+        'candidate_pairs': candidate_pairs,
+        'line_items_assigned': len(assignments),
+        'line_items_linked': len(assignments) + linked,
+        'price_estimates_refreshed': estimated,
+        'mode': 'full' if full else 'incremental',
+    }
+
+
+def refresh_product_stats(session_id: str = '__default__', product_ids: list = None):
+    """
+    Recompute price statistics and the recent price history of products from
+    their price observations, aggregated in SQL. Caller commits. Returns
+    products updated.
+    """
+    from sqlalchemy import update
+    from app.extensions import db
+    from app.models.canonical_product import CanonicalProduct
+    from app.models.price_observation import PriceObservation
+
+    filters = [
+        PriceObservation.session_id == session_id,
+        PriceObservation.canonical_product_id.isnot(None),
+    ]
+    if product_ids is not None:
+        filters.append(PriceObservation.canonical_product_id.in_(product_ids))
+
+    stats = {
+        product_id: (avg_price, min_price, max_price)
+        for product_id, avg_price, min_price, max_price in db.session.query(
+            PriceObservation.canonical_product_id, db.func.avg(PriceObservation.unit_price),
+            db.func.min(PriceObservation.unit_price), db.func.max(PriceObservation.unit_price),
+        ).filter(*filters).group_by(PriceObservation.canonical_product_id)
+    }
+
+    recent = db.session.query(
+        PriceObservation.canonical_product_id.label('product_id'),
+        PriceObservation.unit_price.label('price'),
+        PriceObservation.observed_on.label('date'),
+        PriceObservation.vendor_name.label('vendor'),
+        db.func.row_number().over(
+            partition_by=PriceObservation.canonical_product_id,
+            order_by=PriceObservation.observed_on.desc(),
+        ).label('position'),
+    ).filter(*filters).subquery()
+    history = defaultdict(list)
+    for product_id, price, date, vendor in db.session.query(
+        recent.c.product_id, recent.c.price, recent.c.date, recent.c.vendor,
+    ).filter(recent.c.position <= PRICE_HISTORY_LIMIT):
+        history[product_id].append((date.isoformat() if date else '', price, vendor))
+
+    updates = []
+    for product_id, (avg_price, min_price, max_price) in stats.items():
+        rows = sorted(history.get(product_id, []), key=lambda r: r[0])
+        values = {
+            'id': product_id,
+            'avg_price': round(avg_price, 2),
+            'min_price': round(min_price, 2),
+            'max_price': round(max_price, 2),
+            'price_history': json.dumps([
+                {'price': round(price, 2), 'date': date or None, 'vendor': vendor}
+                for date, price, vendor in rows
+            ]),
+        }
+        if rows:
+            values['last_known_price'] = round(rows[-1][1], 2)
+            if rows[-1][0]:
+                values['last_price_date'] = rows[-1][0]
+        updates.append(values)
+    # Rows differ in which columns they set, so they are grouped by key set
+    for columns in {tuple(sorted(u)) for u in updates}:
+        db.session.execute(update(CanonicalProduct), [u for u in updates if tuple(sorted(u)) == columns])
+    return len(updates)
+
+
+def _load_records(session_id: str, unlinked_only: bool) -> list:
+    from app.extensions import db
+    from app.models.line_item import LineItem
+
+    query = db.session.query(
+        LineItem.id, LineItem.product_name, LineItem.manufacturer, LineItem.part_number,
+        LineItem.category, db.func.substr(LineItem.product_description, 1, 300),
+    ).filter(LineItem.session_id == session_id)\
+     .filter(LineItem.product_name.isnot(None))\
+     .filter(LineItem.product_name != '')
+    if unlinked_only:
+        query = query.filter(LineItem.canonical_product_id.is_(None))
+
+    records = {}
+    descriptions = {}
+    for item_id, name, manufacturer, part_number, category, description in query:
+        key = normalize_alias(name)
+        if not key:
+            continue
+        record = records.get(key)
+        if record is None:
+            record = records[key] = NameRecord(key)
+        record.names[name.strip()] += 1
+        record.item_ids.append(item_id)
+        if manufacturer:
+            record.manufacturers[manufacturer.strip()] += 1
+        if category:
+            record.categories[category] += 1
+        if part_number:
+            part_key = normalize_part_number(part_number, manufacturer)
+            if part_key:
+                record.part_numbers.add(part_number.strip())
+                record.part_keys.add(part_key)
+        if description and key not in descriptions:
+            descriptions[key] = description
+
+    for key, record in records.items():
+        record.tokens = shingles(record.names.most_common(1)[0][0], descriptions.get(key))
+        record.models = model_tokens(record.tokens)
+    return list(records.values())
+
+
+def _load_anchors(session_id: str, record_hashes: np.ndarray, record_part_keys: set):
+    """
+    Existing product aliases sharing at least one LSH band or part number
+    with the new records, as fixed cluster anchors, with their band hashes. Signatures are
+    read from product_identifiers.minhash, so only matching aliases are
+    re-tokenized for scoring.
+    """
+    from app.extensions import db
+    from app.models.product_identifier import ProductIdentifier
+
+    part_keys = defaultdict(set)
+    aliases = []
+    signatures = []
+    rows = db.session.query(
+        ProductIdentifier.canonical_product_id, ProductIdentifier.kind, ProductIdentifier.value,
+        ProductIdentifier.normalized_key, ProductIdentifier.manufacturer_key, ProductIdentifier.minhash,
+    ).filter(ProductIdentifier.session_id == session_id)
+    for product_id, kind, value, key, manufacturer_key, minhash in rows:
+        if kind == 'part_number':
+            part_keys[product_id].add(key)
+            continue
+        aliases.append((product_id, value, key, manufacturer_key))
+        if minhash and len(minhash) == NUM_PERM * SIGNATURE_DTYPE.itemsize:
+            signatures.append(np.frombuffer(minhash, dtype=SIGNATURE_DTYPE))
+        else:
+            signatures.append(minhash_signature(shingles(value)))
+    if not aliases:
+        return [], record_hashes[:0]
+
+    hashes = band_hashes(np.stack(signatures))
+    hit = np.zeros(len(aliases), dtype=bool)
+    for band in range(NUM_BANDS):
+        hit |= np.isin(hashes[:, band], record_hashes[:, band])
+    if record_part_keys:
+        hit |= np.fromiter((bool(part_keys.get(alias[0], set()) & record_part_keys) for alias in aliases),
+                           dtype=bool, count=len(aliases))
+
+    anchors = []
+    for index in np.flatnonzero(hit):
+        product_id, value, key, manufacturer_key = aliases[index]
+        anchor = NameRecord(key, product_id)
+        if manufacturer_key:
+            anchor.manufacturers[manufacturer_key] += 1
+        anchor.tokens = shingles(value)
+        anchor.models = model_tokens(anchor.tokens)
+        anchor.part_keys = part_keys.get(product_id, set())
+        anchors.append(anchor)
+    return anchors, hashes[hit]
+
+
+def _choose_product(cluster: list, products: dict, alias_owner: dict, part_owner: dict, claimed: set,
+                    full: bool):
+    """
+    The existing product a cluster belongs to, or None to create one. In a
+    full run, clusters vote by the part numbers of existing products first
+    (as incremental runs anchor on them) and by alias names second.
+    """
+    votes = Counter()
+    part_votes = Counter()
+    for record in cluster:
+        if record.product_id:
+            votes[record.product_id] += 1
+        elif full:
+            for product_id in alias_owner.get(record.key, ()):
+                votes[product_id] += record.size
+            manufacturer = record.manufacturer
+            for key in record.part_keys:
+                for product_id, manufacturer_key in part_owner.get(key, ()):
+                    if not manufacturer or not manufacturer_key or manufacturer == manufacturer_key:
+                        part_votes[product_id] += record.size
+    ranked = sorted(set(votes) | set(part_votes), key=lambda p: (part_votes[p], votes[p]), reverse=True)
+    for product_id in ranked:
+        if product_id in products and (not full or product_id not in claimed):
+            return products[product_id]
+    return None
+
+
+def _new_product(records: list, session_id: str):
+    from app.models.canonical_product import CanonicalProduct
+
+    lead = max(records, key=lambda r: r.size)
+    manufacturers = sum((r.manufacturers for r in records), Counter())
+    categories = sum((r.categories for r in records), Counter())
+    return CanonicalProduct(
+        canonical_name=lead.names.most_common(1)[0][0][:300],
+        category=categories.most_common(1)[0][0] if categories else None,
+        manufacturer=manufacturers.most_common(1)[0][0][:200] if manufacturers else None,
+        known_part_numbers='[]',
+        known_aliases='[]',
+        price_history='[]',
+        session_id=session_id,
+    )
+
+
+def _merge_into(product, records: list, name_keys: set):
+    """
+    Add the cluster's names and part numbers to the product's known aliases
+    and part numbers. Aliases in name_keys (names clustered anew in a full
+    run) are replaced by the cluster's own names.
+    """
+    canonical_key = normalize_alias(product.canonical_name)
+    aliases = [a for a in _json_list(product.known_aliases) if normalize_alias(a) not in name_keys]
+    seen = {normalize_alias(a) for a in aliases} | {canonical_key}
+    for record in sorted(records, key=lambda r: -r.size):
+        for name, _ in record.names.most_common():
+            key = normalize_alias(name)
+            if key not in seen:
+                seen.add(key)
+                aliases.append(name)
+    part_numbers = _json_list(product.known_part_numbers)
+    seen_parts = {normalize_part_number(p, product.manufacturer) for p in part_numbers}
+    for record in records:
+        for part in sorted(record.part_numbers):
+            key = normalize_part_number(part, product.manufacturer)
+            if key and key not in seen_parts:
+                seen_parts.add(key)
+                part_numbers.append(part)
+    product.known_aliases = json.dumps(aliases)
+    product.known_part_numbers = json.dumps(part_numbers)
+
+    if not product.manufacturer:
+        manufacturers = sum((r.manufacturers for r in records), Counter())
+        product.manufacturer = manufacturers.most_common(1)[0][0][:200] if manufacturers else None
+    if not product.category:
+        categories = sum((r.categories for r in records), Counter())
+        product.category = categories.most_common(1)[0][0] if categories else None
+
+
+def _alias_owners(products) -> dict:
+    owners = defaultdict(list)
+    for product in products:
+        for name in [product.canonical_name] + _json_list(product.known_aliases):
+            owners[normalize_alias(name)].append(product.id)
+    return owners
+
+
+def _part_owners(products) -> dict:
+    """Normalized part number -> [(product id, manufacturer key), ...] of existing products."""
+    owners = defaultdict(list)
+    for product in products:
+        manufacturer_key = normalize_manufacturer(product.manufacturer)
+        for part in _json_list(product.known_part_numbers):
+            key = normalize_part_number(part, product.manufacturer)
+            if key:
+                owners[key].append((product.id, manufacturer_key))
+    return owners
+
+
+def _drop_stale_aliases(products: dict, touched: dict, name_keys: set):
+    """In a full run, remove aliases naming line items from products no cluster was assigned to."""
+    for product_id, product in products.items():
+        if product_id in touched:
+            continue
+        aliases = _json_list(product.known_aliases)
+        kept = [a for a in aliases if normalize_alias(a) not in name_keys]
+        if len(kept) != len(aliases):
+            product.known_aliases = json.dumps(kept)
+
+
+def _models_conflict(a: set, b: set) -> bool:
+    """True when each side has a model/spec token of the same shape the other lacks (5550 vs 5540)."""
+    only_a, only_b = a - b, b - a
+    if not only_a or not only_b:
+        return False
+    return bool({_DIGIT_RE.sub('#', t) for t in only_a} & {_DIGIT_RE.sub('#', t) for t in only_b})
+
+
+def _json_list(value) -> list:
+    if not value:
+        return []
+    try:
+        parsed = json.loads(value)
+    except (json.JSONDecodeError, TypeError):
+        return []
+    return [v for v in parsed if isinstance(v, str) and v.strip()] if isinstance(parsed, list) else []
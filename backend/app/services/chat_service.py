@@ -2,6 +2,8 @@ import json
 import logging
 from sqlalchemy import text
 
+from app.services.conversation_store import load_memory, record_turn
+
 logger = logging.getLogger(__name__)
 
 CHAT_SYSTEM_PROMPT = """You are a procurement document analyst assistant. You help users find information about their procurement documents, purchase orders, invoices, vendor quotes, and line items.
@@ -15,7 +17,7 @@ You have access to a database of procurement documents with extracted line items
 
 When search results are provided, base your answer ONLY on those results. Do not make up information."""
 
-CHAT_QUERY_PROMPT = """Based on the user's question, I searched the procurement database and found these results:
+CHAT_QUERY_PROMPT = """Based on the user's question, I searched the procurement database and found these results. Documents are listed once and referred to by tag (D1, D2, ...) in the line item table and passages:
 
 {context}
 
@@ -27,52 +29,306 @@ Please answer the question based on the search results above. Cite specific docu
 class ChatService:
     """RAG-based chat service for procurement document Q&A."""
 
-    def __init__(self, api_key: str):
-        self.api_key = api_key
+    def __init__(self, gateway=None, answer_cache=None):
+        if gateway is None:
+            from app.services.llm_gateway import get_llm_gateway
+            gateway = get_llm_gateway()
+        self.gateway = gateway
+        self.answer_cache = answer_cache
 
     def process_query(self, query: str, db_session, session_id: str = '__default__',
-                      conversation_history: list = None) -> dict:
+                      conversation_history: list = None, conversation=None) -> dict:
         """
-        Process a chat query using hybrid SQL + FTS5 search.
+        Process a chat query using hybrid line item + BM25 + vector retrieval.
+        With a stored conversation, its bounded memory replaces conversation_history
+        once it has turns, and the new turn is recorded (caller commits).
         Returns {'answer': str, 'sources': [...], 'query_type': str}
         """
-        # Step 1: Search line items (structured search)
-        sql_results = self._sql_search(query, db_session, session_id)
-
-        # Step 2: Search document chunks (FTS5 text search)
-        fts_results = self._fts_search(query, db_session, session_id)
+        summary, carry_over = '', []
+        if conversation is not None and conversation.turn_count:
+            conversation_history, summary, carry_over = load_memory(conversation)
+
+        result = self._answer(query, db_session, session_id, conversation_history, summary, carry_over)
+        source_keys = result.pop('source_keys', [])
+        if conversation is not None:
+            record_turn(conversation, query, result, source_keys)
+            result['conversation_id'] = conversation.id
+        return result
+
+    def _answer(self, query: str, db_session, session_id: str, history: list,
+                summary: str, carry_over: list) -> dict:
+        # Repeated questions are answered from the cache without retrieval or a model call
+        cache, version = self._cache_state(session_id, history or summary)
+        if cache:
+            cached = cache.lookup(session_id, query, version)
+            if cached:
+                return {**cached, 'cached': True}
+
+        # Aggregate, ranking and filter questions are answered directly in SQL
+        routed = self._route_aggregate(query, db_session, session_id)
+        if routed:
+            if cache:
+                cache.store(session_id, query, version, routed)
+            return routed
+
+        # Steps 1-2: Retrieve line items and document chunks, fused and re-ranked
+        sql_results, fts_results = self._retrieve(query, db_session, session_id, carry_over=carry_over)
+        source_keys = self._source_keys(sql_results, fts_results)
+        if cache:
+            cached = cache.lookup_similar(session_id, query, version, source_keys)
+            if cached:
+                return {**cached, 'cached': True}
 
         # Step 3: Build context from results
-        context = self._build_context(sql_results, fts_results)
+        context = self._build_context(query, sql_results, fts_results)
 
         # Step 4: If no API key, return raw results
-        if not self.api_key:
+        if not self.gateway.available:
             return {
-                'answer': f"Found {len(sql_results)} line items and {len(fts_results)} document passages matching your query. (AI synthesis requires ANTHROPIC_API_KEY)",
+                'answer': self._search_only_answer(sql_results, fts_results),
                 'sources': self._format_sources(sql_results, fts_results),
                 'query_type': 'search_only',
+                'source_keys': source_keys,
             }
 
         # Step 5: Synthesize with Claude
-        answer = self._synthesize(query, context, conversation_history)
+        answer, ok = self._synthesize(query, context, history, summary)
 
-        return {
+        result = {
             'answer': answer,
             'sources': self._format_sources(sql_results, fts_results),
             'query_type': 'hybrid',
+            'source_keys': source_keys,
+        }
+        if cache and ok:
+            self._store_answer(cache, session_id, query, version, result, sql_results, fts_results)
+        return result
+
+    def stream_query(self, query: str, db_session, session_id: str = '__default__',
+                     conversation_history: list = None, conversation=None):
+        """
+        Streaming variant of process_query for Server-Sent Events.
+        Yields {'event': 'sources' | 'token' | 'done', 'data': dict}. Sources are
+        emitted as soon as retrieval finishes, then answer text as it is generated.
+        Closing the generator (client disconnect) cancels the model stream.
+        A stored conversation's turn is recorded just before 'done'.
+        """
+        summary, carry_over = '', []
+        if conversation is not None and conversation.turn_count:
+            conversation_history, summary, carry_over = load_memory(conversation)
+
+        result = {'answer': '', 'sources': [], 'query_type': None}
+        source_keys = []
+        for event in self._answer_events(query, db_session, session_id, conversation_history,
+                                         summary, carry_over):
+            if event['event'] == 'sources':
+                data = dict(event['data'])
+                source_keys = data.pop('source_keys', [])
+                result.update(sources=data['sources'], query_type=data['query_type'])
+                if conversation is not None:
+                    data['conversation_id'] = conversation.id
+                event = {'event': 'sources', 'data': data}
+            elif event['event'] == 'token':
+                result['answer'] += event['data']['text']
+            elif event['event'] == 'done' and conversation is not None:
+                record_turn(conversation, query, result, source_keys)
+            yield event
+
+    def _answer_events(self, query: str, db_session, session_id: str, history: list,
+                       summary: str, carry_over: list):
+        cache, version = self._cache_state(session_id, history or summary)
+        cached = cache.lookup(session_id, query, version) if cache else None
+        routed = None
+        if not cached:
+            routed = self._route_aggregate(query, db_session, session_id)
+            if routed and cache:
+                cache.store(session_id, query, version, routed)
+        if cached or routed:
+            yield from self._complete_events(cached or routed, cached=bool(cached))
+            return
+
+        sql_results, fts_results = self._retrieve(query, db_session, session_id, carry_over=carry_over)
+        source_keys = self._source_keys(sql_results, fts_results)
+        if cache:
+            cached = cache.lookup_similar(session_id, query, version, source_keys)
+            if cached:
+                yield from self._complete_events(cached, cached=True)
+                return
+
+        context = self._build_context(query, sql_results, fts_results)
+        query_type = 'hybrid' if self.gateway.available else 'search_only'
+        sources = self._format_sources(sql_results, fts_results)
+        yield {'event': 'sources', 'data': {'sources': sources, 'query_type': query_type, 'source_keys': source_keys}}
+
+        if not self.gateway.available:
+            yield {'event': 'token', 'data': {'text': self._search_only_answer(sql_results, fts_results)}}
+        else:
+            parts = []
+            try:
+                for text in self._stream_synthesis(query, context, history, summary):
+                    parts.append(text)
+                    yield {'event': 'token', 'data': {'text': text}}
+            except Exception as e:
+                logger.error(f"Claude streaming error: {e}")
+                yield {'event': 'token', 'data': {
+                    'text': f"\n\nI found relevant results but couldn't finish the summary. Error: {str(e)}",
+                }}
+            else:
+                if cache:
+                    result = {'answer': ''.join(parts), 'sources': sources, 'query_type': query_type,
+                              'source_keys': source_keys}
+                    self._store_answer(cache, session_id, query, version, result, sql_results, fts_results)
+        yield {'event': 'done', 'data': {'query_type': query_type}}
+
+    def _complete_events(self, result: dict, cached: bool = False):
+        """Events for an answer that is already complete (aggregate or cached)."""
+        yield {'event': 'sources', 'data': {
+            'sources': result['sources'],
+            'query_type': result['query_type'],
+            'source_keys': result.get('source_keys', []),
+        }}
+        yield {'event': 'token', 'data': {'text': result['answer']}}
+        done = {'query_type': result['query_type'], 'data': result.get('data')}
+        if cached:
+            done['cached'] = True
+        yield {'event': 'done', 'data': done}
+
+    def _cache_state(self, session_id: str, conversation_history=None) -> tuple:
+        """
+        Return (cache, data_version) when this question may use the answer cache,
+        else (None, None). Follow-up questions depend on the conversation so they
+        are never cached.
+        """
+        if self.answer_cache is None or conversation_history:
+            return None, None
+        from app.services.data_version import get_data_version
+        return self.answer_cache, get_data_version(session_id)
+
+    def _source_keys(self, sql_results: list, fts_results: list) -> list:
+        from app.services.retrieval import result_key
+        return [result_key(r) for r in sql_results + fts_results]
+
+    def _store_answer(self, cache, session_id: str, query: str, version: int, result: dict,
+                      sql_results: list, fts_results: list):
+        cache.store(
+            session_id, query, version, result,
+            source_keys=result['source_keys'],
+            document_ids={r['document_id'] for r in sql_results + fts_results if r.get('document_id')},
+        )
+
+    def _route_aggregate(self, query: str, db_session, session_id: str):
+        """Answer aggregate questions with SQL templates; None if the question needs retrieval."""
+        from app.services.aggregate_router import AggregateIntentParser, AggregateQueryRunner
+
+        try:
+            with db_session.begin_nested():
+                intent = AggregateIntentParser(self._vocabulary(db_session, session_id)).parse(query)
+                if not intent:
+                    return None
+                return AggregateQueryRunner().run(intent, db_session, session_id)
+        except Exception as e:
+            logger.error(f"Aggregate routing error: {e}")
+            return None
+
+    def _vocabulary(self, db_session, session_id: str) -> dict:
+        """Distinct vendors, categories and contracts the intent parser can recognize."""
+        from app.models.document import Document
+        from app.models.line_item import LineItem
+
+        def _distinct(column, session_column):
+            rows = db_session.query(column).filter(session_column == session_id)\
+                .filter(column.isnot(None)).filter(column != '').distinct().all()
+            return [r[0] for r in rows]
+
+        return {
+            'vendors': _distinct(Document.vendor_name, Document.session_id),
+            'categories': _distinct(LineItem.category, LineItem.session_id),
+            'contracts': _distinct(Document.contract_number, Document.session_id),
         }
 
+    def _retrieve(self, query: str, db_session, session_id: str,
+                  max_line_items: int = 15, max_chunks: int = 10, carry_over: list = None) -> tuple:
+        """
+        Run structured, BM25 and vector retrieval concurrently, fuse them with
+        reciprocal rank fusion and apply a per-document diversity re-rank.
+        carry_over holds the previous turn's hits, fused at half weight so
+        follow-up questions keep their referents.
+        Returns (line_item_results, chunk_results).
+        """
+        from app.services.retrieval import run_legs, reciprocal_rank_fusion, diversify
+
+        legs = {
+            'line_items': lambda s: self._sql_search(query, s, session_id, limit=40),
+            'bm25': lambda s: self._fts_search(query, s, session_id, limit=30),
+            'vector': lambda s: self._vector_search(query, s, session_id, limit=30),
+        }
+        if carry_over:
+            legs['carry_over'] = lambda s: self._carry_over_results(carry_over, s)
+        ranked = run_legs(legs)
+        fused = reciprocal_rank_fusion(
+            [ranked['line_items'], ranked['bm25'], ranked['vector'], ranked.get('carry_over', [])],
+            weights=[1.0, 1.0, 1.0, 0.5],
+        )
+        selected = diversify(fused, limit=len(fused))
+
+        line_items = [r for r in selected if r['type'] == 'line_item'][:max_line_items]
+        chunks = [r for r in selected if r['type'] == 'chunk'][:max_chunks]
+        return line_items, chunks
+
+    def _carry_over_results(self, keys: list, db_session) -> list:
+        """Re-load the previous turn's hits, in their original order."""
+        from app.models.document_chunk import DocumentChunk
+        from app.models.line_item import LineItem
+
+        item_ids = [key for kind, key in keys if kind == 'line_item']
+        chunk_ids = [key for kind, key in keys if kind == 'chunk']
+        loaded = {}
+        if item_ids:
+            for item in db_session.query(LineItem).filter(LineItem.id.in_(item_ids)).all():
+                loaded[('line_item', item.id)] = self._line_item_result(item)
+        if chunk_ids:
+            for chunk in db_session.query(DocumentChunk).filter(DocumentChunk.id.in_(chunk_ids)).all():
+                loaded[('chunk', chunk.id)] = self._chunk_result(chunk)
+        return [loaded[tuple(key)] for key in keys if tuple(key) in loaded]
+
     def _sql_search(self, query: str, db_session, session_id: str, limit: int = 20) -> list:
+        """Ranked line item lookup through the line_items_fts inverted index."""
+        from app.models.line_item import LineItem
+        from app.services.line_item_search import LineItemSearch, index_available
+
+        if not index_available(db_session):
+            return self._like_line_item_search(query, db_session, session_id, limit)
+        try:
+            with db_session.begin_nested():
+                hits = LineItemSearch().search(query, db_session, session_id, limit=limit)
+        except Exception as e:
+            logger.warning(f"Line item index search failed, falling back to LIKE: {e}")
+            return self._like_line_item_search(query, db_session, session_id, limit)
+        if not hits:
+            return []
+
+        items = {
+            item.id: item for item in db_session.query(LineItem)
+            .filter(LineItem.id.in_([item_id for item_id, _ in hits]))
+            .all()
+        }
+        return [
+            self._line_item_result(items[item_id], score=score)
+            for item_id, score in hits
+            if item_id in items
+        ]
+
+    def _like_line_item_search(self, query: str, db_session, session_id: str, limit: int = 20) -> list:
         """Search line items using LIKE matching on key fields."""
         from app.models.line_item import LineItem
         from app.models.document import Document
+        from app.services.text_utils import tokenize
 
         # Extract search terms
-        terms = [t.strip() for t in query.split() if len(t.strip()) > 2]
+        terms = tokenize(query, min_length=3)
         if not terms:
             return []
 
-        results = []
         q = db_session.query(LineItem).join(Document).filter(
             LineItem.session_id == session_id
         )
@@ -94,37 +350,71 @@ class ChatService:
             ])
 
         items = q.filter(or_(*conditions)).limit(limit).all()
-        for item in items:
-            results.append({
-                'type': 'line_item',
-                'product_name': item.product_name,
-                'part_number': item.part_number,
-                'manufacturer': item.manufacturer,
-                'quantity': item.quantity,
-                'unit_price': item.unit_price,
-                'extended_price': item.extended_price,
-                'category': item.category,
-                'vendor_name': item.document.vendor_name if item.document else None,
-                'document_number': item.document.document_number if item.document else None,
-                'document_date': item.document.document_date if item.document else None,
-                'document_id': item.document_id,
-                'document_type': item.document.document_type if item.document else None,
-            })
-
-        return results
+        return [self._line_item_result(item) for item in items]
+
+    def _line_item_result(self, item, score: float = None) -> dict:
+        result = {
+            'type': 'line_item',
+            'line_item_id': item.id,
+            'product_name': item.product_name,
+            'part_number': item.part_number,
+            'manufacturer': item.manufacturer,
+            'quantity': item.quantity,
+            'unit_price': item.unit_price,
+            'extended_price': item.extended_price,
+            'category': item.category,
+            'vendor_name': item.document.vendor_name if item.document else None,
+            'document_number': item.document.document_number if item.document else None,
+            'document_date': item.document.document_date if item.document else None,
+            'document_id': item.document_id,
+            'document_type': item.document.document_type if item.document else None,
+        }
+        if score is not None:
+            result['score'] = round(score, 4)
+        return result
 
     def _fts_search(self, query: str, db_session, session_id: str, limit: int = 10) -> list:
-        """Full-text search on document chunks using FTS5."""
+        """BM25-ranked full-text search on document chunks using FTS5."""
+        from app.models.document_chunk import DocumentChunk
+        from app.services.text_utils import tokenize
+
+        terms = list(dict.fromkeys(tokenize(query, min_length=2)))
+        if not terms:
+            return []
+
+        try:
+            match = ' OR '.join(f'"{t}"' for t in terms)
+            with db_session.begin_nested():
+                rows = db_session.execute(text("""
+                    SELECT c.id, bm25(document_chunks_fts) AS rank
+                    FROM document_chunks_fts
+                    JOIN document_chunks c ON c.rowid = document_chunks_fts.rowid
+                    WHERE document_chunks_fts MATCH :match AND c.session_id = :session_id
+                    ORDER BY rank
+                    LIMIT :limit
+                """), {'match': match, 'session_id': session_id, 'limit': limit}).all()
+        except Exception as e:
+            logger.warning(f"FTS5 search unavailable, falling back to LIKE: {e}")
+            return self._like_chunk_search(terms, db_session, session_id, limit)
+
+        chunks = {
+            c.id: c for c in db_session.query(DocumentChunk)
+            .filter(DocumentChunk.id.in_([r[0] for r in rows]))
+            .all()
+        }
+        return [
+            self._chunk_result(chunks[chunk_id], score=-rank)
+            for chunk_id, rank in rows
+            if chunk_id in chunks
+        ]
+
+    def _like_chunk_search(self, terms: list, db_session, session_id: str, limit: int) -> list:
+        """Unranked LIKE search on document chunks, used when FTS5 is not available."""
         from app.models.document_chunk import DocumentChunk
         from app.models.document import Document
 
         results = []
         try:
-            # Use simple LIKE search as fallback (FTS5 may not be populated)
-            terms = [t.strip() for t in query.split() if len(t.strip()) > 2]
-            if not terms:
-                return []
-
             from sqlalchemy import or_
             conditions = []
             for term in terms:
@@ -136,47 +426,61 @@ class ChatService:
             ).limit(limit).all()
 
             for chunk in chunks:
-                results.append({
-                    'type': 'chunk',
-                    'content': chunk.content[:500],
-                    'chunk_type': chunk.chunk_type,
-                    'document_id': chunk.document_id,
-                    'vendor_name': chunk.document.vendor_name if chunk.document else None,
-                    'document_number': chunk.document.document_number if chunk.document else None,
-                    'original_filename': chunk.document.original_filename if chunk.document else None,
-                })
+                results.append(self._chunk_result(chunk))
         except Exception as e:
             logger.error(f"FTS search error: {e}")
 
         return results
 
-    def _build_context(self, sql_results: list, fts_results: list) -> str:
-        """Build context string from search results for Claude."""
-        parts = []
-
-        if sql_results:
-            parts.append("=== LINE ITEM SEARCH RESULTS ===")
-            for r in sql_results[:15]:
-                line = f"- {r.get('product_name', 'N/A')}"
-                if r.get('part_number'):
-                    line += f" (Part: {r['part_number']})"
-                if r.get('manufacturer'):
-                    line += f" by {r['manufacturer']}"
-                if r.get('quantity') is not None and r.get('unit_price') is not None:
-                    line += f" | Qty: {r['quantity']} @ ${r['unit_price']:,.2f}"
-                if r.get('extended_price') is not None:
-                    line += f" = ${r['extended_price']:,.2f}"
-                line += f" | Vendor: {r.get('vendor_name', 'N/A')}"
-                line += f" | Doc: {r.get('document_number', 'N/A')} ({r.get('document_type', '')})"
-                line += f" | Date: {r.get('document_date', 'N/A')}"
-                parts.append(line)
-
-        if fts_results:
-            parts.append("\n=== DOCUMENT TEXT SEARCH RESULTS ===")
-            for r in fts_results[:10]:
-                parts.append(f"[{r.get('document_number', r.get('original_filename', 'Unknown'))}] {r['content'][:300]}")
-
-        return '\n'.join(parts) if parts else 'No results found matching the query.'
+    def _chunk_result(self, chunk, score: float = None) -> dict:
+        result = {
+            'type': 'chunk',
+            'chunk_id': chunk.id,
+            'content': chunk.content,
+            'chunk_type': chunk.chunk_type,
+            'document_id': chunk.document_id,
+            'vendor_name': chunk.document.vendor_name if chunk.document else None,
+            'document_number': chunk.document.document_number if chunk.document else None,
+            'original_filename': chunk.document.original_filename if chunk.document else None,
+        }
+        if score is not None:
+            result['score'] = round(score, 4)
+        return result
+
+    def _vector_search(self, query: str, db_session, session_id: str, limit: int = 10) -> list:
+        """Semantic nearest-neighbour search over embedded document chunks scoring at least VECTOR_MIN_SCORE."""
+        from app.models.document_chunk import DocumentChunk
+        from app.services.embedder import ChunkEmbedder
+        from app.services.retrieval import VECTOR_MIN_SCORE
+        from app.services.vector_index import get_vector_index
+
+        results = []
+        try:
+            index = get_vector_index(session_id)
+            index.sync()
+            hits = index.search(ChunkEmbedder().embed_one(query), k=limit)
+            # Weak neighbours would still earn an RRF score and take context space
+            hits = [(chunk_id, score) for chunk_id, score in hits if score >= VECTOR_MIN_SCORE]
+            if not hits:
+                return []
+
+            chunks = {
+                c.id: c for c in db_session.query(DocumentChunk)
+                .filter(DocumentChunk.id.in_([chunk_id for chunk_id, _ in hits]))
+                .all()
+            }
+            for chunk_id, score in hits:
+                if chunk_id in chunks:
+                    results.append(self._chunk_result(chunks[chunk_id], score=score))
+        except Exception as e:
+            logger.error(f"Vector search error: {e}")
+
+        return results
+
+    def _build_context(self, query: str, sql_results: list, fts_results: list) -> str:
+        """Build a token-budgeted context string from search results for Claude."""
+        from app.services.context_builder import ContextBuilder
+        return ContextBuilder().build(query, sql_results, fts_results)
 
     def _format_sources(self, sql_results: list, fts_results: list) -> list:
         """Format source citations for the response."""
@@ -194,29 +498,48 @@ class ChatService:
                 })
         return sources
 
-    def _synthesize(self, query: str, context: str, history: list = None) -> str:
-        """Send results to Claude for natural language synthesis."""
-        import anthropic
-        client = anthropic.Anthropic(api_key=self.api_key)
+    def _search_only_answer(self, sql_results: list, fts_results: list) -> str:
+        return (f"Found {len(sql_results)} line items and {len(fts_results)} document passages "
+                f"matching your query. (AI synthesis requires ANTHROPIC_API_KEY)")
 
-        messages = []
-        if history:
-            for msg in history[-6:]:  # Last 3 turns
-                messages.append({"role": msg['role'], "content": msg['content']})
+    def _messages(self, query: str, context: str, history: list = None, summary: str = '') -> list:
+        from app.services.context_builder import compact_history
 
-        messages.append({
-            "role": "user",
-            "content": CHAT_QUERY_PROMPT.format(context=context, question=query),
-        })
+        messages, notes = compact_history(history)
+        summary = '\n'.join(part for part in (summary, notes) if part)
+        content = CHAT_QUERY_PROMPT.format(context=context, question=query)
+        if summary:
+            content = f"Earlier in this conversation:\n{summary}\n\n{content}"
+        messages.append({"role": "user", "content": content})
+        return messages
+
+    def _synthesize(self, query: str, context: str, history: list = None, summary: str = '') -> tuple:
+        """Send results to Claude for natural language synthesis. Returns (answer, succeeded)."""
+        from app.services.llm_gateway import INTERACTIVE
 
         try:
-            response = client.messages.create(
-                model="claude-sonnet-4-5-20250929",
-                max_tokens=1024,
+            response = self.gateway.complete(
+                self._messages(query, context, history, summary),
                 system=CHAT_SYSTEM_PROMPT,
-                messages=messages,
+                max_tokens=1024,
+                priority=INTERACTIVE,
+                label='chat',
             )
-            return response.content[0].text
+            return response['text'], True
         except Exception as e:
             logger.error(f"Claude synthesis error: {e}")
-            return f"I found relevant results but couldn't generate a summary. Error: {str(e)}\n\nRaw context:\n{context[:1000]}"
+            answer = (f"I found relevant results but couldn't generate a summary. Error: {str(e)}"
+                      f"\n\nRaw context:\n{context[:1000]}")
+            return answer, False
+
+    def _stream_synthesis(self, query: str, context: str, history: list = None, summary: str = ''):
+        """Yield answer text deltas from Claude as they are generated. Errors propagate."""
+        from app.services.llm_gateway import INTERACTIVE
+
+        yield from self.gateway.stream(
+            self._messages(query, context, history, summary),
+            system=CHAT_SYSTEM_PROMPT,
+            max_tokens=1024,
+            priority=INTERACTIVE,
+            label='chat',
+        )
@@ -0,0 +1,524 @@
+import fcntl
+import logging
+import os
+import re
+import threading
+import zlib
+from contextlib import contextmanager
+
+import numpy as np
+
+from app.services.text_utils import tokenize
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_FEATURES = 1 << 16
+LINE_ITEM_FEATURES = 1 << 14
+# Additive (Lidstone) smoothing of per-class feature counts.
+SMOOTHING = 0.1
+# Classes with fewer reviewed examples than this are left to the model.
+MIN_CLASS_EXAMPLES = 3
+# Every Nth example is held out to report accuracy when retraining.
+HOLDOUT_EVERY = 5
+HOLDOUT_MIN_EXAMPLES = 20
+MAX_DOCUMENT_CHARS = 20000
+MAX_DESCRIPTION_TOKENS = 40
+TRAIN_BATCH_SIZE = 5000
+DEFAULT_MIN_CONFIDENCE = 0.9
+KEYWORD_WEIGHT = 3.0
+
+# Phrases that are strong evidence for one document type. Each match adds a
+# named feature so a few training examples are enough to learn its weight.
+DOCUMENT_KEYWORDS = (
+    ('invoice', re.compile(r'\binvoice\s*(?:no|number|#|date)|\bamount due\b|\bremit to\b', re.I)),
+    ('quote', re.compile(r'\bquot(?:e|ation)\s*(?:no|number|#|date)|\bquote (?:valid|expires)|\bvalid (?:for|until|through)\b', re.I)),
+    ('purchase_order', re.compile(r'\bpurchase order\b|\bP\.?O\.?\s*(?:no|number|#)', re.I)),
+    ('bom', re.compile(r'\bbill of materials?\b|\bB\.O\.M\b|\bBOM\b')),
+    ('modification', re.compile(r'\b(?:modification|amendment)\s*(?:no|number|#)|\bSF[- ]?30\b', re.I)),
+    ('timesheet', re.compile(r'\btime\s*sheet\b|\bhours worked\b|\bweek ending\b|\bpay period\b', re.I)),
+    ('obligation', re.compile(r'\bobligat(?:ion|ed)\b|\bfunds? certifi|\bappropriation\b|\bline of accounting\b', re.I)),
+    ('delivery', re.compile(r'\bpacking (?:slip|list)\b|\breceiving report\b|\bdelivery receipt\b|\bDD[- ]?250\b|\breceived by\b', re.I)),
+    ('labor', re.compile(r'\blabor categor|\bLCAT\b|\bhourly rate\b', re.I)),
+)
+
+LINE_ITEM_FIELDS = ('product_name', 'product_description', 'part_number',
+                    'manufacturer', 'unit_of_issue', 'labor_category', 'category', 'sub_category')
+_PART_NOISE_RE = re.compile(r'[^A-Z0-9]')
+
+_classifiers = {}
+_classifiers_lock = threading.Lock()
+
+
+class HashedNaiveBayes:
+    """
+    Multinomial naive Bayes over hashed features. A row is a pair of arrays
+    (feature indices, weights); training only adds to count matrices, so the
+    model can be updated incrementally with partial_fit, and prediction for a
+    batch of rows is a single gather over the log-probability matrix.
+    """
+
+    def __init__(self, n_features: int = DOCUMENT_FEATURES, alpha: float = SMOOTHING):
+        self.n_features = n_features
+        self.alpha = alpha
+        self.classes = []
+        self.feature_counts = np.zeros((0, n_features), dtype=np.float32)
+        self.class_counts = np.zeros(0, dtype=np.float64)
+        self._class_index = {}
+        self._log_prob = None
+        self._log_prior = None
+
+    @property
+    def trained(self) -> bool:
+        return int((self.class_counts > 0).sum()) >= 2
+
+    def partial_fit(self, rows: list, labels: list, sample_weight: float = 1.0):
+        """
+        Add labelled rows to the counts. New labels become new classes. A
+        negative sample_weight retracts rows learned earlier (e.g. a label
+        that was later corrected).
+        """
+        if not rows:
+            return
+        for label in labels:
+            if label not in self._class_index:
+                self._class_index[label] = len(self.classes)
+                self.classes.append(label)
+        if len(self.classes) > len(self.class_counts):
+            grow = len(self.classes) - len(self.class_counts)
+            self.feature_counts = np.vstack([
+                self.feature_counts, np.zeros((grow, self.n_features), dtype=np.float32)])
+            self.class_counts = np.concatenate([self.class_counts, np.zeros(grow)])
+
+        label_idx = np.fromiter((self._class_index[label] for label in labels), dtype=np.int64, count=len(labels))
+        indices, weights, row_ids, _ = _flatten(rows)
+        np.add.at(self.feature_counts, (label_idx[row_ids], indices), weights * sample_weight)
+        self.class_counts += np.bincount(label_idx, minlength=len(self.classes)) * sample_weight
+        if sample_weight < 0:
+            np.maximum(self.feature_counts, 0, out=self.feature_counts)
+            np.maximum(self.class_counts, 0, out=self.class_counts)
+        self._log_prob = None
+
+    def predict_proba(self, rows: list) -> np.ndarray:
+        """Posterior class probabilities, an (n_rows, n_classes) matrix."""
+        if not self.trained:
+            return np.zeros((len(rows), len(self.classes)))
+        if self._log_prob is None:
+            smoothed = self.feature_counts.astype(np.float64) + self.alpha
+            self._log_prob = np.log(smoothed / smoothed.sum(axis=1, keepdims=True)).astype(np.float32)
+            with np.errstate(divide='ignore'):
+                self._log_prior = np.log(self.class_counts / self.class_counts.sum())
+
+        indices, weights, _, lengths = _flatten(rows)
+        scores = np.tile(self._log_prior, (len(rows), 1))
+        if len(indices):
+            contrib = self._log_prob[:, indices] * weights
+            filled = lengths > 0
+            starts = (np.cumsum(lengths) - lengths)[filled]
+            scores[filled] += np.add.reduceat(contrib, starts, axis=1).T
+        scores -= scores.max(axis=1, keepdims=True)
+        probs = np.exp(scores)
+        return probs / probs.sum(axis=1, keepdims=True)
+
+    def predict(self, rows: list) -> tuple:
+        """Return (labels, confidences) for a batch of rows; labels are None when untrained."""
+        if not self.trained:
+            return [None] * len(rows), np.zeros(len(rows))
+        probs = self.predict_proba(rows)
+        best = probs.argmax(axis=1)
+        return [self.classes[i] for i in best], probs[np.arange(len(rows)), best]
+
+    def to_arrays(self, prefix: str) -> dict:
+        return {
+            prefix + 'classes': np.array(self.classes, dtype=str),
+            prefix + 'feature_counts': self.feature_counts,
+            prefix + 'class_counts': self.class_counts,
+            prefix + 'alpha': np.float64(self.alpha),
+        }
+
+    @classmethod
+    def from_arrays(cls, data, prefix: str) -> 'HashedNaiveBayes':
+        counts = data[prefix + 'feature_counts']
+        model = cls(n_features=counts.shape[1], alpha=float(data[prefix + 'alpha']))
+        model.classes = [str(c) for c in data[prefix + 'classes']]
+        model._class_index = {c: i for i, c in enumerate(model.classes)}
+        model.feature_counts = counts.astype(np.float32)
+        model.class_counts = data[prefix + 'class_counts'].astype(np.float64)
+        return model
+
+
+class DocumentTypeClassifier:
+    """
+    Local document type classifier over extracted text, filename tokens,
+    file format and keyword patterns, trained from reviewed documents.
+    Classifying a document takes about a millisecond; predictions below
+    min_confidence are returned as None so the mapping model decides.
+    """
+
+    def __init__(self, model: HashedNaiveBayes = None, min_confidence: float = DEFAULT_MIN_CONFIDENCE):
+        self.model = model or HashedNaiveBayes(DOCUMENT_FEATURES)
+        self.min_confidence = min_confidence
+
+    def features(self, text: str, filename: str = '', file_format: str = '') -> tuple:
+        text = (text or '')[:MAX_DOCUMENT_CHARS]
+        feats = {'w:' + t: 1.0 for t in tokenize(text, min_length=2)}
+        for t in tokenize(os.path.splitext(filename or '')[0]):
+            feats['f:' + t] = 1.0
+        if file_format:
+            feats['fmt:' + file_format.lower()] = 1.0
+        for name, pattern in DOCUMENT_KEYWORDS:
+            if pattern.search(text) or pattern.search(filename or ''):
+                feats['k:' + name] = KEYWORD_WEIGHT
+        return hash_features(feats, self.model.n_features)
+
+    def classify(self, text: str, filename: str = '', file_format: str = '') -> tuple:
+        """Return (document_type or None, confidence)."""
+        if not self.model.trained:
+            return None, 0.0
+        labels, confidences = self.model.predict([self.features(text, filename, file_format)])
+        confidence = round(float(confidences[0]), 4)
+        return (labels[0] if confidence >= self.min_confidence else None), confidence
+
+    def train(self, examples: list) -> dict:
+        """
+        Fit on (text, filename, file_format, document_type) examples, replacing
+        the current model. Returns counts plus holdout accuracy and coverage.
+        """
+        counts = {}
+        for example in examples:
+            counts[example[3]] = counts.get(example[3], 0) + 1
+        examples = [e for e in examples if counts[e[3]] >= MIN_CLASS_EXAMPLES]
+        rows = [self.features(text, filename, fmt) for text, filename, fmt, _ in examples]
+        labels = [e[3] for e in examples]
+
+        stats = {'documents': len(examples),
+                 'classes': {label: n for label, n in counts.items() if n >= MIN_CLASS_EXAMPLES}}
+        if len(examples) >= HOLDOUT_MIN_EXAMPLES:
+            stats.update(holdout_stats(rows, labels, self.model, self.min_confidence))
+
+        self.model = HashedNaiveBayes(self.model.n_features, self.model.alpha)
+        self.model.partial_fit(rows, labels)
+        return stats
+
+
+class LineItemCategoryClassifier:
+    """
+    Local category and sub_category classifier for line items, trained on
+    human-verified rows. Features are product name and description words,
+    part number prefixes and shape, manufacturer, unit of issue and labor
+    category. Inference is batched; verifications update the counts through
+    learn() on a copy() that then replaces the shared instance. sub_category is predicted as a joint
+    "category/sub_category" label so the pair stays consistent.
+    """
+
+    def __init__(self, category_model: HashedNaiveBayes = None, sub_category_model: HashedNaiveBayes = None,
+                 min_confidence: float = DEFAULT_MIN_CONFIDENCE):
+        self.category_model = category_model or HashedNaiveBayes(LINE_ITEM_FEATURES)
+        self.sub_category_model = sub_category_model or HashedNaiveBayes(LINE_ITEM_FEATURES)
+        self.min_confidence = min_confidence
+
+    @property
+    def trained(self) -> bool:
+        return self.category_model.trained
+
+    def features(self, item: dict) -> tuple:
+        feats = {}
+        name = tokenize(item.get('product_name'), min_length=2)
+        for t in name:
+            feats['n:' + t] = 1.0
+        for a, b in zip(name, name[1:]):
+            feats[f'nb:{a} {b}'] = 1.0
+        for t in tokenize(item.get('product_description'), min_length=2)[:MAX_DESCRIPTION_TOKENS]:
+            feats.setdefault('d:' + t, 1.0)
+        part = _PART_NOISE_RE.sub('', (item.get('part_number') or '').upper())
+        if part:
+            feats['p2:' + part[:2]] = 1.0
+            feats['p4:' + part[:4]] = 1.0
+            feats['ps:' + ''.join('A' if c.isalpha() else '9' for c in part[:6])] = 1.0
+        manufacturer = tokenize(item.get('manufacturer'))
+        if manufacturer:
+            feats['m:' + ' '.join(manufacturer[:2])] = 1.0
+        if item.get('unit_of_issue'):
+            feats['u:' + item['unit_of_issue'].strip().lower()] = 1.0
+        if item.get('labor_category'):
+            feats['labor'] = 1.0
+            for t in tokenize(item['labor_category']):
+                feats['lc:' + t] = 1.0
+        return hash_features(feats, LINE_ITEM_FEATURES)
+
+    def predict(self, items: list) -> list:
+        """
+        Classify a batch of item dicts. Returns one dict per item with
+        category, sub_category and their confidences; labels below
+        min_confidence are None.
+        """
+        if not items:
+            return []
+        if not self.trained:
+            return [{'category': None, 'category_confidence': 0.0,
+                     'sub_category': None, 'sub_category_confidence': 0.0} for _ in items]
+        rows = [self.features(item) for item in items]
+        categories, category_conf = self.category_model.predict(rows)
+        pairs, pair_conf = self.sub_category_model.predict(rows)
+        out = []
+        for i in range(len(items)):
+            confident = category_conf[i] >= self.min_confidence
+            category = categories[i] if confident else None
+            sub_category, sub_confidence = None, 0.0
+            if pairs[i] is not None:
+                pair_category, _, sub = pairs[i].partition('/')
+                if pair_category == categories[i]:
+                    sub_confidence = round(float(pair_conf[i]), 4)
+                    if confident and sub_confidence >= self.min_confidence:
+                        sub_category = sub
+            out.append({'category': category, 'category_confidence': round(float(category_conf[i]), 4),
+                        'sub_category': sub_category, 'sub_category_confidence': sub_confidence})
+        return out
+
+    def learn(self, items: list, sample_weight: float = 1.0):
+        """Update the counts with labelled item dicts (negative weight retracts them)."""
+        labelled = [item for item in items if item.get('category')]
+        if not labelled:
+            return
+        rows = [self.features(item) for item in labelled]
+        self.category_model.partial_fit(rows, [item['category'] for item in labelled], sample_weight)
+        pairs = [(row, f"{item['category']}/{item['sub_category']}")
+                 for row, item in zip(rows, labelled) if item.get('sub_category')]
+        if pairs:
+            self.sub_category_model.partial_fit([p[0] for p in pairs], [p[1] for p in pairs], sample_weight)
+
+    def train(self, items: list) -> dict:
+        """Fit from scratch on labelled item dicts. Returns counts plus category holdout accuracy."""
+        items = [item for item in items if item.get('category')]
+        stats = {'rows': len(items), 'categories': {}}
+        for item in items:
+            stats['categories'][item['category']] = stats['categories'].get(item['category'], 0) + 1
+        if len(items) >= HOLDOUT_MIN_EXAMPLES:
+            rows = [self.features(item) for item in items]
+            stats.update(holdout_stats(rows, [item['category'] for item in items],
+                                       self.category_model, self.min_confidence))
+        self.category_model = HashedNaiveBayes(LINE_ITEM_FEATURES)
+        self.sub_category_model = HashedNaiveBayes(LINE_ITEM_FEATURES)
+        for start in range(0, len(items), TRAIN_BATCH_SIZE):
+            self.learn(items[start:start + TRAIN_BATCH_SIZE])
+        stats['sub_categories'] = len(self.sub_category_model.classes)
+        return stats
+
+    def to_arrays(self) -> dict:
+        return {**self.category_model.to_arrays('category.'),
+                **self.sub_category_model.to_arrays('sub_category.')}
+
+    def copy(self) -> 'LineItemCategoryClassifier':
+        """An independent copy, so learn() never touches counts other threads predict with."""
+        data = self.to_arrays()
+        return LineItemCategoryClassifier(
+            HashedNaiveBayes.from_arrays(data, 'category.'),
+            HashedNaiveBayes.from_arrays(data, 'sub_category.'),
+            self.min_confidence,
+        )
+
+
+def holdout_stats(rows: list, labels: list, model: HashedNaiveBayes, min_confidence: float) -> dict:
+    """Accuracy and confident coverage on every HOLDOUT_EVERY-th row, trained on the rest."""
+    held = set(range(0, len(rows), HOLDOUT_EVERY))
+    probe = HashedNaiveBayes(model.n_features, model.alpha)
+    probe.partial_fit([r for i, r in enumerate(rows) if i not in held],
+                      [label for i, label in enumerate(labels) if i not in held])
+    predicted, confidences = probe.predict([rows[i] for i in sorted(held)])
+    truth = [labels[i] for i in sorted(held)]
+    confident = confidences >= min_confidence
+    correct = np.array([p == t for p, t in zip(predicted, truth)])
+    return {
+        'holdout_examples': len(truth),
+        'holdout_accuracy': round(float(correct.mean()), 3),
+        'holdout_coverage': round(float(confident.mean()), 3),
+        'holdout_confident_accuracy': round(float(correct[confident].mean()), 3) if confident.any() else None,
+    }
+
+
+def hash_features(feats: dict, n_features: int) -> tuple:
+    """Hash named feature weights into (indices, weights) arrays for HashedNaiveBayes."""
+    mask = n_features - 1
+    indices = np.fromiter((zlib.crc32(f.encode('utf-8')) & mask for f in feats), dtype=np.int64, count=len(feats))
+    weights = np.fromiter(feats.values(), dtype=np.float32, count=len(feats))
+    return indices, weights
+
+
+def get_document_classifier(session_id: str = '__default__') -> DocumentTypeClassifier:
+    """
+    Return the session's document type classifier, reloading it when another
+    process has retrained it. Untrained classifiers predict nothing.
+    """
+    from flask import current_app
+    min_confidence = current_app.config.get('DOC_TYPE_MIN_CONFIDENCE', DEFAULT_MIN_CONFIDENCE)
+
+    def build(data):
+        model = HashedNaiveBayes.from_arrays(data, 'doc_type.') if data else None
+        return DocumentTypeClassifier(model, min_confidence)
+
+    return _cached(_model_path('doc_type', session_id), build)
+
+
+def get_line_item_classifier(session_id: str = '__default__') -> LineItemCategoryClassifier:
+    """Return the session's line item category classifier, reloading it when it changed on disk."""
+    from flask import current_app
+    min_confidence = current_app.config.get('CATEGORY_MIN_CONFIDENCE', DEFAULT_MIN_CONFIDENCE)
+
+    def build(data):
+        if not data:
+            return LineItemCategoryClassifier(min_confidence=min_confidence)
+        return LineItemCategoryClassifier(
+            HashedNaiveBayes.from_arrays(data, 'category.'),
+            HashedNaiveBayes.from_arrays(data, 'sub_category.'),
+            min_confidence,
+        )
+
+    return _cached(_model_path('category', session_id), build)
+
+
+def train_document_classifier(session_id: str = '__default__') -> dict:
+    """Retrain the session's document type classifier from reviewed documents and save it."""
+    from flask import current_app
+    from app.models.document import Document
+    from app.models.document_chunk import DocumentChunk
+    from app.services.field_mapper import DOCUMENT_TYPES
+
+    docs = Document.query.filter(
+        Document.session_id == session_id,
+        Document.processing_status == 'complete',
+        Document.document_type.in_(DOCUMENT_TYPES),
+    ).order_by(Document.created_at).all()
+
+    examples = []
+    for doc in docs:
+        text, size = [], 0
+        for (content,) in DocumentChunk.query.with_entities(DocumentChunk.content)\
+                .filter_by(document_id=doc.id).order_by(DocumentChunk.chunk_index):
+            text.append(content)
+            size += len(content)
+            if size >= MAX_DOCUMENT_CHARS:
+                break
+        examples.append(('\n'.join(text), doc.original_filename, doc.file_format, doc.document_type))
+
+    classifier = DocumentTypeClassifier(
+        min_confidence=current_app.config.get('DOC_TYPE_MIN_CONFIDENCE', DEFAULT_MIN_CONFIDENCE))
+    stats = classifier.train(examples)
+    stats['saved'] = classifier.model.trained
+    if stats['saved']:
+        _save(_model_path('doc_type', session_id), classifier.model.to_arrays('doc_type.'))
+    return stats
+
+
+def train_line_item_classifier(session_id: str = '__default__') -> dict:
+    """Retrain the session's line item category classifier from all human-verified rows and save it."""
+    from flask import current_app
+    from app.models.line_item import LineItem
+
+    query = LineItem.query.with_entities(*(getattr(LineItem, f) for f in LINE_ITEM_FIELDS)).filter(
+        LineItem.session_id == session_id,
+        LineItem.human_verified == 1,
+        LineItem.category.isnot(None),
+    )
+    items = [dict(zip(LINE_ITEM_FIELDS, row)) for row in query.yield_per(TRAIN_BATCH_SIZE)]
+
+    classifier = LineItemCategoryClassifier(
+        min_confidence=current_app.config.get('CATEGORY_MIN_CONFIDENCE', DEFAULT_MIN_CONFIDENCE))
+    stats = classifier.train(items)
+    stats['saved'] = classifier.trained
+    if stats['saved']:
+        path = _model_path('category', session_id)
+        with _file_lock(path):
+            _save(path, classifier.to_arrays())
+    return stats
+
+
+def learn_line_item_labels(session_id: str, add: list = (), remove: list = ()):
+    """
+    Incrementally update the saved category classifier with verified item
+    dicts, retracting earlier labels in remove (e.g. the row before a
+    correction). Serialized across processes with a file lock. The cached
+    classifier is shared with predicting threads, so a copy is trained and
+    swapped in.
+    """
+    path = _model_path('category', session_id)
+    with _file_lock(path):
+        classifier = get_line_item_classifier(session_id).copy()
+        if remove:
+            classifier.learn(list(remove), sample_weight=-1.0)
+        classifier.learn(list(add))
+        if classifier.trained:
+            _save(path, classifier.to_arrays())
+            with _classifiers_lock:
+                _classifiers[path] = (_mtime(path), classifier)
+
+
+def item_fields(item) -> dict:
+    """The classifier's input fields of a LineItem."""
+    return {field: getattr(item, field) for field in LINE_ITEM_FIELDS}
+
+
+def _cached(path: str, build):
+    """Return the classifier cached for path, rebuilding it when the file's mtime changed."""
+    mtime = _mtime(path)
+    with _classifiers_lock:
+        cached = _classifiers.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        data = None
+        if mtime is not None:
+            try:
+                with np.load(path) as npz:
+                    data = {key: npz[key] for key in npz.files}
+            except (OSError, ValueError) as e:
+                logger.warning(f'Ignoring unreadable classifier at {path}: {e}')
+        try:
+            classifier = build(data)
+        except KeyError as e:
+            logger.warning(f'Ignoring incomplete classifier at {path}: {e}')
+            classifier = build(None)
+        _classifiers[path] = (mtime, classifier)
+        return classifier
+
+
+def _save(path: str, arrays: dict):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp.npz'
+    with open(tmp, 'wb') as fh:
+        np.savez(fh, **arrays)
+    os.replace(tmp, path)
+
+
+@contextmanager
+def _file_lock(path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.lock', 'w') as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _mtime(path: str):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _model_path(name: str, session_id: str) -> str:
+    from flask import current_app
+    folder = current_app.config.get('MODEL_FOLDER', '/app/data/models')
+    safe = re.sub(r'[^A-Za-z0-9_.-]', '_', session_id)
+    return os.path.join(folder, f'{safe}.{name}.npz')
+
+
+def _flatten(rows: list) -> tuple:
+    """Concatenate rows into (indices, weights, row ids, row lengths)."""
+    lengths = np.fromiter((len(r[0]) for r in rows), dtype=np.int64, count=len(rows))
+    if not lengths.sum():
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, np.zeros(0, dtype=np.float32), empty, lengths
+    indices = np.concatenate([r[0] for r in rows])
+    weights = np.concatenate([r[1] for r in rows])
+    row_ids = np.repeat(np.arange(len(rows)), lengths)
+    return indices, weights, row_ids, lengths
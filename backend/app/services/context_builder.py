@@ -0,0 +1,223 @@
+import math
+import re
+
+from app.services.text_utils import tokenize
+
+# Prompt budgets, in estimated tokens.
+CONTEXT_TOKEN_BUDGET = 2500
+HISTORY_TOKEN_BUDGET = 600
+# Share of the context budget line items may use when passages are also present.
+LINE_ITEM_SHARE = 0.55
+# Passages get at least this many tokens, or are dropped.
+MIN_CHUNK_TOKENS = 30
+# Word n-gram size used to detect text already included from an overlapping chunk.
+SHINGLE_SIZE = 5
+CHARS_PER_TOKEN = 4
+# Allowance per row of the document list.
+DOCUMENT_ROW_TOKENS = 20
+
+_SENTENCE_RE = re.compile(r'(?<=[.!?;])\s+|\n+')
+
+LINE_ITEM_COLUMNS = (
+    ('part', 'part_number'),
+    ('product', 'product_name'),
+    ('mfr', 'manufacturer'),
+    ('category', 'category'),
+    ('qty', 'quantity'),
+    ('unit_price', 'unit_price'),
+    ('ext_price', 'extended_price'),
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for English text)."""
+    return math.ceil(len(text or '') / CHARS_PER_TOKEN)
+
+
+class ContextBuilder:
+    """
+    Assemble retrieved line items and passages into a prompt context that
+    fits a token budget. Documents are listed once and referenced by tag,
+    line items are encoded as a table, passages are deduplicated against
+    each other and trimmed to their most relevant sentences, with each
+    passage's allowance proportional to its retrieval score.
+    """
+
+    def __init__(self, budget_tokens: int = CONTEXT_TOKEN_BUDGET):
+        self.budget_tokens = budget_tokens
+
+    def build(self, query: str, line_items: list, chunks: list) -> str:
+        if not line_items and not chunks:
+            return 'No results found matching the query.'
+
+        terms = set(tokenize(query))
+        doc_tags = {}
+        documents = []
+
+        def tag(result):
+            doc_id = result.get('document_id')
+            if doc_id not in doc_tags:
+                doc_tags[doc_id] = f'D{len(doc_tags) + 1}'
+                documents.append((doc_tags[doc_id], result))
+            return doc_tags[doc_id]
+
+        item_budget = self.budget_tokens * (LINE_ITEM_SHARE if chunks else 1.0)
+        item_lines = self._line_item_table(line_items, tag, item_budget)
+        used = sum(estimate_tokens(line) for line in item_lines)
+
+        # Reserve room for the document list before sizing passages
+        listed = set(doc_tags) | {r.get('document_id') for r in chunks}
+        chunk_budget = self.budget_tokens - used - DOCUMENT_ROW_TOKENS * (len(listed) + 1)
+        chunk_lines = self._passages(chunks, terms, tag, chunk_budget)
+
+        parts = ['DOCUMENTS (tag | number | type | vendor | date):']
+        for doc_tag, r in documents:
+            parts.append(' | '.join([
+                doc_tag, _cell(r.get('document_number') or r.get('original_filename')),
+                _cell(r.get('document_type')), _cell(r.get('vendor_name')), _cell(r.get('document_date')),
+            ]))
+        if item_lines:
+            parts.append('')
+            parts.extend(item_lines)
+        if chunk_lines:
+            parts.append('')
+            parts.append('PASSAGES:')
+            parts.extend(chunk_lines)
+        return '\n'.join(parts)
+
+    def _line_item_table(self, line_items: list, tag, budget: float) -> list:
+        if not line_items:
+            return []
+        columns = [(name, key) for name, key in LINE_ITEM_COLUMNS
+                   if any(r.get(key) not in (None, '') for r in line_items)]
+        header = 'LINE ITEMS (doc | ' + ' | '.join(name for name, _ in columns) + '):'
+        lines = [header]
+        used = estimate_tokens(header)
+        for r in line_items:
+            row = ' | '.join([tag(r)] + [_cell(r.get(key)) for _, key in columns])
+            cost = estimate_tokens(row)
+            if used + cost > budget:
+                break
+            lines.append(row)
+            used += cost
+        return lines if len(lines) > 1 else []
+
+    def _passages(self, chunks: list, terms: set, tag, budget: float) -> list:
+        if not chunks or budget < MIN_CHUNK_TOKENS:
+            return []
+        weights = [max(r.get('rrf_score') or r.get('score') or 0.0, 1e-6) for r in chunks]
+        total = sum(weights)
+        seen = set()
+        lines = []
+        spare = 0.0
+        for r, weight in zip(chunks, weights):
+            allowance = budget * weight / total + spare
+            if allowance < MIN_CHUNK_TOKENS:
+                spare = allowance
+                continue
+            text = _drop_seen_text(r.get('content') or '', seen)
+            text = _trim_to_relevant(text, terms, int(allowance * CHARS_PER_TOKEN))
+            if not text:
+                spare = allowance
+                continue
+            seen.update(_shingles(text))
+            line = f'[{tag(r)}] {text}'
+            lines.append(line)
+            spare = max(0.0, allowance - estimate_tokens(line))
+        return lines
+
+
+def compact_history(history: list, budget_tokens: int = HISTORY_TOKEN_BUDGET) -> tuple:
+    """
+    Fit conversation history into a token budget. The newest turns are kept
+    verbatim; older ones are reduced to one-line notes.
+    Returns (messages, summary) where messages start with a user turn and
+    summary is the notes text ('' if nothing was compacted).
+    """
+    history = [m for m in (history or []) if m.get('content') and m.get('role') in ('user', 'assistant')]
+    kept = []
+    used = 0
+    for msg in reversed(history):
+        cost = estimate_tokens(msg['content'])
+        if used + cost > budget_tokens * 0.75:
+            break
+        kept.append(msg)
+        used += cost
+    kept.reverse()
+    while kept and kept[0]['role'] != 'user':
+        kept.pop(0)
+
+    older = history[:len(history) - len(kept)]
+    notes = summarize_turns(older, budget_tokens - used)
+    return [{'role': m['role'], 'content': m['content']} for m in kept], notes
+
+
+def summarize_turns(messages: list, budget_tokens: int, previous: str = '') -> str:
+    """
+    Extractive summary of turns: the first sentence of each message, newest
+    kept when the budget runs out. previous is an earlier summary to extend.
+    """
+    notes = [line for line in (previous or '').split('\n') if line]
+    for msg in messages:
+        first = _SENTENCE_RE.split(msg['content'].strip(), maxsplit=1)[0][:200]
+        if first:
+            notes.append(f"{'User' if msg['role'] == 'user' else 'Assistant'}: {first}")
+    while notes and estimate_tokens('\n'.join(notes)) > budget_tokens:
+        notes.pop(0)
+    return '\n'.join(notes)
+
+
+def _cell(value) -> str:
+    if value is None or value == '':
+        return '-'
+    if isinstance(value, float):
+        return f'{value:.2f}'.rstrip('0').rstrip('.') if value != int(value) else str(int(value))
+    return str(value).replace('|', '/').replace('\n', ' ')
+
+
+def _shingles(text: str) -> set:
+    norm = [w.lower().strip('.,;:()') for w in text.split()]
+    return {tuple(norm[i:i + SHINGLE_SIZE]) for i in range(len(norm) - SHINGLE_SIZE + 1)}
+
+
+def _drop_seen_text(text: str, seen: set) -> str:
+    """Remove word runs already included from another passage."""
+    words = text.split()
+    norm = [w.lower().strip('.,;:()') for w in words]
+    keep = [True] * len(words)
+    for i in range(len(words) - SHINGLE_SIZE + 1):
+        if tuple(norm[i:i + SHINGLE_SIZE]) in seen:
+            for j in range(i, i + SHINGLE_SIZE):
+                keep[j] = False
+
+    spans, current = [], []
+    for word, flag in zip(words, keep):
+        if flag:
+            current.append(word)
+        elif current:
+            spans.append(' '.join(current))
+            current = []
+    if current:
+        spans.append(' '.join(current))
+    return ' … '.join(s for s in spans if len(s.split()) >= 3)
+
+
+def _trim_to_relevant(text: str, terms: set, max_chars: int) -> str:
+    """Keep the sentences with the most query terms, in original order, within max_chars."""
+    if len(text) <= max_chars:
+        return text
+    sentences = [s for s in _SENTENCE_RE.split(text) if s.strip()]
+    ranked = sorted(
+        range(len(sentences)),
+        key=lambda i: (-len(terms.intersection(tokenize(sentences[i]))), i),
+    )
+    chosen, used = set(), 0
+    for i in ranked:
+        cost = len(sentences[i]) + 1
+        if used + cost > max_chars:
+            continue
+        chosen.add(i)
+        used += cost
+    if not chosen:
+        return text[:max_chars].rsplit(' ', 1)[0] + ' …'
+    return ' '.join(sentences[i] for i in sorted(chosen))
@@ -0,0 +1,99 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Turns replayed verbatim to the model; anything older lives in the summary.
+RECENT_TURNS = 2
+# Token budget of the running summary.
+SUMMARY_TOKEN_BUDGET = 400
+# Retrieval hits from the previous turn carried into the next one's retrieval.
+MAX_CARRY_OVER = 10
+
+
+def get_conversation(conversation_id: str, user_id: str, session_id: str = '__default__'):
+    """Load a conversation owned by user_id, or raise NotFoundError."""
+    from app.errors import NotFoundError
+    from app.models.conversation import Conversation
+
+    conversation = Conversation.query.filter_by(
+        id=conversation_id, user_id=user_id, session_id=session_id,
+    ).first()
+    if not conversation:
+        raise NotFoundError(f'Conversation {conversation_id} not found')
+    return conversation
+
+
+def start_conversation(user_id: str, title: str, session_id: str = '__default__'):
+    from app.extensions import db
+    from app.models.conversation import Conversation
+
+    conversation = Conversation(user_id=user_id, title=(title or '')[:200], session_id=session_id)
+    db.session.add(conversation)
+    db.session.flush()
+    return conversation
+
+
+def load_memory(conversation) -> tuple:
+    """
+    Return (history, summary, carry_over) for the next turn: the recent turns
+    as chat messages, the running summary of everything older, and the
+    retrieval hits of the last turn. Reads a bounded number of rows.
+    """
+    from app.models.conversation import ConversationTurn
+
+    turns = conversation.turns.filter(
+        ConversationTurn.turn_index >= max(conversation.summarized_turns or 0,
+                                           (conversation.turn_count or 0) - RECENT_TURNS)
+    ).all()
+    history = []
+    for turn in turns:
+        history.append({'role': 'user', 'content': turn.question})
+        if turn.answer:
+            history.append({'role': 'assistant', 'content': turn.answer})
+
+    carry_over = []
+    if turns:
+        try:
+            carry_over = [tuple(key) for key in json.loads(turns[-1].source_keys or '[]')][:MAX_CARRY_OVER]
+        except (json.JSONDecodeError, TypeError):
+            carry_over = []
+    return history, conversation.summary or '', carry_over
+
+
+def record_turn(conversation, question: str, result: dict, source_keys: list = None):
+    """
+    Append a turn and fold turns beyond the recent window into the running
+    summary, so each turn costs a constant amount of work. Caller commits.
+    """
+    from app.extensions import db
+    from app.models.conversation import ConversationTurn
+    from app.services.context_builder import summarize_turns
+
+    db.session.add(ConversationTurn(
+        conversation_id=conversation.id,
+        turn_index=conversation.turn_count or 0,
+        question=question,
+        answer=result.get('answer', ''),
+        query_type=result.get('query_type'),
+        sources=json.dumps(result.get('sources', [])),
+        source_keys=json.dumps([list(key) for key in (source_keys or [])]),
+        session_id=conversation.session_id,
+    ))
+    conversation.turn_count = (conversation.turn_count or 0) + 1
+
+    summarized = conversation.summarized_turns or 0
+    fold_through = conversation.turn_count - RECENT_TURNS
+    if fold_through > summarized:
+        db.session.flush()
+        folded = conversation.turns.filter(
+            ConversationTurn.turn_index >= summarized,
+            ConversationTurn.turn_index < fold_through,
+        ).all()
+        messages = []
+        for turn in folded:
+            messages.append({'role': 'user', 'content': turn.question})
+            if turn.answer:
+                messages.append({'role': 'assistant', 'content': turn.answer})
+        conversation.summary = summarize_turns(messages, SUMMARY_TOKEN_BUDGET, previous=conversation.summary)
+        conversation.summarized_turns = fold_through
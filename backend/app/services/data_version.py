@@ -0,0 +1,80 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# How many versions of change history to keep. Consumers that fall further
+# behind than this do a full rebuild instead of an incremental refresh.
+CHANGE_LOG_RETENTION = 5000
+
+
+def get_data_version(session_id: str = '__default__') -> int:
+    """Return the current data version for a session (0 if never changed)."""
+    from app.extensions import db
+    from app.models.data_version import DataVersion
+
+    version = db.session.query(DataVersion.version)\
+        .filter(DataVersion.session_id == session_id)\
+        .scalar()
+    return version or 0
+
+
+def bump_data_version(session_id: str = '__default__', document_ids: list = None) -> int:
+    """
+    Record that documents in a session changed and return the new version.
+    Pass document_ids=None when the change is not scoped to specific documents.
+    Caller commits, so the bump lands in the same transaction as the change.
+    """
+    from app.extensions import db
+    from app.models.data_version import DataVersion, DataChange
+
+    updated = db.session.query(DataVersion)\
+        .filter(DataVersion.session_id == session_id)\
+        .update({DataVersion.version: DataVersion.version + 1}, synchronize_session=False)
+    if not updated:
+        db.session.add(DataVersion(session_id=session_id, version=1))
+        db.session.flush()
+    version = get_data_version(session_id)
+
+    if document_ids is None:
+        db.session.add(DataChange(session_id=session_id, version=version, document_id=None))
+    else:
+        for doc_id in set(document_ids):
+            db.session.add(DataChange(session_id=session_id, version=version, document_id=doc_id))
+
+    if version % 500 == 0:
+        DataChange.query.filter(
+            DataChange.session_id == session_id,
+            DataChange.version <= version - CHANGE_LOG_RETENTION,
+        ).delete(synchronize_session=False)
+    return version
+
+
+def changed_documents_since(session_id: str, since_version: int):
+    """
+    Return (current_version, set of changed document ids) since a version,
+    or (current_version, None) if a full rebuild is required.
+    """
+    from app.extensions import db
+    from app.models.data_version import DataChange
+
+    current = get_data_version(session_id)
+    if since_version is None or since_version > current:
+        return current, None
+    if since_version == current:
+        return current, set()
+    if current - since_version > CHANGE_LOG_RETENTION:
+        return current, None
+
+    rows = db.session.query(DataChange.version, DataChange.document_id)\
+        .filter(DataChange.session_id == session_id)\
+        .filter(DataChange.version > since_version)\
+        .all()
+    # Every skipped version must be present in the log to trust it
+    if len({r[0] for r in rows}) != current - since_version:
+        return current, None
+    doc_ids = set()
+    for _, doc_id in rows:
+        if doc_id is None:
+            return current, None
+        doc_ids.add(doc_id)
+    return current, doc_ids
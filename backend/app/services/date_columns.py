@@ -0,0 +1,93 @@
+import logging
+
+from app.services.date_utils import date_ordinal, month_key
+
+logger = logging.getLogger(__name__)
+
+# Rows written per bulk UPDATE.
+BACKFILL_BATCH_SIZE = 5000
+
+
+def _date_columns():
+    """(model, [(source string column, derived column, parser), ...]) for every parsed date column."""
+    from app.models.document import Document
+    from app.models.line_item import LineItem
+
+    return (
+        (Document, [
+            ('document_date', 'document_date_ordinal', date_ordinal),
+            ('document_date', 'document_month', month_key),
+            ('period_of_performance_start', 'period_of_performance_start_ordinal', date_ordinal),
+            ('period_of_performance_end', 'period_of_performance_end_ordinal', date_ordinal),
+        ]),
+        (LineItem, [
+            ('period_start', 'period_start_ordinal', date_ordinal),
+            ('period_end', 'period_end_ordinal', date_ordinal),
+        ]),
+    )
+
+
+def backfill_document_dates():
+    """Parse existing document dates (schema upgrade step)."""
+    from app.models.document import Document
+    backfill_date_columns(models=(Document,))
+
+
+def backfill_line_item_dates():
+    """Parse existing line item periods (schema upgrade step)."""
+    from app.models.line_item import LineItem
+    backfill_date_columns(models=(LineItem,))
+
+
+def backfill_date_columns(session_id: str = None, models: tuple = None) -> dict:
+    """
+    Recompute the parsed date columns (ordinals, month keys) from the date
+    strings of every row in a session (all sessions when None), writing only
+    rows whose derived values changed, and bump the data version of sessions
+    whose document dates moved. Caller commits. Returns rows updated per table.
+    """
+    from sqlalchemy import or_, update
+    from app.extensions import db
+    from app.models.document import Document
+    from app.services.data_version import bump_data_version
+
+    updated = {}
+    touched_sessions = set()
+    for model, columns in _date_columns():
+        if models is not None and model not in models:
+            continue
+        sources = sorted({source for source, _, _ in columns})
+        targets = [target for _, target, _ in columns]
+        query = db.session.query(
+            model.id, model.session_id,
+            *(getattr(model, name) for name in sources),
+            *(getattr(model, name) for name in targets),
+        ).filter(or_(*(getattr(model, name).isnot(None) for name in sources + targets)))
+        if session_id is not None:
+            query = query.filter(model.session_id == session_id)
+
+        parsed = {}
+        changes = []
+        for row in query.yield_per(BACKFILL_BATCH_SIZE):
+            raw = dict(zip(sources, row[2:2 + len(sources)]))
+            current = row[2 + len(sources):]
+            values = {}
+            for source, target, parser in columns:
+                key = (parser, raw[source])
+                if key not in parsed:
+                    parsed[key] = parser(raw[source])
+                values[target] = parsed[key]
+            if tuple(values[target] for target in targets) != tuple(current):
+                values['id'] = row[0]
+                changes.append(values)
+                if model is Document:
+                    touched_sessions.add(row[1])
+
+        for start in range(0, len(changes), BACKFILL_BATCH_SIZE):
+            db.session.execute(update(model), changes[start:start + BACKFILL_BATCH_SIZE])
+        updated[model.__tablename__] = len(changes)
+        logger.info(f'Backfilled parsed dates on {len(changes)} {model.__tablename__} rows')
+
+    for session in touched_sessions:
+        bump_data_version(session)
+    return updated
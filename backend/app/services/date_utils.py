@@ -0,0 +1,59 @@
+import re
+from datetime import date, datetime
+
+_ISO_RE = re.compile(r'^(\d{4})-(\d{1,2})-(\d{1,2})')
+_ORDINAL_SUFFIX_RE = re.compile(r'(\d)(st|nd|rd|th)\b', re.I)
+_SEPT_RE = re.compile(r'\bsept\b', re.I)
+
+# Formats seen in extracted document dates, tried in order after the ISO fast path.
+DATE_FORMATS = (
+    '%Y/%m/%d', '%m/%d/%Y', '%m/%d/%y', '%m-%d-%Y', '%m-%d-%y', '%m.%d.%Y', '%d.%m.%Y',
+    '%B %d, %Y', '%B %d %Y', '%b %d, %Y', '%b %d %Y', '%b. %d, %Y',
+    '%d %B %Y', '%d %b %Y', '%d-%b-%Y', '%d-%b-%y', '%Y%m%d',
+    '%B %Y', '%b %Y', '%Y-%m', '%m/%Y',
+)
+
+
+def parse_date(value):
+    """
+    Parse a document date as extracted ("2024-03-15", "03/15/2024",
+    "March 15th, 2024", "Mar 2024", ...) into a date. Month-only values map
+    to the first of the month. Returns None when the value is not a date.
+    """
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = str(value).strip()
+    if not text:
+        return None
+
+    match = _ISO_RE.match(text)
+    if match:
+        try:
+            return date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+        except ValueError:
+            return None
+
+    text = ' '.join(text.replace(',', ', ').split()).replace(' ,', ',')
+    text = _SEPT_RE.sub('Sep', _ORDINAL_SUFFIX_RE.sub(r'\1', text))
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def date_ordinal(value):
+    """Proleptic Gregorian day number (date.toordinal) of a parsed date, or None."""
+    parsed = parse_date(value)
+    return parsed.toordinal() if parsed else None
+
+
+def month_key(value):
+    """'YYYY-MM' key of a parsed date, or None."""
+    parsed = parse_date(value)
+    return f'{parsed.year:04d}-{parsed.month:02d}' if parsed else None
@@ -0,0 +1,392 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# A document is "small" enough to share a mapping call when its serialized
+# tables and text stay under these sizes.
+SMALL_TABLE_CHARS = 3000
+SMALL_TEXT_CHARS = 1500
+# Limits for one packed mapping request.
+BATCH_MAX_DOCUMENTS = 8
+BATCH_MAX_CHARS = 16000
+# Streamed line items are flushed to the database in groups of this size.
+INSERT_BATCH_SIZE = 50
+
+
+def extract_document(doc) -> dict:
+    """Stage 1: run the extractor over the stored file and record the method used."""
+    from app.services.extractor import DocumentExtractor
+
+    extraction = DocumentExtractor().extract(doc.stored_path, doc.file_format)
+    doc.extraction_method = extraction.get('method', 'unknown')
+    return extraction
+
+
+def classify_document(doc, extraction: dict) -> tuple:
+    """
+    Stage 1b: predict the document type with the session's local classifier.
+    A confident prediction is set on the document and recorded in
+    extraction['document_type'] so mapping does not re-classify.
+    Returns (document_type or None, confidence).
+    """
+    from app.services.classifiers import get_document_classifier
+
+    try:
+        classifier = get_document_classifier(doc.session_id or '__default__')
+        document_type, confidence = classifier.classify(
+            extraction.get('full_text', ''), doc.original_filename, doc.file_format)
+    except Exception as e:
+        logger.warning(f'Local document classification failed for doc {doc.id}: {e}')
+        return None, 0.0
+    extraction['document_type_confidence'] = confidence
+    if document_type:
+        doc.document_type = document_type
+        extraction['document_type'] = document_type
+    return document_type, confidence
+
+
+def known_mappings_for(doc) -> dict:
+    """Confirmed source-column mappings for the document's vendor."""
+    from app.models.field_mapping import FieldMapping
+
+    if not doc.vendor_name:
+        return {}
+    existing = FieldMapping.query.filter_by(
+        vendor_name=doc.vendor_name,
+        session_id=doc.session_id or '__default__',
+    ).all()
+    return {fm.source_column_name: fm.target_field for fm in existing}
+
+
+def apply_mapping(doc, extraction: dict, result: dict, model: str) -> int:
+    """
+    Stage 3: persist a complete mapping result for a document: line items,
+    then header metadata, RAG chunks and embeddings (see finish_mapping).
+    Caller commits. Returns line items created.
+    """
+    from app.services.product_resolver import get_product_resolver
+
+    resolver = get_product_resolver(doc.session_id or '__default__')
+    items = [item for item in (add_line_item(doc, li_data, resolver) for li_data in result.get('line_items') or [])
+             if item]
+    categorize_line_items(items, doc.session_id or '__default__')
+    finish_mapping(doc, extraction, result, model)
+    return len(items)
+
+
+def map_and_persist(doc, extraction: dict, mapper) -> int:
+    """
+    Map a document with a streamed response, inserting each line item as soon
+    as it is parsed and flushing in batches while generation continues. Rows
+    parsed before a truncation or malformed tail are kept. Caller commits.
+    Returns line items created.
+    """
+    from app.extensions import db
+    from app.services.product_resolver import get_product_resolver
+
+    stream = mapper.stream_document(
+        raw_tables=extraction.get('tables', []),
+        document_text=extraction.get('full_text', ''),
+        file_format=doc.file_format,
+        known_mappings=known_mappings_for(doc),
+        document_type=extraction.get('document_type'),
+    )
+    session_id = doc.session_id or '__default__'
+    resolver = get_product_resolver(session_id)
+    created = 0
+    pending = []
+    for li_data in stream:
+        item = add_line_item(doc, li_data, resolver)
+        if item:
+            created += 1
+            pending.append(item)
+            if len(pending) >= INSERT_BATCH_SIZE:
+                categorize_line_items(pending, session_id)
+                db.session.flush()
+                pending = []
+    categorize_line_items(pending, session_id)
+    finish_mapping(doc, extraction, stream.result, mapper.model)
+    return created
+
+
+def categorize_line_items(items: list, session_id: str = '__default__') -> int:
+    """
+    Batch-classify new line items with the session's local category
+    classifier (trained on human-verified rows). Confident predictions
+    replace the mapping model's category and sub_category. Returns the
+    number of items categorized locally.
+    """
+    from app.services.classifiers import get_line_item_classifier, item_fields
+
+    if not items:
+        return 0
+    try:
+        classifier = get_line_item_classifier(session_id)
+        if not classifier.trained:
+            return 0
+        predictions = classifier.predict([item_fields(item) for item in items])
+    except Exception as e:
+        logger.warning(f'Local line item categorization failed: {e}')
+        return 0
+    categorized = 0
+    for item, prediction in zip(items, predictions):
+        if not prediction['category']:
+            continue
+        if prediction['category'] != item.category:
+            item.sub_category = None
+        item.category = prediction['category']
+        if prediction['sub_category']:
+            item.sub_category = prediction['sub_category']
+        categorized += 1
+    return categorized
+
+
+def add_line_item(doc, li_data, resolver=None):
+    """
+    Validate one mapped row and add it to the session, linked to its canonical
+    product when the resolver knows its part number or name. Returns the
+    LineItem, or None if rejected.
+    """
+    from app.extensions import db
+    from app.models.line_item import LineItem
+
+    if not isinstance(li_data, dict) or not any(
+        li_data.get(field) for field in ('product_name', 'part_number', 'labor_category', 'product_description')
+    ):
+        logger.warning(f'Skipping mapped row without identifying fields for doc {doc.id}')
+        return None
+
+    if resolver is None:
+        from app.services.product_resolver import get_product_resolver
+        resolver = get_product_resolver(doc.session_id or '__default__')
+
+    item = LineItem(
+        document_id=doc.id,
+        canonical_product_id=resolver.resolve(
+            li_data.get('part_number'), li_data.get('manufacturer'), li_data.get('product_name')),
+        line_number=li_data.get('line_number'),
+        clin=li_data.get('clin'),
+        part_number=li_data.get('part_number'),
+        manufacturer=li_data.get('manufacturer'),
+        product_name=li_data.get('product_name'),
+        product_description=li_data.get('product_description'),
+        category=li_data.get('category'),
+        sub_category=li_data.get('sub_category'),
+        quantity=safe_float(li_data.get('quantity')),
+        unit_of_issue=li_data.get('unit_of_issue'),
+        unit_price=safe_float(li_data.get('unit_price')),
+        extended_price=safe_float(li_data.get('extended_price')),
+        labor_category=li_data.get('labor_category'),
+        labor_hours=safe_float(li_data.get('labor_hours')),
+        labor_rate=safe_float(li_data.get('labor_rate')),
+        mapping_confidence=safe_float(li_data.get('mapping_confidence')),
+        original_row_text=str(li_data),
+        session_id=doc.session_id or '__default__',
+    )
+    db.session.add(item)
+    return item
+
+
+def finish_mapping(doc, extraction: dict, result: dict, model: str):
+    """
+    Apply header metadata, create and embed RAG chunks, set the extraction
+    confidence, record price observations, leave the document in 'review'
+    and bump the data version.
+    Caller commits.
+    """
+    from app.extensions import db
+    from app.models.document_chunk import DocumentChunk
+    from app.services.data_version import bump_data_version
+    from app.services.price_observations import record_price_observations
+
+    session_id = doc.session_id or '__default__'
+    if result.get('error'):
+        logger.warning(f'Mapping returned error for doc {doc.id}: {result["error"]}')
+        doc.notes = f'Mapping warning: {result["error"]}'
+
+    # Update document metadata from AI results
+    metadata = result.get('metadata') or {}
+    doc.document_type = extraction.get('document_type') or result.get('document_type', doc.document_type)
+    doc.vendor_name = metadata.get('vendor_name') or doc.vendor_name
+    doc.document_number = metadata.get('document_number') or doc.document_number
+    doc.document_date = metadata.get('document_date') or doc.document_date
+    doc.contract_number = metadata.get('contract_number') or doc.contract_number
+    doc.task_order_number = metadata.get('task_order_number') or doc.task_order_number
+    doc.total_amount = metadata.get('total_amount') or doc.total_amount
+    doc.period_of_performance_start = metadata.get('period_of_performance_start') or doc.period_of_performance_start
+    doc.period_of_performance_end = metadata.get('period_of_performance_end') or doc.period_of_performance_end
+    doc.ai_model_used = model
+
+    # Create document chunks for RAG
+    full_text = extraction.get('full_text', '')
+    if full_text:
+        chunks = create_chunks(full_text)
+        for idx, chunk_text in enumerate(chunks):
+            db.session.add(DocumentChunk(
+                document_id=doc.id,
+                chunk_index=idx,
+                content=chunk_text,
+                chunk_type='paragraph',
+                session_id=session_id,
+            ))
+        doc.chunk_count = len(chunks)
+
+    # Embed the new chunks locally for semantic retrieval
+    if doc.chunk_count:
+        db.session.flush()
+        try:
+            from app.services.embedder import embed_pending_chunks
+            embed_pending_chunks(session_id=session_id, document_ids=[doc.id])
+        except Exception as e:
+            logger.warning(f'Embedding failed for doc {doc.id}, run `flask embed-chunks` later: {e}')
+
+    # Calculate extraction confidence as average of line item confidences
+    confidences = [
+        safe_float(li_data.get('mapping_confidence'))
+        for li_data in result.get('line_items') or []
+        if isinstance(li_data, dict) and safe_float(li_data.get('mapping_confidence')) is not None
+    ]
+    if confidences:
+        doc.extraction_confidence = round(sum(confidences) / len(confidences), 3)
+
+    # Line items are flushed above or here; their prices become observations
+    db.session.flush()
+    record_price_observations(session_id, [doc.id])
+
+    doc.processing_status = 'review'
+    bump_data_version(session_id, [doc.id])
+
+
+def is_small(extraction: dict) -> bool:
+    """Whether a document's extracted input is small enough to pack with others."""
+    tables = json.dumps(extraction.get('tables', [])[:50])
+    return len(tables) <= SMALL_TABLE_CHARS and len(extraction.get('full_text') or '') <= SMALL_TEXT_CHARS
+
+
+def pack_batches(items: list, max_documents: int = BATCH_MAX_DOCUMENTS,
+                 max_chars: int = BATCH_MAX_CHARS) -> list:
+    """Greedily group (doc, extraction) pairs into batches bounded by count and input size."""
+    batches, current, size = [], [], 0
+    for doc, extraction in items:
+        cost = len(json.dumps(extraction.get('tables', [])[:50])) + len(extraction.get('full_text') or '')
+        if current and (len(current) >= max_documents or size + cost > max_chars):
+            batches.append(current)
+            current, size = [], 0
+        current.append((doc, extraction))
+        size += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def process_documents(docs: list, mapper, batch: bool = True) -> dict:
+    """
+    Extract and map a set of documents, committing after each one. Small
+    documents are packed into shared mapping calls; documents whose share of
+    a batch response fails validation, and large documents, are mapped
+    individually. Returns counts plus per-document outcomes.
+    """
+    from app.extensions import db
+
+    summary = {'processed': 0, 'failed': 0, 'batched': 0, 'individual': 0,
+               'mapping_calls': 0, 'classified_locally': 0, 'line_items_created': 0, 'documents': []}
+
+    def _fail(doc, error):
+        db.session.rollback()
+        doc.processing_status = 'failed'
+        doc.notes = f'Processing error: {error}'
+        db.session.commit()
+        summary['failed'] += 1
+        summary['documents'].append({'id': doc.id, 'status': 'failed', 'error': str(error)})
+
+    def _finish(doc, extraction, result, mode):
+        try:
+            if result is None:
+                created = map_and_persist(doc, extraction, mapper)
+            else:
+                created = apply_mapping(doc, extraction, result, mapper.model)
+            db.session.commit()
+        except Exception as e:
+            logger.exception(f'Persisting mapping failed for document {doc.id}')
+            _fail(doc, e)
+            return
+        summary['processed'] += 1
+        summary[mode] += 1
+        summary['line_items_created'] += created
+        summary['documents'].append({'id': doc.id, 'status': 'review', 'mode': mode,
+                                     'line_items_created': created})
+
+    small, large = [], []
+    for doc in docs:
+        try:
+            doc.processing_status = 'extracting'
+            db.session.commit()
+            extraction = extract_document(doc)
+            if classify_document(doc, extraction)[0]:
+                summary['classified_locally'] += 1
+            doc.processing_status = 'mapping'
+            db.session.commit()
+        except Exception as e:
+            logger.exception(f'Extraction failed for document {doc.id}')
+            _fail(doc, e)
+            continue
+        (small if batch and is_small(extraction) else large).append((doc, extraction))
+
+    # Route by type: documents of the same known type share mapping calls
+    small.sort(key=lambda pair: pair[1].get('document_type') or '~')
+    for group in pack_batches(small):
+        if len(group) == 1:
+            large.extend(group)
+            continue
+        summary['mapping_calls'] += 1
+        results = mapper.map_batch([
+            {
+                'key': f'doc{i + 1}',
+                'raw_tables': extraction.get('tables', []),
+                'document_text': extraction.get('full_text', ''),
+                'file_format': doc.file_format,
+                'known_mappings': known_mappings_for(doc),
+                'document_type': extraction.get('document_type'),
+            }
+            for i, (doc, extraction) in enumerate(group)
+        ])
+        for i, (doc, extraction) in enumerate(group):
+            result = results.get(f'doc{i + 1}')
+            if result is None:
+                large.append((doc, extraction))
+            else:
+                _finish(doc, extraction, result, 'batched')
+
+    for doc, extraction in large:
+        summary['mapping_calls'] += 1
+        _finish(doc, extraction, None, 'individual')
+
+    return summary
+
+
+def safe_float(value):
+    """Safely convert a value to float, returning None on failure."""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def create_chunks(text, chunk_size=800, overlap=100):
+    """Split text into overlapping chunks for RAG."""
+    if not text:
+        return []
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = start + chunk_size
+        chunk = text[start:end]
+        if chunk.strip():
+            chunks.append(chunk.strip())
+        start = end - overlap
+        if start >= len(text):
+            break
+    return chunks
@@ -0,0 +1,156 @@
+import logging
+import math
+import zlib
+from collections import Counter
+
+import numpy as np
+
+from app.services.text_utils import tokenize
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = 256
+EMBEDDING_DTYPE = np.dtype('<f4')
+EMBEDDING_BYTES = EMBEDDING_DIM * EMBEDDING_DTYPE.itemsize
+
+# Each hashed feature is scattered into this many output dimensions with
+# random signs (a sparse Johnson-Lindenstrauss projection).
+_PROJECTION_NNZ = 4
+_rng = np.random.default_rng(20250929)
+_PROJ_MUL = _rng.integers(1, 2**32, size=_PROJECTION_NNZ, dtype=np.uint64) | np.uint64(1)
+_PROJ_ADD = _rng.integers(0, 2**32, size=_PROJECTION_NNZ, dtype=np.uint64)
+_SIGN_MUL = _rng.integers(1, 2**32, size=_PROJECTION_NNZ, dtype=np.uint64) | np.uint64(1)
+_MASK32 = np.uint64(0xFFFFFFFF)
+
+WORD_WEIGHT = 1.0
+BIGRAM_WEIGHT = 0.7
+CHAR_NGRAM_WEIGHT = 0.35
+
+
+class ChunkEmbedder:
+    """Offline text embedder: hashed n-gram TF features with a sparse random projection.
+
+    Vectors are deterministic across processes and need no network or trained
+    model, so chunks can be embedded incrementally and compared at any time.
+    """
+
+    dim = EMBEDDING_DIM
+
+    def _features(self, text: str) -> Counter:
+        words = tokenize(text)
+        feats = Counter()
+        for w in words:
+            feats['w:' + w] += WORD_WEIGHT
+            padded = f'<{w}>'
+            if len(padded) > 4:
+                for i in range(len(padded) - 2):
+                    feats['c:' + padded[i:i + 3]] += CHAR_NGRAM_WEIGHT
+        for a, b in zip(words, words[1:]):
+            feats[f'b:{a} {b}'] += BIGRAM_WEIGHT
+        return feats
+
+    def embed(self, texts: list) -> np.ndarray:
+        """Embed a batch of texts. Returns an (n, dim) float32 matrix of unit vectors."""
+        rows, hashes, weights = [], [], []
+        for row, text in enumerate(texts):
+            for feat, tf in self._features(text or '').items():
+                rows.append(row)
+                hashes.append(zlib.crc32(feat.encode('utf-8')))
+                # Sublinear term frequency
+                weights.append(1.0 + math.log(tf) if tf >= 1 else tf)
+
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        if not rows:
+            return out
+
+        h = np.asarray(hashes, dtype=np.uint64)[:, None]
+        dims = (((h * _PROJ_MUL + _PROJ_ADD) & _MASK32) * np.uint64(self.dim)) >> np.uint64(32)
+        signs = np.where(((h * _SIGN_MUL) & _MASK32) >> np.uint64(31), 1.0, -1.0)
+        vals = (signs * np.asarray(weights, dtype=np.float64)[:, None]).ravel()
+        flat = (np.asarray(rows, dtype=np.int64)[:, None] * self.dim + dims.astype(np.int64)).ravel()
+        out += np.bincount(flat, weights=vals, minlength=out.size).reshape(out.shape).astype(np.float32)
+
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        np.divide(out, norms, out=out, where=norms > 0)
+        return out
+
+    def embed_one(self, text: str) -> np.ndarray:
+        return self.embed([text])[0]
+
+
+def vector_to_blob(vector: np.ndarray) -> bytes:
+    return np.asarray(vector, dtype=EMBEDDING_DTYPE).tobytes()
+
+
+def blob_to_vector(blob) -> np.ndarray:
+    """Decode a stored embedding, or return None if it is missing or stale."""
+    if not blob or len(blob) != EMBEDDING_BYTES:
+        return None
+    return np.frombuffer(blob, dtype=EMBEDDING_DTYPE)
+
+
+def embed_pending_chunks(session_id: str = '__default__', document_ids: list = None,
+                         batch_size: int = 256, rebuild: bool = False) -> int:
+    """
+    Embed document chunks that have no (or a stale) vector, in batches.
+    Incremental by chunk id; pass rebuild=True to re-embed everything.
+    Sets Document.embedded once all of a document's chunks have vectors.
+    Returns the number of chunks embedded. Caller commits.
+    """
+    from sqlalchemy import update, or_
+    from app.extensions import db
+    from app.models.document import Document
+    from app.models.document_chunk import DocumentChunk
+
+    embedder = ChunkEmbedder()
+    base = db.session.query(DocumentChunk.id, DocumentChunk.content)\
+        .filter(DocumentChunk.session_id == session_id)
+    if document_ids:
+        base = base.filter(DocumentChunk.document_id.in_(document_ids))
+    if not rebuild:
+        base = base.filter(or_(
+            DocumentChunk.embedding.is_(None),
+            db.func.length(DocumentChunk.embedding) != EMBEDDING_BYTES,
+        ))
+
+    embedded = 0
+    last_id = ''
+    while True:
+        batch = base.filter(DocumentChunk.id > last_id)\
+            .order_by(DocumentChunk.id)\
+            .limit(batch_size)\
+            .all()
+        if not batch:
+            break
+        vectors = embedder.embed([content for _, content in batch])
+        db.session.execute(update(DocumentChunk), [
+            {'id': chunk_id, 'embedding': vector_to_blob(vec)}
+            for (chunk_id, _), vec in zip(batch, vectors)
+        ])
+        embedded += len(batch)
+        last_id = batch[-1][0]
+
+    # Refresh the per-document embedded flag
+    stale = or_(
+        DocumentChunk.embedding.is_(None),
+        db.func.length(DocumentChunk.embedding) != EMBEDDING_BYTES,
+    )
+    counts = db.session.query(
+        DocumentChunk.document_id,
+        db.func.count(DocumentChunk.id),
+        db.func.sum(db.case((stale, 1), else_=0)),
+    ).filter(DocumentChunk.session_id == session_id)
+    if document_ids:
+        counts = counts.filter(DocumentChunk.document_id.in_(document_ids))
+    status = {row[0]: (row[1], row[2] or 0) for row in counts.group_by(DocumentChunk.document_id).all()}
+
+    docs = Document.query.filter_by(session_id=session_id)
+    if document_ids:
+        docs = docs.filter(Document.id.in_(document_ids))
+    for doc in docs.all():
+        total, pending = status.get(doc.id, (0, 0))
+        doc.embedded = 1 if total and not pending else 0
+
+    if embedded:
+        logger.info(f'Embedded {embedded} chunks for session {session_id}')
+    return embedded
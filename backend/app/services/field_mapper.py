@@ -1,9 +1,14 @@
 import json
 import logging
 
+from app.services.json_stream import StreamingObjectParser
+
 logger = logging.getLogger(__name__)
 
-MAPPING_PROMPT = """You are analyzing a procurement document. Given the following raw table data extracted from a {file_format} file, please:
+# Static instructions, sent as the system prompt. Too short (~500 tokens) for prompt
+# caching to apply; see MIN_CACHEABLE_TOKENS in llm_gateway.
+# The per-document input goes in MAPPING_INPUT_PROMPT.
+MAPPING_PROMPT = """You are analyzing a procurement document. Given the raw table data extracted from the file described in the user message, please:
 
 1. Identify the document type. Choose one of: vendor_quote, purchase_order, invoice, bom, contract_mod, timesheet, obligation, delivery_receipt, other
 
@@ -31,9 +36,9 @@ MAPPING_PROMPT = """You are analyzing a procurement document. Given the followin
    - mapping_confidence: 0.0 to 1.0 for each row
 
 Return ONLY valid JSON with this structure (no markdown, no explanation):
-{{
+{
   "document_type": "...",
-  "metadata": {{
+  "metadata": {
     "vendor_name": "...",
     "document_number": "...",
     "document_date": "...",
@@ -42,9 +47,9 @@ Return ONLY valid JSON with this structure (no markdown, no explanation):
     "total_amount": null or number,
     "period_of_performance_start": "...",
     "period_of_performance_end": "..."
-  }},
+  },
   "line_items": [
-    {{
+    {
       "line_number": 1,
       "part_number": "...",
       "product_name": "...",
@@ -61,9 +66,11 @@ Return ONLY valid JSON with this structure (no markdown, no explanation):
       "labor_hours": number or null,
       "labor_rate": number or null,
       "mapping_confidence": 0.95
-    }}
+    }
   ]
-}}
+}"""
+
+MAPPING_INPUT_PROMPT = """File format: {file_format}
 
 Raw table data:
 {raw_table}
@@ -71,62 +78,212 @@ Raw table data:
 Additional document text for context:
 {document_text}"""
 
+# Prepended to the input when a local classifier already settled the type.
+KNOWN_TYPE_NOTE = """Document type (already classified; use this value and skip step 1): {document_type}
+
+"""
+
+BATCH_INPUT_PROMPT = """The {count} documents below are independent. Apply the instructions to each one separately.
+Return ONLY valid JSON of the form {{"documents": [{{"document_id": "<document id>", <members of the result object with the structure above>}}]}}, with one entry for every document id.
+
+{documents}"""
+
+BATCH_DOCUMENT_BLOCK = """<<<DOCUMENT {key}>>>
+{input}
+<<<END DOCUMENT {key}>>>"""
+
+DOCUMENT_TYPES = {
+    'vendor_quote', 'purchase_order', 'invoice', 'bom', 'contract_mod',
+    'timesheet', 'obligation', 'delivery_receipt', 'other',
+}
+MAPPING_MODEL = "claude-sonnet-4-5-20250929"
+BATCH_MAX_TOKENS = 16000
+# Follow-up requests allowed when a mapping response stops at max_tokens.
+MAX_CONTINUATIONS = 3
+
 
 class FieldMapper:
     """Layer 2: Use Claude API to classify document and map fields."""
 
-    def __init__(self, api_key: str):
-        if not api_key:
+    def __init__(self, gateway=None):
+        if gateway is None:
+            from app.services.llm_gateway import get_llm_gateway
+            gateway = get_llm_gateway()
+        if not gateway.available:
             raise ValueError("ANTHROPIC_API_KEY is required for document processing")
-        import anthropic
-        self.client = anthropic.Anthropic(api_key=api_key)
+        self.gateway = gateway
+        self.model = MAPPING_MODEL
 
     def map_document(self, raw_tables: list, document_text: str,
-                     file_format: str, known_mappings: dict = None) -> dict:
+                     file_format: str, known_mappings: dict = None, document_type: str = None) -> dict:
         """
         Send extracted data to Claude API for classification and field mapping.
         Returns dict with document_type, metadata, and line_items.
         """
+        stream = self.stream_document(raw_tables, document_text, file_format, known_mappings, document_type)
+        for _ in stream:
+            pass
+        return stream.result
+
+    def stream_document(self, raw_tables: list, document_text: str, file_format: str,
+                        known_mappings: dict = None, document_type: str = None) -> 'MappingStream':
+        """
+        Stream the mapping response and parse it incrementally. Iterating the
+        returned MappingStream yields each line item dict as soon as its JSON
+        object closes; afterwards .result holds the full mapping result. Output
+        cut off at max_tokens is continued from the last complete line item.
+        A document_type already known from the local classifier is passed to
+        the model instead of asking it to classify.
+        """
         # Truncate to fit context
         table_str = json.dumps(raw_tables[:50], indent=2)[:8000]
         text_snippet = (document_text or '')[:4000]
 
-        prompt = MAPPING_PROMPT.format(
-            file_format=file_format,
-            raw_table=table_str,
-            document_text=text_snippet,
-        )
+        prompt = _mapping_input(file_format, table_str, text_snippet, document_type)
+        return MappingStream(self._stream_items(prompt, document_type))
+
+    def _stream_items(self, prompt: str, document_type: str = None):
+        from app.services.llm_gateway import BATCH
+
+        parser = StreamingObjectParser('line_items')
+        items = []
+        error = None
+        messages = [{"role": "user", "content": prompt}]
+        for attempt in range(MAX_CONTINUATIONS + 1):
+            try:
+                outcome = yield from self._feed(parser, items, self.gateway.stream(
+                    messages,
+                    system=MAPPING_PROMPT,
+                    max_tokens=4096,
+                    model=self.model,
+                    priority=BATCH,
+                    label='mapping',
+                ))
+            except Exception as e:
+                logger.error(f"Claude API error: {e}")
+                error = str(e)
+                break
+            if parser.complete or (outcome or {}).get('stop_reason') != 'max_tokens':
+                break
+            if attempt == MAX_CONTINUATIONS or not parser.rewind():
+                error = 'Mapping response truncated at max_tokens'
+                break
+            logger.info(f'Mapping output truncated after {len(items)} line items, requesting continuation')
+            # Prefill the kept prefix so the model continues the same JSON document
+            messages = [{"role": "user", "content": prompt},
+                        {"role": "assistant", "content": parser.text}]
+
+        if error is None and not parser.complete:
+            error = 'JSON parse error: response ended before the mapping object closed'
+        if error:
+            logger.error(f"Mapping incomplete, keeping {len(items)} parsed line items: {error}")
+
+        result = {
+            'document_type': document_type or parser.fields.get('document_type') or 'other',
+            'metadata': parser.fields.get('metadata') or {},
+            'line_items': items,
+        }
+        if error:
+            result['error'] = error
+        return result
 
+    def _feed(self, parser, items: list, text_stream):
+        """Feed streamed text to the parser, yielding completed line items; returns the stream outcome."""
+        iterator = iter(text_stream)
         try:
-            response = self.client.messages.create(
-                model="claude-sonnet-4-5-20250929",
-                max_tokens=4096,
-                messages=[{"role": "user", "content": prompt}],
-            )
-
-            content = response.content[0].text.strip()
-            # Remove markdown code fences if present
-            if content.startswith('```'):
-                content = content.split('\n', 1)[1]
-                if content.endswith('```'):
-                    content = content.rsplit('```', 1)[0]
-
-            result = json.loads(content)
-            return result
-
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse Claude response as JSON: {e}")
-            return {
-                'document_type': 'other',
-                'metadata': {},
-                'line_items': [],
-                'error': f'JSON parse error: {str(e)}',
-            }
+            while True:
+                try:
+                    chunk = next(iterator)
+                except StopIteration as stop:
+                    return stop.value
+                for item in parser.feed(chunk):
+                    items.append(item)
+                    yield item
+        finally:
+            iterator.close()
+
+    def map_batch(self, documents: list) -> dict:
+        """
+        Map several small documents in one request. Each entry of documents is
+        {'key', 'raw_tables', 'document_text', 'file_format'} plus an optional
+        locally classified 'document_type'. Returns
+        {key: result} for the documents whose result passed validation; callers
+        map the missing ones individually.
+        """
+        blocks = []
+        for d in documents:
+            blocks.append(BATCH_DOCUMENT_BLOCK.format(
+                key=d['key'],
+                input=_mapping_input(
+                    d['file_format'],
+                    json.dumps(d['raw_tables'][:50], separators=(',', ':'))[:8000],
+                    (d['document_text'] or '')[:4000],
+                    d.get('document_type'),
+                ),
+            ))
+        prompt = BATCH_INPUT_PROMPT.format(count=len(documents), documents='\n\n'.join(blocks))
+
+        from app.services.llm_gateway import BATCH
+        # Streamed, so a long response is not cut off by the client timeout and
+        # documents completed before a failure or truncation are kept
+        parser = StreamingObjectParser('documents')
+        results = []
+        stream = MappingStream(self._feed(parser, results, self.gateway.stream(
+            [{"role": "user", "content": prompt}],
+            system=MAPPING_PROMPT,
+            max_tokens=BATCH_MAX_TOKENS,
+            model=self.model,
+            priority=BATCH,
+            label='mapping_batch',
+        )))
+        try:
+            for _ in stream:
+                pass
         except Exception as e:
-            logger.error(f"Claude API error: {e}")
-            return {
-                'document_type': 'other',
-                'metadata': {},
-                'line_items': [],
-                'error': str(e),
-            }
+            logger.error(f"Batch mapping failed after {len(results)} documents, "
+                         f"falling back to individual calls for the rest: {e}")
+        if (stream.result or {}).get('stop_reason') == 'max_tokens':
+            logger.warning('Batch mapping response was truncated; unfinished documents fall back')
+
+        by_key = {r.pop('document_id', None): r for r in results}
+        valid = {}
+        for d in documents:
+            result = by_key.get(d['key'])
+            if _valid_result(result):
+                valid[d['key']] = result
+            elif d['key'] in by_key:
+                logger.warning(f"Batch mapping result for {d['key']} failed validation")
+        return valid
+
+
+class MappingStream:
+    """Iterable of line items from a streamed mapping; .result is set once exhausted."""
+
+    def __init__(self, generator):
+        self._generator = generator
+        self.result = None
+
+    def __iter__(self):
+        self.result = yield from self._generator
+
+
+def _mapping_input(file_format: str, raw_table: str, document_text: str, document_type: str = None) -> str:
+    prompt = MAPPING_INPUT_PROMPT.format(
+        file_format=file_format,
+        raw_table=raw_table,
+        document_text=document_text,
+    )
+    if document_type:
+        prompt = KNOWN_TYPE_NOTE.format(document_type=document_type) + prompt
+    return prompt
+
+
+def _valid_result(result) -> bool:
+    """Structural check of one document's mapping result."""
+    return (
+        isinstance(result, dict)
+        and result.get('document_type') in DOCUMENT_TYPES
+        and isinstance(result.get('metadata', {}), dict)
+        and isinstance(result.get('line_items'), list)
+        and all(isinstance(li, dict) for li in result['line_items'])
+    )
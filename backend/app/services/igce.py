@@ -0,0 +1,220 @@
+import io
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+MAX_LINES = 1000
+MAX_OPTION_YEARS = 10
+# Most recent observations returned as price sources for each line.
+SOURCES_PER_LINE = 5
+
+
+def escalated_price(unit_price: float, escalation_rate: float, year: int) -> float:
+    """Unit price for contract year `year` (0 = base year), escalated once per year from today's price."""
+    return round(unit_price * (1 + escalation_rate) ** (year + 1), 2)
+
+
+def build_batch_igce(lines: list, escalation_rate: float = 0.03, option_years: int = 0,
+                     session_id: str = '__default__') -> dict:
+    """
+    Independent Government Cost Estimate for a basket of requirement lines.
+
+    Each line is {'product_id' | 'part_number' | 'product_name', 'manufacturer'?,
+    'quantity', 'description'?}. Lines are resolved to canonical products in
+    memory (product_resolver), then products, their price estimates and most
+    recent price observations are loaded in one query each. Every resolved
+    line is priced from its statistical estimate at the line quantity (or the
+    product average when it has none) for the base year and each option year;
+    unresolved or unpriced lines are returned with a status and left out of
+    the totals. Caller commits (missing estimates are computed and stored).
+    """
+    from app.extensions import db
+    from app.models.canonical_product import CanonicalProduct
+    from app.models.price_observation import PriceObservation
+    from app.services.pricing_engine import get_price_estimates
+    from app.services.product_resolver import get_product_resolver
+
+    resolver = get_product_resolver(session_id)
+    product_ids = []
+    for line in lines:
+        product_id = line.get('product_id') or resolver.resolve(
+            line.get('part_number'), line.get('manufacturer'), line.get('product_name'))
+        product_ids.append(product_id)
+
+    wanted = {pid for pid in product_ids if pid}
+    products = {}
+    estimates = {}
+    sources = defaultdict(list)
+    if wanted:
+        products = {
+            p.id: p for p in CanonicalProduct.query
+            .filter(CanonicalProduct.session_id == session_id)
+            .filter(CanonicalProduct.id.in_(wanted))
+        }
+        estimates = get_price_estimates(session_id, list(products))
+        recent = db.session.query(
+            PriceObservation.canonical_product_id.label('product_id'),
+            PriceObservation.unit_price.label('price'),
+            PriceObservation.observed_on.label('date'),
+            PriceObservation.vendor_name.label('vendor'),
+            PriceObservation.document_number.label('document_number'),
+            db.func.row_number().over(
+                partition_by=PriceObservation.canonical_product_id,
+                order_by=PriceObservation.observed_on.desc(),
+            ).label('position'),
+        ).filter(PriceObservation.canonical_product_id.in_(products)).subquery()
+        for product_id, price, date, vendor, number in db.session.query(
+            recent.c.product_id, recent.c.price, recent.c.date, recent.c.vendor, recent.c.document_number,
+        ).filter(recent.c.position <= SOURCES_PER_LINE).order_by(recent.c.product_id, recent.c.position):
+            sources[product_id].append({
+                'price': round(price, 2),
+                'date': date.isoformat() if date else None,
+                'vendor': vendor,
+                'document_number': number,
+            })
+
+    years = ['Base Year'] + [f'Option Year {n}' for n in range(1, option_years + 1)]
+    year_totals = [0.0] * len(years)
+    result_lines = []
+    for index, (line, product_id) in enumerate(zip(lines, product_ids), 1):
+        quantity = line['quantity']
+        entry = {
+            'line': index,
+            'description': line.get('description') or line.get('product_name') or line.get('part_number'),
+            'part_number': line.get('part_number'),
+            'quantity': quantity,
+            'product_id': None,
+            'product_name': None,
+            'status': 'unresolved',
+        }
+        result_lines.append(entry)
+        product = products.get(product_id)
+        if product is None:
+            continue
+        entry.update({
+            'description': entry['description'] or product.canonical_name,
+            'product_id': product.id,
+            'product_name': product.canonical_name,
+            'manufacturer': product.manufacturer,
+            'category': product.category,
+        })
+        average = product.avg_price or product.last_known_price
+        estimate = estimates.get(product.id)
+        if estimate is None and average is None:
+            entry['status'] = 'no_pricing'
+            continue
+        base_price = estimate.price_at(quantity) if estimate else average
+        # The interval is for the mean at the reference quantity; scale it with the breaks
+        scale = base_price / estimate.estimated_price if estimate and estimate.estimated_price else 1.0
+
+        unit_prices = [escalated_price(base_price, escalation_rate, year) for year in range(len(years))]
+        totals = [round(price * quantity, 2) for price in unit_prices]
+        for year, total in enumerate(totals):
+            year_totals[year] += total
+        entry.update({
+            'status': 'estimated',
+            'pricing_method': 'statistical' if estimate else 'average',
+            'avg_unit_price': round(average, 2) if average is not None else None,
+            'base_unit_price': round(base_price, 2),
+            'ci_low': round(estimate.ci_low * scale, 2) if estimate and estimate.ci_low is not None else None,
+            'ci_high': round(estimate.ci_high * scale, 2) if estimate and estimate.ci_high is not None else None,
+            'min_price': round(product.min_price, 2) if product.min_price else None,
+            'max_price': round(product.max_price, 2) if product.max_price else None,
+            'unit_prices': unit_prices,
+            'year_totals': totals,
+            'line_total': round(sum(totals), 2),
+            'price_sources': sources.get(product.id, []),
+        })
+
+    counts = defaultdict(int)
+    for entry in result_lines:
+        counts[entry['status']] += 1
+    return {
+        'escalation_rate': escalation_rate,
+        'option_years': option_years,
+        'years': years,
+        'lines': result_lines,
+        'year_totals': [round(total, 2) for total in year_totals],
+        'grand_total': round(sum(year_totals), 2),
+        'line_count': len(result_lines),
+        'estimated_lines': counts['estimated'],
+        'unresolved_lines': counts['unresolved'],
+        'unpriced_lines': counts['no_pricing'],
+    }
+
+
+def igce_workbook(estimate: dict) -> bytes:
+    """Render a batch IGCE as an XLSX workbook (estimate and price source sheets)."""
+    import openpyxl
+    from openpyxl.styles import Font
+    from openpyxl.utils import get_column_letter
+
+    bold_font = Font(bold=True)
+    years = estimate['years']
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = 'IGCE'
+
+    headers = ['Line', 'Description', 'Part Number', 'Product', 'Manufacturer', 'Status',
+               'Quantity', 'Avg Unit Price', 'Base Unit Price', 'CI Low', 'CI High']
+    headers += [f'{year} Unit Price' for year in years] + [f'{year} Total' for year in years] + ['Line Total']
+    for col_idx, header in enumerate(headers, 1):
+        ws.cell(row=1, column=col_idx, value=header).font = bold_font
+
+    row_idx = 1
+    for row_idx, line in enumerate(estimate['lines'], 2):
+        values = [
+            line['line'], line['description'] or '', line['part_number'] or '', line['product_name'] or '',
+            line.get('manufacturer') or '', line['status'], line['quantity'], line.get('avg_unit_price'),
+            line.get('base_unit_price'), line.get('ci_low'), line.get('ci_high'),
+        ]
+        values += line.get('unit_prices') or [None] * len(years)
+        values += line.get('year_totals') or [None] * len(years)
+        values.append(line.get('line_total'))
+        for col_idx, value in enumerate(values, 1):
+            ws.cell(row=row_idx, column=col_idx, value=value)
+
+    total_row = row_idx + 1
+    ws.cell(row=total_row, column=1, value='Total').font = bold_font
+    first_total_col = 12 + len(years)
+    for offset, total in enumerate(estimate['year_totals'] + [estimate['grand_total']]):
+        ws.cell(row=total_row, column=first_total_col + offset, value=total).font = bold_font
+
+    for col_idx, header in enumerate(headers, 1):
+        ws.column_dimensions[get_column_letter(col_idx)].width = max(len(header) + 2, 12)
+    ws.column_dimensions['B'].width = 40
+    ws.column_dimensions['D'].width = 40
+
+    sources = wb.create_sheet('Price Sources')
+    source_headers = ['Line', 'Product', 'Price', 'Date', 'Vendor', 'Document #']
+    for col_idx, header in enumerate(source_headers, 1):
+        sources.cell(row=1, column=col_idx, value=header).font = bold_font
+    row_idx = 2
+    for line in estimate['lines']:
+        for source in line.get('price_sources') or []:
+            values = [line['line'], line['product_name'], source['price'], source['date'],
+                      source['vendor'], source['document_number']]
+            for col_idx, value in enumerate(values, 1):
+                sources.cell(row=row_idx, column=col_idx, value=value)
+            row_idx += 1
+
+    summary = wb.create_sheet('Summary')
+    rows = [
+        ('Escalation rate', estimate['escalation_rate']),
+        ('Option years', estimate['option_years']),
+        ('Lines', estimate['line_count']),
+        ('Estimated lines', estimate['estimated_lines']),
+        ('Unresolved lines', estimate['unresolved_lines']),
+        ('Lines without pricing', estimate['unpriced_lines']),
+    ]
+    rows += [(f'{year} total', total) for year, total in zip(years, estimate['year_totals'])]
+    rows.append(('Grand total', estimate['grand_total']))
+    for row_idx, (label, value) in enumerate(rows, 1):
+        summary.cell(row=row_idx, column=1, value=label).font = bold_font
+        summary.cell(row=row_idx, column=2, value=value)
+    summary.column_dimensions['A'].width = 24
+
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
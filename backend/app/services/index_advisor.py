@@ -0,0 +1,174 @@
+import logging
+from typing import NamedTuple
+from urllib.parse import urlencode
+
+logger = logging.getLogger(__name__)
+
+TEMP_BTREE = 'USE TEMP B-TREE'
+
+
+class PlanReport(NamedTuple):
+    label: str
+    statement: str
+    plan: list
+    findings: list
+
+
+def _samples(session_id: str) -> dict:
+    """Real filter values from the database to plug into the query templates (None when absent)."""
+    from app.extensions import db
+    from app.models.canonical_product import CanonicalProduct
+    from app.models.document import Document
+    from app.models.line_item import LineItem
+
+    def _most_common(column, session_column):
+        return db.session.query(column).filter(session_column == session_id)\
+            .filter(column.isnot(None)).filter(column != '')\
+            .group_by(column).order_by(db.func.count().desc()).limit(1).scalar()
+
+    product_name = _most_common(LineItem.product_name, LineItem.session_id)
+    words = [w for w in (product_name or '').split() if len(w) >= 3]
+    dated = db.session.query(db.func.min(Document.document_date_ordinal), db.func.max(Document.document_date_ordinal))\
+        .filter(Document.session_id == session_id).one()
+    return {
+        'category': _most_common(LineItem.category, LineItem.session_id),
+        'vendor': _most_common(Document.vendor_name, Document.session_id),
+        'document_type': _most_common(Document.document_type, Document.session_id),
+        'product_id': db.session.query(CanonicalProduct.id)
+            .filter(CanonicalProduct.session_id == session_id).limit(1).scalar(),
+        'term': words[0] if words else None,
+        'dates': dated if dated[0] is not None else None,
+    }
+
+
+def _templates(samples: dict, session_id: str) -> list:
+    """(label, API path or callable) for every query shape the app issues on its hot paths."""
+    from datetime import date
+    from app.extensions import db
+    from app.services.chat_service import ChatService
+
+    def path(base, **params):
+        return f'{base}?{urlencode(params)}' if params else base
+
+    category, vendor, term = samples['category'], samples['vendor'], samples['term']
+    product_id, dates = samples['product_id'], samples['dates']
+    templates = [
+        ('explorer: newest first', path('/api/line-items')),
+        ('explorer: price range by unit price', path('/api/line-items', min_price=100, max_price=1000,
+                                                      sort_by='unit_price', sort_order='asc')),
+        ('explorer: by extended price', path('/api/line-items', sort_by='extended_price')),
+        ('explorer: by product name', path('/api/line-items', sort_by='product_name', sort_order='asc')),
+        ('documents: newest first', path('/api/documents')),
+        ('documents: by status', path('/api/documents', processing_status='review')),
+        ('dashboard', path('/api/dashboard')),
+        ('products: by name', path('/api/products')),
+    ]
+    if category:
+        templates += [
+            ('explorer: category', path('/api/line-items', category=category)),
+            ('products: category', path('/api/products', category=category)),
+        ]
+    if vendor:
+        templates.append(('explorer: vendor', path('/api/line-items', vendor=vendor)))
+    if samples['document_type']:
+        templates += [
+            ('explorer: document type', path('/api/line-items', document_type=samples['document_type'])),
+            ('documents: document type', path('/api/documents', document_type=samples['document_type'])),
+        ]
+    if dates:
+        templates.append(('explorer: date range', path(
+            '/api/line-items', date_from=date.fromordinal(dates[0]).isoformat(),
+            date_to=date.fromordinal((dates[0] + dates[1]) // 2).isoformat())))
+    if term:
+        templates.append(('explorer: search', path('/api/line-items', search=term)))
+    if product_id:
+        templates += [
+            ('products: detail', path(f'/api/products/{product_id}')),
+            ('products: estimate', path(f'/api/products/{product_id}/estimate')),
+            ('products: price series', path(f'/api/products/{product_id}/price-series')),
+        ]
+
+    chat = ChatService()
+    templates.append(('chat: vocabulary', lambda: chat._vocabulary(db.session, session_id)))
+    if term:
+        templates += [
+            ('chat: line item search', lambda: chat._sql_search(term, db.session, session_id, limit=40)),
+            ('chat: like search', lambda: chat._like_line_item_search(term, db.session, session_id, limit=40)),
+        ]
+    if category:
+        question = f'total spend by vendor on {category}'
+        templates.append(('chat: aggregate', lambda: chat._route_aggregate(question, db.session, session_id)))
+    return templates
+
+
+def _findings(statement: str, plan: list, tables: set) -> list:
+    """
+    Full table scans and temp B-trees in an EXPLAIN QUERY PLAN detail list.
+    A scan in index order is only flagged without a LIMIT, since paging
+    through the index is how sorted pages are meant to be served.
+    """
+    limited = ' LIMIT ' in statement.upper()
+    findings = []
+    for detail in plan:
+        words = detail.split()
+        if not detail.startswith('SCAN ') or len(words) < 2 or words[1] not in tables:
+            if detail.startswith(TEMP_BTREE):
+                findings.append(detail.lower())
+            continue
+        if 'USING' not in words:
+            findings.append(f'full scan of {words[1]}')
+        elif 'COVERING' not in words and not limited:
+            findings.append(f'full index scan of {words[1]}')
+    return findings
+
+
+def advise(app, session_id: str = '__default__') -> list:
+    """
+    Replay the app's query templates against its configured database,
+    capturing every SELECT they issue, and return one PlanReport per
+    distinct statement with its EXPLAIN QUERY PLAN and any findings (full
+    table scans, temp B-trees). Point DATABASE_URL at a sample database of
+    realistic size; SQLite only.
+    """
+    from flask_jwt_extended import create_access_token
+    from sqlalchemy import event
+    from app.extensions import db
+    from app.services.analytics_snapshot import get_analytics_snapshot
+
+    # Build the in-memory snapshot up front so its bulk load is not reported
+    get_analytics_snapshot(session_id)
+    templates = _templates(_samples(session_id), session_id)
+
+    captured = {}
+    current = ['']
+
+    def _capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            captured.setdefault(statement, (current[0], parameters))
+
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {create_access_token(identity="index-advisor")}'}
+    event.listen(db.engine, 'before_cursor_execute', _capture)
+    try:
+        for label, target in templates:
+            current[0] = label
+            try:
+                if callable(target):
+                    target()
+                else:
+                    response = client.get(target, headers=headers)
+                    if response.status_code >= 400:
+                        logger.warning(f'Index advisor: {label} returned {response.status_code}')
+            except Exception:
+                db.session.rollback()
+                logger.exception(f'Index advisor: {label} failed')
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', _capture)
+
+    tables = set(db.metadata.tables)
+    reports = []
+    with db.engine.connect() as conn:
+        for statement, (label, parameters) in captured.items():
+            plan = [row[3] for row in conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters)]
+            reports.append(PlanReport(label, statement, plan, _findings(statement, plan, tables)))
+    return reports
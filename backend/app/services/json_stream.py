@@ -0,0 +1,136 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class StreamingObjectParser:
+    """
+    Incremental parser for a streamed JSON object whose bulk is one array of
+    objects (e.g. a mapping result's "line_items").
+
+    feed() scans only the new text and returns the array elements completed
+    by it, so rows can be handled while generation continues. The other
+    top-level members are collected in `fields` as they complete. Text
+    before the opening brace (such as a markdown fence) is ignored.
+
+    After a truncated response, rewind() drops the partial element so a
+    continuation can be appended to `text` and fed through the same parser.
+    """
+
+    def __init__(self, array_key: str):
+        self.array_key = array_key
+        self.text = ''
+        self.fields = {}
+        self.items_parsed = 0
+        self.items_skipped = 0
+        self.complete = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._expect_key = False
+        self._key = None
+        self._value_start = None
+        self._item_start = None
+        self._last_item_end = None
+
+    def feed(self, chunk: str) -> list:
+        self.text += chunk
+        items = []
+        text = self.text
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._expect_key:
+                        self._key = json.loads(text[self._string_start:i + 1])
+                        self._expect_key = False
+                continue
+            if self.complete:
+                continue
+
+            if c == '"':
+                if self._depth > 0:
+                    self._in_string = True
+                    self._string_start = i
+            elif c in '{[':
+                if self._depth == 0:
+                    if c != '{':
+                        continue
+                    self._expect_key = True
+                elif self._depth == 1:
+                    self._value_start = i
+                elif self._depth == 2 and self._key == self.array_key and c == '{':
+                    self._item_start = i
+                self._depth += 1
+            elif c in '}]':
+                if self._depth == 0:
+                    continue
+                self._depth -= 1
+                if self._depth == 2 and self._item_start is not None and c == '}':
+                    item = self._parse(text[self._item_start:i + 1])
+                    if isinstance(item, dict):
+                        items.append(item)
+                        self.items_parsed += 1
+                    else:
+                        self.items_skipped += 1
+                    self._item_start = None
+                    self._last_item_end = i + 1
+                elif self._depth == 1 and self._value_start is not None:
+                    if self._key != self.array_key:
+                        self.fields[self._key] = self._parse(text[self._value_start:i + 1])
+                    self._value_start = None
+                elif self._depth == 0:
+                    self._close_scalar(text, i)
+                    self.complete = True
+            elif self._depth == 1:
+                if c == ':':
+                    self._value_start = i + 1
+                elif c == ',':
+                    self._close_scalar(text, i)
+                    self._expect_key = True
+        self._pos = len(text)
+        return items
+
+    def rewind(self) -> bool:
+        """
+        Cut `text` back to the end of the last complete array element and
+        restore the scanner state there. Returns False if no element has
+        completed yet, in which case there is nothing safe to continue from.
+        """
+        if self._last_item_end is None:
+            return False
+        self.text = self.text[:self._last_item_end]
+        self._pos = len(self.text)
+        self._depth = 2
+        self._in_string = False
+        self._escape = False
+        self._expect_key = False
+        self._key = self.array_key
+        self._value_start = None
+        self._item_start = None
+        self.complete = False
+        return True
+
+    def _close_scalar(self, text: str, end: int):
+        """Finish a scalar member value that ends at index end."""
+        if self._value_start is None or self._key is None:
+            return
+        raw = text[self._value_start:end].strip()
+        if raw:
+            self.fields[self._key] = self._parse(raw)
+        self._value_start = None
+
+    def _parse(self, raw: str):
+        try:
+            return json.loads(raw)
+        except json.JSONDecodeError as e:
+            logger.warning(f'Skipping malformed JSON value in stream: {e}')
+            return None
@@ -0,0 +1,144 @@
+import logging
+import math
+
+from sqlalchemy import text
+
+from app.services.text_utils import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Column order of line_items_fts and the bm25() weight of each column.
+# Identifiers and names matter most; free-text description least.
+INDEX_COLUMNS = (
+    ('product_name', 4.0),
+    ('part_number', 6.0),
+    ('manufacturer', 3.0),
+    ('category', 1.5),
+    ('labor_category', 3.0),
+    ('vendor_name', 3.0),
+    ('contract_number', 5.0),
+    ('document_number', 5.0),
+    ('product_description', 1.0),
+)
+# Columns the Line Item Explorer's free-text box searches.
+EXPLORER_COLUMNS = ('product_name', 'part_number', 'manufacturer', 'product_description')
+
+MAX_QUERY_TERMS = 6
+# Terms found in more than this share of rows are dropped when rarer ones exist.
+MAX_DF_RATIO = 0.4
+
+_available = None
+
+
+def index_available(db_session) -> bool:
+    """Whether the line_items_fts index exists (checked once per process)."""
+    global _available
+    if _available is None:
+        try:
+            with db_session.begin_nested():
+                _available = db_session.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'line_items_fts'"
+                )).first() is not None
+        except Exception:
+            _available = False
+    return _available
+
+
+def indexed_row_count(db_session) -> int:
+    """
+    Number of rows in line_items_fts, kept in line_items_fts_stats by the
+    line_items insert and delete triggers so it costs one row read.
+    """
+    count = db_session.execute(text("SELECT row_count FROM line_items_fts_stats WHERE id = 1")).scalar()
+    if count is None:
+        return db_session.execute(text("SELECT count(*) FROM line_items_fts")).scalar() or 0
+    return count
+
+
+class LineItemSearch:
+    """Ranked keyword search over line items using the line_items_fts inverted index."""
+
+    def select_terms(self, query: str, db_session) -> list:
+        """
+        Reduce a natural-language question to its most discriminative terms.
+        Stopwords and unknown terms are dropped; the rest are ranked by IDF.
+        Returns [(term, idf), ...], rarest first.
+        """
+        terms = list(dict.fromkeys(tokenize(query, min_length=2)))
+        if not terms:
+            return []
+
+        params = {f't{i}': t for i, t in enumerate(terms)}
+        placeholders = ', '.join(f':{k}' for k in params)
+        df = dict(db_session.execute(text(
+            f"SELECT term, doc FROM line_items_fts_vocab WHERE term IN ({placeholders})"
+        ), params).all())
+        total = indexed_row_count(db_session)
+        if not total:
+            return []
+
+        scored = [
+            (t, math.log(1 + (total - df[t] + 0.5) / (df[t] + 0.5)))
+            for t in terms if df.get(t)
+        ]
+        selective = [(t, idf) for t, idf in scored if df[t] <= MAX_DF_RATIO * total]
+        if selective:
+            scored = selective
+        scored.sort(key=lambda x: x[1], reverse=True)
+        return scored[:MAX_QUERY_TERMS]
+
+    def search(self, query: str, db_session, session_id: str, limit: int = 20) -> list:
+        """Return [(line_item_id, score), ...] ranked by weighted BM25."""
+        terms = self.select_terms(query, db_session)
+        if not terms:
+            return []
+
+        match = ' OR '.join(f'"{t}"' for t, _ in terms)
+        weights = ', '.join(str(w) for _, w in INDEX_COLUMNS)
+        rows = db_session.execute(text(f"""
+            SELECT li.id, bm25(line_items_fts, {weights}) AS rank
+            FROM line_items_fts
+            JOIN line_items li ON li.rowid = line_items_fts.rowid
+            WHERE line_items_fts MATCH :match AND li.session_id = :session_id
+            ORDER BY rank
+            LIMIT :limit
+        """), {'match': match, 'session_id': session_id, 'limit': limit}).all()
+        return [(row[0], -row[1]) for row in rows]
+
+
+def resolve_terms(terms: list, db_session):
+    """
+    Map each term to a form present in the index, preferring simple singulars
+    since they also prefix-match the plural. Returns the resolved list, or None
+    if any term is unknown.
+    """
+    candidates = {t: ([t[:-1]] if t.endswith('s') else []) + ([t[:-2]] if t.endswith('es') else []) + [t]
+                  for t in terms}
+    flat = sorted({c for forms in candidates.values() for c in forms})
+    if not flat:
+        return []
+    params = {f't{i}': t for i, t in enumerate(flat)}
+    placeholders = ', '.join(f':{k}' for k in params)
+    known = {row[0] for row in db_session.execute(text(
+        f"SELECT term FROM line_items_fts_vocab WHERE term IN ({placeholders})"
+    ), params).all()}
+
+    resolved = []
+    for t in terms:
+        form = next((c for c in candidates[t] if c in known), None)
+        if form is None:
+            return None
+        resolved.append(form)
+    return resolved
+
+
+def explorer_match_expression(search: str):
+    """
+    FTS5 expression for the explorer search box: every typed word must prefix-match
+    a word in one of the explorer columns. Returns None if nothing is indexable.
+    """
+    words = tokenize(search, drop_stopwords=False)
+    if not words:
+        return None
+    body = ' AND '.join(f'"{w}"*' for w in words)
+    return '{%s}: (%s)' % (' '.join(EXPLORER_COLUMNS), body)
@@ -0,0 +1,367 @@
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "claude-sonnet-4-5-20250929"
+
+# Priority lanes. Interactive calls (chat) are admitted ahead of batch calls
+# (document mapping), and batch work never takes the last free slot.
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+
+DEFAULT_MAX_CONCURRENCY = 4
+MAX_RETRIES = {INTERACTIVE: 2, BATCH: 5}
+BASE_BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 30.0
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+THROTTLE_STATUS = {429, 529}
+# Longest server-requested retry-after honoured; batch calls wait at most this long.
+MAX_RETRY_AFTER_SECONDS = 60.0
+# Interactive calls fail fast instead of waiting longer than this for a retry or a throttle pause.
+INTERACTIVE_MAX_WAIT_SECONDS = 5.0
+# Prompt caching only applies to prefixes of at least this many tokens (Sonnet;
+# smaller prefixes are silently not cached). Token counts are estimated from length.
+MIN_CACHEABLE_TOKENS = 1024
+CHARS_PER_TOKEN = 4
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+class GatewayThrottledError(Exception):
+    """An interactive call was refused because the provider asked callers to wait too long."""
+
+    def __init__(self, wait_seconds: float):
+        super().__init__(f'Model provider is rate limiting; retry in {wait_seconds:.0f}s')
+        self.wait_seconds = wait_seconds
+
+
+def get_llm_gateway():
+    """Return the process-wide LLM gateway, built from app config on first use."""
+    global _gateway
+    if _gateway is None:
+        from flask import current_app
+        with _gateway_lock:
+            if _gateway is None:
+                config = current_app.config
+                if config.get('LLM_GATEWAY') == 'stub':
+                    _gateway = StubLLMGateway()
+                else:
+                    _gateway = LLMGateway(
+                        api_key=config.get('ANTHROPIC_API_KEY', ''),
+                        base_url=config.get('ANTHROPIC_BASE_URL', ''),
+                        max_concurrency=config.get('LLM_MAX_CONCURRENCY', DEFAULT_MAX_CONCURRENCY),
+                    )
+    return _gateway
+
+
+def set_llm_gateway(gateway):
+    """Replace the process-wide gateway (e.g. with a StubLLMGateway in tests)."""
+    global _gateway
+    with _gateway_lock:
+        _gateway = gateway
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit that adapts to provider throttling (AIMD): the limit
+    grows by 1/limit per success and halves on a 429/529, and all callers
+    pause for the retry-after period.
+    """
+
+    def __init__(self, max_limit: int):
+        self.max_limit = max(1, int(max_limit))
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.waiting_interactive = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, priority: str = INTERACTIVE, max_pause: float = None):
+        """Take a slot; raise GatewayThrottledError if callers are paused for longer than max_pause."""
+        with self._cond:
+            if priority == INTERACTIVE:
+                self.waiting_interactive += 1
+            try:
+                while True:
+                    pause = self.paused_until - time.monotonic()
+                    if pause <= 0 and self._has_slot(priority):
+                        break
+                    if max_pause is not None and pause > max_pause:
+                        raise GatewayThrottledError(pause)
+                    self._cond.wait(timeout=pause if pause > 0 else None)
+                self.in_flight += 1
+            finally:
+                if priority == INTERACTIVE:
+                    self.waiting_interactive -= 1
+
+    def release(self, throttled_for: float = None, succeeded: bool = True):
+        """Free a slot; pass throttled_for (seconds) when the call was rate limited."""
+        with self._cond:
+            self.in_flight -= 1
+            if throttled_for is not None:
+                self.limit = max(1.0, self.limit / 2)
+                self.paused_until = max(self.paused_until, time.monotonic() + throttled_for)
+            elif succeeded:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+    def _has_slot(self, priority: str) -> bool:
+        capacity = max(1, int(self.limit))
+        if priority == BATCH:
+            if self.waiting_interactive:
+                return False
+            if capacity > 1:
+                capacity -= 1
+        return self.in_flight < capacity
+
+
+class LLMGateway:
+    """
+    Single entry point for Claude calls. Shares one keep-alive client across
+    the process, retries transient failures with backoff (honouring
+    retry-after, capped), limits concurrency adaptively, marks system prompts
+    long enough to be cached for prompt caching and records token usage and
+    latency per call label. Interactive calls fail fast with
+    GatewayThrottledError rather than wait out a long rate-limit pause.
+    """
+
+    def __init__(self, api_key: str, base_url: str = None,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY, timeout: float = 120.0):
+        self.api_key = api_key
+        self.base_url = base_url or None
+        self.timeout = timeout
+        self.limiter = AdaptiveLimiter(max_concurrency)
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return bool(self.api_key)
+
+    def complete(self, messages: list, system: str = None, max_tokens: int = 1024,
+                 model: str = DEFAULT_MODEL, priority: str = INTERACTIVE,
+                 label: str = 'llm') -> dict:
+        """
+        Run a non-streaming completion.
+        Returns {'text', 'stop_reason', 'usage', 'latency_ms'}; raises on failure.
+        """
+        request = self._request(messages, system, max_tokens, model)
+        retries = MAX_RETRIES.get(priority, 0)
+        for attempt in range(retries + 1):
+            self.limiter.acquire(priority, _max_wait(priority))
+            started = time.monotonic()
+            try:
+                response = self._get_client().messages.create(**request)
+            except Exception as e:
+                delay = self._after_failure(e, attempt, retries, label, priority)
+                time.sleep(delay)
+                continue
+            self.limiter.release()
+            text = ''.join(block.text for block in response.content if block.type == 'text')
+            return {
+                'text': text,
+                'stop_reason': response.stop_reason,
+                'usage': self._record(label, response.usage, started),
+                'latency_ms': round((time.monotonic() - started) * 1000, 1),
+            }
+
+    def stream(self, messages: list, system: str = None, max_tokens: int = 1024,
+               model: str = DEFAULT_MODEL, priority: str = INTERACTIVE, label: str = 'llm'):
+        """
+        Yield text deltas as they are generated. Failures before the first
+        delta are retried; later failures propagate. Closing the generator
+        closes the underlying HTTP stream. The generator's return value is
+        {'stop_reason', 'usage'} (use `yield from` to receive it).
+        """
+        request = self._request(messages, system, max_tokens, model)
+        retries = MAX_RETRIES.get(priority, 0)
+        for attempt in range(retries + 1):
+            self.limiter.acquire(priority, _max_wait(priority))
+            started = time.monotonic()
+            emitted = False
+            try:
+                with self._get_client().messages.stream(**request) as stream:
+                    for text in stream.text_stream:
+                        emitted = True
+                        yield text
+                    message = stream.get_final_message()
+            except GeneratorExit:
+                self.limiter.release(succeeded=False)
+                raise
+            except Exception as e:
+                if emitted:
+                    self.limiter.release(succeeded=False)
+                    self._count(label, 'errors')
+                    raise
+                delay = self._after_failure(e, attempt, retries, label, priority)
+                time.sleep(delay)
+                continue
+            self.limiter.release()
+            usage = self._record(label, message.usage, started)
+            return {'stop_reason': message.stop_reason, 'usage': usage}
+
+    def stats(self) -> dict:
+        """Cumulative call, token and latency counters per label, plus limiter state."""
+        with self._stats_lock:
+            labels = {label: dict(counters) for label, counters in self._stats.items()}
+        return {
+            'concurrency_limit': round(self.limiter.limit, 2),
+            'in_flight': self.limiter.in_flight,
+            'labels': labels,
+        }
+
+    def _get_client(self):
+        if self._client is None:
+            import anthropic
+            with self._client_lock:
+                if self._client is None:
+                    # Retries are handled here so they can feed the limiter
+                    self._client = anthropic.Anthropic(
+                        api_key=self.api_key, base_url=self.base_url,
+                        max_retries=0, timeout=self.timeout,
+                    )
+        return self._client
+
+    def _request(self, messages: list, system: str, max_tokens: int, model: str) -> dict:
+        request = {'model': model, 'max_tokens': max_tokens, 'messages': messages}
+        if system and len(system) >= MIN_CACHEABLE_TOKENS * CHARS_PER_TOKEN:
+            request['system'] = [{'type': 'text', 'text': system, 'cache_control': {'type': 'ephemeral'}}]
+        elif system:
+            # Below the cacheable minimum a cache_control marker is ignored by
+            # the API; the current mapping and chat prompts are this short
+            request['system'] = system
+        return request
+
+    def _after_failure(self, error: Exception, attempt: int, retries: int, label: str,
+                       priority: str = INTERACTIVE) -> float:
+        """Release the slot for a failed call; return the retry delay or re-raise."""
+        status = getattr(error, 'status_code', None)
+        retryable = status in RETRYABLE_STATUS or _is_connection_error(error)
+        delay = _retry_after(error)
+        if delay is None:
+            delay = min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2 ** attempt) * (0.5 + random.random() / 2)
+        delay = min(delay, MAX_RETRY_AFTER_SECONDS)
+
+        if status in THROTTLE_STATUS:
+            self.limiter.release(throttled_for=delay)
+            self._count(label, 'throttled')
+        else:
+            self.limiter.release(succeeded=False)
+
+        if not retryable or attempt >= retries:
+            self._count(label, 'errors')
+            raise error
+        max_wait = _max_wait(priority)
+        if max_wait is not None and delay > max_wait:
+            self._count(label, 'errors')
+            raise GatewayThrottledError(delay) from error
+        logger.warning(f'LLM {label} call failed ({status or type(error).__name__}), '
+                       f'retrying in {delay:.1f}s')
+        self._count(label, 'retries')
+        return delay
+
+    def _record(self, label: str, usage, started: float) -> dict:
+        latency_ms = round((time.monotonic() - started) * 1000, 1)
+        tokens = {
+            'input_tokens': getattr(usage, 'input_tokens', 0) or 0,
+            'output_tokens': getattr(usage, 'output_tokens', 0) or 0,
+            'cache_creation_input_tokens': getattr(usage, 'cache_creation_input_tokens', 0) or 0,
+            'cache_read_input_tokens': getattr(usage, 'cache_read_input_tokens', 0) or 0,
+        }
+        with self._stats_lock:
+            counters = self._stats.setdefault(label, _empty_counters())
+            counters['calls'] += 1
+            counters['latency_ms'] += latency_ms
+            for key, value in tokens.items():
+                counters[key] += value
+        logger.info(f'LLM {label}: {latency_ms}ms, in={tokens["input_tokens"]} '
+                    f'out={tokens["output_tokens"]} cache_read={tokens["cache_read_input_tokens"]}')
+        return tokens
+
+    def _count(self, label: str, counter: str):
+        with self._stats_lock:
+            self._stats.setdefault(label, _empty_counters())[counter] += 1
+
+
+class StubLLMGateway:
+    """
+    Offline stand-in with the LLMGateway interface, for tests and local runs
+    (LLM_GATEWAY=stub). responder(system, messages, label) returns the reply text.
+    """
+
+    available = True
+
+    def __init__(self, responder=None):
+        self.responder = responder or _stub_reply
+        self.calls = []
+
+    def complete(self, messages: list, system: str = None, max_tokens: int = 1024,
+                 model: str = DEFAULT_MODEL, priority: str = INTERACTIVE,
+                 label: str = 'llm') -> dict:
+        self.calls.append({'label': label, 'priority': priority, 'system': system, 'messages': messages})
+        return {
+            'text': self.responder(system, messages, label),
+            'stop_reason': 'end_turn',
+            'usage': {'input_tokens': 0, 'output_tokens': 0,
+                      'cache_creation_input_tokens': 0, 'cache_read_input_tokens': 0},
+            'latency_ms': 0.0,
+        }
+
+    def stream(self, messages: list, system: str = None, max_tokens: int = 1024,
+               model: str = DEFAULT_MODEL, priority: str = INTERACTIVE, label: str = 'llm'):
+        response = self.complete(messages, system, max_tokens, model, priority, label)
+        words = response['text'].split(' ')
+        for i, word in enumerate(words):
+            yield word if i == len(words) - 1 else word + ' '
+        return {'stop_reason': response['stop_reason'], 'usage': response['usage']}
+
+    def stats(self) -> dict:
+        return {'concurrency_limit': None, 'in_flight': 0, 'labels': {'stub': {'calls': len(self.calls)}}}
+
+
+def _stub_reply(system, messages, label) -> str:
+    if label == 'mapping':
+        return '{"document_type": "other", "metadata": {}, "line_items": []}'
+    return 'This is a stub answer; no language model is configured.'
+
+
+def _empty_counters() -> dict:
+    return {
+        'calls': 0, 'errors': 0, 'retries': 0, 'throttled': 0, 'latency_ms': 0.0,
+        'input_tokens': 0, 'output_tokens': 0,
+        'cache_creation_input_tokens': 0, 'cache_read_input_tokens': 0,
+    }
+
+
+def _max_wait(priority: str):
+    return INTERACTIVE_MAX_WAIT_SECONDS if priority == INTERACTIVE else None
+
+
+def _is_connection_error(error: Exception) -> bool:
+    try:
+        import anthropic
+    except ImportError:
+        return False
+    return isinstance(error, anthropic.APIConnectionError)
+
+
+def _retry_after(error: Exception):
+    """Seconds to wait from the retry-after(-ms) headers of an API error, if any."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except ValueError:
+        return None
+    return None
@@ -0,0 +1,135 @@
+import logging
+from datetime import date
+
+logger = logging.getLogger(__name__)
+
+# Series bucket expressions over the ISO observed_on column.
+SERIES_INTERVALS = {
+    'month': '%Y-%m',
+    'year': '%Y',
+}
+
+
+def record_price_observations(session_id: str = '__default__', document_ids: list = None) -> int:
+    """
+    Replace the price observations of the given documents (all of the
+    session's when None) with one row per priced line item, dated by the
+    document's parsed date ordinal. Caller commits. Returns observations written.
+    """
+    from sqlalchemy import insert
+    from app.extensions import db
+    from app.models.document import Document
+    from app.models.line_item import LineItem
+    from app.models.price_observation import PriceObservation
+    from app.services.pricing_engine import invalidate_price_estimates
+
+    stale = PriceObservation.query.filter(PriceObservation.session_id == session_id)
+    query = db.session.query(
+        LineItem.id, LineItem.document_id, LineItem.canonical_product_id, LineItem.unit_price,
+        LineItem.quantity, LineItem.extended_price,
+        Document.document_date_ordinal, Document.vendor_name, Document.document_number,
+    ).join(Document, LineItem.document_id == Document.id)\
+     .filter(LineItem.session_id == session_id)\
+     .filter(LineItem.unit_price.isnot(None))
+    if document_ids is not None:
+        if not document_ids:
+            return 0
+        stale = stale.filter(PriceObservation.document_id.in_(document_ids))
+        query = query.filter(LineItem.document_id.in_(document_ids))
+    touched = {row[0] for row in stale.with_entities(PriceObservation.canonical_product_id).distinct()}
+    stale.delete(synchronize_session=False)
+
+    rows = []
+    for item_id, document_id, product_id, price, quantity, extended, ordinal, vendor, number in query:
+        rows.append({
+            'line_item_id': item_id,
+            'document_id': document_id,
+            'canonical_product_id': product_id,
+            'unit_price': price,
+            'quantity': quantity,
+            'extended_price': extended,
+            'vendor_name': vendor,
+            'document_number': number,
+            'observed_on': date.fromordinal(ordinal) if ordinal else None,
+            'session_id': session_id,
+        })
+    if rows:
+        db.session.execute(insert(PriceObservation), rows)
+    invalidate_price_estimates(touched | {row['canonical_product_id'] for row in rows})
+    return len(rows)
+
+
+def sync_observation_products(session_id: str = '__default__') -> int:
+    """Copy line items' canonical_product_id onto their observations where it changed. Caller commits."""
+    from sqlalchemy import select, update
+    from app.extensions import db
+    from app.models.line_item import LineItem
+    from app.models.price_observation import PriceObservation
+    from app.services.pricing_engine import invalidate_price_estimates
+
+    linked = select(LineItem.canonical_product_id)\
+        .where(LineItem.id == PriceObservation.line_item_id)\
+        .scalar_subquery()
+    moved = db.session.query(PriceObservation.canonical_product_id, linked)\
+        .filter(PriceObservation.session_id == session_id)\
+        .filter(PriceObservation.canonical_product_id.is_not(linked))\
+        .distinct().all()
+    if not moved:
+        return 0
+    invalidate_price_estimates({pid for pair in moved for pid in pair})
+    result = db.session.execute(
+        update(PriceObservation)
+        .where(PriceObservation.session_id == session_id)
+        .where(PriceObservation.canonical_product_id.is_not(linked))
+        .values(canonical_product_id=linked)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount or 0
+
+
+def price_series(product_id: str, interval: str = 'month', date_from=None, date_to=None) -> list:
+    """
+    Downsampled price series of a product: min/avg/max unit price, count and
+    quantity per period, oldest first. Dated observations only; the query is
+    answered from the (product, date, price) index.
+    """
+    from app.extensions import db
+    from app.models.price_observation import PriceObservation
+
+    period = db.func.strftime(SERIES_INTERVALS[interval], PriceObservation.observed_on)
+    query = db.session.query(
+        period.label('period'),
+        db.func.min(PriceObservation.unit_price),
+        db.func.avg(PriceObservation.unit_price),
+        db.func.max(PriceObservation.unit_price),
+        db.func.count(),
+        db.func.sum(PriceObservation.quantity),
+    ).filter(PriceObservation.canonical_product_id == product_id)\
+     .filter(PriceObservation.observed_on.isnot(None))
+    if date_from:
+        query = query.filter(PriceObservation.observed_on >= date_from)
+    if date_to:
+        query = query.filter(PriceObservation.observed_on <= date_to)
+
+    return [
+        {
+            'period': period_key,
+            'min': round(low, 2),
+            'avg': round(mean, 2),
+            'max': round(high, 2),
+            'count': count,
+            'quantity': quantity,
+        }
+        for period_key, low, mean, high, count, quantity in query.group_by(period).order_by(period)
+    ]
+
+
+def backfill_price_observations():
+    """Build observations for every session's existing line items (schema upgrade step)."""
+    from app.extensions import db
+    from app.models.line_item import LineItem
+
+    sessions = [row[0] for row in db.session.query(LineItem.session_id).distinct()]
+    for session_id in sessions:
+        written = record_price_observations(session_id)
+        logger.info(f'Recorded {written} price observations in session {session_id}')
@@ -0,0 +1,291 @@
+"""
+Statistical unit price estimates for canonical products.
+
+Every product's price observations are processed in one vectorized NumPy
+pass: observations are grouped by product, outliers are trimmed in log-price
+space (robust z-score on the median absolute deviation, or Tukey fences on
+the interquartile range), the remainder is averaged with exponential recency
+weights, a weighted log-log regression of price on quantity captures
+quantity breaks, and a t-based confidence interval is derived from the
+weighted spread and the effective sample size.
+
+Estimates are stored in price_estimates. Writes to price_observations delete
+the estimates of the products they touch, and refresh_price_estimates()
+recomputes only products without one (or all with full=True).
+"""
+
+import logging
+from datetime import date, datetime, timezone
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+OUTLIER_METHODS = ('mad', 'iqr')
+# Robust z-score (MAD) or fence multiple (IQR) beyond which a price is an outlier.
+MAD_THRESHOLD = 3.5
+IQR_MULTIPLIER = 1.5
+# Spread floor in log space (about 5%) so groups of identical prices still trim typos.
+MIN_LOG_SPREAD = 0.05
+# Groups smaller than this are not trimmed.
+MIN_TRIM_OBSERVATIONS = 4
+# Quantity breaks need this many observations over at least two quantities.
+MIN_REGRESSION_OBSERVATIONS = 3
+# Fitted elasticities are clipped to this range (prices do not rise with volume here).
+QUANTITY_SLOPE_RANGE = (-1.0, 0.0)
+# Undated observations weigh as much as a dated one this many half-lives old.
+UNDATED_HALF_LIVES = 2.0
+CONFIDENCE_LEVEL = 0.95
+# Two-sided 95% Student t quantiles by degrees of freedom; the normal value beyond.
+_T_95 = np.array([
+    np.inf, 12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042,
+])
+_Z_95 = 1.960
+
+
+def estimate_prices(groups: np.ndarray, prices: np.ndarray, quantities: np.ndarray,
+                    ages: np.ndarray, n_groups: int, half_life_days: float = 365.0,
+                    outlier_method: str = 'mad') -> dict:
+    """
+    Vectorized per-group price statistics.
+
+    groups: int group index per observation (0..n_groups-1); prices: unit
+    prices (> 0); quantities: order quantities (NaN when unknown); ages: days
+    since the observation (NaN when undated). Returns a dict of arrays of
+    length n_groups: estimate, median, std, ci_low, ci_high, slope,
+    ref_quantity, n, n_used, n_trimmed, n_eff. Groups without observations
+    hold NaN estimates.
+    """
+    if outlier_method not in OUTLIER_METHODS:
+        raise ValueError(f'Unknown outlier method: {outlier_method}')
+    log_prices = np.log(prices)
+    counts = np.bincount(groups, minlength=n_groups)
+
+    outliers = _outliers(groups, log_prices, counts, outlier_method)
+    keep = ~outliers
+    g, p, lp, q = groups[keep], prices[keep], log_prices[keep], quantities[keep]
+    age = np.where(np.isnan(ages[keep]), UNDATED_HALF_LIVES * half_life_days, np.maximum(ages[keep], 0.0))
+    w = np.exp2(-age / half_life_days)
+
+    sum_w = np.bincount(g, weights=w, minlength=n_groups)
+    sum_w2 = np.bincount(g, weights=w * w, minlength=n_groups)
+    used = np.bincount(g, minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(g, weights=w * p, minlength=n_groups) / sum_w
+        variance = np.bincount(g, weights=w * (p - mean[g]) ** 2, minlength=n_groups) / sum_w
+        n_eff = sum_w * sum_w / sum_w2
+        # Bessel-style correction with the effective sample size
+        variance = np.where(n_eff > 1, variance * n_eff / (n_eff - 1), 0.0)
+        std = np.sqrt(variance)
+        half_width = _t_quantile(n_eff - 1) * std / np.sqrt(n_eff)
+    single = n_eff <= 1
+    half_width[single] = np.nan
+
+    median = np.exp(_group_quantile(g, lp, used, 0.5))
+    slope, ref_quantity = _quantity_breaks(g, lp, q, w, n_groups)
+
+    return {
+        'estimate': mean,
+        'median': median,
+        'std': std,
+        'ci_low': np.maximum(mean - half_width, 0.0),
+        'ci_high': mean + half_width,
+        'slope': slope,
+        'ref_quantity': ref_quantity,
+        'n': counts,
+        'n_used': used,
+        'n_trimmed': counts - used,
+        'n_eff': n_eff,
+    }
+
+
+def refresh_price_estimates(session_id: str = '__default__', product_ids: list = None,
+                            full: bool = False) -> int:
+    """
+    Recompute stored estimates: for product_ids when given, otherwise for
+    every product with observations but no estimate (all of them when full).
+    Caller commits. Returns estimates written.
+    """
+    from flask import current_app
+    from sqlalchemy import insert
+    from app.extensions import db
+    from app.models.price_estimate import PriceEstimate
+    from app.models.price_observation import PriceObservation
+
+    query = db.session.query(
+        PriceObservation.canonical_product_id, PriceObservation.unit_price,
+        PriceObservation.quantity, db.func.julianday(PriceObservation.observed_on),
+        PriceObservation.observed_on,
+    ).filter(PriceObservation.session_id == session_id)\
+     .filter(PriceObservation.canonical_product_id.isnot(None))\
+     .filter(PriceObservation.unit_price > 0)
+    stale = PriceEstimate.query.filter(PriceEstimate.session_id == session_id)
+    if product_ids is not None:
+        if not product_ids:
+            return 0
+        query = query.filter(PriceObservation.canonical_product_id.in_(product_ids))
+        stale = stale.filter(PriceEstimate.canonical_product_id.in_(product_ids))
+    elif not full:
+        estimated = db.session.query(PriceEstimate.canonical_product_id)\
+            .filter(PriceEstimate.session_id == session_id)
+        query = query.filter(PriceObservation.canonical_product_id.notin_(estimated))
+        stale = None
+
+    rows = query.all()
+    if stale is not None:
+        stale.delete(synchronize_session=False)
+    if not rows:
+        return 0
+
+    codes = {}
+    groups = np.fromiter((codes.setdefault(r[0], len(codes)) for r in rows), dtype=np.int64, count=len(rows))
+    prices = np.fromiter((r[1] for r in rows), dtype=np.float64, count=len(rows))
+    quantities = np.fromiter((r[2] if r[2] and r[2] > 0 else np.nan for r in rows),
+                             dtype=np.float64, count=len(rows))
+    today = _julian_day(date.today())
+    ages = np.fromiter((today - r[3] if r[3] is not None else np.nan for r in rows),
+                       dtype=np.float64, count=len(rows))
+    latest = {}
+    for product_id, _, _, _, observed_on in rows:
+        if observed_on and (product_id not in latest or observed_on > latest[product_id]):
+            latest[product_id] = observed_on
+
+    method = current_app.config.get('PRICE_OUTLIER_METHOD', 'mad')
+    half_life = current_app.config.get('PRICE_HALF_LIFE_DAYS', 365.0)
+    stats = estimate_prices(groups, prices, quantities, ages, len(codes), half_life, method)
+
+    now = datetime.now(timezone.utc)
+    estimates = []
+    for product_id, i in codes.items():
+        if not stats['n_used'][i]:
+            continue
+        estimates.append({
+            'canonical_product_id': product_id,
+            'estimated_price': round(float(stats['estimate'][i]), 2),
+            'median_price': round(float(stats['median'][i]), 2),
+            'std_dev': round(float(stats['std'][i]), 2),
+            'ci_low': _rounded(stats['ci_low'][i]),
+            'ci_high': _rounded(stats['ci_high'][i]),
+            'confidence_level': CONFIDENCE_LEVEL,
+            'quantity_slope': _rounded(stats['slope'][i], 4),
+            'reference_quantity': _rounded(stats['ref_quantity'][i], 4),
+            'observations': int(stats['n'][i]),
+            'observations_used': int(stats['n_used'][i]),
+            'outliers_trimmed': int(stats['n_trimmed'][i]),
+            'effective_sample_size': round(float(stats['n_eff'][i]), 2),
+            'latest_observation': latest.get(product_id),
+            'method': f'{method}/half-life {half_life:g}d',
+            'computed_at': now,
+            'session_id': session_id,
+        })
+    db.session.execute(insert(PriceEstimate), estimates)
+    return len(estimates)
+
+
+def invalidate_price_estimates(product_ids) -> int:
+    """Delete the stored estimates of products whose observations changed. Caller commits."""
+    from app.models.price_estimate import PriceEstimate
+
+    product_ids = [pid for pid in set(product_ids) if pid]
+    if not product_ids:
+        return 0
+    return PriceEstimate.query.filter(PriceEstimate.canonical_product_id.in_(product_ids))\
+        .delete(synchronize_session=False)
+
+
+def get_price_estimates(session_id: str, product_ids: list) -> dict:
+    """
+    Stored estimates of the given products, computing any that are missing
+    (invalidated since their last refresh). Caller commits. Returns
+    {product_id: PriceEstimate}.
+    """
+    from app.extensions import db
+    from app.models.price_estimate import PriceEstimate
+
+    product_ids = list(set(product_ids))
+    if not product_ids:
+        return {}
+    found = {e.canonical_product_id: e for e in PriceEstimate.query.filter(
+        PriceEstimate.canonical_product_id.in_(product_ids))}
+    missing = [pid for pid in product_ids if pid not in found]
+    if missing and refresh_price_estimates(session_id, missing):
+        db.session.flush()
+        found.update({e.canonical_product_id: e for e in PriceEstimate.query.filter(
+            PriceEstimate.canonical_product_id.in_(missing))})
+    return found
+
+
+def _outliers(groups: np.ndarray, values: np.ndarray, counts: np.ndarray, method: str) -> np.ndarray:
+    """Mask of values outside their group's robust bounds (groups below MIN_TRIM_OBSERVATIONS are kept)."""
+    if method == 'mad':
+        median = _group_quantile(groups, values, counts, 0.5)
+        deviation = np.abs(values - median[groups])
+        spread = np.maximum(1.4826 * _group_quantile(groups, deviation, counts, 0.5), MIN_LOG_SPREAD)
+        outside = deviation > MAD_THRESHOLD * spread[groups]
+    else:
+        q1 = _group_quantile(groups, values, counts, 0.25)
+        q3 = _group_quantile(groups, values, counts, 0.75)
+        spread = np.maximum(q3 - q1, MIN_LOG_SPREAD)
+        outside = (values < (q1 - IQR_MULTIPLIER * spread)[groups]) | (values > (q3 + IQR_MULTIPLIER * spread)[groups])
+    return outside & (counts[groups] >= MIN_TRIM_OBSERVATIONS)
+
+
+def _group_quantile(groups: np.ndarray, values: np.ndarray, counts: np.ndarray, q: float) -> np.ndarray:
+    """Linearly interpolated q-quantile of values within each group (NaN for empty groups)."""
+    result = np.full(len(counts), np.nan)
+    if not len(values):
+        return result
+    order = np.lexsort((values, groups))
+    ordered = values[order]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    present = counts > 0
+    position = starts[present] + q * (counts[present] - 1)
+    low = np.floor(position).astype(np.int64)
+    high = np.minimum(low + 1, starts[present] + counts[present] - 1)
+    fraction = position - low
+    result[present] = ordered[low] * (1 - fraction) + ordered[high] * fraction
+    return result
+
+
+def _quantity_breaks(groups: np.ndarray, log_prices: np.ndarray, quantities: np.ndarray,
+                     weights: np.ndarray, n_groups: int) -> tuple:
+    """
+    Weighted least squares of log price on log quantity per group. Returns
+    (slope, reference quantity) arrays; the slope is NaN where quantities do
+    not vary enough to fit, and the reference is the weighted geometric mean
+    quantity.
+    """
+    known = ~np.isnan(quantities)
+    g, y, w = groups[known], log_prices[known], weights[known]
+    x = np.log(quantities[known])
+    sw = np.bincount(g, weights=w, minlength=n_groups)
+    sx = np.bincount(g, weights=w * x, minlength=n_groups)
+    sy = np.bincount(g, weights=w * y, minlength=n_groups)
+    sxx = np.bincount(g, weights=w * x * x, minlength=n_groups)
+    sxy = np.bincount(g, weights=w * x * y, minlength=n_groups)
+    n = np.bincount(g, minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        denominator = sw * sxx - sx * sx
+        fit = (n >= MIN_REGRESSION_OBSERVATIONS) & (denominator > 1e-9 * np.maximum(sw * sw, 1e-12))
+        slope = np.where(fit, (sw * sxy - sx * sy) / np.where(fit, denominator, 1.0), np.nan)
+        ref_quantity = np.where(sw > 0, np.exp(sx / np.where(sw > 0, sw, 1.0)), np.nan)
+    return np.clip(slope, *QUANTITY_SLOPE_RANGE), ref_quantity
+
+
+def _t_quantile(df: np.ndarray) -> np.ndarray:
+    """Two-sided 95% t quantile for (possibly fractional) degrees of freedom."""
+    df = np.nan_to_num(df, nan=0.0)
+    index = np.clip(np.floor(df).astype(np.int64), 1, len(_T_95))
+    table = np.append(_T_95, _Z_95)
+    return table[index]
+
+
+def _julian_day(day: date) -> float:
+    # SQLite julianday() of midnight: proleptic Gregorian ordinal offset
+    return day.toordinal() + 1721424.5
+
+
+def _rounded(value, digits: int = 2):
+    return None if value is None or np.isnan(value) else round(float(value), digits)
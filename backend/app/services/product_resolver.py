@@ -0,0 +1,311 @@
+import json
+import logging
+import re
+import threading
+
+from app.services.text_utils import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Labels sometimes captured together with the value, e.g. "P/N: 210-BGCD".
+_PART_LABEL_RE = re.compile(
+    r'^\s*(?:P/?N|MPN|SKU|PART\s*(?:NO|NUMBER|#)|MFR\.?\s*(?:P/?N|PART\s*(?:NO|#)|#)|CAT(?:ALOG)?\s*(?:NO|#))'
+    r'\s*[:#.]?\s*',
+    re.I,
+)
+# A leading alphabetic token followed by a separator, e.g. "DELL-" in "DELL-210-BGCD".
+_PREFIX_RE = re.compile(r'^([A-Za-z]+)[\s:_/-]+(?=\w)')
+_NON_ALNUM_RE = re.compile(r'[^A-Z0-9]')
+
+# Manufacturer and reseller prefixes stripped from part numbers in addition to
+# the row's own manufacturer name.
+VENDOR_PREFIXES = frozenset({
+    'DELL', 'CSCO', 'CISCO', 'HP', 'HPE', 'LEN', 'LENOVO', 'MSFT', 'MICROSOFT',
+    'VMW', 'VMWARE', 'CRWD', 'PANW', 'FTNT', 'JNPR', 'NTAP', 'APC', 'CDW', 'SHI',
+})
+
+# Part numbers shorter than this (after normalization) are too generic to key on.
+MIN_PART_KEY_LENGTH = 3
+# Product ids per IN (...) lookup when reloading changed products.
+_LOOKUP_CHUNK = 500
+
+_resolvers = {}
+_resolvers_lock = threading.Lock()
+
+
+def normalize_part_number(value, manufacturer: str = None) -> str:
+    """
+    Lookup key for a part number: labels and vendor prefixes removed,
+    upper-cased, punctuation and spaces dropped. "P/N dell-210-bgcd" and
+    "210 BGCD" both become "210BGCD". Returns '' for unusable values.
+    """
+    if not value:
+        return ''
+    text = _PART_LABEL_RE.sub('', str(value).strip())
+    prefix = _PREFIX_RE.match(text)
+    if prefix:
+        head = prefix.group(1).upper()
+        if head in VENDOR_PREFIXES or head in _manufacturer_tokens(manufacturer):
+            text = text[prefix.end():]
+    key = _NON_ALNUM_RE.sub('', text.upper())
+    return key if len(key) >= MIN_PART_KEY_LENGTH else ''
+
+
+def normalize_alias(value) -> str:
+    """Lookup key for a product name or alias: lower-cased word tokens."""
+    return ' '.join(tokenize(value or '', drop_stopwords=False))
+
+
+def normalize_manufacturer(value) -> str:
+    """First word of a manufacturer name ("Dell Technologies" -> "dell")."""
+    tokens = tokenize(value or '', drop_stopwords=False)
+    return tokens[0] if tokens else ''
+
+
+class ProductResolver:
+    """
+    In-memory hash index from normalized part numbers and name aliases to
+    canonical product ids. A part number that maps to several products is
+    disambiguated by manufacturer; otherwise it is left unresolved.
+    Candidate lists are replaced rather than mutated, so a copy() can be
+    updated while other threads resolve against the original.
+    """
+
+    def __init__(self, version: int = None):
+        self.version = version
+        self.parts = {}
+        self.aliases = {}
+        self._keys = {}
+
+    def add(self, kind: str, key: str, product_id: str, manufacturer_key: str = ''):
+        index = self.parts if kind == 'part_number' else self.aliases
+        candidates = index.get(key, [])
+        if all(pid != product_id for pid, _ in candidates):
+            index[key] = candidates + [(product_id, manufacturer_key or '')]
+            self._keys[product_id] = self._keys.get(product_id, ()) + ((kind, key),)
+
+    def remove(self, product_id: str):
+        """Drop every key of a product."""
+        for kind, key in self._keys.pop(product_id, ()):
+            index = self.parts if kind == 'part_number' else self.aliases
+            candidates = [c for c in index.get(key, []) if c[0] != product_id]
+            if candidates:
+                index[key] = candidates
+            else:
+                index.pop(key, None)
+
+    def copy(self, version: int = None) -> 'ProductResolver':
+        resolver = ProductResolver(version)
+        resolver.parts = dict(self.parts)
+        resolver.aliases = dict(self.aliases)
+        resolver._keys = dict(self._keys)
+        return resolver
+
+    def resolve(self, part_number: str = None, manufacturer: str = None, product_name: str = None):
+        """Return the canonical product id for a line item's identifiers, or None."""
+        manufacturer_key = normalize_manufacturer(manufacturer)
+        key = normalize_part_number(part_number, manufacturer)
+        if key:
+            product_id = _pick(self.parts.get(key), manufacturer_key)
+            if product_id:
+                return product_id
+        alias = normalize_alias(product_name)
+        if alias:
+            return _pick(self.aliases.get(alias), manufacturer_key)
+        return None
+
+    def __len__(self):
+        return len(self.parts) + len(self.aliases)
+
+
+def get_product_resolver(session_id: str = '__default__', refresh: bool = False) -> ProductResolver:
+    """
+    Return the session's resolver. When identifiers were rewritten since it
+    was built (see catalog_changes), only the changed products are reloaded;
+    a full identifier sync or refresh=True rebuilds it from product_identifiers.
+    """
+    from app.extensions import db
+    from app.models.product_identifier import ProductIdentifier
+
+    version = get_catalog_version(session_id)
+    with _resolvers_lock:
+        cached = _resolvers.get(session_id)
+        if cached is not None and cached.version == version and not refresh:
+            return cached
+
+    changed = None
+    if cached is not None and not refresh and cached.version < version:
+        changed = changed_products_since(session_id, cached.version)
+    columns = (ProductIdentifier.kind, ProductIdentifier.normalized_key,
+               ProductIdentifier.canonical_product_id, ProductIdentifier.manufacturer_key)
+    if changed is None:
+        resolver = ProductResolver(version)
+        rows = db.session.query(*columns).filter(ProductIdentifier.session_id == session_id)
+    else:
+        resolver = cached.copy(version)
+        for product_id in changed:
+            resolver.remove(product_id)
+        rows = []
+        changed = sorted(changed)
+        for start in range(0, len(changed), _LOOKUP_CHUNK):
+            rows += db.session.query(*columns).filter(
+                ProductIdentifier.canonical_product_id.in_(changed[start:start + _LOOKUP_CHUNK])).all()
+    for kind, key, product_id, manufacturer_key in rows:
+        resolver.add(kind, key, product_id, manufacturer_key)
+    with _resolvers_lock:
+        _resolvers[session_id] = resolver
+    return resolver
+
+
+def get_catalog_version(session_id: str = '__default__') -> int:
+    """The session's latest catalog_changes id (0 if identifiers were never synced)."""
+    from sqlalchemy import func
+    from app.extensions import db
+    from app.models.data_version import CatalogChange
+
+    return db.session.query(func.max(CatalogChange.id))\
+        .filter(CatalogChange.session_id == session_id).scalar() or 0
+
+
+def changed_products_since(session_id: str, since_version: int):
+    """
+    Return the ids of products whose identifiers changed after since_version,
+    or None if the whole catalog was resynced since then (a full rebuild).
+    """
+    from app.extensions import db
+    from app.models.data_version import CatalogChange
+
+    product_ids = set()
+    for (product_id,) in db.session.query(CatalogChange.canonical_product_id)\
+            .filter(CatalogChange.session_id == session_id, CatalogChange.id > since_version):
+        if product_id is None:
+            return None
+        product_ids.add(product_id)
+    return product_ids
+
+
+def sync_product_identifiers(products: list, full: bool = False) -> int:
+    """
+    Replace the identifier rows of the given products with keys derived from
+    their canonical name, known_aliases and known_part_numbers, and log the
+    change for resolvers. Pass full=True when products is the whole catalog
+    (products may have been deleted); resolvers then rebuild and older log
+    rows are dropped. Caller commits. Returns identifier rows written.
+    """
+    from app.extensions import db
+    from app.models.data_version import CatalogChange
+    from app.models.product_identifier import ProductIdentifier
+    from app.services.canonicalizer import shingles, signature_bytes
+
+    if not products:
+        return 0
+    ProductIdentifier.query.filter(
+        ProductIdentifier.canonical_product_id.in_([p.id for p in products])
+    ).delete(synchronize_session=False)
+
+    written = 0
+    for product in products:
+        manufacturer_key = normalize_manufacturer(product.manufacturer)
+        seen = set()
+        entries = [('alias', v, normalize_alias(v))
+                   for v in [product.canonical_name] + _json_list(product.known_aliases)]
+        entries += [('part_number', v, normalize_part_number(v, product.manufacturer))
+                     for v in _json_list(product.known_part_numbers)]
+        for kind, value, key in entries:
+            if not key or (kind, key) in seen:
+                continue
+            seen.add((kind, key))
+            db.session.add(ProductIdentifier(
+                canonical_product_id=product.id,
+                kind=kind,
+                value=str(value)[:500],
+                normalized_key=key[:500],
+                manufacturer_key=manufacturer_key[:100],
+                minhash=signature_bytes(shingles(value)) if kind == 'alias' else None,
+                session_id=product.session_id or '__default__',
+            ))
+            written += 1
+
+    if full:
+        for session_id in {p.session_id or '__default__' for p in products}:
+            marker = CatalogChange(session_id=session_id, canonical_product_id=None)
+            db.session.add(marker)
+            db.session.flush()
+            CatalogChange.query.filter(
+                CatalogChange.session_id == session_id, CatalogChange.id < marker.id,
+            ).delete(synchronize_session=False)
+    else:
+        db.session.add_all([
+            CatalogChange(session_id=p.session_id or '__default__', canonical_product_id=p.id)
+            for p in products
+        ])
+    db.session.flush()
+    return written
+
+
+def link_line_items(session_id: str = '__default__', document_ids: list = None,
+                    unlinked_only: bool = False) -> int:
+    """
+    Resolve canonical_product_id for a session's line items (optionally only
+    those of document_ids, or only those not linked yet) and update the rows
+    whose link changed. Caller commits. Returns rows updated.
+    """
+    from sqlalchemy import update
+    from app.extensions import db
+    from app.models.line_item import LineItem
+
+    resolver = get_product_resolver(session_id)
+    query = db.session.query(
+        LineItem.id, LineItem.part_number, LineItem.manufacturer,
+        LineItem.product_name, LineItem.canonical_product_id,
+    ).filter(LineItem.session_id == session_id)
+    if document_ids is not None:
+        query = query.filter(LineItem.document_id.in_(document_ids))
+    if unlinked_only:
+        query = query.filter(LineItem.canonical_product_id.is_(None))
+
+    updates = []
+    for item_id, part_number, manufacturer, product_name, current in query:
+        product_id = resolver.resolve(part_number, manufacturer, product_name)
+        if product_id != current:
+            updates.append({'id': item_id, 'canonical_product_id': product_id})
+    if updates:
+        db.session.execute(update(LineItem), updates)
+    return len(updates)
+
+
+def backfill_product_links():
+    """Build identifiers for existing products and link every line item (schema upgrade step)."""
+    from app.extensions import db
+    from app.models.canonical_product import CanonicalProduct
+    from app.services.price_observations import sync_observation_products
+
+    sessions = [row[0] for row in db.session.query(CanonicalProduct.session_id).distinct()]
+    for session_id in sessions:
+        sync_product_identifiers(CanonicalProduct.query.filter_by(session_id=session_id).all(), full=True)
+        linked = link_line_items(session_id)
+        sync_observation_products(session_id)
+        logger.info(f'Linked {linked} line items to canonical products in session {session_id}')
+
+
+def _pick(candidates, manufacturer_key: str):
+    if not candidates:
+        return None
+    if len(candidates) == 1:
+        return candidates[0][0]
+    matching = {pid for pid, mfr in candidates if manufacturer_key and mfr == manufacturer_key}
+    return matching.pop() if len(matching) == 1 else None
+
+
+def _manufacturer_tokens(manufacturer: str) -> set:
+    return {t.upper() for t in tokenize(manufacturer or '', drop_stopwords=False)}
+
+
+def _json_list(value) -> list:
+    if not value:
+        return []
+    try:
+        parsed = json.loads(value)
+    except (json.JSONDecodeError, TypeError):
+        return []
+    return [v for v in parsed if isinstance(v, str) and v.strip()] if isinstance(parsed, list) else []
@@ -0,0 +1,113 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+# Standard RRF damping constant; larger values flatten the rank curve.
+RRF_K = 60
+RETRIEVAL_TIMEOUT_SECONDS = 3.0
+# Each further hit from an already-selected document keeps this share of its score.
+DIVERSITY_DECAY = 0.6
+# Vector hits scoring below this cosine similarity are dropped before fusion. On
+# the hashed n-gram embeddings, unrelated text scores up to ~0.1 against a query.
+VECTOR_MIN_SCORE = 0.12
+# SQLite VM instructions between checks of a leg's cancellation flag.
+_PROGRESS_INTERVAL = 10_000
+
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='retrieval')
+
+
+def run_legs(legs: dict, timeout: float = RETRIEVAL_TIMEOUT_SECONDS) -> dict:
+    """
+    Run retrieval legs concurrently, each in its own app context and DB session.
+    legs maps a name to a callable taking a db session and returning a ranked list.
+    Legs that fail or miss the deadline contribute an empty list. At the
+    deadline, legs not yet started are cancelled and running ones are
+    interrupted at their next SQLite statement step (a progress handler), so
+    they free their pool thread; time spent outside SQL (e.g. the vector
+    scan) cannot be interrupted and runs to completion.
+    """
+    from flask import current_app
+    from app.extensions import db
+
+    app = current_app._get_current_object()
+    cancelled = threading.Event()
+
+    def _run(fn):
+        with app.app_context():
+            connection = db.session.connection()
+            raw = connection.connection.driver_connection if connection.dialect.name == 'sqlite' else None
+            if raw is not None:
+                raw.set_progress_handler(lambda: 1 if cancelled.is_set() else 0, _PROGRESS_INTERVAL)
+            try:
+                return fn(db.session)
+            finally:
+                if raw is not None:
+                    raw.set_progress_handler(None, 0)
+
+    futures = {name: _executor.submit(_run, fn) for name, fn in legs.items()}
+    wait(futures.values(), timeout=timeout)
+    cancelled.set()
+
+    results = {}
+    for name, future in futures.items():
+        if not future.done():
+            future.cancel()
+            logger.warning(f'Retrieval leg {name} exceeded {timeout}s, skipping')
+            results[name] = []
+            continue
+        try:
+            results[name] = future.result() or []
+        except Exception as e:
+            logger.error(f'Retrieval leg {name} failed: {e}')
+            results[name] = []
+    return results
+
+
+def result_key(result: dict) -> tuple:
+    """Identity of a retrieval hit, used to merge the same hit across legs."""
+    if result.get('type') == 'line_item':
+        return ('line_item', result.get('line_item_id'))
+    return ('chunk', result.get('chunk_id'))
+
+
+def reciprocal_rank_fusion(ranked_lists: list, k: int = RRF_K, weights: list = None) -> list:
+    """
+    Fuse ranked result lists: score(d) = sum over lists of w / (k + rank(d)).
+    Returns merged results (first-seen copy of each) ordered by fused score,
+    with the score stored under 'rrf_score'.
+    """
+    weights = weights or [1.0] * len(ranked_lists)
+    scores, items = {}, {}
+    for ranked, weight in zip(ranked_lists, weights):
+        for rank, result in enumerate(ranked, 1):
+            key = result_key(result)
+            scores[key] = scores.get(key, 0.0) + weight / (k + rank)
+            items.setdefault(key, result)
+
+    fused = []
+    for key in sorted(scores, key=scores.get, reverse=True):
+        result = dict(items[key])
+        result['rrf_score'] = round(scores[key], 6)
+        fused.append(result)
+    return fused
+
+
+def diversify(results: list, limit: int, decay: float = DIVERSITY_DECAY) -> list:
+    """
+    Greedy re-rank that discounts repeated hits from the same document,
+    so one long document cannot crowd every other source out of the context.
+    """
+    remaining = list(results)
+    per_doc = {}
+    selected = []
+    while remaining and len(selected) < limit:
+        best_idx = max(
+            range(len(remaining)),
+            key=lambda i: remaining[i]['rrf_score'] * decay ** per_doc.get(remaining[i].get('document_id'), 0),
+        )
+        best = remaining.pop(best_idx)
+        per_doc[best.get('document_id')] = per_doc.get(best.get('document_id'), 0) + 1
+        selected.append(best)
+    return selected
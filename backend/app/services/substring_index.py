@@ -0,0 +1,101 @@
+import logging
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Trigram (FTS5 'trigram' tokenizer) indexes over identifier-like columns, keyed by
+# source table: (index table, indexed columns). Values are stored normalized.
+TRIGRAM_INDEXES = {
+    'line_items': ('line_items_trigram', ('part_number', 'manufacturer_part_number')),
+    'documents': ('documents_trigram', ('vendor_name', 'document_number', 'contract_number', 'original_filename')),
+}
+# Line item columns the explorer search box matches as substrings.
+PART_NUMBER_COLUMNS = ('part_number', 'manufacturer_part_number')
+
+# Punctuation dropped before indexing and matching, so "35F-123", "35F 123" and "35f123" agree.
+SEPARATORS = ' -./_,#():\'"'
+# Trigram lookups need at least one whole trigram; shorter needles fall back to ILIKE.
+MIN_NEEDLE_LENGTH = 3
+
+_STRIP = str.maketrans('', '', SEPARATORS)
+_available = None
+
+
+def normalize_identifier(value) -> str:
+    """Lowercase value with SEPARATORS removed ('' for None)."""
+    return str(value).translate(_STRIP).lower() if value is not None else ''
+
+
+def normalized_sql(expression: str) -> str:
+    """SQL expression stripping SEPARATORS from a column (the trigram tokenizer folds case itself)."""
+    for char in SEPARATORS:
+        literal = char.replace("'", "''")
+        expression = f"replace({expression}, '{literal}', '')"
+    return expression
+
+
+def trigram_needle(needle: str):
+    """Normalized needle when long enough for a trigram lookup, else None."""
+    normalized = normalize_identifier(needle or '')
+    return normalized if len(normalized) >= MIN_NEEDLE_LENGTH else None
+
+
+def contains(needle: str, value) -> bool:
+    """Whether value matches needle the way substring_filter does (normalized when indexable)."""
+    normalized = trigram_needle(needle)
+    if normalized:
+        return normalized in normalize_identifier(value)
+    return needle.lower() in str(value).lower()
+
+
+def trigram_available(db_session) -> bool:
+    """Whether the trigram indexes exist (checked once per process)."""
+    global _available
+    if _available is None:
+        try:
+            with db_session.begin_nested():
+                _available = db_session.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'documents_trigram'"
+                )).first() is not None
+        except Exception:
+            _available = False
+    return _available
+
+
+def trigram_match(columns: tuple, needle: str):
+    """FTS5 expression matching needle as a substring of any of columns, or None if too short."""
+    normalized = trigram_needle(needle)
+    if normalized is None:
+        return None
+    return '{%s} : "%s"' % (' '.join(columns), normalized.replace('"', '""'))
+
+
+def substring_filter(model, columns: tuple, needle: str, db_session):
+    """
+    Condition for "any of model's columns contains needle": a rowid lookup in
+    the table's trigram index, or ILIKE '%needle%' when the needle is shorter
+    than a trigram or the index is missing.
+    """
+    from app.extensions import db
+
+    table = model.__tablename__
+    index, _ = TRIGRAM_INDEXES[table]
+    match = trigram_match(columns, needle)
+    if match is None or not trigram_available(db_session):
+        return db.or_(*(getattr(model, column).ilike(f'%{needle}%') for column in columns))
+    param = f"{index}_{'_'.join(columns)}"
+    return db.text(
+        f'{table}.rowid IN (SELECT rowid FROM {index} WHERE {index} MATCH :{param})'
+    ).bindparams(**{param: match})
+
+
+def substring_rowids(table: str, columns: tuple, needle: str, db_session) -> list:
+    """Rowids of table whose columns contain needle, from the trigram index ([] if not indexable)."""
+    index, _ = TRIGRAM_INDEXES[table]
+    match = trigram_match(columns, needle)
+    if match is None or not trigram_available(db_session):
+        return []
+    return [row[0] for row in db_session.execute(
+        text(f'SELECT rowid FROM {index} WHERE {index} MATCH :match'), {'match': match},
+    )]
@@ -0,0 +1,25 @@
+import re
+
+# Words that carry no retrieval signal in procurement questions
+STOPWORDS = frozenset("""
+a about above after all also am an and any are as at be been before being
+between both but by can could did do does doing down during each few for from
+further get got had has have having he her here hers him his how i if in into
+is it its just me more most my no nor not now of off on once only or other our
+ours out over own same she should show so some such than that the their them
+then there these they this those through to too under until up us very was we
+were what when where which while who whom why will with would you your
+""".split())
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text: str, drop_stopwords: bool = True, min_length: int = 1) -> list:
+    """Lowercase and split text into alphanumeric tokens."""
+    if not text:
+        return []
+    tokens = _TOKEN_RE.findall(text.lower())
+    return [
+        t for t in tokens
+        if len(t) >= min_length and not (drop_stopwords and t in STOPWORDS)
+    ]
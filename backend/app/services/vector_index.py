@@ -0,0 +1,316 @@
+import fcntl
+import logging
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from app.services.embedder import EMBEDDING_DIM, blob_to_vector
+
+logger = logging.getLogger(__name__)
+
+# Below this many rows a brute-force matrix-vector product is fastest.
+IVF_MIN_ROWS = 50_000
+IVF_TRAIN_SAMPLE = 100_000
+IVF_ITERATIONS = 8
+DEFAULT_NPROBE = 12
+# Fold the delta into the base matrix once it grows past this fraction.
+COMPACT_FRACTION = 0.1
+COMPACT_MIN_ROWS = 1_000
+_ASSIGN_BLOCK = 65_536
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_vector_index(session_id: str = '__default__') -> 'VectorIndex':
+    """Return the process-wide vector index for a session."""
+    from flask import current_app
+    folder = current_app.config.get('VECTOR_INDEX_FOLDER', '/app/data/vectors')
+    with _indexes_lock:
+        index = _indexes.get((folder, session_id))
+        if index is None:
+            index = VectorIndex(session_id, folder)
+            _indexes[(folder, session_id)] = index
+        return index
+
+
+class VectorIndex:
+    """
+    Nearest-neighbour index over a session's chunk embeddings.
+
+    The bulk of the vectors live in a memory-mapped .npy matrix on disk; rows
+    added since the last compaction sit in a small delta matrix, and removed
+    rows are tombstoned. Large indexes are partitioned with a spherical k-means
+    inverted file (IVF) so a query only scores the closest few clusters.
+    The index follows the session data version and only re-reads chunks of
+    documents that changed.
+    """
+
+    def __init__(self, session_id: str, folder: str):
+        self.session_id = session_id
+        self.folder = folder
+        safe = re.sub(r'[^A-Za-z0-9_.-]', '_', session_id)
+        self._prefix = os.path.join(folder, safe)
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.version = None
+        self.base = np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+        self.base_ids = np.zeros(0, dtype='S36')
+        self.base_docs = np.zeros(0, dtype='S36')
+        self.base_alive = np.zeros(0, dtype=bool)
+        self.delta = np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+        self.delta_ids = np.zeros(0, dtype='S36')
+        self.delta_docs = np.zeros(0, dtype='S36')
+        self.delta_alive = np.zeros(0, dtype=bool)
+        self.centroids = None
+        self.ivf_order = None
+        self.ivf_offsets = None
+
+    # ── Public API ──────────────────────────────────────────────
+
+    def __len__(self):
+        return int(self.base_alive.sum() + self.delta_alive.sum())
+
+    def sync(self):
+        """Bring the index up to the session's current data version."""
+        from app.services.data_version import get_data_version, changed_documents_since
+
+        current = get_data_version(self.session_id)
+        if self.version == current:
+            return
+        with self._lock, self._file_lock():
+            self._load()
+            if self.version == current:
+                return
+            current, changed = changed_documents_since(self.session_id, self.version)
+            if changed is None:
+                self._rebuild(current)
+            else:
+                self._apply_changes(changed, current)
+            self._save()
+
+    def search(self, query_vector: np.ndarray, k: int = 10, nprobe: int = DEFAULT_NPROBE) -> list:
+        """Return [(chunk_id, score), ...] for the k most similar chunks."""
+        q = np.asarray(query_vector, dtype=np.float32)
+        if k <= 0 or not np.any(q):
+            return []
+
+        with self._lock:
+            cand_scores, cand_ids = [], []
+
+            if len(self.base_ids):
+                if self.centroids is not None:
+                    rows = self._probe(q, nprobe)
+                    scores = self.base[rows] @ q
+                else:
+                    rows = None
+                    scores = self.base @ q
+                alive = self.base_alive[rows] if rows is not None else self.base_alive
+                scores = np.where(alive, scores, -np.inf)
+                top = _top_k(scores, k)
+                cand_scores.append(scores[top])
+                cand_ids.append(self.base_ids[rows[top] if rows is not None else top])
+
+            if len(self.delta_ids):
+                scores = np.where(self.delta_alive, self.delta @ q, -np.inf)
+                top = _top_k(scores, k)
+                cand_scores.append(scores[top])
+                cand_ids.append(self.delta_ids[top])
+
+        if not cand_scores:
+            return []
+        scores = np.concatenate(cand_scores)
+        ids = np.concatenate(cand_ids)
+        order = _top_k(scores, k)
+        return [
+            (ids[i].decode('ascii'), float(scores[i]))
+            for i in order
+            if np.isfinite(scores[i])
+        ]
+
+    # ── Maintenance ─────────────────────────────────────────────
+
+    def _rebuild(self, version: int):
+        ids, docs, matrix = self._fetch_vectors(document_ids=None)
+        self._reset()
+        self.base, self.base_ids, self.base_docs = matrix, ids, docs
+        self.base_alive = np.ones(len(ids), dtype=bool)
+        self._train_ivf()
+        self.version = version
+        self._write_base()
+        logger.info(f'Vector index rebuilt for {self.session_id}: {len(ids)} chunks')
+
+    def _apply_changes(self, changed_doc_ids: set, version: int):
+        if changed_doc_ids:
+            changed = np.array(sorted(changed_doc_ids), dtype='S36')
+            if len(self.base_docs):
+                self.base_alive = self.base_alive & ~np.isin(self.base_docs, changed)
+            keep = ~np.isin(self.delta_docs, changed)
+            self.delta = self.delta[keep]
+            self.delta_ids = self.delta_ids[keep]
+            self.delta_docs = self.delta_docs[keep]
+            self.delta_alive = self.delta_alive[keep]
+
+            ids, docs, matrix = self._fetch_vectors(document_ids=list(changed_doc_ids))
+            self.delta = np.vstack([self.delta, matrix])
+            self.delta_ids = np.concatenate([self.delta_ids, ids])
+            self.delta_docs = np.concatenate([self.delta_docs, docs])
+            self.delta_alive = np.concatenate([self.delta_alive, np.ones(len(ids), dtype=bool)])
+        self.version = version
+
+        dead = len(self.base_alive) - int(self.base_alive.sum())
+        churn = len(self.delta_ids) + dead
+        if churn > max(COMPACT_MIN_ROWS, COMPACT_FRACTION * len(self.base_ids)):
+            self._compact()
+
+    def _compact(self):
+        """Fold the delta into the base matrix and drop tombstoned rows."""
+        alive = self.base_alive
+        self.base = np.vstack([np.asarray(self.base[alive]), self.delta[self.delta_alive]])
+        self.base_ids = np.concatenate([self.base_ids[alive], self.delta_ids[self.delta_alive]])
+        self.base_docs = np.concatenate([self.base_docs[alive], self.delta_docs[self.delta_alive]])
+        self.base_alive = np.ones(len(self.base_ids), dtype=bool)
+        self.delta = np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+        self.delta_ids = np.zeros(0, dtype='S36')
+        self.delta_docs = np.zeros(0, dtype='S36')
+        self.delta_alive = np.zeros(0, dtype=bool)
+        self._train_ivf()
+        self._write_base()
+
+    def _fetch_vectors(self, document_ids=None):
+        from app.extensions import db
+        from app.models.document_chunk import DocumentChunk
+
+        q = db.session.query(DocumentChunk.id, DocumentChunk.document_id, DocumentChunk.embedding)\
+            .filter(DocumentChunk.session_id == self.session_id)\
+            .filter(DocumentChunk.embedding.isnot(None))
+        ids, docs, vectors = [], [], []
+        batches = [None] if document_ids is None else [
+            document_ids[i:i + 500] for i in range(0, len(document_ids), 500)
+        ]
+        for batch in batches:
+            bq = q if batch is None else q.filter(DocumentChunk.document_id.in_(batch))
+            for chunk_id, doc_id, blob in bq.yield_per(5000):
+                vec = blob_to_vector(blob)
+                if vec is None:
+                    continue
+                ids.append(chunk_id)
+                docs.append(doc_id)
+                vectors.append(vec)
+        matrix = np.vstack(vectors) if vectors else np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+        return np.array(ids, dtype='S36'), np.array(docs, dtype='S36'), matrix
+
+    # ── IVF ─────────────────────────────────────────────────────
+
+    def _train_ivf(self):
+        n = len(self.base_ids)
+        if n < IVF_MIN_ROWS:
+            self.centroids = self.ivf_order = self.ivf_offsets = None
+            return
+        nlist = int(min(4096, max(16, np.sqrt(n))))
+        rng = np.random.default_rng(0)
+        sample_size = min(n, IVF_TRAIN_SAMPLE, 64 * nlist)
+        sample = np.asarray(self.base[np.sort(rng.choice(n, size=sample_size, replace=False))])
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(IVF_ITERATIONS):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            order = np.argsort(assign, kind='stable')
+            starts = np.searchsorted(assign[order], np.arange(nlist))
+            sums = np.add.reduceat(sample[order], np.minimum(starts, len(order) - 1), axis=0)
+            sums[np.bincount(assign, minlength=nlist) == 0] = 0
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            empty = norms[:, 0] == 0
+            sums[empty] = centroids[empty]
+            norms[empty] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+
+        assign = np.empty(n, dtype=np.int32)
+        for start in range(0, n, _ASSIGN_BLOCK):
+            block = np.asarray(self.base[start:start + _ASSIGN_BLOCK])
+            assign[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        self.centroids = centroids
+        self.ivf_order = np.argsort(assign, kind='stable').astype(np.int64)
+        self.ivf_offsets = np.searchsorted(assign[self.ivf_order], np.arange(nlist + 1))
+
+    def _probe(self, q: np.ndarray, nprobe: int) -> np.ndarray:
+        lists = _top_k(self.centroids @ q, min(nprobe, len(self.centroids)))
+        rows = np.concatenate([
+            self.ivf_order[self.ivf_offsets[c]:self.ivf_offsets[c + 1]] for c in lists
+        ])
+        # Sorted row order keeps mmap reads sequential
+        return np.sort(rows)
+
+    # ── Persistence ─────────────────────────────────────────────
+
+    @contextmanager
+    def _file_lock(self):
+        os.makedirs(self.folder, exist_ok=True)
+        with open(self._prefix + '.lock', 'w') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _write_base(self):
+        tmp = self._prefix + '.vectors.tmp.npy'
+        np.save(tmp, np.asarray(self.base, dtype=np.float32))
+        os.replace(tmp, self._prefix + '.vectors.npy')
+        self.base = np.load(self._prefix + '.vectors.npy', mmap_mode='r')
+
+    def _save(self):
+        tmp = self._prefix + '.meta.tmp.npz'
+        extra = {}
+        if self.centroids is not None:
+            extra = {'centroids': self.centroids, 'ivf_order': self.ivf_order,
+                     'ivf_offsets': self.ivf_offsets}
+        with open(tmp, 'wb') as fh:
+            np.savez(
+                fh,
+                version=np.int64(self.version),
+                base_ids=self.base_ids, base_docs=self.base_docs, base_alive=self.base_alive,
+                delta=self.delta, delta_ids=self.delta_ids, delta_docs=self.delta_docs,
+                delta_alive=self.delta_alive, **extra,
+            )
+        os.replace(tmp, self._prefix + '.meta.npz')
+
+    def _load(self):
+        """Pick up state persisted by this or another worker process."""
+        meta_path = self._prefix + '.meta.npz'
+        vec_path = self._prefix + '.vectors.npy'
+        if not (os.path.exists(meta_path) and os.path.exists(vec_path)):
+            return
+        try:
+            with np.load(meta_path) as meta:
+                version = int(meta['version'])
+                if self.version is not None and version <= self.version:
+                    return
+                base = np.load(vec_path, mmap_mode='r')
+                if base.shape != (len(meta['base_ids']), EMBEDDING_DIM):
+                    return
+                self.base = base
+                for name in ('base_ids', 'base_docs', 'base_alive',
+                             'delta', 'delta_ids', 'delta_docs', 'delta_alive'):
+                    setattr(self, name, meta[name])
+                if 'centroids' in meta:
+                    self.centroids = meta['centroids']
+                    self.ivf_order = meta['ivf_order']
+                    self.ivf_offsets = meta['ivf_offsets']
+                else:
+                    self.centroids = self.ivf_order = self.ivf_offsets = None
+                self.version = version
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f'Ignoring unreadable vector index at {self._prefix}: {e}')
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k largest scores, highest first."""
+    if len(scores) <= k:
+        return np.argsort(-scores, kind='stable')
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind='stable')]
@@ -0,0 +1,52 @@
+import contextlib
+import io
+
+import pytest
+
+from app import create_app
+from app.config import config
+
+
+def _reset_caches():
+    """Drop process-wide caches keyed by session and data version, which would outlive a test's database."""
+    from app.services import (
+        analytics_snapshot, answer_cache, autocomplete, classifiers, line_item_search, llm_gateway,
+        product_resolver, substring_index, vector_index,
+    )
+
+    for cache in (analytics_snapshot._snapshots, autocomplete._indexes, classifiers._classifiers,
+                  product_resolver._resolvers, vector_index._indexes):
+        cache.clear()
+    line_item_search._available = substring_index._available = None
+    answer_cache._cache = llm_gateway._gateway = None
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """App on a fresh SQLite database seeded with the demo data, using the offline model stub."""
+    monkeypatch.setattr(config['testing'], 'SQLALCHEMY_DATABASE_URI', f'sqlite:///{tmp_path}/test.db')
+    monkeypatch.setattr(config['testing'], 'UPLOAD_FOLDER', str(tmp_path / 'uploads'))
+    monkeypatch.setattr(config['testing'], 'VECTOR_INDEX_FOLDER', str(tmp_path / 'vectors'))
+    monkeypatch.setattr(config['testing'], 'MODEL_FOLDER', str(tmp_path / 'models'))
+    monkeypatch.setattr(config['testing'], 'LLM_GATEWAY', 'stub')
+    monkeypatch.setattr(config['testing'], 'ANTHROPIC_API_KEY', '')
+    _reset_caches()
+
+    app = create_app('testing')
+    with app.app_context():
+        from app.seed import seed
+        with contextlib.redirect_stdout(io.StringIO()):
+            seed()
+        yield app
+    _reset_caches()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth_headers(app):
+    from flask_jwt_extended import create_access_token
+    return {'Authorization': f'Bearer {create_access_token(identity="admin")}'}
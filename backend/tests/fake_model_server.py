@@ -0,0 +1,94 @@
+"""
+Minimal stand-in for the Anthropic Messages API, for tests that exercise the
+real SDK and HTTP path. Point LLMGateway(base_url=server.url) at it. Streaming
+requests get the documented SSE event sequence, one text delta per token.
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeModelServer:
+    def __init__(self, tokens: list, delay: float = 0.0):
+        self.tokens = tokens
+        self.delay = delay
+        self.requests = []
+        self.completed = threading.Event()
+        self.aborted = threading.Event()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'FakeModelServer':
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                server.requests.append(body)
+                if body.get('stream'):
+                    self._stream(body)
+                else:
+                    self._reply(body)
+
+            def _reply(self, body):
+                payload = json.dumps(_message(body['model'], ''.join(server.tokens), 'end_turn')).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _stream(self, body):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.end_headers()
+                events = [('message_start', {'type': 'message_start', 'message': _message(body['model'], None, None)}),
+                          ('content_block_start', {'type': 'content_block_start', 'index': 0,
+                                                   'content_block': {'type': 'text', 'text': ''}})]
+                events += [('content_block_delta', {'type': 'content_block_delta', 'index': 0,
+                                                    'delta': {'type': 'text_delta', 'text': token}})
+                           for token in server.tokens]
+                events += [('content_block_stop', {'type': 'content_block_stop', 'index': 0}),
+                           ('message_delta', {'type': 'message_delta',
+                                              'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+                                              'usage': {'output_tokens': len(server.tokens)}}),
+                           ('message_stop', {'type': 'message_stop'})]
+                try:
+                    for name, data in events:
+                        self.wfile.write(f'event: {name}\ndata: {json.dumps(data)}\n\n'.encode())
+                        self.wfile.flush()
+                        if name == 'content_block_delta' and server.delay:
+                            time.sleep(server.delay)
+                except (BrokenPipeError, ConnectionResetError):
+                    server.aborted.set()
+                    return
+                server.completed.set()
+
+        return Handler
+
+
+def _message(model: str, text, stop_reason) -> dict:
+    return {
+        'id': 'msg_fake', 'type': 'message', 'role': 'assistant', 'model': model,
+        'content': [{'type': 'text', 'text': text}] if text is not None else [],
+        'stop_reason': stop_reason, 'stop_sequence': None,
+        'usage': {'input_tokens': 10, 'output_tokens': 0 if text is None else 1},
+    }
@@ -0,0 +1,54 @@
+from datetime import date
+
+import pytest
+
+from app.services.aggregate_router import AggregateIntentParser, _vendor_aliases
+
+VOCABULARY = {
+    'vendors': ['Total Network Solutions Inc', 'Top Gun Supply LLC', 'First Federal Systems', 'Dell Technologies'],
+    'categories': ['Software'],
+    'contracts': [],
+}
+
+
+@pytest.fixture
+def parser():
+    return AggregateIntentParser(VOCABULARY, today=date(2025, 10, 1))
+
+
+@pytest.mark.parametrize('vendor, word', [
+    ('Total Network Solutions Inc', 'total'),
+    ('Top Gun Supply LLC', 'top'),
+    ('First Federal Systems', 'first'),
+])
+def test_common_first_words_are_not_vendor_aliases(vendor, word):
+    assert word not in _vendor_aliases(vendor)
+
+
+def test_distinctive_first_word_is_vendor_alias():
+    assert 'dell' in _vendor_aliases('Dell Technologies')
+
+
+@pytest.mark.parametrize('question', ['What is our total spend?', 'Show top vendors by spend'])
+def test_headline_questions_are_not_vendor_filtered(parser, question):
+    intent = parser.parse(question)
+    assert intent['metric'] == 'spend'
+    assert 'vendor' not in intent['filters']
+
+
+def test_full_vendor_name_still_filters(parser):
+    intent = parser.parse('How much did we spend with Total Network Solutions?')
+    assert intent['filters']['vendor'] == ['Total Network Solutions Inc']
+
+
+@pytest.mark.parametrize('question, metric', [
+    ('How many laptops did we buy?', 'quantity'),
+    ('How many monitors?', 'quantity'),
+    ('How many items did we order from Dell?', 'quantity'),
+    ('How many licenses do we have?', 'quantity'),
+    ('How many line items are there?', 'count'),
+    ('How many items are there?', 'count'),
+    ('How many invoices did we get?', 'documents'),
+])
+def test_how_many_metric(parser, question, metric):
+    assert parser.parse(question)['metric'] == metric
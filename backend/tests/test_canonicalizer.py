@@ -0,0 +1,67 @@
+import pytest
+
+from app.services.canonicalizer import MERGE_THRESHOLD, NameRecord, model_tokens, score_pair, shingles
+
+SEED_PART_PRODUCTS = {
+    '210-BBBQ': 'cp000003-0000-0000-0000-000000000003',
+    '210-AZYB': 'cp000009-0000-0000-0000-000000000009',
+    '338-CBXJ': 'cp000010-0000-0000-0000-000000000010',
+}
+
+
+def _record(name, description=None):
+    record = NameRecord(name.lower())
+    record.tokens = shingles(name, description)
+    record.models = model_tokens(record.tokens)
+    return record
+
+
+def test_description_years_are_not_model_tokens():
+    senior = _record('Senior Developer', 'Full-stack development and system architecture - September 2025')
+    junior = _record('Junior Developer', 'Front-end development and bug fixes - September 2025')
+    assert '2025' not in senior.tokens
+    assert score_pair(senior, junior) < MERGE_THRESHOLD
+
+
+def test_description_model_numbers_still_count():
+    assert 'p2422h' in shingles('Dell Monitor', 'Dell P2422H 24 inch monitor, 2024 model year')
+
+
+@pytest.mark.parametrize('a, b', [
+    ('Help Desk Tier 1 Support', 'Help Desk Tier 2 Support'),
+    ('Systems Engineer Level II', 'Systems Engineer Level III'),
+])
+def test_differing_qualifiers_conflict(a, b):
+    assert score_pair(_record(a), _record(b)) == 0.0
+
+
+def test_qualifier_on_one_side_only_does_not_conflict():
+    assert score_pair(_record('Help Desk Tier 1 Support'), _record('Help Desk Support')) > 0.0
+
+
+def _products_by_name(db):
+    from app.models.line_item import LineItem
+    return {name: product_id for name, product_id in db.session.query(LineItem.product_name,
+                                                                        LineItem.canonical_product_id)}
+
+
+@pytest.mark.parametrize('full', [False, True])
+def test_rebuild_keeps_labor_categories_apart(client, auth_headers, full):
+    from app.extensions import db
+
+    response = client.post('/api/products/rebuild', headers=auth_headers, json={'full': full})
+    assert response.status_code == 200
+    products = _products_by_name(db)
+    assert products['Senior Developer'] != products['Junior Developer']
+    assert products['Help Desk Tier 1 Support'] != products['Help Desk Tier 2 Support']
+
+
+@pytest.mark.parametrize('full', [False, True])
+def test_rebuild_keeps_part_number_products(client, auth_headers, full):
+    from app.services.product_resolver import get_product_resolver
+
+    response = client.post('/api/products/rebuild', headers=auth_headers, json={'full': full})
+    assert response.status_code == 200
+    resolver = get_product_resolver(refresh=True)
+    for part_number, product_id in SEED_PART_PRODUCTS.items():
+        assert resolver.resolve(part_number, 'Dell Technologies') == product_id
@@ -0,0 +1,15 @@
+def test_failed_aggregate_route_keeps_new_conversation(client, auth_headers, monkeypatch):
+    from app.services.aggregate_router import AggregateIntentParser
+
+    def broken(self, query):
+        raise RuntimeError('parser failed')
+
+    monkeypatch.setattr(AggregateIntentParser, 'parse', broken)
+    response = client.post('/api/chat', headers=auth_headers, json={'message': 'What is our total spend?'})
+    assert response.status_code == 200
+    conversation_id = response.get_json()['conversation_id']
+
+    stored = client.get(f'/api/chat/conversations/{conversation_id}', headers=auth_headers)
+    assert stored.status_code == 200
+    assert [t['question'] for t in stored.get_json()['turns']] == ['What is our total spend?']
+
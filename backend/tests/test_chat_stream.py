@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from fake_model_server import FakeModelServer
+
+QUESTION = 'Tell me about the Dell Latitude quote'
+
+
+@pytest.fixture
+def fake_model(app):
+    from app.services.llm_gateway import LLMGateway, set_llm_gateway
+
+    servers = []
+
+    def start(tokens, delay=0.0):
+        server = FakeModelServer(tokens, delay).start()
+        servers.append(server)
+        set_llm_gateway(LLMGateway(api_key='test-key', base_url=server.url))
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def _events(chunks):
+    """Parse SSE chunks into (event, data) pairs."""
+    buffer = ''
+    for chunk in chunks:
+        buffer += chunk.decode()
+        while '\n\n' in buffer:
+            block, buffer = buffer.split('\n\n', 1)
+            fields = dict(line.split(': ', 1) for line in block.splitlines() if ': ' in line)
+            yield fields['event'], json.loads(fields['data'])
+
+
+def test_stream_emits_sources_tokens_done(client, auth_headers, fake_model):
+    server = fake_model(['The ', 'Latitude ', 'quote ', 'is ', '$1,175 ', 'per ', 'unit.'])
+
+    response = client.post('/api/chat/stream', headers=auth_headers, json={'message': QUESTION})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    events = list(_events([response.get_data()]))
+
+    names = [name for name, _ in events]
+    assert names[0] == 'sources' and names[-1] == 'done'
+    assert set(names[1:-1]) == {'token'}
+    assert events[0][1]['conversation_id']
+    assert ''.join(data['text'] for name, data in events if name == 'token') == ''.join(server.tokens)
+    assert server.requests[0]['stream'] is True
+    assert server.completed.is_set()
+
+
+def test_client_disconnect_cancels_model_stream(client, auth_headers, fake_model):
+    server = fake_model([f'word{i} ' for i in range(500)], delay=0.01)
+
+    response = client.post('/api/chat/stream', headers=auth_headers, json={'message': QUESTION}, buffered=False)
+    events = _events(response.iter_encoded())
+    assert next(events)[0] == 'sources'
+    assert next(events)[0] == 'token'
+    response.close()
+
+    # Closing the response closes the upstream HTTP stream long before the model finishes
+    assert server.aborted.wait(timeout=5)
+    assert not server.completed.is_set()
@@ -0,0 +1,27 @@
+import numpy as np
+
+from app.services.classifiers import get_line_item_classifier, learn_line_item_labels
+
+LAPTOP = {'product_name': 'Dell Latitude 5550 Laptop', 'part_number': '210-BGCD', 'manufacturer': 'Dell',
+          'category': 'Hardware', 'sub_category': 'Laptops'}
+LICENSE = {'product_name': 'Falcon Endpoint Protection License', 'part_number': 'FAL-EP-1Y',
+           'manufacturer': 'CrowdStrike', 'category': 'Software', 'sub_category': 'Security'}
+MONITOR = {'product_name': 'Dell 27 Monitor P2725H', 'part_number': '210-BBBQ', 'manufacturer': 'Dell',
+           'category': 'Hardware', 'sub_category': 'Monitors'}
+
+
+def test_learning_swaps_in_a_copy_instead_of_mutating_the_shared_classifier(app):
+    learn_line_item_labels('__default__', add=[LAPTOP, LICENSE])
+    shared = get_line_item_classifier()
+    classes = list(shared.category_model.classes)
+    counts = shared.category_model.feature_counts.copy()
+    before = shared.predict([MONITOR])
+
+    learn_line_item_labels('__default__', add=[MONITOR, {**LICENSE, 'category': 'Services'}])
+
+    assert shared.category_model.classes == classes
+    assert np.array_equal(shared.category_model.feature_counts, counts)
+    assert shared.predict([MONITOR]) == before
+    updated = get_line_item_classifier()
+    assert updated is not shared
+    assert 'Services' in updated.category_model.classes
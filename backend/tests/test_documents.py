@@ -0,0 +1,16 @@
+import pytest
+
+from app.api.documents import PROCESS_BATCH_MAX_DOCUMENTS
+
+
+def test_process_batch_rejects_oversized_requests(client, auth_headers):
+    ids = [f'doc-{i}' for i in range(PROCESS_BATCH_MAX_DOCUMENTS + 1)]
+    response = client.post('/api/documents/process-batch', headers=auth_headers, json={'document_ids': ids})
+    assert response.status_code == 400
+    assert 'process-queue' in response.get_json()['message']
+
+
+@pytest.mark.parametrize('limit', ['100', 0, True, 2.5])
+def test_process_batch_validates_limit(client, auth_headers, limit):
+    response = client.post('/api/documents/process-batch', headers=auth_headers, json={'limit': limit})
+    assert response.status_code == 400
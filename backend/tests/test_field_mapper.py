@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+from app.services.field_mapper import FieldMapper
+
+DOC1 = {'document_id': 'doc1', 'document_type': 'vendor_quote', 'metadata': {'vendor_name': 'Dell'},
+        'line_items': [{'product_name': 'Latitude 5550', 'quantity': 2}]}
+DOC2 = {'document_id': 'doc2', 'document_type': 'invoice', 'metadata': {},
+        'line_items': [{'product_name': 'P2725H Monitor', 'quantity': 4}]}
+
+
+class StreamingGateway:
+    """Streams text in small chunks, then ends with stop_reason or raises error."""
+
+    available = True
+
+    def __init__(self, text, stop_reason='end_turn', error=None):
+        self.text = text
+        self.stop_reason = stop_reason
+        self.error = error
+        self.labels = []
+
+    def stream(self, messages, system=None, max_tokens=1024, model=None, priority=None, label='llm'):
+        self.labels.append(label)
+        for i in range(0, len(self.text), 7):
+            yield self.text[i:i + 7]
+        if self.error:
+            raise self.error
+        return {'stop_reason': self.stop_reason, 'usage': {}}
+
+
+def _documents():
+    return [{'key': key, 'raw_tables': [], 'document_text': 'text', 'file_format': 'pdf'}
+            for key in ('doc1', 'doc2')]
+
+
+def test_map_batch_streams_all_documents():
+    gateway = StreamingGateway(json.dumps({'documents': [DOC1, DOC2]}))
+    results = FieldMapper(gateway).map_batch(_documents())
+    assert gateway.labels == ['mapping_batch']
+    assert set(results) == {'doc1', 'doc2'}
+    assert results['doc2']['line_items'] == DOC2['line_items']
+    assert 'document_id' not in results['doc1']
+
+
+@pytest.mark.parametrize('ending', [
+    {'stop_reason': 'max_tokens'},
+    {'error': TimeoutError('read timed out')},
+])
+def test_map_batch_keeps_finished_documents_of_a_cut_off_response(ending):
+    text = json.dumps({'documents': [DOC1, DOC2]})
+    gateway = StreamingGateway(text[:text.index('P2725H')], **ending)
+    results = FieldMapper(gateway).map_batch(_documents())
+    assert set(results) == {'doc1'}
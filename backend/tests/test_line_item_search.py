@@ -0,0 +1,41 @@
+from sqlalchemy import text
+
+from app.services.line_item_search import indexed_row_count
+
+
+def _scan_count(session):
+    return session.execute(text('SELECT count(*) FROM line_items_fts')).scalar()
+
+
+def _stored_count(session):
+    return session.execute(text('SELECT row_count FROM line_items_fts_stats WHERE id = 1')).scalar()
+
+
+def test_indexed_row_count_follows_inserts_and_deletes(app):
+    from app.extensions import db
+    from app.models.line_item import LineItem
+
+    assert indexed_row_count(db.session) == _stored_count(db.session) == _scan_count(db.session) > 0
+
+    item = LineItem.query.first()
+    db.session.add(LineItem(document_id=item.document_id, product_name='Dell Pro Dock WD25',
+                            session_id='__default__'))
+    db.session.flush()
+    # Exact inside the open transaction too
+    assert indexed_row_count(db.session) == _scan_count(db.session)
+
+    db.session.delete(item)
+    db.session.commit()
+    assert indexed_row_count(db.session) == _scan_count(db.session)
+
+
+def test_indexed_row_count_is_initialized_for_existing_rows(app):
+    from app import _init_line_items_fts
+    from app.extensions import db
+
+    expected = _scan_count(db.session)
+    db.session.execute(text('DROP TRIGGER line_items_fts_count_ai'))
+    db.session.execute(text('DELETE FROM line_items_fts_stats'))
+    db.session.commit()
+    _init_line_items_fts()
+    assert _stored_count(db.session) == expected
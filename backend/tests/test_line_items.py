@@ -0,0 +1,39 @@
+MONITOR = 'cp000003-0000-0000-0000-000000000003'
+LAPTOP = 'cp000001-0000-0000-0000-000000000001'
+
+
+def _monitor_item():
+    from app.models.line_item import LineItem
+    return LineItem.query.filter_by(part_number='210-BBBQ').first()
+
+
+def test_editing_identity_fields_relinks_item_and_observations(client, auth_headers):
+    from app.extensions import db
+    from app.models.price_observation import PriceObservation
+    from app.services.product_resolver import link_line_items
+    from app.services.price_observations import record_price_observations
+
+    link_line_items('__default__')
+    record_price_observations('__default__')
+    db.session.commit()
+    item = _monitor_item()
+    assert item.canonical_product_id == MONITOR
+
+    response = client.put(f'/api/line-items/{item.id}', headers=auth_headers,
+                          json={'part_number': '210-BGCD', 'product_name': 'Dell Latitude 5550 Laptop'})
+    assert response.status_code == 200
+    assert response.get_json()['canonical_product_id'] == LAPTOP
+    observations = PriceObservation.query.filter_by(line_item_id=item.id).all()
+    assert observations and {o.canonical_product_id for o in observations} == {LAPTOP}
+
+
+def test_editing_other_fields_keeps_link(client, auth_headers):
+    from app.extensions import db
+    from app.services.product_resolver import link_line_items
+
+    link_line_items('__default__')
+    db.session.commit()
+    item = _monitor_item()
+    response = client.put(f'/api/line-items/{item.id}', headers=auth_headers, json={'unit_of_issue': 'BX'})
+    assert response.status_code == 200
+    assert response.get_json()['canonical_product_id'] == MONITOR
@@ -0,0 +1,78 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import llm_gateway
+from app.services.llm_gateway import (
+    BATCH, CHARS_PER_TOKEN, INTERACTIVE, MAX_RETRY_AFTER_SECONDS, MIN_CACHEABLE_TOKENS,
+    GatewayThrottledError, LLMGateway,
+)
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after):
+        super().__init__('rate limited')
+        self.response = SimpleNamespace(headers={'retry-after': str(retry_after)})
+
+
+def _reply(text='ok'):
+    return SimpleNamespace(
+        content=[SimpleNamespace(type='text', text=text)], stop_reason='end_turn',
+        usage=SimpleNamespace(input_tokens=1, output_tokens=1),
+    )
+
+
+def _gateway(*outcomes):
+    """Gateway whose client raises or returns each outcome in turn."""
+    outcomes = list(outcomes)
+
+    def create(**request):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    gateway = LLMGateway(api_key='test')
+    gateway._client = SimpleNamespace(messages=SimpleNamespace(create=create))
+    return gateway
+
+
+def test_short_system_prompt_is_not_marked_for_caching():
+    request = LLMGateway(api_key='test')._request([], 'short prompt', 10, 'model')
+    assert request['system'] == 'short prompt'
+
+
+def test_long_system_prompt_is_marked_for_caching():
+    system = 'x' * (MIN_CACHEABLE_TOKENS * CHARS_PER_TOKEN)
+    request = LLMGateway(api_key='test')._request([], system, 10, 'model')
+    assert request['system'][0]['cache_control'] == {'type': 'ephemeral'}
+
+
+def test_interactive_call_fails_fast_on_long_retry_after(monkeypatch):
+    slept = []
+    monkeypatch.setattr(llm_gateway.time, 'sleep', slept.append)
+    gateway = _gateway(RateLimited(60), _reply())
+
+    started = time.monotonic()
+    with pytest.raises(GatewayThrottledError):
+        gateway.complete([{'role': 'user', 'content': 'hi'}], priority=INTERACTIVE)
+    assert slept == [] and time.monotonic() - started < 1
+
+    # Later interactive callers are refused while the pause lasts, without queueing
+    with pytest.raises(GatewayThrottledError):
+        gateway.complete([{'role': 'user', 'content': 'hi'}], priority=INTERACTIVE)
+    assert gateway.limiter.in_flight == 0
+
+
+def test_batch_call_waits_capped_retry_after(monkeypatch):
+    slept = []
+    monkeypatch.setattr(llm_gateway.time, 'sleep', slept.append)
+    gateway = _gateway(RateLimited(3600), _reply('done'))
+    # The throttle pause itself is the limiter's business; only the retry sleep is under test
+    monkeypatch.setattr(gateway.limiter, 'acquire', lambda priority, max_pause=None: None)
+
+    assert gateway.complete([{'role': 'user', 'content': 'hi'}], priority=BATCH)['text'] == 'done'
+    assert slept == [MAX_RETRY_AFTER_SECONDS]
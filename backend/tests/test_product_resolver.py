@@ -0,0 +1,58 @@
+import json
+
+from app.services.product_resolver import get_product_resolver, sync_product_identifiers
+
+MONITOR = 'cp000003-0000-0000-0000-000000000003'
+LAPTOP = 'cp000001-0000-0000-0000-000000000001'
+
+
+def test_data_version_bumps_do_not_rebuild_the_resolver(app):
+    from app.extensions import db
+    from app.services.data_version import bump_data_version
+
+    resolver = get_product_resolver()
+    bump_data_version('__default__')
+    db.session.commit()
+    assert get_product_resolver() is resolver
+
+
+def test_identifier_sync_reloads_only_changed_products(app):
+    from app.extensions import db
+    from app.models.canonical_product import CanonicalProduct
+
+    shared = get_product_resolver()
+    assert shared.resolve('210-BBBQ', 'Dell') == MONITOR
+    monitor = db.session.get(CanonicalProduct, MONITOR)
+    monitor.known_part_numbers = json.dumps(['210-ZZZZ'])
+    sync_product_identifiers([monitor])
+    db.session.commit()
+
+    resolver = get_product_resolver()
+    assert resolver is not shared
+    assert resolver.resolve('210-ZZZZ', 'Dell') == MONITOR
+    assert resolver.resolve('210-BBBQ', 'Dell') is None
+    assert resolver.resolve('210-BGCD', 'Dell') == LAPTOP
+    # Threads still holding the previous resolver keep a consistent view
+    assert shared.resolve('210-BBBQ', 'Dell') == MONITOR
+    assert shared.resolve('210-ZZZZ', 'Dell') is None
+
+
+def test_full_sync_rebuilds_without_deleted_products(app):
+    from app.extensions import db
+    from app.models.canonical_product import CanonicalProduct
+    from app.models.line_item import LineItem
+    from app.models.price_estimate import PriceEstimate
+    from app.models.price_observation import PriceObservation
+    from app.models.product_identifier import ProductIdentifier
+
+    assert get_product_resolver().resolve('210-BBBQ', 'Dell') == MONITOR
+    LineItem.query.filter_by(canonical_product_id=MONITOR).update({'canonical_product_id': None})
+    for model in (ProductIdentifier, PriceObservation, PriceEstimate):
+        model.query.filter_by(canonical_product_id=MONITOR).delete()
+    CanonicalProduct.query.filter_by(id=MONITOR).delete()
+    sync_product_identifiers(CanonicalProduct.query.filter_by(session_id='__default__').all(), full=True)
+    db.session.commit()
+
+    resolver = get_product_resolver()
+    assert resolver.resolve('210-BBBQ', 'Dell') is None
+    assert resolver.resolve('210-BGCD', 'Dell') == LAPTOP
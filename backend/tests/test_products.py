@@ -0,0 +1,36 @@
+import pytest
+
+BATCH_IGCE = '/api/products/igce/batch'
+
+
+@pytest.mark.parametrize('line', [
+    {'product_name': ['x'], 'quantity': 3},
+    {'part_number': 210, 'quantity': 3},
+    {'product_name': 'Laptop', 'manufacturer': {'name': 'Dell'}},
+    {'product_name': 'Laptop', 'description': 5},
+    {'product_id': ['cp000001'], 'quantity': 1},
+    {'product_name': 'Laptop', 'quantity': True},
+    {'product_name': 'Laptop', 'quantity': '3'},
+    'Laptop',
+])
+def test_batch_igce_rejects_malformed_lines(client, auth_headers, line):
+    response = client.post(BATCH_IGCE, headers=auth_headers, json={'lines': [line]})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('body', [
+    {'escalation_rate': True},
+    {'option_years': True},
+])
+def test_batch_igce_rejects_boolean_parameters(client, auth_headers, body):
+    response = client.post(BATCH_IGCE, headers=auth_headers,
+                           json={'lines': [{'product_name': 'Dell Latitude 5550 Laptop'}], **body})
+    assert response.status_code == 400
+
+
+def test_batch_igce_accepts_valid_lines(client, auth_headers):
+    response = client.post(BATCH_IGCE, headers=auth_headers, json={'lines': [
+        {'part_number': '210-BBBQ', 'manufacturer': 'Dell Technologies', 'quantity': 10},
+        {'product_name': 'Dell Latitude 5550 Laptop', 'description': None, 'quantity': 2.5},
+    ]})
+    assert response.status_code == 200
@@ -0,0 +1,37 @@
+import threading
+
+from sqlalchemy import text
+
+from app.services.retrieval import VECTOR_MIN_SCORE, run_legs
+
+
+def test_run_legs_interrupts_legs_past_the_deadline(app):
+    finished = threading.Event()
+
+    def endless(session):
+        try:
+            return session.execute(text(
+                'WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT count(*) FROM c'
+            )).scalar()
+        finally:
+            finished.set()
+
+    results = run_legs({'endless': endless, 'fast': lambda session: [{'type': 'chunk', 'chunk_id': 1}]},
+                       timeout=0.2)
+    assert results['endless'] == []
+    assert results['fast'] == [{'type': 'chunk', 'chunk_id': 1}]
+    # The leg stops at its next statement step instead of holding a pool thread
+    assert finished.wait(timeout=2)
+
+
+def test_vector_search_drops_weak_neighbours(app):
+    from app.extensions import db
+    from app.services.chat_service import ChatService
+    from app.services.embedder import embed_pending_chunks
+
+    embed_pending_chunks()
+    db.session.commit()
+    results = ChatService()._vector_search('Latitude laptops', db.session, '__default__', limit=30)
+    assert results
+    assert all(r['score'] >= VECTOR_MIN_SCORE for r in results)
+    assert {r['vendor_name'] for r in results}.isdisjoint({'CrowdStrike Inc', 'Cisco Systems'})
@@ -0,0 +1,44 @@
+import { useEffect, useState } from 'react';
+import client from './client';
+import type { AutocompleteField, AutocompleteSuggestion } from '@/types';
+
+export const autocompleteApi = {
+  suggest: (fields: AutocompleteField[], q: string, limit: number = 10) =>
+    client.get<{ query: string; suggestions: AutocompleteSuggestion[] }>('/autocomplete', {
+      params: { field: fields.join(','), q, limit },
+    }).then(r => r.data.suggestions),
+};
+
+/** Value that follows `value` once it has stopped changing for `delay` ms. */
+export function useDebouncedValue<T>(value: T, delay: number = 300): T {
+  const [debounced, setDebounced] = useState(value);
+  useEffect(() => {
+    const timer = setTimeout(() => setDebounced(value), delay);
+    return () => clearTimeout(timer);
+  }, [value, delay]);
+  return debounced;
+}
+
+/** Distinct suggested values for a filter box, refreshed on every keystroke. */
+export function useAutocomplete(fields: AutocompleteField[], query: string): string[] {
+  const [values, setValues] = useState<string[]>([]);
+  const key = fields.join(',');
+  useEffect(() => {
+    if (!query.trim()) {
+      setValues([]);
+      return;
+    }
+    let stale = false;
+    autocompleteApi.suggest(key.split(',') as AutocompleteField[], query.trim())
+      .then((suggestions) => {
+        if (!stale) setValues(Array.from(new Set(suggestions.map((s) => s.value))));
+      })
+      .catch(() => {
+        // Suggestions are best-effort
+      });
+    return () => {
+      stale = true;
+    };
+  }, [key, query]);
+  return values;
+}
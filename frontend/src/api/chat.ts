@@ -4,11 +4,78 @@ interface ChatResponse {
   answer: string;
   sources: Array<{ document_id: string; document_number: string; vendor_name: string; original_filename: string }>;
   query_type: string;
+  conversation_id: string;
+}
+
+type ChatSource = ChatResponse['sources'][number];
+
+export interface ChatStreamHandlers {
+  onSources?: (sources: ChatSource[], queryType: string, conversationId: string) => void;
+  onToken?: (text: string) => void;
+  onDone?: () => void;
+}
+
+// Parse the text/event-stream body of /api/chat/stream and dispatch each event.
+// The server keeps the conversation; pass its id (null starts a new one).
+async function streamChat(
+  message: string,
+  conversationId: string | null,
+  handlers: ChatStreamHandlers,
+  signal?: AbortSignal,
+): Promise<void> {
+  const token = localStorage.getItem('pdi_token');
+  const res = await fetch('/api/chat/stream', {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      Accept: 'text/event-stream',
+      ...(token ? { Authorization: `Bearer ${token}` } : {}),
+    },
+    body: JSON.stringify({ message, conversation_id: conversationId }),
+    signal,
+  });
+  if (res.status === 401) {
+    localStorage.removeItem('pdi_token');
+    localStorage.removeItem('pdi_user');
+    window.location.href = '/login';
+    return;
+  }
+  if (!res.ok || !res.body) {
+    const body = await res.json().catch(() => ({}));
+    throw new Error(body.answer || body.error || `Chat request failed (${res.status})`);
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let sep;
+    while ((sep = buffer.indexOf('\n\n')) !== -1) {
+      const frame = buffer.slice(0, sep);
+      buffer = buffer.slice(sep + 2);
+      let event = 'message';
+      let data = '';
+      for (const line of frame.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+      }
+      if (!data) continue;
+      const payload = JSON.parse(data);
+      if (event === 'sources') handlers.onSources?.(payload.sources || [], payload.query_type, payload.conversation_id);
+      else if (event === 'token') handlers.onToken?.(payload.text);
+      else if (event === 'done') handlers.onDone?.();
+      else if (event === 'error') throw new Error(payload.message);
+    }
+  }
 }
 
 export const chatApi = {
-  send: (message: string, history: Array<{ role: string; content: string }> = []) =>
-    client.post<ChatResponse>('/chat', { message, history }).then(r => r.data),
+  send: (message: string, conversationId: string | null = null) =>
+    client.post<ChatResponse>('/chat', { message, conversation_id: conversationId }).then(r => r.data),
+  stream: streamChat,
   suggestions: () =>
     client.get<{ suggestions: string[] }>('/chat/suggestions').then(r => r.data),
 };
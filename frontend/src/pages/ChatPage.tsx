@@ -10,6 +10,7 @@ import {
   Bot,
 } from 'lucide-react';
 import client from '@/api/client';
+import { chatApi } from '@/api/chat';
 
 interface ChatMessage {
   role: 'user' | 'assistant';
@@ -25,11 +26,16 @@ export default function ChatPage() {
   const navigate = useNavigate();
   const [messages, setMessages] = useState<ChatMessage[]>([]);
   const [input, setInput] = useState('');
+  const [conversationId, setConversationId] = useState<string | null>(null);
   const [sending, setSending] = useState(false);
   const [suggestions, setSuggestions] = useState<string[]>([]);
   const [loadingSuggestions, setLoadingSuggestions] = useState(true);
   const messagesEndRef = useRef<HTMLDivElement>(null);
   const inputRef = useRef<HTMLTextAreaElement>(null);
+  // The answer stream in flight; aborting it closes the request so the server stops generating
+  const streamRef = useRef<AbortController | null>(null);
+
+  useEffect(() => () => streamRef.current?.abort(), []);
 
   // Scroll to bottom on new message
   const scrollToBottom = useCallback(() => {
@@ -68,40 +74,47 @@ export default function ChatPage() {
     setMessages(updatedMessages);
     setInput('');
     setSending(true);
+    streamRef.current?.abort();
+    const controller = new AbortController();
+    streamRef.current = controller;
 
-    // Build history for API (excluding the current message)
-    const history = messages.map((m) => ({
-      role: m.role,
-      content: m.content,
-    }));
+    // Stream the answer into a placeholder assistant message as tokens arrive.
+    let assistantMessage: ChatMessage = { role: 'assistant', content: '', sources: [] };
+    const render = () => setMessages([...updatedMessages, assistantMessage]);
 
     try {
-      const res = await client.post('/chat', {
-        message: text.trim(),
-        history,
-      });
-
-      const assistantMessage: ChatMessage = {
-        role: 'assistant',
-        content: res.data.answer || 'I could not generate a response.',
-        sources: res.data.sources || [],
-      };
-
-      setMessages([...updatedMessages, assistantMessage]);
+      await chatApi.stream(text.trim(), conversationId, {
+        onSources: (sources, _queryType, id) => {
+          assistantMessage = { ...assistantMessage, sources };
+          if (id) setConversationId(id);
+        },
+        onToken: (token) => {
+          assistantMessage = { ...assistantMessage, content: assistantMessage.content + token };
+          render();
+        },
+      }, controller.signal);
+      if (!assistantMessage.content) {
+        assistantMessage = { ...assistantMessage, content: 'I could not generate a response.' };
+        render();
+      }
     } catch (err: any) {
+      // Superseded by a new message or chat, or the page was left
+      if (controller.signal.aborted) return;
       const errMsg =
-        err?.response?.data?.answer ||
-        err?.response?.data?.error ||
+        err?.message ||
         'An error occurred while processing your question. Please try again.';
       const errorMessage: ChatMessage = {
         role: 'assistant',
-        content: errMsg,
-        sources: [],
+        content: assistantMessage.content ? `${assistantMessage.content}\n\n${errMsg}` : errMsg,
+        sources: assistantMessage.sources || [],
       };
       setMessages([...updatedMessages, errorMessage]);
     } finally {
-      setSending(false);
-      inputRef.current?.focus();
+      if (streamRef.current === controller) {
+        streamRef.current = null;
+        setSending(false);
+        inputRef.current?.focus();
+      }
     }
   };
 
@@ -122,7 +135,11 @@ export default function ChatPage() {
   };
 
   const handleNewChat = () => {
+    streamRef.current?.abort();
+    streamRef.current = null;
+    setSending(false);
     setMessages([]);
+    setConversationId(null);
     setInput('');
     inputRef.current?.focus();
   };
@@ -238,8 +255,8 @@ export default function ChatPage() {
                 </div>
               ))}
 
-              {/* Thinking indicator */}
-              {sending && (
+              {/* Thinking indicator (until the first streamed token arrives) */}
+              {sending && messages[messages.length - 1]?.role !== 'assistant' && (
                 <div className="flex gap-3 justify-start">
                   <div className="flex-shrink-0 w-7 h-7 bg-eaw-primary rounded-full flex items-center justify-center">
                     <Bot size={14} className="text-white" />
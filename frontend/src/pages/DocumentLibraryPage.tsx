@@ -16,6 +16,7 @@ import {
   FileSpreadsheet,
 } from 'lucide-react';
 import client from '@/api/client';
+import { useAutocomplete, useDebouncedValue } from '@/api/autocomplete';
 
 interface DocumentItem {
   id: string;
@@ -129,6 +130,11 @@ export default function DocumentLibraryPage() {
   const [vendor, setVendor] = useState('');
   const [page, setPage] = useState(1);
   const perPage = 25;
+  // The list query follows the text boxes once typing pauses; keystrokes only hit autocomplete
+  const debouncedSearch = useDebouncedValue(search);
+  const debouncedVendor = useDebouncedValue(vendor);
+  const searchSuggestions = useAutocomplete(['document_number', 'contract_number', 'vendor'], search);
+  const vendorSuggestions = useAutocomplete(['vendor'], vendor);
 
   // Data
   const [data, setData] = useState<ListResponse | null>(null);
@@ -139,10 +145,10 @@ export default function DocumentLibraryPage() {
     setLoading(true);
     try {
       const params: Record<string, string | number> = { page, per_page: perPage };
-      if (search) params.search = search;
+      if (debouncedSearch) params.search = debouncedSearch;
       if (docType) params.document_type = docType;
       if (status) params.processing_status = status;
-      if (vendor) params.vendor_name = vendor;
+      if (debouncedVendor) params.vendor_name = debouncedVendor;
 
       const res = await client.get('/documents', { params });
       setData(res.data);
@@ -151,7 +157,7 @@ export default function DocumentLibraryPage() {
     } finally {
       setLoading(false);
     }
-  }, [page, search, docType, status, vendor]);
+  }, [page, debouncedSearch, docType, status, debouncedVendor]);
 
   useEffect(() => {
     fetchDocuments();
@@ -160,7 +166,7 @@ export default function DocumentLibraryPage() {
   // Reset page when filters change
   useEffect(() => {
     setPage(1);
-  }, [search, docType, status, vendor]);
+  }, [debouncedSearch, docType, status, debouncedVendor]);
 
   const handleUpload = async (file: File) => {
     const ext = file.name.split('.').pop()?.toLowerCase() || '';
@@ -346,7 +352,13 @@ export default function DocumentLibraryPage() {
                 onChange={(e) => setSearch(e.target.value)}
                 className="input-field pl-8"
                 placeholder="Search filename, vendor, doc #..."
+                list="document-search-suggestions"
               />
+              <datalist id="document-search-suggestions">
+                {searchSuggestions.map((s) => (
+                  <option key={s} value={s} />
+                ))}
+              </datalist>
             </div>
           </div>
           <div className="min-w-[150px]">
@@ -381,7 +393,13 @@ export default function DocumentLibraryPage() {
               onChange={(e) => setVendor(e.target.value)}
               className="input-field"
               placeholder="Filter by vendor"
+              list="document-vendor-suggestions"
             />
+            <datalist id="document-vendor-suggestions">
+              {vendorSuggestions.map((v) => (
+                <option key={v} value={v} />
+              ))}
+            </datalist>
           </div>
         </div>
       </div>
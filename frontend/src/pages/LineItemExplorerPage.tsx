@@ -25,6 +25,7 @@ import {
   ResponsiveContainer,
 } from 'recharts';
 import client from '@/api/client';
+import { useAutocomplete, useDebouncedValue } from '@/api/autocomplete';
 
 interface LineItem {
   id: string;
@@ -91,6 +92,9 @@ export default function LineItemExplorerPage() {
   const [sortBy, setSortBy] = useState('created_at');
   const [sortOrder, setSortOrder] = useState<'asc' | 'desc'>('desc');
   const perPage = 25;
+  // The list query follows the search box once typing pauses; keystrokes only hit autocomplete
+  const debouncedSearch = useDebouncedValue(search);
+  const searchSuggestions = useAutocomplete(['part_number', 'product_name', 'manufacturer'], search);
 
   // Data
   const [items, setItems] = useState<LineItem[]>([]);
@@ -108,7 +112,7 @@ export default function LineItemExplorerPage() {
         sort_by: sortBy,
         sort_order: sortOrder,
       };
-      if (search) params.search = search;
+      if (debouncedSearch) params.search = debouncedSearch;
       if (vendor) params.vendor = vendor;
       if (category) params.category = category;
       if (minPrice) params.min_price = parseFloat(minPrice);
@@ -132,7 +136,7 @@ export default function LineItemExplorerPage() {
     } finally {
       setLoading(false);
     }
-  }, [page, search, vendor, category, minPrice, maxPrice, sortBy, sortOrder]);
+  }, [page, debouncedSearch, vendor, category, minPrice, maxPrice, sortBy, sortOrder]);
 
   const fetchSpendAnalysis = useCallback(async () => {
     try {
@@ -160,7 +164,7 @@ export default function LineItemExplorerPage() {
 
   useEffect(() => {
     setPage(1);
-  }, [search, vendor, category, minPrice, maxPrice]);
+  }, [debouncedSearch, vendor, category, minPrice, maxPrice]);
 
   const handleSort = (field: string) => {
     if (sortBy === field) {
@@ -234,7 +238,13 @@ export default function LineItemExplorerPage() {
                 onChange={(e) => setSearch(e.target.value)}
                 className="input-field pl-8"
                 placeholder="Product name, part #, manufacturer..."
+                list="line-item-search-suggestions"
               />
+              <datalist id="line-item-search-suggestions">
+                {searchSuggestions.map((s) => (
+                  <option key={s} value={s} />
+                ))}
+              </datalist>
             </div>
           </div>
           <div className="min-w-[150px]">
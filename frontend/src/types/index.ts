@@ -181,6 +181,23 @@ export interface ChatMessage {
   sources?: ChatSource[];
 }
 
+// ── Autocomplete ─────────────────────────────────────
+
+export type AutocompleteField =
+  | 'vendor'
+  | 'contract_number'
+  | 'document_number'
+  | 'part_number'
+  | 'product_name'
+  | 'manufacturer';
+
+export interface AutocompleteSuggestion {
+  value: string;
+  field: AutocompleteField;
+  spend: number;
+  count: number;
+}
+
 // ── Dashboard ────────────────────────────────────────
 
 export interface DashboardData {